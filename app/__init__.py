@@ -5,8 +5,9 @@ from flask_login import LoginManager, current_user
 from flask_jwt_extended import JWTManager
 from config import Config
 from datetime import datetime
+from app.replica import RoutingSession, init_replica, read_replica
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 login_manager = LoginManager()
 jwt = JWTManager()
@@ -16,6 +17,7 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
     
     db.init_app(app)
+    init_replica(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
     jwt.init_app(app)
@@ -29,20 +31,41 @@ def create_app(config_class=Config):
     from app.routes.products import bp as products_bp
     from app.routes.documents import bp as documents_bp
     from app.routes.reports import bp as reports_bp
+    from app.routes.jobs import bp as jobs_bp
     
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(products_bp, url_prefix='/products')
     app.register_blueprint(documents_bp, url_prefix='/documents')
     app.register_blueprint(reports_bp, url_prefix='/reports')
+    app.register_blueprint(jobs_bp, url_prefix='/jobs')
+    
+    from app.services.job_service import JobRunner
+    JobRunner(app)
+    
+    from app.services.reservation_service import ReservationSweeper
+    ReservationSweeper(app)
+    
+    from app.cli import register_commands
+    register_commands(app)
+    
+    from app.instrumentation import init_instrumentation
+    init_instrumentation(app)
+    
+    from app.metrics import init_metrics
+    init_metrics(app)
+    
+    from app.analytics import init_analytics
+    init_analytics(app)
     
     @app.context_processor
     def utility_processor():
         return {'now': datetime.now()}
     
     @app.route('/')
+    @read_replica
     def index():
-        from app.models import Product, Supplier, Document, User, StockBalance
-        from sqlalchemy import func
+        from app.models import Product, Supplier, Document, User
+        from app.services.replenishment_service import ReplenishmentService
         
         stats = {
             'products_count': Product.query.count(),
@@ -53,24 +76,13 @@ def create_app(config_class=Config):
         
         recent_documents = Document.query.order_by(Document.created_at.desc()).limit(5).all()
         
-        low_stock = []
-        products = Product.query.all()
-        for product in products:
-            total = db.session.query(func.sum(StockBalance.quantity)).filter_by(
-                product_id=product.id
-            ).scalar() or 0
-            if total > 0 and total < 10:
-                low_stock.append({
-                    'id': product.id,
-                    'name': product.name,
-                    'article': product.article,
-                    'quantity': float(total)
-                })
+        # Остаток не выше точки заказа (спрос и срок поставки - по истории)
+        low_stock = ReplenishmentService.low_stock(limit=5)
         
         return render_template('index.html', 
                              stats=stats, 
                              recent_documents=recent_documents,
-                             low_stock=low_stock[:5])
+                             low_stock=low_stock)
     
     return app
 
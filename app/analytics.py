@@ -0,0 +1,350 @@
+"""Колоночное хранилище движений товаров в массивах NumPy.
+
+Строки проведенных документов загружаются одной выборкой в массивы
+(товар, день, направление, вес, количество, сумма), после чего группировки,
+итоги, бегущие остатки и сравнения периодов считаются векторно.
+
+Новые проведения и отмены дописываются в конец массивов: при обращении
+хранилище выбирает документы, проведенные или отмененные после отметки
+последнего учтенного события (отмена добавляет строки с весом -1). posted_at
+ставится до фиксации транзакции, поэтому выборка захватывает еще
+ANALYTICS_OVERLAP секунд до отметки, а уже учтенные события этого окна
+пропускаются. Раз в ANALYTICS_MAX_AGE секунд хранилище загружается заново.
+У каждого процесса свое хранилище, поэтому изменения других процессов
+видны без общей памяти.
+"""
+from datetime import datetime, timedelta
+from time import time
+import threading
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import Float, cast, or_, select
+
+from app import db
+from app.models import Document, DocumentItem, MOVEMENT_TYPES
+
+FETCH_SIZE = 100000
+
+# Направление движения: приход увеличивает остаток, расход уменьшает
+DIRECTIONS = {'income': 1, 'expense': -1}
+
+
+def day_number(value):
+    """Номер дня (date.toordinal) - так даты хранятся в массивах"""
+    return value.toordinal() if value is not None else None
+
+
+class MovementStore:
+    """Движения товаров в массивах NumPy с дозагрузкой новых проведений"""
+
+    def __init__(self, overlap=60):
+        self._lock = threading.Lock()
+        self.loaded_at = None
+        self.overlap = timedelta(seconds=overlap)
+        self.watermark = None  # последний учтенный posted_at/cancelled_at
+        self._seen = {}  # учтенные события окна перекрытия: (id, вес) -> время
+        self._set_columns(_empty_columns())
+
+    def _set_columns(self, columns):
+        self._cache = {}
+        self.product_id = columns['product_id']
+        self.day = columns['day']
+        self.direction = columns['direction']
+        self.weight = columns['weight']  # 1 - проведение, -1 - отмена ранее учтенного
+        self.quantity = columns['quantity']
+        self.amount = columns['amount']
+
+    def __len__(self):
+        return len(self.product_id)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in (self.product_id, self.day, self.direction,
+                                                self.weight, self.quantity, self.amount))
+
+    # ---------- загрузка ----------
+
+    def load(self):
+        """
+        Полная загрузка всех проведенных документов. Отметка и окно
+        перекрытия считаются и по отмененным документам: их отмена уже
+        отражена тем, что строки не загружены.
+        """
+        with self._lock:
+            documents = db.session.execute(select(
+                Document.id, Document.doc_date, Document.doc_type, Document.status,
+                Document.posted_at, Document.cancelled_at
+            ).where(Document.status.in_(('posted', 'cancelled')),
+                    Document.doc_type.in_(MOVEMENT_TYPES))).all()
+            self._set_columns(_fetch_lines([row for row in documents if row.status == 'posted'],
+                                           1, all_posted=True))
+            self.watermark = _latest_event(documents)
+            self._seen = {}
+            self._remember(documents)
+            self.loaded_at = time()
+
+    def refresh(self, max_age=None):
+        """Полная загрузка при устаревании, иначе дозагрузка новых событий"""
+        if self.loaded_at is None or (max_age is not None and time() - self.loaded_at > max_age):
+            self.load()
+            return
+
+        with self._lock:
+            floor = self._floor()
+            if floor is None:
+                posted_filter = Document.posted_at.isnot(None)
+                cancelled_filter = Document.cancelled_at.isnot(None)
+            else:
+                posted_filter = Document.posted_at >= floor
+                cancelled_filter = Document.cancelled_at >= floor
+
+            documents = db.session.execute(select(
+                Document.id, Document.doc_date, Document.doc_type,
+                Document.posted_at, Document.cancelled_at
+            ).where(or_(posted_filter, cancelled_filter),
+                    Document.doc_type.in_(MOVEMENT_TYPES))).all()
+
+            posted = [row for row in documents if self._is_new(row.id, 1, row.posted_at)]
+            cancelled = [row for row in documents
+                         if self._is_new(row.id, -1, row.cancelled_at)]
+            if not posted and not cancelled:
+                return
+
+            self._append(_fetch_lines(posted, 1))
+            self._append(_fetch_lines(cancelled, -1))
+            self.watermark = max(self.watermark or datetime.min, _latest_event(documents))
+            self._remember(documents)
+
+    def _floor(self):
+        """Начало окна перекрытия дозагрузки"""
+        return self.watermark - self.overlap if self.watermark is not None else None
+
+    def _is_new(self, document_id, weight, moment):
+        floor = self._floor()
+        return moment is not None and (floor is None or moment >= floor) \
+            and (document_id, weight) not in self._seen
+
+    def _remember(self, documents):
+        """Учтенные события окна перекрытия; более старые забываются"""
+        floor = self._floor()
+        for row in documents:
+            for weight, moment in ((1, row.posted_at), (-1, row.cancelled_at)):
+                if moment is not None and (floor is None or moment >= floor):
+                    self._seen[(row.id, weight)] = moment
+        if floor is not None:
+            self._seen = {key: moment for key, moment in self._seen.items() if moment >= floor}
+
+    def _append(self, columns):
+        if not len(columns['product_id']):
+            return
+        self._set_columns({
+            'product_id': np.concatenate((self.product_id, columns['product_id'])),
+            'day': np.concatenate((self.day, columns['day'])),
+            'direction': np.concatenate((self.direction, columns['direction'])),
+            'weight': np.concatenate((self.weight, columns['weight'])),
+            'quantity': np.concatenate((self.quantity, columns['quantity'])),
+            'amount': np.concatenate((self.amount, columns['amount']))
+        })
+
+    def cached(self, key, compute):
+        """
+        Результат compute() для ключа key; кэш сбрасывается при любом
+        изменении массивов (загрузка, дозагрузка)
+        """
+        cache = self._cache
+        if key not in cache:
+            cache[key] = compute()
+        return cache[key]
+
+    # ---------- расчеты ----------
+
+    def mask(self, date_from=None, date_to=None, product_ids=None):
+        """Булева маска строк по диапазону дат (включительно) и товарам"""
+        mask = np.ones(len(self), dtype=bool)
+        if date_from is not None:
+            mask &= self.day >= day_number(date_from)
+        if date_to is not None:
+            mask &= self.day <= day_number(date_to)
+        if product_ids is not None:
+            mask &= np.isin(self.product_id, np.asarray(list(product_ids), dtype=np.int32))
+        return mask
+
+    def by_product(self, date_from=None, date_to=None, direction=None):
+        """
+        Оборот по товарам: массивы product_id, quantity, amount, operations
+        (только товары с движениями). direction: 'income', 'expense' или все.
+        """
+        mask = self.mask(date_from, date_to)
+        if direction is not None:
+            mask &= self.direction == DIRECTIONS[direction]
+        return _group(self.product_id[mask], self.weight[mask],
+                      self.quantity[mask], self.amount[mask])
+
+    def totals(self, date_from=None, date_to=None):
+        """Итоги оборота за период: (quantity, amount, operations)"""
+        mask = self.mask(date_from, date_to)
+        weight = self.weight[mask]
+        return (float(np.dot(weight, self.quantity[mask])),
+                float(np.dot(weight, self.amount[mask])),
+                int(weight.sum(dtype=np.int64)))
+
+    def compare(self, date_from, date_to, previous_from):
+        """
+        Оборот по товарам за [date_from, date_to] и предыдущий период
+        [previous_from, date_from) одним проходом: product_id и массивы
+        quantity/prev_quantity, amount/prev_amount, operations/prev_operations,
+        delta_quantity, delta_amount.
+        """
+        mask = self.mask(previous_from, date_to)
+        current = self.day[mask] >= day_number(date_from)
+        ids, inverse = np.unique(self.product_id[mask], return_inverse=True)
+        weight = self.weight[mask]
+        quantity = weight * self.quantity[mask]
+        amount = weight * self.amount[mask]
+        size = len(ids)
+        result = {
+            'product_id': ids,
+            'quantity': np.bincount(inverse, quantity * current, size),
+            'prev_quantity': np.bincount(inverse, quantity * ~current, size),
+            'amount': np.bincount(inverse, amount * current, size),
+            'prev_amount': np.bincount(inverse, amount * ~current, size),
+            'operations': np.bincount(inverse, weight * current, size).astype(np.int64),
+            'prev_operations': np.bincount(inverse, weight * ~current, size).astype(np.int64)
+        }
+        result['delta_quantity'] = result['quantity'] - result['prev_quantity']
+        result['delta_amount'] = result['amount'] - result['prev_amount']
+        return result
+
+    def balances(self, date_to=None):
+        """Остатки по товарам на конец дня date_to: массивы product_id, quantity"""
+        mask = self.mask(date_to=date_to)
+        ids, inverse = np.unique(self.product_id[mask], return_inverse=True)
+        signed = self.weight[mask] * self.direction[mask] * self.quantity[mask]
+        return ids, np.bincount(inverse, signed, len(ids))
+
+    def running_balance(self, product_id, date_from=None, date_to=None):
+        """
+        Бегущий остаток товара по дням с движениями: массивы day (номер дня)
+        и balance на конец дня. Остаток на начало - по всем движениям до date_from.
+        """
+        rows = self.product_id == product_id
+        if date_to is not None:
+            rows &= self.day <= day_number(date_to)
+        days = self.day[rows]
+        signed = self.weight[rows] * self.direction[rows] * self.quantity[rows]
+
+        opening = 0.0
+        if date_from is not None:
+            before = days < day_number(date_from)
+            opening = float(signed[before].sum())
+            days, signed = days[~before], signed[~before]
+
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        daily = np.bincount(inverse, signed, len(unique_days))
+        return unique_days, opening + np.cumsum(daily)
+
+
+def init_analytics(app):
+    """Хранилище движений приложения (загружается при первом обращении)"""
+    app.extensions['analytics'] = MovementStore(app.config['ANALYTICS_OVERLAP'])
+
+
+def get_store():
+    """Актуальное хранилище движений текущего приложения"""
+    store = current_app.extensions['analytics']
+    store.refresh(current_app.config['ANALYTICS_MAX_AGE'])
+    return store
+
+
+def _empty_columns():
+    return {
+        'product_id': np.empty(0, dtype=np.int32),
+        'day': np.empty(0, dtype=np.int32),
+        'direction': np.empty(0, dtype=np.int8),
+        'weight': np.empty(0, dtype=np.int8),
+        'quantity': np.empty(0, dtype=np.float64),
+        'amount': np.empty(0, dtype=np.float64)
+    }
+
+
+def _fetch_lines(documents, weight, all_posted=False):
+    """
+    Строки документов в массивы; дата и тип берутся из документа по document_id.
+    all_posted - documents содержит все проведенные документы (полная загрузка).
+    """
+    if not documents:
+        return _empty_columns()
+
+    doc_ids = np.fromiter((row.id for row in documents), dtype=np.int64, count=len(documents))
+    order = np.argsort(doc_ids)
+    doc_ids = doc_ids[order]
+    doc_days = np.fromiter((row.doc_date.toordinal() for row in documents),
+                           dtype=np.int32, count=len(documents))[order]
+    doc_directions = np.fromiter((DIRECTIONS.get(row.doc_type, 0) for row in documents),
+                                 dtype=np.int8, count=len(documents))[order]
+
+    query = select(
+        DocumentItem.document_id,
+        DocumentItem.product_id,
+        cast(DocumentItem.quantity, Float),
+        cast(DocumentItem.price, Float)
+    )
+    if all_posted:
+        queries = [query.join(Document, DocumentItem.document_id == Document.id
+                              ).where(Document.status == 'posted',
+                                      Document.doc_type.in_(MOVEMENT_TYPES))]
+    else:
+        queries = [query.where(DocumentItem.document_id.in_(doc_ids[start:start + 1000].tolist()))
+                   for start in range(0, len(doc_ids), 1000)]
+
+    # Строки читаются курсором драйвера: разбор Row в SQLAlchemy медленнее
+    # самой выборки. Параметры запроса - только константы и id документов.
+    connection = db.session.connection()
+    cursor = connection.connection.cursor()
+    parts = []
+    try:
+        for part_query in queries:
+            cursor.execute(str(part_query.compile(dialect=connection.dialect,
+                                                  compile_kwargs={'literal_binds': True})))
+            while True:
+                chunk = cursor.fetchmany(FETCH_SIZE)
+                if not chunk:
+                    break
+                parts.append(np.array(chunk, dtype=np.float64).reshape(-1, 4))
+    finally:
+        cursor.close()
+    if not parts:
+        return _empty_columns()
+    lines = np.concatenate(parts)
+
+    # Строки документов, проведенных во время загрузки, отбрасываются
+    position = np.minimum(np.searchsorted(doc_ids, lines[:, 0]), len(doc_ids) - 1)
+    known = doc_ids[position] == lines[:, 0]
+    lines, position = lines[known], position[known]
+    quantity = lines[:, 2]
+    return {
+        'product_id': lines[:, 1].astype(np.int32),
+        'day': doc_days[position],
+        'direction': doc_directions[position],
+        'weight': np.full(len(lines), weight, dtype=np.int8),
+        'quantity': quantity,
+        'amount': quantity * lines[:, 3]
+    }
+
+
+def _group(product_ids, weight, quantity, amount):
+    ids, inverse = np.unique(product_ids, return_inverse=True)
+    size = len(ids)
+    return {
+        'product_id': ids,
+        'quantity': np.bincount(inverse, weight * quantity, size),
+        'amount': np.bincount(inverse, weight * amount, size),
+        'operations': np.bincount(inverse, weight, size).astype(np.int64)
+    }
+
+
+def _latest_event(documents):
+    moments = [moment for row in documents for moment in (row.posted_at, row.cancelled_at)
+               if moment is not None]
+    return max(moments) if moments else None
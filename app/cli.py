@@ -0,0 +1,268 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+replica_cli = AppGroup('replica', help='Обслуживание реплики для отчетов')
+seed_cli = AppGroup('seed', help='Генерация тестовых данных')
+bench_cli = AppGroup('bench', help='Нагрузочные замеры')
+turnover_cli = AppGroup('turnover', help='Агрегат дневного оборота')
+period_cli = AppGroup('period', help='Закрытие месяцев и снимки остатков')
+forecast_cli = AppGroup('forecast', help='Прогноз спроса')
+catalog_cli = AppGroup('catalog', help='Каталог товаров')
+documents_cli = AppGroup('documents', help='Документы движения товаров')
+cells_cli = AppGroup('cells', help='Складские ячейки')
+
+
+@replica_cli.command('sync')
+def replica_sync():
+    """Скопировать основную БД в реплику"""
+    from app.replica import sync_replica
+
+    synced_at = sync_replica()
+    click.echo(f'Реплика синхронизирована: {synced_at:%d.%m.%Y %H:%M:%S}')
+
+
+@seed_cli.command('bulk')
+@click.option('--products', default=100000, show_default=True, help='Количество товаров')
+@click.option('--cells', default=1000, show_default=True, help='Количество ячеек')
+@click.option('--lines', default=2000000, show_default=True, help='Количество строк документов')
+@click.option('--categories', default=50, show_default=True)
+@click.option('--suppliers', default=200, show_default=True)
+@click.option('--days', default=730, show_default=True, help='Глубина истории, дней')
+@click.option('--skew', default=1.1, show_default=True, help='Перекос популярности (Ципф)')
+@click.option('--seed', default=42, show_default=True, help='Зерно генератора')
+def seed_bulk(products, cells, lines, categories, suppliers, days, skew, seed):
+    """Массовая генерация товаров, ячеек и проведенных документов"""
+    from time import perf_counter
+    from app import db
+    from app.services.dataset_service import DatasetService
+
+    db.create_all()
+    started = perf_counter()
+    summary = DatasetService.generate(
+        products=products, cells=cells, lines=lines, categories=categories,
+        suppliers=suppliers, days=days, skew=skew, seed=seed,
+        progress=lambda done, total: click.echo(f'  строк: {done}/{total}')
+    )
+    click.echo(f'Создано за {perf_counter() - started:.1f} с: '
+               f'товаров {summary["products"]}, ячеек {summary["cells"]}, '
+               f'документов {summary["documents"]}, строк {summary["lines"]}')
+
+
+@bench_cli.command('run')
+@click.option('--output', '-o', default='bench.json', show_default=True, help='Файл результатов')
+@click.option('--repeat', default=3, show_default=True, help='Повторов каждого замера')
+def bench_run(output, repeat):
+    """Замер всех маршрутов и методов StockService с сохранением в JSON"""
+    from app.services.benchmark_service import BenchmarkService
+
+    report = BenchmarkService.run(current_app._get_current_object(), repeat=repeat)
+    BenchmarkService.save(report, output)
+    for row in report['results']:
+        if 'error' in row:
+            click.echo(f'{"ОШИБКА":>13}  {"":>6}  {row["name"]}: {row["error"]}')
+            continue
+        click.echo(f'{row["median_ms"]:10.1f} мс  {"-" if row["queries"] is None else row["queries"]:>6}  {row["name"]}')
+    click.echo(f'Результаты сохранены в {output}')
+
+
+@bench_cli.command('compare')
+@click.argument('baseline', type=click.File(encoding='utf-8'))
+@click.argument('current', type=click.File(encoding='utf-8'))
+@click.option('--threshold', default=1.2, show_default=True, help='Допустимое замедление (раз)')
+def bench_compare(baseline, current, threshold):
+    """Сравнение двух прогонов; код выхода 1 при регрессии"""
+    import json
+    from app.services.benchmark_service import BenchmarkService
+
+    rows = BenchmarkService.compare(json.load(baseline), json.load(current), threshold)
+    for name, base_ms, current_ms, ratio, regressed in rows:
+        mark = 'РЕГРЕССИЯ' if regressed else ''
+        click.echo(f'{base_ms:10.1f} -> {current_ms:10.1f} мс  x{ratio:5.2f}  {name} {mark}')
+    if any(row[4] for row in rows):
+        raise SystemExit(1)
+
+
+@turnover_cli.command('rebuild')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Пересчитать с даты (ГГГГ-ММ-ДД), по умолчанию - полностью')
+def turnover_rebuild(since):
+    """Заполнение агрегата daily_product_turnover по проведенным документам"""
+    from app.services.turnover_service import TurnoverService
+
+    rows = TurnoverService.rebuild(since.date() if since else None)
+    click.echo(f'Агрегат оборота пересчитан: {rows} строк')
+
+
+def _month_end(value):
+    from datetime import datetime
+    from app.services.period_service import PeriodService
+
+    return PeriodService.month_end(datetime.strptime(value, '%Y-%m').date())
+
+
+@period_cli.command('close')
+@click.option('--month', default=None, help='Месяц ГГГГ-ММ, по умолчанию - прошлый')
+@click.option('--workers', default=4, show_default=True, help='Потоков расчета')
+@click.option('--chunk-size', default=5000, show_default=True, help='Товаров в части')
+@click.option('--rebuild', is_flag=True, help='Пересчитать, если месяц уже закрыт')
+def period_close(month, workers, chunk_size, rebuild):
+    """Закрытие месяца со снимком остатков на его конец"""
+    from datetime import date, timedelta
+    from app.services.period_service import PeriodService
+
+    period_end = _month_end(month) if month else date.today().replace(day=1) - timedelta(days=1)
+    try:
+        if rebuild:
+            rows = PeriodService.rebuild(period_end, workers, chunk_size)
+        else:
+            rows = PeriodService.close(
+                period_end, workers, chunk_size,
+                progress=lambda done, total: click.echo(f'  частей: {done}/{total}')
+            )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Период по {period_end:%d.%m.%Y} закрыт, строк снимка: {rows}')
+
+
+@period_cli.command('reopen')
+@click.argument('month')
+def period_reopen(month):
+    """Открытие месяца ГГГГ-ММ (и всех закрытых после него)"""
+    from app.services.period_service import PeriodService
+
+    ends = PeriodService.reopen(_month_end(month))
+    if not ends:
+        raise click.ClickException('Месяц не закрыт')
+    click.echo('Открыты периоды: ' + ', '.join(f'{end:%m.%Y}' for end in ends))
+
+
+@forecast_cli.command('refresh')
+@click.option('--workers', default=4, show_default=True, help='Процессов подбора')
+@click.option('--chunk-size', default=20000, show_default=True, help='Товаров в части')
+def forecast_refresh(workers, chunk_size):
+    """Пересчет прогнозов спроса (запускать по ночам)"""
+    from app.services.forecast_service import ForecastService
+
+    products = ForecastService.refresh(
+        workers=workers, chunk_size=chunk_size,
+        progress=lambda done, total: click.echo(f'  частей: {done}/{total}')
+    )
+    click.echo(f'Прогноз пересчитан для {products} товаров')
+
+
+@catalog_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), default=None,
+              help='Формат файла, по умолчанию - по расширению')
+@click.option('--encoding', default='utf-8-sig', show_default=True, help='Кодировка файла')
+@click.option('--chunk-size', default=None, type=int, help='Строк в части')
+@click.option('--no-create', is_flag=True,
+              help='Не создавать отсутствующие категории и поставщиков')
+def catalog_import(path, file_format, encoding, chunk_size, no_create):
+    """Загрузка товаров из CSV/JSONL с обновлением по артикулу"""
+    from app.services.import_service import CatalogImportService
+
+    file_format = file_format or ('jsonl' if path.lower().endswith(('.jsonl', '.json'))
+                                  else 'csv')
+    with open(path, 'rb') as stream:
+        result = CatalogImportService.import_file(
+            stream, file_format, encoding, chunk_size, create_missing=not no_create,
+            progress=lambda rows: click.echo(f'  строк: {rows}')
+        )
+    for line, message in result.errors[:50]:
+        click.echo(f'  строка {line}: {message}')
+    if result.failed > 50:
+        click.echo(f'  ... и еще {result.failed - 50} ошибок')
+    click.echo(result.summary())
+
+
+@catalog_cli.command('barcodes')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--encoding', default='utf-8-sig', show_default=True, help='Кодировка файла')
+@click.option('--chunk-size', default=None, type=int, help='Строк в части')
+def catalog_barcodes(path, encoding, chunk_size):
+    """Загрузка штрихкодов из CSV: артикул; штрихкод; кратность"""
+    from app.services.barcode_service import BarcodeService
+
+    with open(path, 'rb') as stream:
+        result = BarcodeService.import_file(
+            stream, encoding, chunk_size,
+            progress=lambda rows: click.echo(f'  строк: {rows}')
+        )
+    for line, message in result.errors[:50]:
+        click.echo(f'  строка {line}: {message}')
+    if result.failed > 50:
+        click.echo(f'  ... и еще {result.failed - 50} ошибок')
+    click.echo(result.summary())
+
+
+@documents_cli.command('import')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', default=4, show_default=True, help='Потоков загрузки (по файлам)')
+@click.option('--post', is_flag=True, help='Сразу провести загруженные документы')
+@click.option('--encoding', default='utf-8-sig', show_default=True, help='Кодировка CSV')
+@click.option('--chunk-size', default=None, type=int, help='Накладных в части')
+def documents_import(paths, workers, post, encoding, chunk_size):
+    """Загрузка приходных накладных поставщиков из XML/CSV"""
+    from app.services.document_import_service import DocumentImportService
+
+    result = DocumentImportService.import_files(
+        list(paths), workers, post, encoding, chunk_size,
+        progress=lambda path, file_result: click.echo(f'  {path}: {file_result.summary()}')
+    )
+    for place, message in result.errors[:50]:
+        click.echo(f'  {place}: {message}')
+    if result.failed > 50:
+        click.echo(f'  ... и еще {result.failed - 50} ошибок')
+    click.echo(result.summary())
+
+
+@documents_cli.command('slotting')
+@click.option('--limit', default=50, show_default=True, help='Сколько перемещений вывести')
+@click.option('--create', is_flag=True, help='Создать черновик перемещения по всем рекомендациям')
+def documents_slotting(limit, create):
+    """Рекомендуемое размещение: часто подбираемые товары - ближе к отгрузке"""
+    from app.services.slotting_service import SlottingService
+
+    plan = SlottingService.plan()
+    for move in plan['moves'][:limit]:
+        click.echo(f'  {move["article"]}: {move["cell"]} -> {move["dest_cell"]}, '
+                   f'подборов {move["picks"]}, экономия {move["savings"]:.1f} м')
+    click.echo(f'Товаров: {plan["products"]}, перемещений: {len(plan["moves"])}, '
+               f'путь {plan["current"]:.1f} -> {plan["planned"]:.1f} м, '
+               f'экономия {plan["savings"]:.1f} м')
+    if create and plan['moves']:
+        document = SlottingService.create_transfer()
+        click.echo(f'Создан черновик перемещения №{document.doc_number}')
+
+
+@documents_cli.command('expire-reservations')
+def documents_expire_reservations():
+    """Снятие просроченных резервов черновиков расхода (для cron)"""
+    from app.services.reservation_service import ReservationService
+
+    documents = ReservationService.expire()
+    click.echo(f'Снято просроченных резервов документов: {documents}')
+
+
+@cells_cli.command('occupancy')
+def cells_occupancy():
+    """Пересчет заполненности всех ячеек по остаткам"""
+    from app.services.occupancy_service import OccupancyService
+
+    cells = OccupancyService.rebuild()
+    click.echo(f'Заполненность пересчитана: {cells} ячеек')
+
+
+def register_commands(app):
+    """Регистрация CLI-команд приложения"""
+    app.cli.add_command(replica_cli)
+    app.cli.add_command(seed_cli)
+    app.cli.add_command(bench_cli)
+    app.cli.add_command(turnover_cli)
+    app.cli.add_command(period_cli)
+    app.cli.add_command(forecast_cli)
+    app.cli.add_command(catalog_cli)
+    app.cli.add_command(documents_cli)
+    app.cli.add_command(cells_cli)
@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, SubmitField, SelectField, TextAreaField, FloatField, IntegerField, DateField, BooleanField, FieldList, FormField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError, NumberRange, Optional
 from datetime import date
@@ -56,15 +57,54 @@ class ProductForm(FlaskForm):
         ('л', 'Литр')
     ], validators=[DataRequired()])
     price = FloatField('Цена', validators=[DataRequired(), NumberRange(min=0)])
+    volume = FloatField('Объем единицы, м³', validators=[Optional(), NumberRange(min=0)])
+    weight = FloatField('Вес единицы, кг', validators=[Optional(), NumberRange(min=0)])
     category_id = SelectField('Категория', coerce=int, validators=[DataRequired()], choices=[])
     supplier_id = SelectField('Поставщик', coerce=int, validators=[DataRequired()], choices=[])
     submit = SubmitField('Сохранить')
 
 
+class BarcodeForm(FlaskForm):
+    """Форма штрихкода товара"""
+    code = StringField('Штрихкод', validators=[DataRequired(), Length(max=64)])
+    multiplier = FloatField('Единиц в упаковке', default=1,
+                            validators=[DataRequired(), NumberRange(min=0.001)])
+    submit = SubmitField('Добавить')
+
+
+class ProductImportForm(FlaskForm):
+    """Форма загрузки каталога товаров"""
+    file = FileField('Файл', validators=[
+        FileRequired(), FileAllowed(['csv', 'txt', 'jsonl', 'json'], 'Только CSV или JSONL')
+    ])
+    encoding = SelectField('Кодировка', choices=[
+        ('utf-8-sig', 'UTF-8'),
+        ('cp1251', 'Windows-1251')
+    ])
+    create_missing = BooleanField('Создавать отсутствующие категории и поставщиков', default=True)
+    submit = SubmitField('Загрузить')
+
+
+class DocumentImportForm(FlaskForm):
+    """Форма загрузки накладных поставщиков"""
+    file = FileField('Файл', validators=[
+        FileRequired(), FileAllowed(['xml', 'csv', 'txt'], 'Только XML или CSV')
+    ])
+    encoding = SelectField('Кодировка CSV', choices=[
+        ('utf-8-sig', 'UTF-8'),
+        ('cp1251', 'Windows-1251')
+    ])
+    post = BooleanField('Сразу провести документы')
+    submit = SubmitField('Загрузить')
+
+
 class WarehouseCellForm(FlaskForm):
     """Форма складской ячейки"""
     name = StringField('Номер ячейки', validators=[DataRequired(), Length(max=20)])
     description = StringField('Описание', validators=[Length(max=100)])
+    max_volume = FloatField('Вместимость, м³', validators=[Optional(), NumberRange(min=0)])
+    max_weight = FloatField('Допустимый вес, кг', validators=[Optional(), NumberRange(min=0)])
+    max_slots = IntegerField('Мест (разных товаров)', validators=[Optional(), NumberRange(min=1)])
     submit = SubmitField('Сохранить')
 
 
@@ -91,6 +131,38 @@ class DocumentForm(FlaskForm):
     submit = SubmitField('Сохранить')
 
 
+class InventoryForm(FlaskForm):
+    """Форма создания инвентаризации"""
+    doc_date = DateField('Дата инвентаризации', default=date.today, validators=[DataRequired()])
+    cell_from = StringField('Ячейки с', validators=[Length(max=20)])
+    cell_to = StringField('по', validators=[Length(max=20)])
+    category_id = SelectField('Категория', coerce=int, validators=[Optional()], choices=[])
+    comment = TextAreaField('Комментарий', validators=[Length(max=500)])
+    submit = SubmitField('Создать')
+
+
+class TransferForm(FlaskForm):
+    """Форма перемещения между ячейками"""
+    doc_date = DateField('Дата документа', default=date.today, validators=[DataRequired()])
+    cell_id = SelectField('Из ячейки', coerce=int, validators=[DataRequired()], choices=[])
+    dest_cell_id = SelectField('В ячейку', coerce=int, validators=[DataRequired()], choices=[])
+    comment = TextAreaField('Комментарий', validators=[Length(max=500)])
+    post = BooleanField('Сразу провести')
+    submit = SubmitField('Создать')
+
+
+class InventoryCountForm(FlaskForm):
+    """Форма загрузки пересчета со сканера"""
+    file = FileField('Файл пересчета', validators=[
+        FileRequired(), FileAllowed(['csv', 'txt'], 'Только CSV')
+    ])
+    encoding = SelectField('Кодировка', choices=[
+        ('utf-8-sig', 'UTF-8'),
+        ('cp1251', 'Windows-1251')
+    ])
+    submit = SubmitField('Загрузить')
+
+
 class StockFilterForm(FlaskForm):
     """Форма фильтрации остатков"""
     product_id = SelectField('Товар', coerce=int, validators=[Optional()], choices=[])
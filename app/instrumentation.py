@@ -0,0 +1,137 @@
+"""Учет SQL-запросов в рамках HTTP-запроса.
+
+Слушатели before/after_cursor_execute считают число запросов, суммарное время
+и повторяющиеся "формы" запросов (признак N+1). Итоги отдаются в заголовке
+Server-Timing, а при SQL_DEBUG_PANEL - в панели внизу HTML-страницы.
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from time import perf_counter
+import re
+import threading
+
+from flask import g, request, render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACES = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """Нормализованная форма запроса: без литералов и с одной ? в списках IN"""
+    shape = _SPACES.sub(' ', statement).strip()
+    shape = _NUMBER.sub('?', shape)
+    return _IN_LIST.sub('(?)', shape)
+
+
+class QueryStats:
+    """Статистика SQL-запросов за интервал (HTTP-запрос, тест)"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes = Counter()
+        self.shape_time = defaultdict(float)
+
+    def record(self, statement, elapsed):
+        shape = statement_shape(statement)
+        self.count += 1
+        self.total_time += elapsed
+        self.shapes[shape] += 1
+        self.shape_time[shape] += elapsed
+
+    def repeated(self, threshold=2):
+        """Формы запросов, выполненные не меньше threshold раз (самые частые первыми)"""
+        return [(shape, count, self.shape_time[shape])
+                for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def report(self, threshold=2):
+        """Текстовая сводка для сообщений об ошибках и логов"""
+        lines = [f'{self.count} SQL-запросов, {self.total_time * 1000:.1f} мс']
+        for shape, count, elapsed in self.repeated(threshold):
+            lines.append(f'  {count}x ({elapsed * 1000:.1f} мс): {shape[:200]}')
+        return '\n'.join(lines)
+
+
+def _collectors():
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    return _local.collectors
+
+
+@contextmanager
+def capture_queries():
+    """Сбор статистики всех SQL-запросов текущего потока внутри блока with"""
+    stats = QueryStats()
+    _collectors().append(stats)
+    try:
+        yield stats
+    finally:
+        _collectors().remove(stats)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info['query_start'].pop()
+    for stats in _collectors():
+        stats.record(statement, elapsed)
+
+
+def init_instrumentation(app):
+    """Подключение учета SQL к запросам приложения"""
+
+    @app.before_request
+    def start_sql_stats():
+        if not app.config['SQL_INSTRUMENTATION']:
+            return
+        g.request_started = perf_counter()
+        g.sql_stats = QueryStats()
+        _collectors().append(g.sql_stats)
+
+    @app.after_request
+    def report_sql_stats(response):
+        stats = g.get('sql_stats')
+        if stats is None:
+            return response
+
+        threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+        total = (perf_counter() - g.request_started) * 1000
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={stats.total_time * 1000:.2f};desc="{stats.count} queries", '
+            f'app;dur={total:.2f}'
+        )
+
+        if stats.repeated(threshold):
+            app.logger.warning('Возможен N+1 в %s:\n%s', request.endpoint,
+                               stats.report(threshold))
+
+        if app.config['SQL_DEBUG_PANEL'] and response.mimetype == 'text/html' \
+                and not response.direct_passthrough:
+            _inject_debug_panel(response, stats, threshold)
+        return response
+
+    @app.teardown_request
+    def stop_sql_stats(exc):
+        stats = g.pop('sql_stats', None)
+        if stats is not None and stats in _collectors():
+            _collectors().remove(stats)
+
+
+def _inject_debug_panel(response, stats, threshold):
+    """Вставка панели с SQL-статистикой перед </body>"""
+    body = response.get_data(as_text=True)
+    if '</body>' not in body:
+        return
+    panel = render_template('debug/sql_panel.html', stats=stats,
+                            repeated=stats.repeated(threshold)[:10])
+    response.set_data(body.replace('</body>', panel + '</body>', 1))
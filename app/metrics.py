@@ -0,0 +1,261 @@
+"""Метрики приложения в формате Prometheus (/metrics).
+
+Каждый поток пишет в собственный набор счетчиков, поэтому на горячем пути нет
+блокировок; счетчики завершившегося потока переносятся в общий итог процесса.
+Процесс периодически сохраняет снимок своих счетчиков в файл
+METRICS_DIR/metrics_<pid>.json; /metrics суммирует снимки всех процессов
+(несколько воркеров за прокси) и удаляет файлы завершившихся процессов.
+Без METRICS_DIR метрики только свои.
+"""
+from time import perf_counter, time
+import json
+import os
+import threading
+import weakref
+
+from flask import Response, current_app, g, request
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'warehouse_http_requests_total': ('counter', 'Количество HTTP-запросов'),
+    'warehouse_http_request_errors_total': ('counter', 'Количество ответов с ошибкой 5xx'),
+    'warehouse_http_request_duration_seconds': ('histogram', 'Время обработки HTTP-запроса'),
+    'warehouse_http_request_db_seconds_total': ('counter', 'Время SQL-запросов в HTTP-запросах'),
+    'warehouse_http_request_db_queries_total': ('counter', 'Количество SQL-запросов в HTTP-запросах'),
+    'warehouse_documents_posted_total': ('counter', 'Проведено документов'),
+    'warehouse_document_lines_processed_total': ('counter', 'Обработано строк документов'),
+    'warehouse_document_posting_duration_seconds': ('histogram', 'Время проведения документа'),
+}
+
+
+class _Shard:
+    """Счетчики одного потока"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+class _Owner:
+    """Метка потока в threading.local: освобождается при завершении потока"""
+
+
+_local = threading.local()
+_shards = []
+_retired = _Shard()  # счетчики завершившихся потоков
+_shards_lock = threading.Lock()  # только при появлении и завершении потока и при сборе
+_last_flush = [0.0]
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        _local.owner = _Owner()
+        weakref.finalize(_local.owner, _retire, shard)
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def _retire(shard):
+    """Перенос счетчиков завершившегося потока в общий итог процесса"""
+    with _shards_lock:
+        _shards.remove(shard)
+        for key, value in shard.counters.items():
+            _retired.counters[key] = _retired.counters.get(key, 0) + value
+        for key, data in shard.histograms.items():
+            _add_histogram(_retired.histograms, key, list(data))
+
+
+def inc(name, labels=(), value=1):
+    """Увеличение счетчика"""
+    counters = _shard().counters
+    key = (name, tuple(labels))
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, labels, value):
+    """Наблюдение значения гистограммы"""
+    histograms = _shard().histograms
+    key = (name, tuple(labels))
+    data = histograms.get(key)
+    if data is None:
+        data = histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+    for index, bound in enumerate(BUCKETS):
+        if value <= bound:
+            data[index] += 1
+    data[-2] += value
+    data[-1] += 1
+
+
+def observe_posting(doc_type, lines, seconds):
+    """Учет проведенного документа (вызывается из StockService)"""
+    labels = (('doc_type', doc_type),)
+    inc('warehouse_documents_posted_total', labels)
+    inc('warehouse_document_lines_processed_total', labels, lines)
+    observe('warehouse_document_posting_duration_seconds', labels, seconds)
+
+
+def snapshot():
+    """Сумма счетчиков всех потоков процесса"""
+    with _shards_lock:
+        shards = list(_shards)
+        counters = dict(_retired.counters)
+        histograms = {key: list(data) for key, data in _retired.histograms.items()}
+    for shard in shards:
+        for key, value in list(shard.counters.items()):
+            counters[key] = counters.get(key, 0) + value
+        for key, data in list(shard.histograms.items()):
+            _add_histogram(histograms, key, list(data))
+    return counters, histograms
+
+
+def _add_histogram(histograms, key, data):
+    if key in histograms:
+        histograms[key] = [a + b for a, b in zip(histograms[key], data)]
+    else:
+        histograms[key] = data
+
+
+def flush(directory):
+    """Сохранение снимка процесса в METRICS_DIR (атомарная замена файла)"""
+    counters, histograms = snapshot()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'metrics_{os.getpid()}.json')
+    temp = f'{path}.{threading.get_ident()}.tmp'
+    with open(temp, 'w', encoding='utf-8') as output:
+        json.dump({
+            'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'histograms': [[name, labels, data] for (name, labels), data in histograms.items()]
+        }, output)
+    os.replace(temp, path)
+    _last_flush[0] = time()
+
+
+def collect(directory=None):
+    """Счетчики всех процессов (из файлов METRICS_DIR) или только текущего"""
+    if not directory:
+        return snapshot()
+
+    flush(directory)
+    counters, histograms = {}, {}
+    for filename in os.listdir(directory):
+        if not (filename.startswith('metrics_') and filename.endswith('.json')):
+            continue
+        if not _process_alive(filename[len('metrics_'):-len('.json')]):
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass  # файл уже удалил другой процесс
+            continue
+        try:
+            with open(os.path.join(directory, filename), encoding='utf-8') as source:
+                data = json.load(source)
+        except (OSError, ValueError):
+            continue  # файл пишется или поврежден - пропускаем до следующего сбора
+        for name, labels, value in data['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in data['histograms']:
+            _add_histogram(histograms, (name, tuple(tuple(pair) for pair in labels)), values)
+    return counters, histograms
+
+
+def _process_alive(pid):
+    """Жив ли процесс pid (файл с нераспознанным именем не удаляется)"""
+    try:
+        os.kill(int(pid), 0)
+    except ValueError:
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # процесс есть, но принадлежит другому пользователю
+    return True
+
+
+def render(counters, histograms):
+    """Текстовый формат экспозиции Prometheus"""
+    lines = []
+    series = {}
+    for (name, labels), value in counters.items():
+        series.setdefault(name, []).append((labels, value))
+    for (name, labels), data in histograms.items():
+        series.setdefault(name, []).append((labels, data))
+
+    for name in sorted(series):
+        kind, description = HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(series[name]):
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                continue
+            # Корзины хранятся накопительными (value <= bound)
+            for bound, count in zip(BUCKETS, value):
+                lines.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} {count}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {value[-1]}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(value[-2])}')
+            lines.append(f'{name}_count{_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def init_metrics(app):
+    """Подключение сбора метрик и маршрута /metrics"""
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+
+        endpoint = request.endpoint or '<unmatched>'
+        elapsed = perf_counter() - started
+        inc('warehouse_http_requests_total', (('endpoint', endpoint),
+                                              ('method', request.method),
+                                              ('status', str(response.status_code))))
+        if response.status_code >= 500:
+            inc('warehouse_http_request_errors_total', (('endpoint', endpoint),))
+        observe('warehouse_http_request_duration_seconds', (('endpoint', endpoint),), elapsed)
+
+        stats = g.get('sql_stats')
+        if stats is not None:
+            inc('warehouse_http_request_db_seconds_total', (('endpoint', endpoint),),
+                stats.total_time)
+            inc('warehouse_http_request_db_queries_total', (('endpoint', endpoint),),
+                stats.count)
+
+        directory = app.config['METRICS_DIR']
+        if directory and time() - _last_flush[0] >= app.config['METRICS_FLUSH_INTERVAL']:
+            flush(directory)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """Метрики в формате Prometheus"""
+        token = current_app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+
+        counters, histograms = collect(current_app.config['METRICS_DIR'])
+        return Response(render(counters, histograms),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
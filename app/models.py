@@ -2,6 +2,11 @@ from app import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import json
+
+# Типы документов, меняющие количество товара на складе; остальные типы
+# (инвентаризация, перемещение) в движения, оборот и остатки на дату не попадают
+MOVEMENT_TYPES = ('income', 'expense')
 
 class User(UserMixin, db.Model):
     """Модель пользователя"""
@@ -79,6 +84,8 @@ class Product(db.Model):
     name = db.Column(db.String(200), nullable=False)
     unit = db.Column(db.String(20), nullable=False, default='шт')  # шт, кг, м
     price = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    volume = db.Column(db.Numeric(10, 4))  # м³ на единицу, None - не учитывается
+    weight = db.Column(db.Numeric(10, 3))  # кг на единицу, None - не учитывается
     
     # Внешние ключи
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
@@ -90,11 +97,33 @@ class Product(db.Model):
     # Связи
     balances = db.relationship('StockBalance', backref='product', lazy='dynamic')
     document_items = db.relationship('DocumentItem', backref='product', lazy='dynamic')
+    barcodes = db.relationship('ProductBarcode', backref='product', lazy='dynamic',
+                               cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Product {self.article}: {self.name}>'
 
 
+class ProductBarcode(db.Model):
+    """
+    Штрихкод товара (EAN или внутренний код). У товара может быть несколько
+    кодов: штучный и упаковочные, multiplier - единиц товара в упаковке.
+    Сканер ищет товар по уникальному индексу кода.
+    """
+    __tablename__ = 'product_barcodes'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(64), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
+    multiplier = db.Column(db.Numeric(10, 3), nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_product_barcodes_code', 'code', unique=True),)
+    
+    def __repr__(self):
+        return f'<Barcode {self.code}: {self.product_id} x{self.multiplier}>'
+
+
 class WarehouseCell(db.Model):
     """Модель складской ячейки"""
     __tablename__ = 'warehouse_cells'
@@ -103,8 +132,15 @@ class WarehouseCell(db.Model):
     name = db.Column(db.String(20), unique=True, nullable=False)  # A-01, B-12 и т.д.
     description = db.Column(db.String(100))
     
+    # Вместимость, None - без ограничения
+    max_volume = db.Column(db.Numeric(10, 3))  # м³
+    max_weight = db.Column(db.Numeric(10, 2))  # кг
+    max_slots = db.Column(db.Integer)  # разных товаров
+    
     # Связи
     balances = db.relationship('StockBalance', backref='cell', lazy='dynamic')
+    occupancy = db.relationship('CellOccupancy', backref='cell', uselist=False,
+                                cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Cell {self.name}>'
@@ -121,6 +157,9 @@ class StockBalance(db.Model):
     cell_id = db.Column(db.Integer, db.ForeignKey('warehouse_cells.id'), nullable=False)
     
     quantity = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    # Зарезервировано черновиками расхода и свободный остаток (считает БД)
+    reserved = db.Column(db.Numeric(10, 2), nullable=False, default=0, server_default='0')
+    available = db.Column(db.Numeric(10, 2), db.Computed('quantity - reserved', persisted=True))
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Уникальность: один товар в одной ячейке
@@ -130,14 +169,56 @@ class StockBalance(db.Model):
         return f'<Balance {self.product_id} in {self.cell_id}: {self.quantity}>'
 
 
+class StockReservation(db.Model):
+    """
+    Резерв товара черновиком расхода. Сумма резервов остатка хранится в
+    stock_balances.reserved; просроченные резервы снимает ReservationService.expire.
+    """
+    __tablename__ = 'stock_reservations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    cell_id = db.Column(db.Integer, db.ForeignKey('warehouse_cells.id'), nullable=False)
+    quantity = db.Column(db.Numeric(10, 2), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<Reservation {self.document_id}: {self.product_id} x{self.quantity}>'
+
+
+class CellOccupancy(db.Model):
+    """
+    Заполненность ячеек: занятые объем, вес и места и остаток вместимости.
+    Пересчитывается по остаткам затронутых ячеек при каждом проведении
+    (OccupancyService.refresh), поиск ячеек под товар идет по индексам
+    свободного объема и веса без суммирования остатков.
+    """
+    __tablename__ = 'cell_occupancy'
+    
+    cell_id = db.Column(db.Integer, db.ForeignKey('warehouse_cells.id'), primary_key=True)
+    volume = db.Column(db.Numeric(14, 4), nullable=False, default=0)
+    weight = db.Column(db.Numeric(14, 3), nullable=False, default=0)
+    slots = db.Column(db.Integer, nullable=False, default=0)  # товаров с остатком
+    # Свободно, None - без ограничения
+    free_volume = db.Column(db.Numeric(14, 4), index=True)
+    free_weight = db.Column(db.Numeric(14, 3), index=True)
+    free_slots = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Occupancy {self.cell_id}: {self.volume} м³, {self.weight} кг>'
+
+
 class Document(db.Model):
-    """Модель документа (приход/расход)"""
+    """Модель документа (приход/расход/инвентаризация/перемещение)"""
     __tablename__ = 'documents'
     
     id = db.Column(db.Integer, primary_key=True)
-    doc_type = db.Column(db.String(10), nullable=False)  # income, expense
+    doc_type = db.Column(db.String(10), nullable=False)  # income, expense, inventory, transfer
     doc_number = db.Column(db.String(20), unique=True, nullable=False)
-    doc_date = db.Column(db.Date, nullable=False, default=datetime.utcnow)
+    doc_date = db.Column(db.Date, nullable=False, default=datetime.utcnow, index=True)
     
     # Статусы: draft, posted, cancelled
     status = db.Column(db.String(20), nullable=False, default='draft')
@@ -150,12 +231,26 @@ class Document(db.Model):
     posted_at = db.Column(db.DateTime)
     cancelled_at = db.Column(db.DateTime)
     
+    # Номер накладной поставщика (для загруженных из файлов)
+    external_number = db.Column(db.String(50), index=True)
+    
+    # Документ-основание (инвентаризация для документов оприходования/списания)
+    base_id = db.Column(db.Integer, db.ForeignKey('documents.id'), index=True)
+    
+    # Расход, недопоставку по которому содержит этот черновик (частичное проведение)
+    backorder_for_id = db.Column(db.Integer, db.ForeignKey('documents.id'), index=True)
+    
     # Комментарий
     comment = db.Column(db.String(500))
     
     # Связи
     items = db.relationship('DocumentItem', backref='document', lazy='dynamic', 
                            cascade='all, delete-orphan')
+    derived = db.relationship('Document', backref=db.backref('base', remote_side=[id]),
+                              lazy='dynamic', foreign_keys=[base_id])
+    backorders = db.relationship('Document',
+                                 backref=db.backref('backorder_for', remote_side=[id]),
+                                 lazy='dynamic', foreign_keys=[backorder_for_id])
     
     def total_amount(self):
         """Расчет общей суммы документа"""
@@ -170,6 +265,12 @@ class Document(db.Model):
     def is_posted(self):
         return self.status == 'posted'
     
+    def is_inventory(self):
+        return self.doc_type == 'inventory'
+    
+    def is_transfer(self):
+        return self.doc_type == 'transfer'
+    
     def __repr__(self):
         return f'<Document {self.doc_number}: {self.doc_type}>'
 
@@ -184,11 +285,228 @@ class DocumentItem(db.Model):
     document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     
-    quantity = db.Column(db.Numeric(10, 2), nullable=False)
+    quantity = db.Column(db.Numeric(10, 2), nullable=False)  # для инвентаризации - фактическое
     price = db.Column(db.Numeric(10, 2), nullable=False)  # Цена на момент документа
     
+    # Инвентаризация: пересчитываемая ячейка и учетный остаток в ней (фиксируется
+    # при проведении). Перемещение: ячейка-источник и ячейка-получатель
+    cell_id = db.Column(db.Integer, db.ForeignKey('warehouse_cells.id'))
+    book_quantity = db.Column(db.Numeric(10, 2))
+    dest_cell_id = db.Column(db.Integer, db.ForeignKey('warehouse_cells.id'))
+    
+    # Приход: партия и срок годности (строки без них партию не создают)
+    lot_number = db.Column(db.String(50))
+    expiry_date = db.Column(db.Date)
+    
+    cell = db.relationship('WarehouseCell', foreign_keys=[cell_id])
+    dest_cell = db.relationship('WarehouseCell', foreign_keys=[dest_cell_id])
+    
     def total(self):
         return self.quantity * self.price
     
+    def variance(self):
+        """Расхождение факта с учетом (для инвентаризации)"""
+        return self.quantity - (self.book_quantity or 0)
+    
+    def __repr__(self):
+        return f'<Item {self.product_id}: {self.quantity}>'
+
+class StockLot(db.Model):
+    """
+    Остаток партии товара по складу в целом (без ячеек). Партии создаются
+    приходами со сроком годности или номером партии; сумма партий товара не
+    больше его остатка, остальное - товар без партии. Расход списывает партии
+    по FEFO: первыми - с ближайшим сроком годности.
+    """
+    __tablename__ = 'stock_lots'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    lot_number = db.Column(db.String(50))
+    expiry_date = db.Column(db.Date)
+    quantity = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    product = db.relationship('Product')
+    
+    __table_args__ = (
+        # FEFO: партии товара по возрастанию срока - один проход по индексу
+        db.Index('ix_stock_lots_product_expiry', 'product_id', 'expiry_date'),
+        # Истекающие партии: только ненулевые остатки
+        db.Index('ix_stock_lots_expiry', 'expiry_date',
+                 postgresql_where=db.text('quantity > 0'), sqlite_where=db.text('quantity > 0')),
+    )
+    
+    def __repr__(self):
+        return f'<Lot {self.product_id} {self.lot_number} до {self.expiry_date}: {self.quantity}>'
+
+
+class LotAllocation(db.Model):
+    """Списание партии строкой расхода (для возврата при отмене)"""
+    __tablename__ = 'lot_allocations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_item_id = db.Column(db.Integer, db.ForeignKey('document_items.id'),
+                                 nullable=False, index=True)
+    lot_id = db.Column(db.Integer, db.ForeignKey('stock_lots.id'), nullable=False, index=True)
+    quantity = db.Column(db.Numeric(12, 2), nullable=False)
+    
+    lot = db.relationship('StockLot')
+
+
+class CellMovement(db.Model):
+    """
+    Изменение остатка ячейки строкой документа (со знаком): приход в ячейку
+    приемки, списание расхода по ячейкам, перемещение, пересчет
+    инвентаризации и их отмены. По движениям отмена расхода возвращает товар
+    в ячейки списания, а закрытие месяца строит снимок по ячейкам.
+    """
+    __tablename__ = 'cell_movements'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_item_id = db.Column(db.Integer, db.ForeignKey('document_items.id'),
+                                 nullable=False, index=True)
+    cell_id = db.Column(db.Integer, db.ForeignKey('warehouse_cells.id'), nullable=False)
+    quantity = db.Column(db.Numeric(12, 2), nullable=False)
+
+
+class DailyProductTurnover(db.Model):
+    """Оборот товара за день по типу документа (агрегат для отчетов)"""
+    __tablename__ = 'daily_product_turnover'
+    
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    doc_type = db.Column(db.String(10), primary_key=True)  # income, expense
+    
+    quantity = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    total_sum = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    operations = db.Column(db.Integer, nullable=False, default=0)  # строк документов
+    
+    __table_args__ = (db.Index('ix_daily_turnover_product', 'product_id', 'day'),)
+    
+    def __repr__(self):
+        return f'<Turnover {self.day} {self.product_id} {self.doc_type}: {self.quantity}>'
+
+
+class TurnoverBucket(db.Model):
+    """Кэш оборота за закрытый интервал графика (день, неделя, месяц)"""
+    __tablename__ = 'turnover_buckets'
+    
+    granularity = db.Column(db.String(10), primary_key=True)  # day, week, month
+    bucket_start = db.Column(db.Date, primary_key=True)
+    
+    quantity = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    total_sum = db.Column(db.Numeric(18, 2), nullable=False, default=0)
+    operations = db.Column(db.Integer, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<TurnoverBucket {self.granularity} {self.bucket_start}: {self.total_sum}>'
+
+
+class CacheVersion(db.Model):
+    """
+    Счетчик сбросов кэша: растет при каждом сбросе, поэтому заполнение кэша
+    по данным, прочитанным до сброса, можно отличить и отменить
+    """
+    __tablename__ = 'cache_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<CacheVersion {self.name}: {self.version}>'
+
+
+class ServiceLease(db.Model):
+    """
+    Аренда фоновой службы: службу выполняет только процесс holder, пока
+    не истек expires_at; затем аренду может взять любой другой процесс
+    """
+    __tablename__ = 'service_leases'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<ServiceLease {self.name}: {self.holder} до {self.expires_at}>'
+
+
+class ClosedPeriod(db.Model):
+    """Закрытый месяц: документы с датой не позже period_end не проводятся"""
+    __tablename__ = 'closed_periods'
+    
+    period_end = db.Column(db.Date, primary_key=True)  # последний день месяца
+    closed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    snapshot_rows = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ClosedPeriod {self.period_end}>'
+
+
+class BalanceSnapshot(db.Model):
+    """Остаток товара в ячейке на конец закрытого месяца"""
+    __tablename__ = 'balance_snapshots'
+    
+    period_end = db.Column(db.Date, db.ForeignKey('closed_periods.period_end'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    cell_id = db.Column(db.Integer, db.ForeignKey('warehouse_cells.id'), primary_key=True)
+    
+    quantity = db.Column(db.Numeric(14, 2), nullable=False)
+    value = db.Column(db.Numeric(16, 2), nullable=False)  # по цене товара на дату закрытия
+    
+    __table_args__ = (db.Index('ix_balance_snapshot_product', 'product_id', 'period_end'),)
+    
+    def __repr__(self):
+        return f'<Snapshot {self.period_end} {self.product_id} in {self.cell_id}: {self.quantity}>'
+
+
+class DemandForecast(db.Model):
+    """Прогноз недельного расхода товара (пересчет - flask forecast refresh)"""
+    __tablename__ = 'demand_forecasts'
+    
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    week_start = db.Column(db.Date, primary_key=True)  # понедельник прогнозной недели
+    
+    quantity = db.Column(db.Numeric(14, 3), nullable=False)
+    method = db.Column(db.String(10), nullable=False)  # ses, holt
+    error = db.Column(db.Float)  # средняя абсолютная ошибка прогноза на неделю по истории
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Forecast {self.product_id} {self.week_start}: {self.quantity}>'
+
+
+class Job(db.Model):
+    """Модель фоновой задачи (проведение, выгрузка, отчет)"""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(20), nullable=False, index=True)  # post, export, report
+    
+    # Статусы: queued, running, done, failed
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)  # 0..100
+    params = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    message = db.Column(db.String(500))
+    result_path = db.Column(db.String(500))
+    worker = db.Column(db.String(100))  # host:pid исполнителя
+    
+    # Внешние ключи
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # Документ задачи проведения; без внешнего ключа - задачи переживают удаление черновика
+    document_id = db.Column(db.Integer, index=True)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def get_params(self):
+        return json.loads(self.params or '{}')
+    
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+    
     def __repr__(self):
-        return f'<Item {self.product_id}: {self.quantity}>'
\ No newline at end of file
+        return f'<Job {self.id}: {self.job_type} {self.status}>'
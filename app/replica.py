@@ -0,0 +1,168 @@
+"""Маршрутизация чтения на реплику БД для тяжёлых отчётов.
+
+Реплика подключается через REPLICA_DATABASE_URI; ее движок создает
+init_replica() и хранит в app.extensions, а не в привязках Flask-SQLAlchemy,
+чтобы у приложений процесса не было общих метаданных реплики. Запросы внутри
+представлений, помеченных @read_replica, уходят на реплику, а любые записи
+(flush, INSERT/UPDATE/DELETE) - на основную БД. Если реплика отстала больше
+чем на REPLICA_MAX_LAG секунд, чтение остаётся на основной БД; результат
+проверки отставания запоминается на REPLICA_CHECK_INTERVAL секунд.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from time import monotonic
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context, stream_with_context
+from flask_sqlalchemy.session import Session
+
+SYNC_STATE_TABLE = 'replica_sync_state'
+
+
+class RoutingSession(Session):
+    """Сессия, отправляющая чтение отчётов на реплику"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._route_to_replica(clause):
+            return replica_engine()
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _route_to_replica(self, clause):
+        if not has_app_context() or not g.get('read_replica'):
+            return False
+
+        # После первой записи сессия "прилипает" к основной БД,
+        # чтобы запрос видел собственные изменения
+        if self._flushing or isinstance(clause, sa.sql.dml.UpdateBase):
+            self.info['pinned_to_primary'] = True
+        if self.info.get('pinned_to_primary'):
+            return False
+
+        return replica_engine() is not None
+
+
+def init_replica(app):
+    """Движок реплики приложения (если задан REPLICA_DATABASE_URI)"""
+    uri = app.config.get('REPLICA_DATABASE_URI')
+    app.extensions['replica_engine'] = sa.create_engine(uri) if uri else None
+    app.extensions['replica_checked'] = None  # (момент проверки, реплика свежая)
+
+
+def replica_engine():
+    """Движок реплики текущего приложения или None"""
+    return current_app.extensions.get('replica_engine')
+
+
+def read_replica(view):
+    """Декоратор: чтение внутри представления идёт на реплику (если она свежая)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        previous = g.get('read_replica', False)
+        g.read_replica = replica_available()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.read_replica = previous
+    return wrapper
+
+
+def stream_from_replica(generator):
+    """
+    Потоковый ответ представления @read_replica: генератор выполняется после
+    выхода из представления, поэтому флаг чтения с реплики ставится заново
+    на время каждой его порции.
+    """
+    use_replica = g.get('read_replica', False)
+
+    def wrapper():
+        previous = g.get('read_replica', False)
+        g.read_replica = use_replica
+        try:
+            yield from generator
+        finally:
+            g.read_replica = previous
+    return stream_with_context(wrapper())
+
+
+@contextmanager
+def primary_reads():
+    """Чтение внутри блока идет на основную БД даже в представлении @read_replica"""
+    previous = g.get('read_replica', False) if has_app_context() else False
+    if has_app_context():
+        g.read_replica = False
+    try:
+        yield
+    finally:
+        if has_app_context():
+            g.read_replica = previous
+
+
+def replica_available():
+    """Реплика настроена и отстаёт не больше REPLICA_MAX_LAG секунд"""
+    if replica_engine() is None:
+        return False
+
+    max_lag = current_app.config.get('REPLICA_MAX_LAG')
+    if max_lag is None:
+        return True
+
+    checked = current_app.extensions.get('replica_checked')
+    if checked and monotonic() - checked[0] < current_app.config['REPLICA_CHECK_INTERVAL']:
+        return checked[1]
+    lag = replica_lag()
+    available = lag is not None and lag <= max_lag
+    current_app.extensions['replica_checked'] = (monotonic(), available)
+    return available
+
+
+def replica_lag():
+    """Отставание реплики в секундах (None - реплика ни разу не синхронизировалась)"""
+    engine = replica_engine()
+
+    try:
+        with engine.connect() as conn:
+            synced_at = conn.execute(
+                sa.text(f'SELECT MAX(synced_at) FROM {SYNC_STATE_TABLE}')
+            ).scalar()
+    except sa.exc.OperationalError:
+        return None
+
+    if synced_at is None:
+        return None
+    if isinstance(synced_at, str):
+        synced_at = datetime.fromisoformat(synced_at)
+    return (datetime.utcnow() - synced_at).total_seconds()
+
+
+def sync_replica():
+    """
+    Копирование основной SQLite-базы в реплику (для локального запуска).
+    Для серверных СУБД реплику наполняет штатная репликация.
+    """
+    replica = replica_engine()
+    if replica is None:
+        raise RuntimeError('Реплика не настроена (REPLICA_DATABASE_URI)')
+
+    primary = current_app.extensions['sqlalchemy'].engines[None]
+    if primary.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+        raise RuntimeError('Синхронизация копированием поддерживается только для SQLite')
+
+    synced_at = datetime.utcnow()
+    source = primary.raw_connection()
+    target = replica.raw_connection()
+    try:
+        source.driver_connection.backup(target.driver_connection)
+        cursor = target.cursor()
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {SYNC_STATE_TABLE} (synced_at TIMESTAMP NOT NULL)')
+        cursor.execute(f'DELETE FROM {SYNC_STATE_TABLE}')
+        cursor.execute(f'INSERT INTO {SYNC_STATE_TABLE} (synced_at) VALUES (?)',
+                       (synced_at.isoformat(sep=' '),))
+        cursor.close()
+        target.commit()
+    finally:
+        target.close()
+        source.close()
+
+    current_app.extensions['replica_checked'] = None
+    return synced_at
@@ -1,9 +1,19 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from app import db
-from app.models import Document, DocumentItem, Product, Supplier
-from app.forms import DocumentForm
+from app.models import Document, DocumentItem, Product, Supplier, Category, WarehouseCell
+from app.forms import (DocumentForm, DocumentImportForm, InventoryForm, InventoryCountForm,
+                       TransferForm)
 from app.services.stock_service import StockService
+from app.services.job_service import JobService
+from app.services.replenishment_service import ReplenishmentService
+from app.services.document_import_service import DocumentImportService
+from app.services.inventory_service import InventoryService
+from app.services.transfer_service import TransferService
+from app.services.slotting_service import SlottingService
+from app.services.lot_service import LotService
+from app.services.reservation_service import ReservationService
+from app.services.numbering_service import NumberingService
 from datetime import datetime
 
 bp = Blueprint('documents', __name__)
@@ -82,19 +92,13 @@ def document_create():
                                   title='Новый документ',
                                   form=form,
                                   products=products,
+                                  available=ReservationService.available(),
                                   edit_mode=False)
         
         try:
-            # Генерация номера документа
-            today = datetime.now()
-            prefix = 'ПН' if form.doc_type.data == 'income' else 'РН'
-            
-            # Считаем количество документов за текущий месяц
-            count = Document.query.filter(
-                Document.doc_number.like(f'{prefix}-{today.strftime("%Y%m")}%')
-            ).count() + 1
-            
-            doc_number = f"{prefix}-{today.strftime('%Y%m')}-{count:04d}"
+            # Генерация номера документа: следующий за наибольшим номером месяца
+            doc_number = NumberingService.next_number(
+                'ПН' if form.doc_type.data == 'income' else 'РН')
             
             # Создаем документ
             document = Document(
@@ -124,6 +128,8 @@ def document_create():
                         quantity=float(quantity),
                         price=float(price)
                     )
+                    if document.doc_type == 'income':
+                        item.lot_number, item.expiry_date = _item_lot(i)
                     db.session.add(item)
                     items_added += 1
             
@@ -134,10 +140,12 @@ def document_create():
                                       title='Новый документ',
                                       form=form,
                                       products=products,
+                                      available=ReservationService.available(),
                                       edit_mode=False)
             
             db.session.commit()
             flash(f'Документ №{doc_number} успешно создан', 'success')
+            _reserve(document)
             return redirect(url_for('documents.document_view', id=document.id))
             
         except Exception as e:
@@ -149,6 +157,7 @@ def document_create():
                           title='Новый документ',
                           form=form,
                           products=products,
+                          available=ReservationService.available(),
                           edit_mode=False)
 
 
@@ -166,6 +175,13 @@ def document_edit(id):
         flash('Можно редактировать только документы в статусе "Черновик"', 'danger')
         return redirect(url_for('documents.document_view', id=id))
     
+    if document.is_inventory():
+        flash('Фактические остатки инвентаризации загружаются файлом пересчета', 'info')
+        return redirect(url_for('documents.document_view', id=id))
+    if document.is_transfer():
+        flash('Перемещение не редактируется: удалите черновик и создайте новый', 'info')
+        return redirect(url_for('documents.document_view', id=id))
+    
     form = DocumentForm(obj=document)
     
     # Заполняем select поля
@@ -197,6 +213,8 @@ def document_edit(id):
                         quantity=float(quantity),
                         price=float(price)
                     )
+                    if document.doc_type == 'income':
+                        item.lot_number, item.expiry_date = _item_lot(i)
                     db.session.add(item)
                     items_added += 1
             
@@ -206,6 +224,7 @@ def document_edit(id):
             
             db.session.commit()
             flash(f'Документ №{document.doc_number} обновлен', 'success')
+            _reserve(document)
             return redirect(url_for('documents.document_view', id=id))
             
         except Exception as e:
@@ -216,6 +235,7 @@ def document_edit(id):
                           title=f'Редактирование: {document.doc_number}',
                           form=form,
                           products=products,
+                          available=ReservationService.available(),
                           document=document,
                           edit_mode=True)
 
@@ -225,9 +245,21 @@ def document_edit(id):
 def document_view(id):
     """Просмотр документа"""
     document = Document.query.get_or_404(id)
+    if document.is_inventory():
+        return render_template('documents/inventory.html',
+                              title=f'Инвентаризация №{document.doc_number}',
+                              document=document,
+                              lines=InventoryService.lines(
+                                  document, current_app.config['INVENTORY_PAGE_ROWS']),
+                              totals=InventoryService.totals(document),
+                              form=InventoryCountForm())
     return render_template('documents/view.html',
                           title=f'Документ №{document.doc_number}',
-                          document=document)
+                          document=document,
+                          lots=LotService.item_lots(document)
+                          if document.doc_type == 'expense' and document.is_posted() else {},
+                          reserved_until=ReservationService.reserved_until(document)
+                          if document.doc_type == 'expense' and document.is_draft() else None)
 
 
 @bp.route('/<int:id>/post', methods=['POST'])
@@ -244,10 +276,30 @@ def document_post(id):
         flash(f'Документ №{document.doc_number} уже был проведен или отменен', 'danger')
         return redirect(url_for('documents.document_view', id=id))
     
+    # Частичное проведение расхода: нехватка уходит в черновик-недопоставку
+    partial = document.doc_type == 'expense' and request.form.get('partial') == '1'
+    
+    # Большие документы проводятся фоновой задачей, чтобы не упираться в таймаут
+    if document.items.count() >= current_app.config['JOB_POST_MIN_ITEMS']:
+        job = JobService.pending_post(document.id)
+        if job is not None:
+            flash(f'Документ №{document.doc_number} уже в очереди на проведение '
+                  f'(задача №{job.id})', 'warning')
+            return redirect(url_for('documents.document_view', id=id))
+        job = JobService.enqueue('post', {'document_id': document.id, 'partial': partial},
+                                 author_id=current_user.id)
+        flash(f'Документ №{document.doc_number} поставлен в очередь на проведение '
+              f'(задача №{job.id})', 'info')
+        return redirect(url_for('documents.document_view', id=id))
+    
     if document.doc_type == 'income':
         success, message = StockService.process_income_document(document)
+    elif document.doc_type == 'inventory':
+        success, message = InventoryService.process_document(document)
+    elif document.doc_type == 'transfer':
+        success, message = TransferService.process_document(document)
     else:
-        success, message = StockService.process_expense_document(document)
+        success, message = StockService.process_expense_document(document, partial=partial)
     
     if success:
         flash(message, 'success')
@@ -271,7 +323,10 @@ def document_cancel(id):
         flash(f'Можно отменить только проведенный документ', 'danger')
         return redirect(url_for('documents.document_view', id=id))
     
-    success, message = StockService.cancel_document(document)
+    if document.is_transfer():
+        success, message = TransferService.cancel_document(document)
+    else:
+        success, message = StockService.cancel_document(document)
     
     if success:
         flash(message, 'success')
@@ -281,6 +336,24 @@ def document_cancel(id):
     return redirect(url_for('documents.document_view', id=id))
 
 
+@bp.route('/<int:id>/reserve', methods=['POST'])
+@login_required
+def document_reserve(id):
+    """Резерв (продление резерва) товаров черновика расхода"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для редактирования документов', 'danger')
+        return redirect(url_for('documents.document_list'))
+    
+    document = Document.query.get_or_404(id)
+    
+    if not document.is_draft() or document.doc_type != 'expense':
+        flash('Резервируются только черновики расхода', 'danger')
+        return redirect(url_for('documents.document_view', id=id))
+    
+    _reserve(document)
+    return redirect(url_for('documents.document_view', id=id))
+
+
 @bp.route('/<int:id>/delete', methods=['POST'])
 @login_required
 def document_delete(id):
@@ -296,8 +369,240 @@ def document_delete(id):
         return redirect(url_for('documents.document_view', id=id))
     
     doc_number = document.doc_number
+    ReservationService.release([document])
     db.session.delete(document)
     db.session.commit()
     
     flash(f'Документ №{doc_number} удален', 'success')
-    return redirect(url_for('documents.document_list'))
\ No newline at end of file
+    return redirect(url_for('documents.document_list'))
+
+@bp.route('/replenishment')
+@login_required
+def replenishment():
+    """Рекомендуемые заказы поставщикам по точкам заказа"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для создания документов', 'danger')
+        return redirect(url_for('documents.document_list'))
+    
+    groups = ReplenishmentService.suggestions()
+    return render_template('documents/replenishment.html', groups=groups)
+
+
+@bp.route('/replenishment/create', methods=['POST'])
+@login_required
+def replenishment_create():
+    """Создание черновиков приходов по рекомендациям для выбранных поставщиков"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для создания документов', 'danger')
+        return redirect(url_for('documents.document_list'))
+    
+    supplier_ids = request.form.getlist('supplier_id', type=int)
+    if not supplier_ids:
+        flash('Выберите хотя бы одного поставщика', 'danger')
+        return redirect(url_for('documents.replenishment'))
+    
+    try:
+        documents = ReplenishmentService.create_orders(supplier_ids, author_id=current_user.id)
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Ошибка при создании документов: {str(e)}', 'danger')
+        return redirect(url_for('documents.replenishment'))
+    
+    if not documents:
+        flash('Нет рекомендаций для выбранных поставщиков', 'warning')
+        return redirect(url_for('documents.replenishment'))
+    
+    numbers = ', '.join(document.doc_number for document in documents)
+    flash(f'Созданы черновики приходов: {numbers}', 'success')
+    return redirect(url_for('documents.document_list', type='income', status='draft'))
+
+
+@bp.route('/import', methods=['GET', 'POST'])
+@login_required
+def document_import():
+    """Загрузка приходных накладных поставщиков из XML/CSV"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для создания документов', 'danger')
+        return redirect(url_for('documents.document_list'))
+    
+    form = DocumentImportForm()
+    result = None
+    
+    if form.validate_on_submit():
+        upload = form.file.data
+        file_format = 'xml' if upload.filename.lower().endswith('.xml') else 'csv'
+        try:
+            result = DocumentImportService.import_file(
+                upload.stream, file_format, form.encoding.data, post=form.post.data,
+                author_id=current_user.id
+            )
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Ошибка загрузки: {str(e)}', 'danger')
+        else:
+            flash(result.summary(), 'warning' if result.failed else 'success')
+    
+    return render_template('documents/import.html', form=form, result=result)
+
+
+@bp.route('/inventory/create', methods=['GET', 'POST'])
+@login_required
+def inventory_create():
+    """Создание инвентаризации по диапазону ячеек и/или категории"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для создания документов', 'danger')
+        return redirect(url_for('documents.document_list'))
+    
+    form = InventoryForm()
+    form.category_id.choices = [(0, '-- Все категории --')] + [
+        (c.id, c.name) for c in Category.query.order_by(Category.name)]
+    
+    if form.validate_on_submit():
+        try:
+            document = InventoryService.create(
+                form.cell_from.data, form.cell_to.data, form.category_id.data,
+                form.doc_date.data, current_user.id, form.comment.data or None
+            )
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+        else:
+            flash(f'Документ №{document.doc_number} создан, строк: {document.items.count()}',
+                  'success')
+            return redirect(url_for('documents.document_view', id=document.id))
+    
+    return render_template('documents/inventory_form.html', title='Новая инвентаризация',
+                          form=form)
+
+
+@bp.route('/<int:id>/counts', methods=['POST'])
+@login_required
+def inventory_counts(id):
+    """Загрузка фактических остатков инвентаризации со сканера"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для редактирования документов', 'danger')
+        return redirect(url_for('documents.document_list'))
+    
+    document = Document.query.get_or_404(id)
+    form = InventoryCountForm()
+    if not form.validate_on_submit():
+        for error in form.file.errors:
+            flash(error, 'danger')
+        return redirect(url_for('documents.document_view', id=id))
+    
+    try:
+        result = InventoryService.load_counts(document, form.file.data.stream,
+                                              form.encoding.data)
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+        return redirect(url_for('documents.document_view', id=id))
+    
+    flash(result.summary(), 'warning' if result.failed else 'success')
+    for line, message in result.errors[:10]:
+        flash(f'Строка {line}: {message}', 'danger')
+    return redirect(url_for('documents.document_view', id=id))
+
+
+@bp.route('/transfer/create', methods=['GET', 'POST'])
+@login_required
+def transfer_create():
+    """Перемещение между ячейками: выбранных товаров или всего содержимого ячейки"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для создания документов', 'danger')
+        return redirect(url_for('documents.document_list'))
+    
+    form = TransferForm()
+    cells = [(c.id, c.name) for c in WarehouseCell.query.order_by(WarehouseCell.name)]
+    form.cell_id.choices = cells
+    form.dest_cell_id.choices = cells
+    products = Product.query.order_by(Product.name).all()
+    
+    if form.validate_on_submit():
+        lines = []
+        for i in range(5):
+            product_id = request.form.get(f'product_{i}', type=int)
+            quantity = request.form.get(f'quantity_{i}', type=float)
+            if product_id and quantity:
+                lines.append({'product_id': product_id, 'cell_id': form.cell_id.data,
+                              'dest_cell_id': form.dest_cell_id.data, 'quantity': quantity})
+        try:
+            # Без товаров перемещается все содержимое ячейки
+            if lines:
+                document = TransferService.create(lines, form.doc_date.data, current_user.id,
+                                                  form.comment.data or None)
+            else:
+                document = TransferService.create_cell_transfer(
+                    form.cell_id.data, form.dest_cell_id.data, form.doc_date.data,
+                    current_user.id, form.comment.data or None)
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+        else:
+            flash(f'Документ №{document.doc_number} создан', 'success')
+            if form.post.data:
+                success, message = TransferService.process_document(document)
+                flash(message, 'success' if success else 'danger')
+            return redirect(url_for('documents.document_view', id=document.id))
+    
+    return render_template('documents/transfer_form.html', title='Новое перемещение',
+                          form=form, products=products)
+
+
+@bp.route('/slotting')
+@login_required
+def slotting():
+    """Рекомендуемое размещение товаров по ячейкам"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для создания документов', 'danger')
+        return redirect(url_for('documents.document_list'))
+    
+    plan = SlottingService.plan()
+    return render_template('documents/slotting.html', plan=plan)
+
+
+@bp.route('/slotting/create', methods=['POST'])
+@login_required
+def slotting_create():
+    """Черновик перемещения по выбранным рекомендациям размещения"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для создания документов', 'danger')
+        return redirect(url_for('documents.document_list'))
+    
+    product_ids = request.form.getlist('product_id', type=int)
+    if not product_ids:
+        flash('Выберите хотя бы один товар', 'danger')
+        return redirect(url_for('documents.slotting'))
+    
+    try:
+        document = SlottingService.create_transfer(product_ids, author_id=current_user.id)
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+        return redirect(url_for('documents.slotting'))
+    
+    if document is None:
+        flash('Нет рекомендаций для выбранных товаров', 'warning')
+        return redirect(url_for('documents.slotting'))
+    
+    flash(f'Создан черновик перемещения №{document.doc_number}', 'success')
+    return redirect(url_for('documents.document_view', id=document.id))
+
+
+def _reserve(document):
+    """Резерв черновика расхода после сохранения; нехватка - предупреждение"""
+    if document.doc_type != 'expense':
+        return
+    success, message = ReservationService.reserve(document)
+    flash(message if success else f'Товар не зарезервирован: {message}',
+          'info' if success else 'warning')
+
+
+def _item_lot(i):
+    """Партия и срок годности строки i формы прихода"""
+    lot_number = request.form.get(f'lot_{i}', '').strip()[:50] or None
+    try:
+        expiry_date = datetime.strptime(request.form.get(f'expiry_{i}', ''), '%Y-%m-%d').date()
+    except ValueError:
+        expiry_date = None
+    return lot_number, expiry_date
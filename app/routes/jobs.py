@@ -0,0 +1,52 @@
+from flask import Blueprint, jsonify, send_file, url_for
+from flask_login import login_required, current_user
+from app.models import Job
+import os
+
+bp = Blueprint('jobs', __name__)
+
+
+def _get_job(id):
+    """Задача, доступная текущему пользователю (автор или администратор)"""
+    job = Job.query.get_or_404(id)
+    if job.author_id != current_user.id and not current_user.is_admin():
+        return None
+    return job
+
+
+@bp.route('/<int:id>')
+@login_required
+def job_status(id):
+    """Статус и прогресс фоновой задачи"""
+    job = _get_job(id)
+    if job is None:
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    return jsonify({
+        'id': job.id,
+        'type': job.job_type,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'download_url': url_for('jobs.job_download', id=job.id)
+                        if job.status == 'done' and job.result_path else None
+    })
+
+
+@bp.route('/<int:id>/download')
+@login_required
+def job_download(id):
+    """Скачивание результата завершенной задачи"""
+    job = _get_job(id)
+    if job is None:
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    if job.status != 'done' or not job.result_path or not os.path.exists(job.result_path):
+        return jsonify({'error': 'Результат задачи недоступен', 'status': job.status}), 404
+    
+    mimetype = 'text/csv' if job.result_path.endswith('.csv') else 'application/json'
+    return send_file(job.result_path, mimetype=mimetype, as_attachment=True,
+                     download_name=os.path.basename(job.result_path))
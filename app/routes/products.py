@@ -1,9 +1,14 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from app import db
-from app.models import Product, Category, Supplier, WarehouseCell, StockBalance
-from app.forms import ProductForm, CategoryForm, SupplierForm, WarehouseCellForm, StockFilterForm
+from app.models import Product, ProductBarcode, Category, Supplier, WarehouseCell, StockBalance
+from app.forms import (ProductForm, ProductImportForm, BarcodeForm, CategoryForm, SupplierForm,
+                       WarehouseCellForm, StockFilterForm)
 from app.services.stock_service import StockService
+from app.services.import_service import CatalogImportService
+from app.services.occupancy_service import OccupancyService
+from app.services.barcode_service import BarcodeService
+from app.services.reservation_service import ReservationService
 from sqlalchemy.exc import IntegrityError
 
 bp = Blueprint('products', __name__)
@@ -31,9 +36,13 @@ def product_list():
         query = query.filter_by(supplier_id=supplier_id)
     
     if search:
+        # Отсканированный штрихкод - точное совпадение по индексу кода
+        barcode = db.session.query(ProductBarcode.product_id).filter(
+            ProductBarcode.code == BarcodeService.normalize(search))
         query = query.filter(
             (Product.name.ilike(f'%{search}%')) | 
-            (Product.article.ilike(f'%{search}%'))
+            (Product.article.ilike(f'%{search}%')) |
+            (Product.id.in_(barcode.scalar_subquery()))
         )
     
     # Пагинация
@@ -84,6 +93,8 @@ def product_create():
             name=form.name.data,
             unit=form.unit.data,
             price=form.price.data,
+            volume=form.volume.data,
+            weight=form.weight.data,
             category_id=form.category_id.data if form.category_id.data != 0 else None,
             supplier_id=form.supplier_id.data if form.supplier_id.data != 0 else None
         )
@@ -97,6 +108,35 @@ def product_create():
     return render_template('products/form.html', title='Новый товар', form=form)
 
 
+@bp.route('/import', methods=['GET', 'POST'])
+@login_required
+def product_import():
+    """Загрузка каталога товаров из CSV/JSONL с обновлением по артикулу"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для создания товаров', 'danger')
+        return redirect(url_for('products.product_list'))
+    
+    form = ProductImportForm()
+    result = None
+    
+    if form.validate_on_submit():
+        upload = form.file.data
+        file_format = 'jsonl' if upload.filename.lower().endswith(('.jsonl', '.json')) else 'csv'
+        try:
+            result = CatalogImportService.import_file(
+                upload.stream, file_format, form.encoding.data,
+                create_missing=form.create_missing.data
+            )
+            BarcodeService.invalidate()
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Ошибка загрузки: {str(e)}', 'danger')
+        else:
+            flash(result.summary(), 'warning' if result.failed else 'success')
+    
+    return render_template('products/import.html', form=form, result=result)
+
+
 @bp.route('/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def product_edit(id):
@@ -129,12 +169,80 @@ def product_edit(id):
         product.category_id = form.category_id.data if form.category_id.data != 0 else None
         product.supplier_id = form.supplier_id.data if form.supplier_id.data != 0 else None
         
+        # Размеры меняют заполненность ячеек, где лежит товар
+        dimensions = (product.volume, product.weight)
+        product.volume = form.volume.data
+        product.weight = form.weight.data
+        if dimensions != (product.volume, product.weight):
+            db.session.flush()
+            OccupancyService.refresh_product(product.id)
+        
         db.session.commit()
+        BarcodeService.invalidate(product.id)
         
         flash(f'Товар "{product.name}" успешно обновлен', 'success')
         return redirect(url_for('products.product_list'))
     
-    return render_template('products/form.html', title='Редактирование', form=form, product=product)
+    return render_template('products/form.html', title='Редактирование', form=form, product=product,
+                          barcode_form=BarcodeForm())
+
+
+@bp.route('/<int:id>/barcodes', methods=['POST'])
+@login_required
+def barcode_add(id):
+    """Привязка штрихкода к товару"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для редактирования товаров', 'danger')
+        return redirect(url_for('products.product_list'))
+    
+    product = Product.query.get_or_404(id)
+    form = BarcodeForm()
+    if form.validate_on_submit():
+        try:
+            barcode = BarcodeService.add(product, form.code.data, form.multiplier.data)
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+        else:
+            flash(f'Штрихкод {barcode.code} добавлен', 'success')
+    else:
+        for errors in form.errors.values():
+            flash(errors[0], 'danger')
+    
+    return redirect(url_for('products.product_edit', id=id))
+
+
+@bp.route('/barcodes/<int:id>/delete', methods=['POST'])
+@login_required
+def barcode_delete(id):
+    """Удаление штрихкода товара"""
+    if not current_user.is_manager():
+        flash('У вас нет прав для редактирования товаров', 'danger')
+        return redirect(url_for('products.product_list'))
+    
+    barcode = ProductBarcode.query.get_or_404(id)
+    product_id, code = barcode.product_id, barcode.code
+    BarcodeService.remove(barcode)
+    
+    flash(f'Штрихкод {code} удален', 'success')
+    return redirect(url_for('products.product_edit', id=product_id))
+
+
+@bp.route('/scan')
+@login_required
+def scan():
+    """Товар по отсканированному коду (для сканеров): JSON с товаром, кратностью и свободным остатком"""
+    code = request.args.get('code', '')
+    if not code.strip():
+        return jsonify({'error': 'Не указан штрихкод'}), 400
+    
+    result = BarcodeService.resolve(code)
+    if result is None:
+        return jsonify({'error': f'Штрихкод {code.strip()} не найден'}), 404
+    # Свободный остаток не кэшируется: одно чтение строки остатка
+    result['available'] = float(ReservationService.available([result['product_id']]).get(
+        result['product_id'], 0))
+    return jsonify(result)
 
 
 @bp.route('/<int:id>/delete', methods=['POST'])
@@ -162,6 +270,7 @@ def product_delete(id):
         name = product.name
         db.session.delete(product)
         db.session.commit()
+        BarcodeService.invalidate(id)
         flash(f'Товар "{name}" удален', 'success')
         
     except IntegrityError as e:
@@ -178,13 +287,13 @@ def product_delete(id):
 @login_required
 def product_movement(id):
     """История движения товара"""
-    from app.models import Document, DocumentItem
+    from app.models import Document, DocumentItem, MOVEMENT_TYPES
     
     product = Product.query.get_or_404(id)
     
     # Получаем все движения по товару
     items = DocumentItem.query.filter_by(product_id=id).join(Document).filter(
-        Document.status == 'posted'
+        Document.status == 'posted', Document.doc_type.in_(MOVEMENT_TYPES)
     ).order_by(Document.doc_date).all()
     
     movements = []
@@ -200,6 +309,7 @@ def product_movement(id):
         movements.append({
             'date': item.document.doc_date,
             'doc_number': item.document.doc_number,
+            'doc_id': item.document.id,
             'doc_type': item.document.doc_type,
             'doc_type_name': 'Приход' if item.document.doc_type == 'income' else 'Расход',
             'quantity': float(item.quantity),
@@ -399,9 +509,22 @@ def supplier_delete(id):
 @bp.route('/cells')
 @login_required
 def cell_list():
-    """Список ячеек"""
-    cells = WarehouseCell.query.all()
-    return render_template('products/cells.html', title='Складские ячейки', cells=cells)
+    """Список ячеек с заполненностью; по article и quantity - ячейки, куда поместится товар"""
+    cells = OccupancyService.utilization()
+    
+    article = request.args.get('article', '').strip()
+    quantity = request.args.get('quantity', type=float)
+    product, candidates = None, None
+    if article and quantity and quantity > 0:
+        product = Product.query.filter_by(article=article).first()
+        if product is None:
+            flash(f'Товар с артикулом "{article}" не найден', 'danger')
+        else:
+            candidates = OccupancyService.candidates(product, quantity)
+    
+    return render_template('products/cells.html', title='Складские ячейки', cells=cells,
+                          article=article, quantity=quantity, product=product,
+                          candidates=candidates)
 
 
 @bp.route('/cells/create', methods=['GET', 'POST'])
@@ -421,10 +544,15 @@ def cell_create():
         
         cell = WarehouseCell(
             name=form.name.data,
-            description=form.description.data
+            description=form.description.data,
+            max_volume=form.max_volume.data,
+            max_weight=form.max_weight.data,
+            max_slots=form.max_slots.data
         )
         
         db.session.add(cell)
+        db.session.flush()
+        OccupancyService.refresh([cell.id])
         db.session.commit()
         
         flash(f'Ячейка "{cell.name}" создана', 'success')
@@ -1,40 +1,39 @@
-from flask import Blueprint, render_template, request, jsonify, send_file
+from flask import (Blueprint, render_template, request, jsonify, send_file, url_for, flash,
+                   Response, current_app)
 from flask_login import login_required, current_user
 from app import db
-from app.models import Product, Category, Supplier, Document, DocumentItem, StockBalance
+from app.models import Product, Category, Supplier, Document, DocumentItem, Job, MOVEMENT_TYPES
+from app.replica import read_replica, stream_from_replica
+from app.services.report_service import ReportService, PERIOD_GRANULARITY
+from app.services.job_service import JobService
+from app.services.classification_service import ClassificationService
+from app.services.forecast_service import ForecastService
+from app.services.valuation_service import ValuationService, PRICE_BASES
+from app.services.turnover_ratio_service import TurnoverRatioService
+from app.services.period_service import PeriodService
+from app.services.lot_service import LotService
 from datetime import datetime, timedelta
-from sqlalchemy import func, extract
-import csv
+from sqlalchemy import func
 import io
 from decimal import Decimal
 
 bp = Blueprint('reports', __name__)
 
+# Строк ABC/XYZ на странице, полный список - в выгрузке
+ABC_XYZ_PAGE_ROWS = 500
+# Строк прогноза на странице
+FORECAST_PAGE_ROWS = 500
+# Строк оборачиваемости на странице, полный список - в выгрузке
+TURNOVER_RATIO_PAGE_ROWS = 500
+# Партий с истекающим сроком на странице
+EXPIRING_PAGE_ROWS = 500
+
 @bp.route('/stock')
 @login_required
+@read_replica
 def stock_report():
     """Отчет по остаткам товаров"""
-    # Получаем все товары с остатками
-    products = Product.query.all()
-    
-    report_data = []
-    for product in products:
-        # Суммарный остаток по всем ячейкам
-        total = db.session.query(func.sum(StockBalance.quantity)).filter_by(
-            product_id=product.id
-        ).scalar() or 0
-        
-        if total > 0:  # Только товары в наличии
-            report_data.append({
-                'id': product.id,
-                'article': product.article,
-                'name': product.name,
-                'category': product.category.name if product.category else '-',
-                'unit': product.unit,
-                'total_quantity': float(total),
-                'avg_price': float(product.price),
-                'total_value': float(total * product.price)
-            })
+    report_data = ReportService.stock_rows()
     
     # Сортировка по категории и названию
     report_data.sort(key=lambda x: (x['category'], x['name']))
@@ -53,63 +52,53 @@ def stock_report():
                           generated_at=datetime.now())
 
 
+@bp.route('/valuation')
+@login_required
+@read_replica
+def valuation_report():
+    """
+    Оценка остатков на дату с итогами по категориям. Без фильтра по категории
+    по умолчанию показываются только итоги (detail=1 - с товарами).
+    """
+    category_id = request.args.get('category_id', 0, type=int)
+    detail = request.args.get('detail', 1 if category_id else 0, type=int)
+    as_of, price_basis = _valuation_params()
+    
+    rows, response = _report_rows(
+        'valuation', lambda: ValuationService.rows(as_of, category_id, price_basis,
+                                                   with_products=bool(detail)),
+        as_of=as_of.isoformat() if as_of else None, category_id=category_id,
+        price_basis=price_basis, detail=detail)
+    if response is not None:
+        return response
+    
+    return render_template('reports/valuation.html',
+                          title='Оценка остатков',
+                          report_data=rows,
+                          total=rows[-1],
+                          as_of=as_of,
+                          price_basis=price_basis,
+                          detail=detail,
+                          categories=Category.query.all(),
+                          selected_category=category_id,
+                          generated_at=datetime.now())
+
+
 @bp.route('/turnover')
 @login_required
+@read_replica
 def turnover_report():
     """Отчет по обороту товаров за период"""
     # Параметры отчета
     period = request.args.get('period', 'month')  # week, month, quarter, year
     category_id = request.args.get('category_id', 0, type=int)
     
-    # Определяем дату начала
-    today = datetime.now().date()
-    if period == 'week':
-        start_date = today - timedelta(days=7)
-    elif period == 'month':
-        start_date = today - timedelta(days=30)
-    elif period == 'quarter':
-        start_date = today - timedelta(days=90)
-    elif period == 'year':
-        start_date = today - timedelta(days=365)
-    else:
-        start_date = today - timedelta(days=30)
-    
-    # Базовый запрос
-    query = db.session.query(
-        Product.id,
-        Product.article,
-        Product.name,
-        Category.name.label('category_name'),
-        Product.unit,
-        func.sum(DocumentItem.quantity).label('total_quantity'),
-        func.sum(DocumentItem.quantity * DocumentItem.price).label('total_sum'),
-        func.count(DocumentItem.id).label('operations_count')
-    ).join(DocumentItem, Product.id == DocumentItem.product_id
-    ).join(Document, DocumentItem.document_id == Document.id
-    ).join(Category, Product.category_id == Category.id, isouter=True
-    ).filter(Document.doc_date >= start_date
-    ).filter(Document.status == 'posted'  # Только проведенные
-    )
-    
-    # Фильтр по категории
-    if category_id:
-        query = query.filter(Product.category_id == category_id)
-    
-    # Группировка
-    query = query.group_by(Product.id, Category.name).order_by(Product.name)
-    
-    report_data = []
-    for row in query.all():
-        report_data.append({
-            'id': row.id,
-            'article': row.article,
-            'name': row.name,
-            'category': row.category_name or '-',
-            'unit': row.unit,
-            'total_quantity': float(row.total_quantity or 0),
-            'total_sum': float(row.total_sum or 0),
-            'operations_count': row.operations_count
-        })
+    start_date, end_date = _report_range(period)
+    report_data, response = _report_rows(
+        'turnover', lambda: ReportService.turnover_rows(start_date, category_id, end_date),
+        date_from=start_date.isoformat(), date_to=end_date.isoformat(), category_id=category_id)
+    if response is not None:
+        return response
     
     # Категории для фильтра
     categories = Category.query.all()
@@ -126,14 +115,140 @@ def turnover_report():
                           selected_category=category_id,
                           period=period,
                           start_date=start_date,
+                          end_date=end_date,
                           total_operations=total_operations,
                           total_quantity=total_quantity,
                           total_sum=total_sum,
                           generated_at=datetime.now())
 
 
+@bp.route('/turnover/compare')
+@login_required
+@read_replica
+def turnover_compare():
+    """Сравнение оборота за произвольный период с предыдущим периодом"""
+    period = request.args.get('period', 'month')
+    category_id = request.args.get('category_id', 0, type=int)
+    
+    date_from, date_to = _report_range(period)
+    previous_from, previous_to = ReportService.previous_range(date_from, date_to)
+    report_data = ReportService.turnover_comparison(date_from, date_to, category_id)
+    
+    totals = {key: sum(item[key] for item in report_data)
+              for key in ('quantity', 'prev_quantity', 'total_sum', 'prev_total_sum',
+                          'operations', 'prev_operations', 'delta_sum')}
+    
+    return render_template('reports/turnover_compare.html',
+                          title='Сравнение периодов',
+                          report_data=report_data,
+                          categories=Category.query.all(),
+                          selected_category=category_id,
+                          date_from=date_from,
+                          date_to=date_to,
+                          previous_from=previous_from,
+                          previous_to=previous_to,
+                          totals=totals,
+                          generated_at=datetime.now())
+
+
+@bp.route('/turnover/ratio')
+@login_required
+@read_replica
+def turnover_ratio_report():
+    """Оборачиваемость запасов и запас в днях по товарам и категориям"""
+    period = request.args.get('period', 'quarter')
+    category_id = request.args.get('category_id', 0, type=int)
+    
+    date_from, date_to = _report_range(period)
+    rows, category_rows, total = TurnoverRatioService.rows(date_from, date_to, category_id)
+    
+    return render_template('reports/turnover_ratio.html',
+                          title='Оборачиваемость запасов',
+                          report_data=rows[:TURNOVER_RATIO_PAGE_ROWS],
+                          total_items=len(rows),
+                          category_rows=category_rows,
+                          total=total,
+                          categories=Category.query.all(),
+                          selected_category=category_id,
+                          period=period,
+                          date_from=date_from,
+                          date_to=date_to,
+                          generated_at=datetime.now())
+
+
+@bp.route('/expiring')
+@login_required
+@read_replica
+def expiring_report():
+    """Партии, срок годности которых истекает в ближайшие days дней (и уже истекшие)"""
+    days = max(request.args.get('days', current_app.config['EXPIRY_REPORT_DAYS'], type=int), 0)
+    category_id = request.args.get('category_id', 0, type=int)
+    
+    return render_template('reports/expiring.html',
+                          title='Истекающие сроки годности',
+                          report_data=LotService.expiring(days, category_id=category_id,
+                                                          limit=EXPIRING_PAGE_ROWS),
+                          total=LotService.expiring_totals(days, category_id=category_id),
+                          page_rows=EXPIRING_PAGE_ROWS,
+                          days=days,
+                          categories=Category.query.all(),
+                          selected_category=category_id,
+                          generated_at=datetime.now())
+
+
+@bp.route('/abc-xyz')
+@login_required
+@read_replica
+def abc_xyz_report():
+    """ABC/XYZ-классификация товаров по расходу за период"""
+    period = request.args.get('period', 'year')
+    category_id = request.args.get('category_id', 0, type=int)
+    
+    date_from, date_to = _report_range(period)
+    rows, response = _report_rows(
+        'abc-xyz', lambda: ClassificationService.rows(date_from, date_to, category_id),
+        date_from=date_from.isoformat(), date_to=date_to.isoformat(), category_id=category_id)
+    if response is not None:
+        return response
+    matrix = ClassificationService.matrix(rows)
+    total_value = sum(value for _, value in matrix.values())
+    
+    return render_template('reports/abc_xyz.html',
+                          title='ABC/XYZ-анализ',
+                          report_data=rows[:ABC_XYZ_PAGE_ROWS],
+                          total_items=len(rows),
+                          matrix=matrix,
+                          total_value=total_value,
+                          categories=Category.query.all(),
+                          selected_category=category_id,
+                          period=period,
+                          date_from=date_from,
+                          date_to=date_to,
+                          generated_at=datetime.now())
+
+
+@bp.route('/forecast')
+@login_required
+@read_replica
+def forecast_report():
+    """Прогноз недельного расхода товаров (из последнего ночного пересчета)"""
+    category_id = request.args.get('category_id', 0, type=int)
+    rows = ForecastService.rows(category_id, limit=FORECAST_PAGE_ROWS)
+    
+    return render_template('reports/forecast.html',
+                          title='Прогноз спроса',
+                          report_data=rows,
+                          page_rows=FORECAST_PAGE_ROWS,
+                          horizon=current_app.config['FORECAST_HORIZON_WEEKS'],
+                          computed_at=max((row['computed_at'] for row in rows), default=None),
+                          categories=Category.query.all(),
+                          selected_category=category_id,
+                          generated_at=datetime.now())
+
+
 @bp.route('/suppliers')
 @login_required
+@read_replica
 def suppliers_report():
     """Отчет по поставщикам"""
     suppliers = Supplier.query.all()
@@ -191,6 +306,7 @@ def suppliers_report():
 
 @bp.route('/movement/<int:product_id>')
 @login_required
+@read_replica
 def product_movement(product_id):
     """Детальный отчет по движению конкретного товара"""
     product = Product.query.get_or_404(product_id)
@@ -199,7 +315,8 @@ def product_movement(product_id):
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
     
-    query = DocumentItem.query.filter_by(product_id=product_id).join(Document)
+    query = DocumentItem.query.filter_by(product_id=product_id).join(Document).filter(
+        Document.doc_type.in_(MOVEMENT_TYPES))
     
     if date_from:
         query = query.filter(Document.doc_date >= datetime.strptime(date_from, '%Y-%m-%d').date())
@@ -214,22 +331,9 @@ def product_movement(product_id):
     # Сначала получаем начальный остаток на дату начала (если указана)
     if date_from:
         start_date = datetime.strptime(date_from, '%Y-%m-%d').date()
-        # Считаем остаток на начало периода
-        initial = db.session.query(func.sum(StockBalance.quantity)).filter_by(
-            product_id=product_id
-        ).scalar() or 0
-        
-        # Вычитаем движения до начальной даты
-        before = db.session.query(
-            func.sum(DocumentItem.quantity)
-        ).join(Document
-        ).filter(
-            DocumentItem.product_id == product_id,
-            Document.doc_date < start_date,
-            Document.status == 'posted'
-        ).scalar() or 0
-        
-        running_balance = float(initial) - float(before)
+        # Остаток на конец предыдущего дня: снимок закрытого месяца + движения после него
+        running_balance = float(PeriodService.balance_at(product_id,
+                                                         start_date - timedelta(days=1)))
     
     for item in query.order_by(Document.doc_date, Document.id).all():
         if item.document.status != 'posted':
@@ -272,33 +376,15 @@ def product_movement(product_id):
 
 @bp.route('/export/stock')
 @login_required
+@read_replica
 def export_stock():
     """Экспорт остатков в CSV"""
+    if request.args.get('background', type=int):
+        return _enqueue_export('stock')
+    
     # Создаем файл в памяти
     output = io.StringIO()
-    writer = csv.writer(output, delimiter=';')
-    
-    # Заголовки
-    writer.writerow(['Артикул', 'Наименование', 'Категория', 'Ед.изм.', 
-                     'Количество', 'Цена', 'Сумма'])
-    
-    # Данные
-    products = Product.query.all()
-    for product in products:
-        total = db.session.query(func.sum(StockBalance.quantity)).filter_by(
-            product_id=product.id
-        ).scalar() or 0
-        
-        if total > 0:
-            writer.writerow([
-                product.article,
-                product.name,
-                product.category.name if product.category else '-',
-                product.unit,
-                float(total),
-                float(product.price),
-                float(total * product.price)
-            ])
+    ReportService.write_stock_csv(output)
     
     # Подготовка ответа
     output.seek(0)
@@ -312,118 +398,190 @@ def export_stock():
 
 @bp.route('/export/turnover')
 @login_required
+@read_replica
 def export_turnover():
-    """Экспорт оборота в CSV"""
+    """Экспорт оборота в CSV за тот же диапазон, что и на странице отчета"""
     period = request.args.get('period', 'month')
+    category_id = request.args.get('category_id', 0, type=int)
+    date_from, date_to = _report_range(period)
+    
+    if request.args.get('background', type=int):
+        return _enqueue_export('turnover', date_from=date_from.isoformat(),
+                               date_to=date_to.isoformat(), category_id=category_id)
     
-    # Определяем дату начала (как в turnover_report)
-    today = datetime.now().date()
-    if period == 'week':
-        start_date = today - timedelta(days=7)
-    elif period == 'month':
-        start_date = today - timedelta(days=30)
-    elif period == 'quarter':
-        start_date = today - timedelta(days=90)
-    elif period == 'year':
-        start_date = today - timedelta(days=365)
-    else:
-        start_date = today - timedelta(days=30)
-    
-    # Запрос данных (аналогично turnover_report)
-    query = db.session.query(
-        Product.article,
-        Product.name,
-        Category.name.label('category'),
-        Product.unit,
-        func.sum(DocumentItem.quantity).label('total_qty'),
-        func.sum(DocumentItem.quantity * DocumentItem.price).label('total_sum'),
-        func.count(DocumentItem.id).label('ops')
-    ).join(DocumentItem
-    ).join(Document
-    ).join(Category, isouter=True
-    ).filter(
-        Document.doc_date >= start_date,
-        Document.status == 'posted'
-    ).group_by(Product.id, Category.name).order_by(Product.name)
-    
-    # Создаем CSV
     output = io.StringIO()
-    writer = csv.writer(output, delimiter=';')
-    
-    writer.writerow(['Артикул', 'Наименование', 'Категория', 'Ед.изм.',
-                     'Кол-во', 'Сумма', 'Кол-во операций'])
-    
-    for row in query.all():
-        writer.writerow([
-            row.article,
-            row.name,
-            row.category or '-',
-            row.unit,
-            float(row.total_qty or 0),
-            float(row.total_sum or 0),
-            row.ops
-        ])
+    ReportService.write_turnover_csv(output, date_from, date_to, category_id)
     
     output.seek(0)
     return send_file(
         io.BytesIO(output.getvalue().encode('cp1251')),
         mimetype='text/csv',
         as_attachment=True,
-        download_name=f'oborot_{period}_{datetime.now().strftime("%Y%m%d")}.csv'
+        download_name=f'oborot_{date_from:%Y%m%d}_{date_to:%Y%m%d}.csv'
+    )
+
+
+@bp.route('/export/abc-xyz')
+@login_required
+@read_replica
+def export_abc_xyz():
+    """Потоковая выгрузка ABC/XYZ-классификации в CSV"""
+    period = request.args.get('period', 'year')
+    category_id = request.args.get('category_id', 0, type=int)
+    date_from, date_to = _report_range(period)
+    
+    filename = f'abc_xyz_{date_from:%Y%m%d}_{date_to:%Y%m%d}.csv'
+    return Response(
+        stream_from_replica(ClassificationService.iter_csv(date_from, date_to, category_id)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+@bp.route('/export/turnover-ratio')
+@login_required
+@read_replica
+def export_turnover_ratio():
+    """Потоковая выгрузка оборачиваемости запасов в CSV"""
+    period = request.args.get('period', 'quarter')
+    category_id = request.args.get('category_id', 0, type=int)
+    date_from, date_to = _report_range(period)
+    
+    filename = f'oborachivaemost_{date_from:%Y%m%d}_{date_to:%Y%m%d}.csv'
+    return Response(
+        stream_from_replica(TurnoverRatioService.iter_csv(date_from, date_to, category_id)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
 
+@bp.route('/export/valuation')
+@login_required
+@read_replica
+def export_valuation():
+    """Потоковая выгрузка оценки остатков с итогами в CSV"""
+    category_id = request.args.get('category_id', 0, type=int)
+    as_of, price_basis = _valuation_params()
+    
+    filename = f'ocenka_{(as_of or datetime.now().date()):%Y%m%d}.csv'
+    return Response(
+        stream_from_replica(ValuationService.iter_csv(as_of, category_id, price_basis)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+def _enqueue_export(report, **params):
+    """Постановка выгрузки в очередь фоновых задач"""
+    job = JobService.enqueue('export', dict(params, report=report), author_id=current_user.id)
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('jobs.job_status', id=job.id)
+    }), 202
+
+
+def _report_rows(report, build, **params):
+    """
+    Строки тяжелого отчета: (строки, ответ). background=1 - постановка задачи
+    'report' (ответ 202 со ссылкой на страницу результата), job=<id> - строки
+    завершенной задачи с теми же параметрами, иначе расчет build() в запросе.
+    """
+    params = dict(params, report=report)
+    if request.args.get('background', type=int):
+        job = JobService.enqueue('report', params, author_id=current_user.id)
+        args = request.args.to_dict()
+        args.pop('background')
+        return None, (jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('jobs.job_status', id=job.id),
+            'result_url': url_for(request.endpoint, **dict(args, job=job.id))
+        }), 202)
+    
+    job_id = request.args.get('job', type=int)
+    if job_id:
+        job = db.session.get(Job, job_id)
+        if job is not None and job.get_params() == params \
+                and (job.author_id == current_user.id or current_user.is_admin()):
+            rows = JobService.report_result(job)
+            if rows is not None:
+                return rows, None
+        flash('Результат фоновой задачи недоступен, отчет построен заново', 'warning')
+    return build(), None
+
+
 # ============== API ДЛЯ ГРАФИКОВ ==============
 
 @bp.route('/api/chart/turnover')
 @login_required
+@read_replica
 def api_turnover_chart():
-    """API для данных графика оборота"""
+    """
+    API для данных графика оборота.
+    Диапазон и детализация задаются явно (date_from, date_to, granularity:
+    day, week, month) или выводятся из периода отчета (period).
+    """
     period = request.args.get('period', 'month')
+    granularity = request.args.get('granularity', PERIOD_GRANULARITY.get(period, 'week'))
     
-    # Группировка по дням/неделям/месяцам
-    if period == 'week':
-        # По дням
-        data = db.session.query(
-            Document.doc_date,
-            func.sum(DocumentItem.quantity * DocumentItem.price).label('total')
-        ).join(DocumentItem
-        ).filter(Document.status == 'posted'
-        ).group_by(Document.doc_date
-        ).order_by(Document.doc_date).limit(7).all()
-        
-        labels = [d.doc_date.strftime('%d.%m') for d in data]
-        values = [float(d.total) for d in data]
-        
-    elif period == 'month':
-        # По неделям (упрощенно)
-        data = db.session.query(
-            extract('week', Document.doc_date).label('week'),
-            func.sum(DocumentItem.quantity * DocumentItem.price).label('total')
-        ).join(DocumentItem
-        ).filter(Document.status == 'posted'
-        ).group_by('week'
-        ).order_by('week').limit(4).all()
-        
-        labels = [f'Неделя {int(d.week)}' for d in data]
-        values = [float(d.total) for d in data]
-        
-    else:
-        # По месяцам
-        data = db.session.query(
-            extract('month', Document.doc_date).label('month'),
-            func.sum(DocumentItem.quantity * DocumentItem.price).label('total')
-        ).join(DocumentItem
-        ).filter(Document.status == 'posted'
-        ).group_by('month'
-        ).order_by('month').limit(12).all()
-        
-        months = ['Янв', 'Фев', 'Мар', 'Апр', 'Май', 'Июн',
-                  'Июл', 'Авг', 'Сен', 'Окт', 'Ноя', 'Дек']
-        labels = [months[int(d.month)-1] for d in data]
-        values = [float(d.total) for d in data]
+    try:
+        date_to = _parse_date(request.args.get('date_to')) or datetime.now().date()
+        date_from = _parse_date(request.args.get('date_from')) \
+            or ReportService.period_start(period)
+        labels, values = ReportService.turnover_chart(date_from, date_to, granularity)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
         'labels': labels,
-        'values': values
-    })
\ No newline at end of file
+        'values': values,
+        'granularity': granularity
+    })
+
+
+@bp.route('/api/forecast/<int:product_id>')
+@login_required
+@read_replica
+def api_forecast(product_id):
+    """API: недельная история расхода товара и сохраненный прогноз"""
+    if db.session.get(Product, product_id) is None:
+        return jsonify({'error': 'Товар не найден'}), 404
+    return jsonify(ForecastService.product_forecast(product_id))
+
+
+def _report_range(period):
+    """Диапазон отчета: date_from/date_to из запроса или период относительно сегодня"""
+    today = datetime.now().date()
+    try:
+        date_from = _parse_date(request.args.get('date_from'))
+        date_to = _parse_date(request.args.get('date_to'))
+    except ValueError:
+        flash('Неверный формат даты, показан период по умолчанию', 'warning')
+        date_from = date_to = None
+    
+    date_to = date_to or today
+    date_from = date_from or ReportService.period_start(period)
+    if date_from > date_to:
+        flash('Дата начала больше даты окончания', 'warning')
+        date_from = date_to
+    return date_from, date_to
+
+
+def _valuation_params():
+    """Дата оценки (None - текущие остатки) и база цены из запроса"""
+    try:
+        as_of = _parse_date(request.args.get('as_of'))
+    except ValueError:
+        flash('Неверный формат даты, показаны текущие остатки', 'warning')
+        as_of = None
+    if as_of and as_of >= datetime.now().date():
+        as_of = None
+    price_basis = request.args.get('price_basis', 'catalog')
+    if price_basis not in PRICE_BASES:
+        price_basis = 'catalog'
+    return as_of, price_basis
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
\ No newline at end of file
@@ -0,0 +1,131 @@
+from app import db
+from app.models import Document, DocumentItem, StockBalance, StockReservation
+from app.services.numbering_service import NumberingService
+from app.services.reservation_service import ReservationService
+from collections import defaultdict
+from decimal import Decimal
+from itertools import groupby
+from sqlalchemy import exists, func, select
+
+
+class BackorderService:
+    """
+    Недопоставки расходов. Частичное проведение расхода переносит нехватку
+    строк в связанный черновик расхода (backorder_for_id), а проведение
+    приходов пересматривает такие черновики по поступившим товарам и
+    резервирует те, что теперь можно отгрузить целиком.
+    """
+
+    @staticmethod
+    def shippable(document):
+        """
+        Сколько можно отгрузить по строкам документа - одним запросом:
+        [(строка, можно отгрузить)]. Свободный остаток товара по всем ячейкам
+        вместе с собственным резервом документа распределяется по строкам по порядку.
+        """
+        products = select(DocumentItem.product_id).where(DocumentItem.document_id == document.id)
+        free = select(StockBalance.product_id,
+                      func.sum(StockBalance.available).label('quantity')
+                      ).where(StockBalance.product_id.in_(products)
+                      ).group_by(StockBalance.product_id).subquery('free')
+        own = select(StockReservation.product_id,
+                     func.sum(StockReservation.quantity).label('quantity')
+                     ).where(StockReservation.document_id == document.id
+                     ).group_by(StockReservation.product_id).subquery('own')
+        rows = db.session.query(
+            DocumentItem,
+            func.coalesce(free.c.quantity, 0) + func.coalesce(own.c.quantity, 0)
+        ).outerjoin(free, free.c.product_id == DocumentItem.product_id
+        ).outerjoin(own, own.c.product_id == DocumentItem.product_id
+        ).filter(DocumentItem.document_id == document.id).order_by(DocumentItem.id).all()
+
+        remaining, result = {}, []
+        for item, available in rows:
+            free = remaining.setdefault(item.product_id, max(Decimal(str(available)), 0))
+            shippable = min(free, Decimal(str(item.quantity)))
+            remaining[item.product_id] = free - shippable
+            result.append((item, shippable))
+        return result
+
+    @staticmethod
+    def split(document, lines):
+        """
+        Перенос нехватки строк документа в новый черновик-недопоставку в
+        текущей транзакции. lines - результат shippable(). Строки черновика -
+        копии строк документа (цена, партия) на количество нехватки, после
+        чего строки документа уменьшаются до отгружаемого, пустые удаляются.
+        Возвращает черновик или None, если нехватки нет.
+        """
+        short = [(item, shippable) for item, shippable in lines if shippable < item.quantity]
+        if not short:
+            return None
+        columns = [column.key for column in DocumentItem.__table__.columns
+                   if column.key not in ('id', 'document_id')]
+        copies = [dict({key: getattr(item, key) for key in columns},
+                       quantity=item.quantity - shippable) for item, shippable in short]
+
+        backorder = Document(
+            doc_type='expense',
+            doc_number=NumberingService.next_number('РН'),
+            doc_date=document.doc_date,
+            supplier_id=document.supplier_id,
+            author_id=document.author_id,
+            comment=f'Недопоставка по документу №{document.doc_number}',
+            status='draft',
+            backorder_for_id=document.id
+        )
+        db.session.add(backorder)
+        db.session.flush()
+        db.session.execute(DocumentItem.__table__.insert(),
+                           [dict(copy, document_id=backorder.id) for copy in copies])
+
+        for item, shippable in short:
+            if shippable:
+                item.quantity = shippable
+            else:
+                db.session.delete(item)
+        db.session.flush()
+        return backorder
+
+    @staticmethod
+    def reevaluate(documents, now=None):
+        """
+        Пересмотр недопоставок после проведения приходов documents: черновики
+        с поступившими товарами без резерва по порядку создания резервируются,
+        если свободного остатка хватает на весь черновик. Все резервы - одной
+        пачкой (ReservationService.reserve_lines). Возвращает число черновиков.
+        """
+        received = select(DocumentItem.product_id).where(
+            DocumentItem.document_id.in_([document.id for document in documents]))
+        with_received = select(DocumentItem.document_id).where(
+            DocumentItem.product_id.in_(received))
+        lines = db.session.query(
+            DocumentItem.document_id, DocumentItem.product_id, func.sum(DocumentItem.quantity)
+        ).join(Document, Document.id == DocumentItem.document_id
+        ).filter(Document.backorder_for_id.isnot(None), Document.status == 'draft',
+                 Document.doc_type == 'expense', Document.id.in_(with_received),
+                 ~exists().where(StockReservation.document_id == Document.id)
+        ).group_by(DocumentItem.document_id, DocumentItem.product_id
+        ).order_by(DocumentItem.document_id).all()
+        if not lines:
+            return 0
+
+        free = defaultdict(Decimal, {
+            product_id: Decimal(str(available)) for product_id, available in
+            ReservationService.available({product_id for _, product_id, _ in lines}).items()})
+        chosen, backorders = [], 0
+        for _, group in groupby(lines, key=lambda line: line[0]):
+            group = list(group)
+            if all(free[product_id] >= quantity for _, product_id, quantity in group):
+                for _, product_id, quantity in group:
+                    free[product_id] -= quantity
+                chosen.extend(group)
+                backorders += 1
+        if not chosen:
+            return 0
+
+        if ReservationService.reserve_lines(chosen, now) is None:
+            db.session.rollback()  # Остатки изменились - пересмотр при следующем приходе
+            return 0
+        db.session.commit()
+        return backorders
@@ -0,0 +1,284 @@
+from app import db
+from app.models import Product, ProductBarcode
+from app.services.import_service import ImportResult
+from app.services.stock_service import dialect_insert
+from collections import OrderedDict, defaultdict
+from decimal import Decimal, InvalidOperation
+from flask import current_app
+from time import monotonic
+import csv
+import io
+import threading
+
+# Названия колонок файла штрихкодов (в нижнем регистре) -> поле
+COLUMN_ALIASES = {
+    'article': 'article', 'артикул': 'article',
+    'barcode': 'code', 'code': 'code', 'ean': 'code', 'штрихкод': 'code',
+    'multiplier': 'multiplier', 'кратность': 'multiplier', 'в упаковке': 'multiplier'
+}
+EAN_LENGTHS = (8, 13, 14)
+
+
+class BarcodeCache:
+    """
+    LRU-кэш результатов сканирования в памяти процесса: код -> товар и
+    кратность (None - код не найден). Записи живут не дольше ttl секунд,
+    чтобы правки товаров в других процессах становились видны. Коды
+    записей хранятся и по товару (None - ненайденные), поэтому сброс
+    товара не перебирает весь кэш.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._codes = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, code):
+        """(найдено в кэше, значение)"""
+        with self._lock:
+            item = self._items.get(code)
+            if item is None or item[0] < monotonic():
+                return False, None
+            self._items.move_to_end(code)
+            return True, item[1]
+
+    def put(self, code, value):
+        with self._lock:
+            self._forget(code)
+            self._items[code] = (monotonic() + self.ttl, value)
+            self._codes[_product_id(value)].add(code)
+            while len(self._items) > self.size:
+                self._forget(next(iter(self._items)))
+
+    def invalidate(self, product_id=None):
+        """Сброс записей товара и всех ненайденных кодов, без product_id - всего кэша"""
+        with self._lock:
+            if product_id is None:
+                self._items.clear()
+                self._codes.clear()
+                return
+            for key in (product_id, None):
+                for code in self._codes.pop(key, ()):
+                    del self._items[code]
+
+    def _forget(self, code):
+        """Удаление записи из кэша и из кодов товара (под блокировкой)"""
+        item = self._items.pop(code, None)
+        if item is None:
+            return
+        key = _product_id(item[1])
+        codes = self._codes[key]
+        codes.discard(code)
+        if not codes:
+            del self._codes[key]
+
+
+class BarcodeService:
+    """
+    Штрихкоды товаров и поиск товара по отсканированному коду. Код ищется
+    по уникальному индексу product_barcodes, затем по артикулу (внутренние
+    этикетки); результаты кэшируются в памяти процесса (BarcodeCache),
+    правки товаров и кодов сбрасывают записи товара.
+    """
+
+    @staticmethod
+    def normalize(code):
+        """Код без пробелов; UPC-A (12 цифр) приводится к EAN-13 ведущим нулем"""
+        code = ''.join(str(code or '').split())
+        if len(code) == 12 and code.isdigit():
+            code = '0' + code
+        return code
+
+    @staticmethod
+    def validate(code):
+        """Нормализованный код; ValueError - пустой, длинный или с неверной контрольной цифрой"""
+        code = BarcodeService.normalize(code)
+        if not code:
+            raise ValueError('Не указан штрихкод')
+        if len(code) > ProductBarcode.code.type.length:
+            raise ValueError(f'Штрихкод длиннее {ProductBarcode.code.type.length} символов')
+        if code.isdigit() and len(code) in EAN_LENGTHS and not _check_digit_ok(code):
+            raise ValueError(f'Неверная контрольная цифра штрихкода {code}')
+        return code
+
+    @staticmethod
+    def resolve(code):
+        """
+        Товар по отсканированному коду: {code, product_id, article, name, unit,
+        price, multiplier} или None
+        """
+        code = BarcodeService.normalize(code)
+        if not code:
+            return None
+        cache = _cache()
+        found, value = cache.get(code)
+        if not found:
+            value = _lookup(code)
+            cache.put(code, value)
+        return dict(value) if value is not None else None
+
+    @staticmethod
+    def invalidate(product_id=None):
+        """Сброс кэша сканирования после изменения товара (без product_id - полностью)"""
+        _cache().invalidate(product_id)
+
+    @staticmethod
+    def add(product, code, multiplier=1):
+        """Привязка кода к товару; ValueError - код неверный или занят"""
+        code = BarcodeService.validate(code)
+        multiplier = _multiplier(multiplier)
+        existing = ProductBarcode.query.filter_by(code=code).first()
+        if existing is not None:
+            raise ValueError(f'Штрихкод {code} уже привязан к товару {existing.product.article}')
+        barcode = ProductBarcode(product_id=product.id, code=code, multiplier=multiplier)
+        db.session.add(barcode)
+        db.session.commit()
+        BarcodeService.invalidate(product.id)
+        return barcode
+
+    @staticmethod
+    def remove(barcode):
+        product_id = barcode.product_id
+        db.session.delete(barcode)
+        db.session.commit()
+        BarcodeService.invalidate(product_id)
+
+    @staticmethod
+    def import_file(stream, encoding='utf-8-sig', chunk_size=None, progress=None):
+        """
+        Загрузка кодов из CSV (артикул; штрихкод; кратность) частями по
+        IMPORT_CHUNK_SIZE строк: товары ищутся одним запросом на часть,
+        коды пишутся INSERT ... ON CONFLICT (code) DO UPDATE - код переходит
+        к товару из файла. progress(строк обработано) - после каждой части.
+        """
+        if not isinstance(stream, io.TextIOBase):
+            stream = io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline='')
+        chunk_size = chunk_size or current_app.config['IMPORT_CHUNK_SIZE']
+        insert = dialect_insert(db.session.get_bind().dialect.name)
+        result = ImportResult()
+
+        chunk = []
+        for line, record in _read_csv(stream):
+            result.rows += 1
+            if isinstance(record, str):
+                result.error(line, record)
+                continue
+            chunk.append((line, record))
+            if len(chunk) >= chunk_size:
+                _write(chunk, insert, result)
+                chunk = []
+                if progress:
+                    progress(result.rows)
+        if chunk:
+            _write(chunk, insert, result)
+        if progress:
+            progress(result.rows)
+        BarcodeService.invalidate()
+        return result
+
+
+def _cache():
+    cache = current_app.extensions.get('barcode_cache')
+    if cache is None:
+        cache = current_app.extensions.setdefault('barcode_cache', BarcodeCache(
+            current_app.config['BARCODE_CACHE_SIZE'], current_app.config['BARCODE_CACHE_TTL']))
+    return cache
+
+
+def _product_id(value):
+    return value['product_id'] if value is not None else None
+
+
+def _lookup(code):
+    """Товар по коду (уникальный индекс), иначе по артикулу - кратность 1"""
+    columns = (Product.id, Product.article, Product.name, Product.unit, Product.price)
+    row = db.session.query(ProductBarcode.multiplier, *columns).join(
+        Product, ProductBarcode.product_id == Product.id
+    ).filter(ProductBarcode.code == code).first()
+    if row is None:
+        row = db.session.query(db.literal(1).label('multiplier'), *columns
+                               ).filter(Product.article == code).first()
+    if row is None:
+        return None
+    return {
+        'code': code,
+        'product_id': row.id,
+        'article': row.article,
+        'name': row.name,
+        'unit': row.unit,
+        'price': float(row.price),
+        'multiplier': float(row.multiplier)
+    }
+
+
+def _check_digit_ok(code):
+    """Контрольная цифра EAN-8/13, GTIN-14: веса 3 и 1 справа налево"""
+    digits = [int(digit) for digit in code[:-1]]
+    total = sum(digit * (3 if position % 2 == 0 else 1)
+                for position, digit in enumerate(reversed(digits)))
+    return (10 - total % 10) % 10 == int(code[-1])
+
+
+def _multiplier(value):
+    if value is None or str(value).strip() == '':
+        return Decimal(1)
+    try:
+        multiplier = Decimal(str(value).strip().replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f'Неверная кратность: {value}')
+    if not multiplier > 0:
+        raise ValueError('Кратность должна быть больше нуля')
+    return multiplier
+
+
+def _write(chunk, insert, result):
+    """Проверка и запись части: один запрос товаров, один запрос кодов, один INSERT"""
+    products = dict(db.session.query(Product.article, Product.id).filter(
+        Product.article.in_({str(record.get('article') or '').strip()
+                             for _, record in chunk})))
+    rows = {}
+    for line, record in chunk:
+        article = str(record.get('article') or '').strip()
+        try:
+            if article not in products:
+                raise ValueError(f'Товар с артикулом "{article}" не найден')
+            code = BarcodeService.validate(record.get('code'))
+            rows[code] = {'code': code, 'product_id': products[article],
+                          'multiplier': _multiplier(record.get('multiplier'))}
+        except ValueError as e:
+            result.error(line, str(e))
+    if not rows:
+        return
+
+    existing = {code for code, in db.session.query(ProductBarcode.code).filter(
+        ProductBarcode.code.in_(list(rows)))}
+    statement = insert(ProductBarcode.__table__)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['code'],
+        set_={'product_id': statement.excluded.product_id,
+              'multiplier': statement.excluded.multiplier}
+    ), list(rows.values()))
+    db.session.commit()
+    result.updated += len(existing)
+    result.inserted += len(rows) - len(existing)
+
+
+def _read_csv(stream):
+    """(номер строки, запись или текст ошибки); разделитель ; или , по заголовку"""
+    header = stream.readline()
+    delimiter = ';' if header.count(';') >= header.count(',') else ','
+    fields = [COLUMN_ALIASES.get(field.strip().lower())
+              for field in next(csv.reader([header], delimiter=delimiter), [])]
+    if 'article' not in fields or 'code' not in fields:
+        yield 1, 'В заголовке нет колонок "Артикул" и "Штрихкод" (article, barcode)'
+        return
+    reader = csv.reader(stream, delimiter=delimiter)
+    for values in reader:
+        if not any(values):
+            continue
+        yield reader.line_num + 1, {field: value for field, value in zip(fields, values) if field}
@@ -0,0 +1,209 @@
+from app import db
+from app.instrumentation import capture_queries
+from app.models import (User, Product, Category, Supplier, WarehouseCell, Document,
+                        DocumentItem)
+from app.services.stock_service import StockService
+from datetime import datetime
+from flask import url_for
+from sqlalchemy import func
+from statistics import median
+from time import perf_counter
+import json
+import os
+import subprocess
+
+# GET-маршруты, которые не замеряются: выход из системы, служебные
+SKIPPED_ENDPOINTS = {'static', 'auth.logout', 'jobs.job_status', 'jobs.job_download'}
+
+# Модель, из которой берется значение параметра маршрута
+PARAM_MODELS = (
+    ('category', Category),
+    ('supplier', Supplier),
+    ('cell', WarehouseCell),
+    ('document', Document),
+    ('product', Product),
+)
+
+
+class BenchmarkService:
+    """Замеры времени маршрутов и методов StockService на текущей БД"""
+
+    @staticmethod
+    def run(app, repeat=3, posting_lines=50):
+        """Прогон всех замеров; результат - словарь, пригодный для JSON"""
+        results = BenchmarkService.bench_routes(app, repeat)
+        results += BenchmarkService.bench_stock_service(repeat, posting_lines)
+        return {
+            'commit': _git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'dataset': {
+                'products': Product.query.count(),
+                'documents': Document.query.count(),
+                'lines': DocumentItem.query.count(),
+                'cells': WarehouseCell.query.count()
+            },
+            'results': results
+        }
+
+    @staticmethod
+    def bench_routes(app, repeat=3):
+        """Замер всех GET-маршрутов приложения от имени администратора"""
+        user = User.query.filter_by(role='admin').first()
+        if user is None:
+            raise RuntimeError('Для замеров нужен пользователь с ролью admin')
+
+        samples = _sample_ids()
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+
+        results = []
+        for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+            if 'GET' not in rule.methods or rule.endpoint in SKIPPED_ENDPOINTS:
+                continue
+
+            values = {}
+            for argument in rule.arguments:
+                values[argument] = samples.get(_param_model(rule.endpoint, argument))
+            if None in values.values():
+                continue
+
+            with app.test_request_context():
+                url = url_for(rule.endpoint, **values)
+
+            name = f'GET {rule.rule}'
+            try:
+                results.append(_measure(name, 'route', repeat, lambda: client.get(url)))
+            except Exception as e:
+                # Сломанный маршрут не должен прерывать остальные замеры
+                db.session.rollback()
+                results.append({'name': name, 'kind': 'route', 'error': repr(e)[:300]})
+        return results
+
+    @staticmethod
+    def bench_stock_service(repeat=3, posting_lines=50):
+        """Замер методов StockService; документы для проведения создаются и удаляются"""
+        product_id = _busiest_product()
+        results = []
+        if product_id is None:
+            return results
+
+        results.append(_measure('StockService.get_stock_balance', 'service', repeat,
+                                StockService.get_stock_balance))
+        results.append(_measure('StockService.get_product_movement', 'service', repeat,
+                                lambda: StockService.get_product_movement(product_id)))
+
+        product_ids = [row.id for row in Product.query.with_entities(Product.id)
+                       .limit(posting_lines)]
+        income_times, expense_times, cancel_times = [], [], []
+        for run in range(repeat):
+            income = _bench_document('income', product_ids, run)
+            income_times.append(_timed(lambda: StockService.process_income_document(income)))
+            expense = _bench_document('expense', product_ids, run)
+            expense_times.append(_timed(lambda: StockService.process_expense_document(expense)))
+            cancel_times.append(_timed(lambda: StockService.cancel_document(expense)))
+            StockService.cancel_document(income)
+            for document in (income, expense):
+                db.session.delete(document)
+            db.session.commit()
+
+        for name, times in (('process_income_document', income_times),
+                            ('process_expense_document', expense_times),
+                            ('cancel_document', cancel_times)):
+            results.append(_result(f'StockService.{name} ({len(product_ids)} строк)',
+                                   'service', times, None))
+        return results
+
+    @staticmethod
+    def save(report, path):
+        with open(path, 'w', encoding='utf-8') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def compare(baseline, current, threshold=1.2):
+        """
+        Сравнение двух прогонов по медиане.
+        Возвращает строки (name, base_ms, current_ms, ratio, regressed).
+        """
+        base = {row['name']: row for row in baseline['results'] if 'error' not in row}
+        rows = []
+        for row in current['results']:
+            if 'error' in row or row['name'] not in base:
+                continue
+            base_ms = base[row['name']]['median_ms']
+            ratio = row['median_ms'] / base_ms if base_ms else float('inf')
+            rows.append((row['name'], base_ms, row['median_ms'], ratio, ratio > threshold))
+        return rows
+
+
+def _sample_ids():
+    """Значения параметров маршрутов: самый "тяжелый" товар и последние записи"""
+    samples = {model: db.session.query(func.max(model.id)).scalar()
+               for _, model in PARAM_MODELS}
+    samples[Product] = _busiest_product() or samples[Product]
+    return samples
+
+
+def _param_model(endpoint, argument):
+    name = f'{endpoint}.{argument}'
+    for keyword, model in PARAM_MODELS:
+        if keyword in name:
+            return model
+    return Product
+
+
+def _busiest_product():
+    row = db.session.query(DocumentItem.product_id).group_by(DocumentItem.product_id
+    ).order_by(func.count(DocumentItem.id).desc()).first()
+    return row.product_id if row else db.session.query(func.min(Product.id)).scalar()
+
+
+def _bench_document(doc_type, product_ids, run):
+    document = Document(
+        doc_type=doc_type,
+        doc_number=f'BENCH-{doc_type[0]}-{os.getpid() % 10000}-{run}',
+        doc_date=datetime.utcnow().date(),
+        status='draft'
+    )
+    db.session.add(document)
+    db.session.flush()
+    db.session.add_all([DocumentItem(document_id=document.id, product_id=product_id,
+                                     quantity=1, price=1) for product_id in product_ids])
+    db.session.commit()
+    return document
+
+
+def _timed(func):
+    started = perf_counter()
+    func()
+    return (perf_counter() - started) * 1000
+
+
+def _measure(name, kind, repeat, func):
+    times, queries = [], None
+    for _ in range(repeat):
+        with capture_queries() as stats:
+            times.append(_timed(func))
+        queries = stats.count
+    return _result(name, kind, times, queries)
+
+
+def _result(name, kind, times, queries):
+    return {
+        'name': name,
+        'kind': kind,
+        'runs': len(times),
+        'min_ms': round(min(times), 3),
+        'median_ms': round(median(times), 3),
+        'max_ms': round(max(times), 3),
+        'queries': queries
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,202 @@
+from app import db
+from app.models import CacheVersion, DailyProductTurnover, TurnoverBucket
+from app.replica import primary_reads
+from datetime import date, timedelta
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+GRANULARITIES = ('day', 'week', 'month')
+MAX_BUCKETS = 1000
+# Счетчик сбросов кэша интервалов в cache_versions
+CACHE_NAME = 'turnover_buckets'
+
+
+class BucketService:
+    """
+    Разбиение оборота на календарные интервалы (день, неделя с понедельника,
+    месяц). Закрытые интервалы - целиком до текущего - кэшируются в
+    turnover_buckets, при каждом запросе пересчитывается только текущий.
+    Каждый сброс увеличивает версию кэша; интервалы, посчитанные до сброса,
+    не сохраняются.
+    """
+
+    @staticmethod
+    def bucket_start(day, granularity):
+        """Начало интервала, содержащего дату day"""
+        if granularity == 'day':
+            return day
+        if granularity == 'week':
+            return day - timedelta(days=day.weekday())
+        if granularity == 'month':
+            return day.replace(day=1)
+        raise ValueError(f'Неизвестная детализация: {granularity}')
+
+    @staticmethod
+    def next_bucket(start, granularity):
+        """Начало следующего интервала"""
+        if granularity == 'day':
+            return start + timedelta(days=1)
+        if granularity == 'week':
+            return start + timedelta(days=7)
+        if granularity == 'month':
+            return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        raise ValueError(f'Неизвестная детализация: {granularity}')
+
+    @staticmethod
+    def bucket_starts(date_from, date_to, granularity):
+        """Начала всех интервалов, пересекающих диапазон [date_from, date_to]"""
+        if date_from > date_to:
+            raise ValueError('Дата начала больше даты окончания')
+        starts = []
+        start = BucketService.bucket_start(date_from, granularity)
+        while start <= date_to:
+            starts.append(start)
+            if len(starts) > MAX_BUCKETS:
+                raise ValueError(f'Слишком много интервалов (больше {MAX_BUCKETS})')
+            start = BucketService.next_bucket(start, granularity)
+        return starts
+
+    @staticmethod
+    def turnover_series(date_from, date_to, granularity, today=None):
+        """
+        Оборот по интервалам диапазона, включая пустые. Диапазон расширяется
+        до границ интервалов. Возвращает список словарей start, end (последний
+        день интервала), quantity, total_sum, operations.
+        """
+        starts = BucketService.bucket_starts(date_from, date_to, granularity)
+        current = BucketService.bucket_start(today or date.today(), granularity)
+        closed = [start for start in starts if start < current]
+
+        values = {}
+        if closed:
+            values.update(BucketService._closed_buckets(closed, granularity))
+        if starts[-1] >= current:
+            values.update(_fold(_daily_totals(current, BucketService.next_bucket(
+                starts[-1], granularity)), granularity))
+
+        series = []
+        for start in starts:
+            quantity, total_sum, operations = values.get(start, (0.0, 0.0, 0))
+            series.append({
+                'start': start,
+                'end': BucketService.next_bucket(start, granularity) - timedelta(days=1),
+                'quantity': quantity,
+                'total_sum': total_sum,
+                'operations': operations
+            })
+        return series
+
+    @staticmethod
+    def invalidate(day, onwards=False):
+        """
+        Сброс кэша интервалов, содержащих day (при onwards - и всех последующих).
+        Вызывается при изменении оборота задним числом в той же транзакции.
+        """
+        _bump_version()
+        for granularity in GRANULARITIES:
+            query = TurnoverBucket.query.filter(TurnoverBucket.granularity == granularity)
+            start = BucketService.bucket_start(day, granularity)
+            if onwards:
+                query = query.filter(TurnoverBucket.bucket_start >= start)
+            else:
+                query = query.filter(TurnoverBucket.bucket_start == start)
+            query.delete(synchronize_session=False)
+
+    @staticmethod
+    def invalidate_all():
+        """Сброс всего кэша интервалов (полный пересчет оборота)"""
+        _bump_version()
+        TurnoverBucket.query.delete(synchronize_session=False)
+
+    @staticmethod
+    def _closed_buckets(closed, granularity):
+        """
+        Закрытые интервалы из кэша; недостающие считаются одним запросом и
+        сохраняются, если с начала расчета кэш не сбрасывали (иначе проведение
+        задним числом между расчетом и вставкой оставило бы устаревшие итоги).
+        Кэш читается и заполняется только по основной БД: сброс идет на ней,
+        а отставшая реплика сохранила бы устаревшие итоги навсегда.
+        """
+        with primary_reads():
+            values = {row.bucket_start: (float(row.quantity), float(row.total_sum), row.operations)
+                      for row in TurnoverBucket.query.filter(
+                          TurnoverBucket.granularity == granularity,
+                          TurnoverBucket.bucket_start >= closed[0],
+                          TurnoverBucket.bucket_start <= closed[-1])}
+
+            missing = [start for start in closed if start not in values]
+            if not missing:
+                return values
+
+            version = db.session.query(CacheVersion.version).filter(
+                CacheVersion.name == CACHE_NAME).scalar()
+            computed = _fold(_daily_totals(missing[0], BucketService.next_bucket(
+                missing[-1], granularity)), granularity)
+        for start in missing:
+            quantity, total_sum, operations = computed.get(start, (0.0, 0.0, 0))
+            values[start] = (quantity, total_sum, operations)
+            db.session.add(TurnoverBucket(granularity=granularity, bucket_start=start,
+                                          quantity=quantity, total_sum=total_sum,
+                                          operations=operations))
+        try:
+            if _version_unchanged(version):
+                db.session.commit()
+            else:
+                db.session.rollback()
+        except IntegrityError:
+            # Тот же интервал уже сохранен параллельным запросом
+            db.session.rollback()
+        return values
+
+
+def _bump_version():
+    """Увеличение версии кэша интервалов в текущей транзакции"""
+    from app.services.stock_service import dialect_insert
+
+    table = CacheVersion.__table__
+    statement = dialect_insert(db.session.get_bind().dialect.name)(table)
+    db.session.execute(statement.values(name=CACHE_NAME, version=1).on_conflict_do_update(
+        index_elements=['name'], set_={'version': table.c.version + 1}))
+
+
+def _version_unchanged(version):
+    """
+    Версия кэша все еще равна прочитанной до расчета. Условный UPDATE
+    блокирует строку версии до конца транзакции, поэтому сброс не проскочит
+    между проверкой и фиксацией вставки.
+    """
+    from app.services.stock_service import dialect_insert
+
+    table = CacheVersion.__table__
+    if version is None:
+        statement = dialect_insert(db.session.get_bind().dialect.name)(table)
+        result = db.session.execute(statement.values(name=CACHE_NAME, version=0
+                                                     ).on_conflict_do_nothing())
+    else:
+        result = db.session.execute(table.update().where(
+            table.c.name == CACHE_NAME, table.c.version == version
+        ).values(version=table.c.version))
+    return result.rowcount == 1
+
+
+def _daily_totals(start, end):
+    """Оборот по дням в полуинтервале [start, end) из агрегата daily_product_turnover"""
+    rows = db.session.query(
+        DailyProductTurnover.day,
+        func.sum(DailyProductTurnover.quantity),
+        func.sum(DailyProductTurnover.total_sum),
+        func.sum(DailyProductTurnover.operations)
+    ).filter(DailyProductTurnover.day >= start, DailyProductTurnover.day < end
+    ).group_by(DailyProductTurnover.day).all()
+    return [(day, float(quantity or 0), float(total_sum or 0), int(operations or 0))
+            for day, quantity, total_sum, operations in rows]
+
+
+def _fold(daily, granularity):
+    """Сложение дневных итогов по интервалам"""
+    buckets = {}
+    for day, quantity, total_sum, operations in daily:
+        start = BucketService.bucket_start(day, granularity)
+        old = buckets.get(start, (0.0, 0.0, 0))
+        buckets[start] = (old[0] + quantity, old[1] + total_sum, old[2] + operations)
+    return buckets
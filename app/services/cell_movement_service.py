@@ -0,0 +1,95 @@
+from app import db
+from app.models import CellMovement, Document, DocumentItem, MOVEMENT_TYPES
+from collections import defaultdict
+from decimal import Decimal
+from sqlalchemy import case, exists, func, literal, select
+
+
+class CellMovementService:
+    """
+    Движения товара по ячейкам: какие ячейки изменила каждая строка документа
+    (cell_movements). Записываются при проведении и отмене в текущей
+    транзакции, фиксирует их вызывающий код. Строки приходов и расходов,
+    проведенных без записи движений, относятся к ячейке приемки.
+    """
+
+    @staticmethod
+    def record(rows):
+        """Движения [(строка документа, ячейка, количество со знаком)] одной вставкой"""
+        rows = [{'document_item_id': item_id, 'cell_id': cell_id, 'quantity': quantity}
+                for item_id, cell_id, quantity in rows if quantity]
+        if rows:
+            db.session.execute(CellMovement.__table__.insert(), rows)
+
+    @staticmethod
+    def record_lines(documents, cell, sign=1):
+        """
+        Движения всех строк документов одним INSERT ... SELECT: cell - номер
+        ячейки или колонка строки (DocumentItem.cell_id, dest_cell_id)
+        """
+        if isinstance(cell, int):
+            cell = literal(cell)
+        db.session.execute(CellMovement.__table__.insert().from_select(
+            ['document_item_id', 'cell_id', 'quantity'],
+            select(DocumentItem.id, cell, DocumentItem.quantity * sign).where(
+                DocumentItem.document_id.in_([document.id for document in documents]))
+        ))
+
+    @staticmethod
+    def written_off(document):
+        """
+        Списание строк документа по ячейкам в формате ReservationService.allocate:
+        [(строка, товар, ячейка, количество)]. Строки без записанных
+        движений списаны из ячейки приемки.
+        """
+        from app.services.stock_service import DEFAULT_CELL_ID
+
+        rows = db.session.query(
+            DocumentItem.id, DocumentItem.product_id, DocumentItem.quantity,
+            CellMovement.cell_id, CellMovement.quantity.label('moved')
+        ).outerjoin(CellMovement, CellMovement.document_item_id == DocumentItem.id
+        ).filter(DocumentItem.document_id == document.id
+        ).order_by(DocumentItem.id, CellMovement.id)
+        totals = defaultdict(Decimal)
+        for row in rows:
+            if row.cell_id is None:
+                totals[(row.id, row.product_id, DEFAULT_CELL_ID)] += row.quantity
+            else:
+                totals[(row.id, row.product_id, row.cell_id)] -= row.moved
+        return [(item_id, product_id, cell_id, quantity)
+                for (item_id, product_id, cell_id), quantity in totals.items() if quantity > 0]
+
+    @staticmethod
+    def balances(after, until, condition):
+        """
+        Изменение остатков по (товар, ячейка) документами с датой в
+        (after, until] для строк, отобранных condition:
+        {(product_id, cell_id): количество}
+        """
+        from app.services.stock_service import DEFAULT_CELL_ID
+
+        dated = Document.doc_date <= until
+        if after:
+            dated = dated & (Document.doc_date > after)
+        changes = defaultdict(Decimal)
+        for product_id, cell_id, quantity in db.session.query(
+                DocumentItem.product_id, CellMovement.cell_id, func.sum(CellMovement.quantity)
+        ).join(DocumentItem, CellMovement.document_item_id == DocumentItem.id
+        ).join(Document, DocumentItem.document_id == Document.id
+        ).filter(dated, condition
+        ).group_by(DocumentItem.product_id, CellMovement.cell_id):
+            changes[(product_id, cell_id)] += Decimal(str(quantity or 0))
+
+        # Проведенные без записи движений. Приход и расход по инвентаризации
+        # пропускаются: ячейки записаны в строках самой инвентаризации
+        signed = case((Document.doc_type == 'income', DocumentItem.quantity),
+                      else_=-DocumentItem.quantity)
+        for product_id, quantity in db.session.query(
+                DocumentItem.product_id, func.sum(signed)
+        ).join(Document, DocumentItem.document_id == Document.id
+        ).filter(dated, condition, Document.status == 'posted',
+                 Document.doc_type.in_(MOVEMENT_TYPES), Document.base_id.is_(None),
+                 ~exists().where(CellMovement.document_item_id == DocumentItem.id)
+        ).group_by(DocumentItem.product_id):
+            changes[(product_id, DEFAULT_CELL_ID)] += Decimal(str(quantity or 0))
+        return changes
@@ -0,0 +1,143 @@
+from app.analytics import get_store, day_number
+from app.services.report_service import ReportService
+from flask import current_app
+import csv
+import io
+import numpy as np
+
+ABC_XYZ_CSV_HEADER = ['Артикул', 'Наименование', 'Категория', 'ABC', 'XYZ',
+                      'Расход, сумма', 'Доля, %', 'Накопленная доля, %',
+                      'Спрос в неделю', 'Коэф. вариации, %']
+
+
+class ClassificationService:
+    """
+    ABC/XYZ-классификация товаров по расходу за период.
+    ABC - по накопленной доле суммы расхода, XYZ - по коэффициенту вариации
+    недельного спроса. Расчет векторный по хранилищу движений (app/analytics.py).
+    """
+
+    @staticmethod
+    def abc_xyz(date_from, date_to):
+        """
+        Классы товаров с расходом за период: словарь массивов product_id, value,
+        share, cumulative_share, mean_demand, variation, abc, xyz.
+        Результат кэшируется до изменения движений.
+        """
+        store = get_store()
+        config = current_app.config
+        thresholds = (tuple(config['ABC_THRESHOLDS']), tuple(config['XYZ_THRESHOLDS']))
+        return store.cached(('abc_xyz', date_from, date_to, thresholds),
+                            lambda: _classify(store, date_from, date_to, *thresholds))
+
+    @staticmethod
+    def rows(date_from, date_to, category_id=0):
+        """
+        Строки отчета по всем товарам (без расхода - классы C и Z),
+        по убыванию суммы расхода
+        """
+        result = ClassificationService.abc_xyz(date_from, date_to)
+        products = ReportService.product_info(category_id=category_id)
+
+        rows = []
+        for index, product_id in enumerate(result['product_id'].tolist()):
+            product = products.pop(product_id, None)
+            if product is None:
+                continue
+            variation = result['variation'][index]
+            rows.append(dict(
+                product,
+                abc=str(result['abc'][index]),
+                xyz=str(result['xyz'][index]),
+                value=float(result['value'][index]),
+                share=float(result['share'][index]) * 100,
+                cumulative_share=float(result['cumulative_share'][index]) * 100,
+                mean_demand=float(result['mean_demand'][index]),
+                variation=float(variation) * 100 if np.isfinite(variation) else None
+            ))
+        rows.sort(key=lambda row: -row['value'])
+
+        for product in sorted(products.values(), key=lambda product: product['name']):
+            rows.append(dict(product, abc='C', xyz='Z', value=0.0, share=0.0,
+                             cumulative_share=100.0, mean_demand=0.0, variation=None))
+        return rows
+
+    @staticmethod
+    def matrix(rows):
+        """Сводка по 9 группам: {(abc, xyz): (количество товаров, сумма расхода)}"""
+        summary = {(abc, xyz): [0, 0.0] for abc in 'ABC' for xyz in 'XYZ'}
+        for row in rows:
+            group = summary[(row['abc'], row['xyz'])]
+            group[0] += 1
+            group[1] += row['value']
+        return summary
+
+    @staticmethod
+    def iter_csv(date_from, date_to, category_id=0, encoding='cp1251'):
+        """Выгрузка в CSV по частям (для потоковой отдачи)"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+        writer.writerow(ABC_XYZ_CSV_HEADER)
+        for number, row in enumerate(ClassificationService.rows(date_from, date_to,
+                                                                category_id), 1):
+            writer.writerow([
+                row['article'],
+                row['name'],
+                row['category'],
+                row['abc'],
+                row['xyz'],
+                round(row['value'], 2),
+                round(row['share'], 3),
+                round(row['cumulative_share'], 3),
+                round(row['mean_demand'], 3),
+                '' if row['variation'] is None else round(row['variation'], 1)
+            ])
+            if number % 1000 == 0:
+                yield buffer.getvalue().encode(encoding, errors='replace')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode(encoding, errors='replace')
+
+
+def _classify(store, date_from, date_to, abc_thresholds, xyz_thresholds):
+    first_day, last_day = day_number(date_from), day_number(date_to)
+    mask = store.mask(date_from, date_to) & (store.direction == -1)
+    ids, inverse = np.unique(store.product_id[mask], return_inverse=True)
+    size = len(ids)
+    weight = store.weight[mask]
+    value = np.bincount(inverse, weight * store.amount[mask], size)
+
+    # ABC: доля суммы расхода до товара в порядке убывания суммы
+    order = np.argsort(-value, kind='stable')
+    total = value.sum()
+    share = value / total if total > 0 else np.zeros(size)
+    cumulative = np.empty(size)
+    cumulative[order] = np.cumsum(share[order])
+    before = cumulative - share
+    abc = np.where(before < abc_thresholds[0], 'A',
+                   np.where(before < abc_thresholds[1], 'B', 'C'))
+
+    # XYZ: недели отсчитываются от конца периода, неполной может быть только первая
+    weeks = (last_day - first_day) // 7 + 1
+    week = (last_day - store.day[mask]) // 7
+    keys, key_inverse = np.unique(inverse.astype(np.int64) * weeks + week,
+                                  return_inverse=True)
+    weekly = np.bincount(key_inverse, weight * store.quantity[mask], len(keys))
+    owner = keys // weeks
+    mean = np.bincount(owner, weekly, size) / weeks
+    variance = np.maximum(np.bincount(owner, weekly * weekly, size) / weeks - mean * mean, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variation = np.where(mean > 0, np.sqrt(variance) / mean, np.inf)
+    xyz = np.where(variation <= xyz_thresholds[0], 'X',
+                   np.where(variation <= xyz_thresholds[1], 'Y', 'Z'))
+
+    return {
+        'product_id': ids,
+        'value': value,
+        'share': share,
+        'cumulative_share': cumulative,
+        'mean_demand': mean,
+        'variation': variation,
+        'abc': abc,
+        'xyz': xyz
+    }
@@ -0,0 +1,184 @@
+from app import db
+from app.models import (Category, Supplier, Product, WarehouseCell, StockBalance,
+                        Document, DocumentItem)
+from app.services.stock_service import DEFAULT_CELL_ID
+from app.services.occupancy_service import OccupancyService
+from app.services.turnover_service import TurnoverService
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+from sqlalchemy import func
+import random
+
+CHUNK_SIZE = 50000
+
+
+class DatasetService:
+    """Генерация синтетических данных для нагрузочной проверки"""
+
+    @staticmethod
+    def generate(products=1000, cells=100, lines=100000, categories=30, suppliers=50,
+                 days=730, lines_per_document=10, skew=1.1, seed=42, progress=None):
+        """
+        Массовая генерация справочников и проведенных документов.
+        Популярность товаров распределена по Ципфу (параметр skew), около 30%
+        документов - приходы. Остатки согласованы с историей движений:
+        недостающее количество покрывается документом начальных остатков.
+        """
+        rnd = random.Random(seed)
+        now = datetime.utcnow()
+        ids = _IdAllocator()
+        tag = f'{seed}-{now:%Y%m%d%H%M%S}'
+
+        category_rows = [{'id': ids.next(Category), 'name': f'Категория {tag}-{n}'}
+                         for n in range(categories)]
+        supplier_rows = [{'id': ids.next(Supplier), 'name': f'Поставщик {n}',
+                          'created_at': now} for n in range(suppliers)]
+        cell_rows = []
+        for n in range(cells):
+            cell_id = ids.next(WarehouseCell)
+            # Ряды A..Z по порядку, номер места - id ячейки (уникален)
+            cell_rows.append({'id': cell_id, 'name': f'{chr(65 + n * 26 // cells)}-{cell_id:05d}'})
+        product_rows = [{
+            'id': ids.next(Product),
+            'article': f'SYN-{tag}-{n:06d}',
+            'name': f'Товар {n}',
+            'unit': rnd.choice(('шт', 'шт', 'шт', 'кг', 'м', 'уп')),
+            'price': round(rnd.lognormvariate(6, 1), 2),
+            'category_id': rnd.choice(category_rows)['id'] if category_rows else None,
+            'supplier_id': rnd.choice(supplier_rows)['id'] if supplier_rows else None,
+            'created_at': now,
+            'updated_at': now
+        } for n in range(products)]
+
+        for model, rows in ((Category, category_rows), (Supplier, supplier_rows),
+                            (WarehouseCell, cell_rows), (Product, product_rows)):
+            _bulk_insert(model, rows)
+
+        if not product_rows or not lines:
+            db.session.commit()
+            return DatasetService._summary(product_rows, cell_rows, 0, 0)
+
+        product_ids = [row['id'] for row in product_rows]
+        prices = {row['id']: float(row['price']) for row in product_rows}
+        rnd.shuffle(product_ids)  # популярность не зависит от порядка создания
+        cum_weights = list(accumulate(1 / (rank + 1) ** skew for rank in range(len(product_ids))))
+
+        # Документ начальных остатков создается первым, строки - в конце
+        start = date.today() - timedelta(days=days)
+        opening_id = ids.next(Document)
+        _bulk_insert(Document, [_document_row(opening_id, 'income', start, now, 'OPEN')])
+
+        # Размеры документов (экспоненциальное распределение) и их даты по возрастанию
+        sizes = []
+        remaining = lines
+        while remaining > 0:
+            sizes.append(min(remaining, max(1, int(rnd.expovariate(1 / lines_per_document)))))
+            remaining -= sizes[-1]
+        doc_dates = sorted(start + timedelta(days=rnd.randrange(days + 1)) for _ in sizes)
+        supplier_ids = [row['id'] for row in supplier_rows] or [None]
+
+        net = dict.fromkeys(product_ids, 0)
+        lowest = dict.fromkeys(product_ids, 0)
+        documents, items, generated = [], [], 0
+
+        for doc_date, count in zip(doc_dates, sizes):
+            doc_id = ids.next(Document)
+            doc_type = 'income' if rnd.random() < 0.3 else 'expense'
+            row = _document_row(doc_id, doc_type, doc_date, now)
+            row['supplier_id'] = rnd.choice(supplier_ids) if doc_type == 'income' else None
+            documents.append(row)
+
+            for product_id in rnd.choices(product_ids, cum_weights=cum_weights, k=count):
+                if doc_type == 'income':
+                    quantity = rnd.randint(10, 200)
+                    net[product_id] += quantity
+                else:
+                    quantity = rnd.randint(1, 20)
+                    net[product_id] -= quantity
+                    lowest[product_id] = min(lowest[product_id], net[product_id])
+                items.append({'document_id': doc_id, 'product_id': product_id,
+                              'quantity': quantity, 'price': prices[product_id]})
+            generated += count
+
+            if len(items) >= CHUNK_SIZE:
+                _flush(documents, items)
+                if progress:
+                    progress(generated, lines)
+
+        opening = [{'document_id': opening_id, 'product_id': product_id,
+                    'quantity': -low, 'price': prices[product_id]}
+                   for product_id, low in lowest.items() if low < 0]
+        items.extend(opening)
+        _flush(documents, items)
+
+        balances = [{'product_id': product_id, 'cell_id': DEFAULT_CELL_ID,
+                     'quantity': net[product_id] - lowest[product_id], 'last_updated': now}
+                    for product_id in product_ids if net[product_id] - lowest[product_id] > 0]
+        DatasetService._merge_balances(balances)
+
+        db.session.commit()
+        TurnoverService.rebuild(since=start)
+        OccupancyService.rebuild()
+        if progress:
+            progress(lines, lines)
+        return DatasetService._summary(product_rows, cell_rows, len(sizes) + 1,
+                                       generated + len(opening))
+
+    @staticmethod
+    def _merge_balances(balances):
+        """Добавление сгенерированных остатков к уже существующим"""
+        if not balances:
+            return
+        existing = {row.product_id: row for row in
+                    StockBalance.query.filter_by(cell_id=balances[0]['cell_id'])}
+        new_rows = []
+        for row in balances:
+            if row['product_id'] in existing:
+                existing[row['product_id']].quantity += row['quantity']
+            else:
+                new_rows.append(row)
+        _bulk_insert(StockBalance, new_rows)
+
+    @staticmethod
+    def _summary(products, cells, documents, lines):
+        return {'products': len(products), 'cells': len(cells),
+                'documents': documents, 'lines': lines}
+
+
+class _IdAllocator:
+    """Выдача первичных ключей без обращения к БД на каждую строку"""
+
+    def __init__(self):
+        self._next = {}
+
+    def next(self, model):
+        if model not in self._next:
+            self._next[model] = (db.session.query(func.max(model.id)).scalar() or 0) + 1
+        value = self._next[model]
+        self._next[model] = value + 1
+        return value
+
+
+def _document_row(doc_id, doc_type, doc_date, now, prefix='SYN'):
+    return {
+        'id': doc_id,
+        'doc_type': doc_type,
+        'doc_number': f'{prefix}-{doc_id:09d}',
+        'doc_date': doc_date,
+        'status': 'posted',
+        'created_at': now,
+        'posted_at': now
+    }
+
+
+def _flush(documents, items):
+    _bulk_insert(Document, documents)
+    _bulk_insert(DocumentItem, items)
+    documents.clear()
+    items.clear()
+
+
+def _bulk_insert(model, rows):
+    """Пакетная вставка (executemany) частями по CHUNK_SIZE строк"""
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(model.__table__.insert(), rows[start:start + CHUNK_SIZE])
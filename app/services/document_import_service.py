@@ -0,0 +1,417 @@
+from app import db
+from app.models import Document, DocumentItem, Product, Supplier
+from app.services.numbering_service import NumberingService
+from app.services.period_service import PeriodService
+from app.services.stock_service import StockService
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from threading import Lock
+from xml.etree.ElementTree import iterparse, ParseError
+import csv
+import io
+
+# Названия колонок CSV (в нижнем регистре) -> поле накладной
+COLUMN_ALIASES = {
+    'number': 'number', 'номер': 'number', 'номер накладной': 'number',
+    'date': 'date', 'дата': 'date',
+    'supplier': 'supplier', 'поставщик': 'supplier',
+    'inn': 'supplier_inn', 'supplier_inn': 'supplier_inn', 'инн': 'supplier_inn',
+    'comment': 'comment', 'комментарий': 'comment',
+    'article': 'article', 'артикул': 'article',
+    'quantity': 'quantity', 'количество': 'quantity', 'кол-во': 'quantity',
+    'price': 'price', 'цена': 'price',
+    'lot': 'lot', 'lot_number': 'lot', 'партия': 'lot',
+    'expiry': 'expiry', 'expiry_date': 'expiry', 'срок годности': 'expiry', 'годен до': 'expiry'
+}
+FORMATS = ('xml', 'csv')
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y')
+LOOKUP_BATCH = 500  # артикулов в одном запросе IN
+MAX_ERRORS = 1000  # ошибок в результате, остальные только считаются
+
+
+class DocumentImportResult:
+    """Итог загрузки накладных: счетчики и ошибки по документам файла"""
+
+    def __init__(self):
+        self.documents = 0
+        self.items = 0
+        self.posted = 0
+        self.failed = 0
+        self.errors = []  # (место в файле, сообщение)
+
+    def error(self, place, message):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((place, message))
+
+    def merge(self, other):
+        self.documents += other.documents
+        self.items += other.items
+        self.posted += other.posted
+        self.failed += other.failed
+        self.errors.extend(other.errors[:MAX_ERRORS - len(self.errors)])
+
+    def summary(self):
+        return (f'Документов: {self.documents}, строк: {self.items}, '
+                f'проведено: {self.posted}, ошибок: {self.failed}')
+
+
+class DocumentImportService:
+    """
+    Загрузка приходных накладных поставщиков из XML/CSV в черновики приходов.
+    Файл читается потоком, документы пишутся частями по DOCUMENT_IMPORT_CHUNK_SIZE:
+    товары ищутся по артикулу через общий кэш, номера выдаются блоками на часть,
+    документы и строки вставляются executemany. Накладная, уже загруженная
+    от того же поставщика, пропускается.
+
+    XML: <documents><document number="" date="" supplier="" supplier_inn="">
+    <comment/><item article="" quantity="" price="" lot="" expiry=""/></document></documents>
+    CSV: строка на позицию, соседние строки с одинаковыми номером, датой и
+    поставщиком - один документ. Партия и срок годности (lot, expiry) необязательны.
+    """
+
+    @staticmethod
+    def import_file(stream, file_format='xml', encoding='utf-8-sig', post=False,
+                    chunk_size=None, author_id=None, run=None):
+        """
+        Загрузка из бинарного или текстового потока (XML - только бинарный).
+        post - сразу провести загруженные документы частями.
+        run - общее состояние загрузки нескольких файлов (import_files).
+        """
+        if file_format not in FORMATS:
+            raise ValueError(f'Неизвестный формат: {file_format}')
+        if file_format == 'csv' and not isinstance(stream, io.TextIOBase):
+            stream = io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline='')
+
+        chunk_size = chunk_size or current_app.config['DOCUMENT_IMPORT_CHUNK_SIZE']
+        importer = _Importer(run or _Run(), post, author_id)
+        records = _read_xml(stream) if file_format == 'xml' else _read_csv(stream)
+
+        chunk = []
+        for place, record in records:
+            if isinstance(record, str):
+                importer.result.error(place, record)
+                continue
+            chunk.append((place, record))
+            if len(chunk) >= chunk_size:
+                importer.write(chunk)
+                chunk = []
+        if chunk:
+            importer.write(chunk)
+        return importer.result
+
+    @staticmethod
+    def import_files(paths, workers=4, post=False, encoding='utf-8-sig', chunk_size=None,
+                     author_id=None, progress=None):
+        """
+        Загрузка нескольких файлов (формат по расширению) в workers потоках,
+        у каждого потока свой контекст и сессия; кэш товаров и выдача номеров
+        общие. progress(путь, результат файла) вызывается по завершении файла.
+        """
+        run = _Run()
+        total = DocumentImportResult()
+
+        def load(path):
+            file_format = 'csv' if path.lower().endswith(('.csv', '.txt')) else 'xml'
+            with open(path, 'rb') as stream:
+                try:
+                    return DocumentImportService.import_file(
+                        stream, file_format, encoding, post, chunk_size, author_id, run)
+                except (ValueError, ParseError) as e:
+                    db.session.rollback()
+                    result = DocumentImportResult()
+                    result.error('файл', str(e))
+                    return result
+
+        for path, result in zip(paths, _map_files(load, paths, workers)):
+            result.errors = [(f'{path}: {place}', message) for place, message in result.errors]
+            total.merge(result)
+            if progress:
+                progress(path, result)
+        return total
+
+
+class _Run:
+    """Общее для файлов одной загрузки: поставщики, кэш товаров, номера"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.suppliers_by_inn = {}
+        self.suppliers_by_name = {}
+        for id, name, inn in db.session.query(Supplier.id, Supplier.name, Supplier.inn
+                                              ).order_by(Supplier.id):
+            if inn:
+                self.suppliers_by_inn.setdefault(inn.strip(), id)
+            self.suppliers_by_name.setdefault(name.lower(), id)
+        self.products = {}  # артикул -> (id, цена) или None
+        self.loaded = set()  # (поставщик, номер накладной) загруженные в этом запуске
+        self.closed = PeriodService.last_closed()
+        self.prefix = NumberingService.prefix('ПН')
+        self.next_number = None
+
+    def supplier(self, inn, name):
+        if inn and inn in self.suppliers_by_inn:
+            return self.suppliers_by_inn[inn]
+        return self.suppliers_by_name.get((name or '').lower())
+
+    def lookup(self, articles):
+        """Товары по артикулам; отсутствующие в кэше загружаются пачками"""
+        missing = [article for article in set(articles) if article not in self.products]
+        for start in range(0, len(missing), LOOKUP_BATCH):
+            batch = missing[start:start + LOOKUP_BATCH]
+            found = {article: (id, price) for id, article, price in db.session.query(
+                Product.id, Product.article, Product.price).filter(Product.article.in_(batch))}
+            with self.lock:
+                for article in batch:
+                    self.products[article] = found.get(article)
+        return {article: self.products[article] for article in articles}
+
+    def numbers(self, count, reset=False):
+        """Блок из count номеров документов подряд"""
+        with self.lock:
+            if self.next_number is None or reset:
+                self.next_number = NumberingService.last_number(self.prefix) + 1
+            start = self.next_number
+            self.next_number += count
+        return NumberingService.numbers(self.prefix, count, start)
+
+
+class _Importer:
+    def __init__(self, run, post, author_id):
+        self.run = run
+        self.post = post
+        self.author_id = author_id
+        self.result = DocumentImportResult()
+
+    def write(self, chunk):
+        """Проверка и запись части; при совпадении номеров блок берется заново"""
+        documents = self._documents(chunk)
+        if not documents:
+            return
+        for attempt in range(3):
+            try:
+                ids = self._insert(documents, reset=attempt > 0)
+                break
+            except IntegrityError as e:
+                db.session.rollback()
+                if not NumberingService.is_conflict(e):
+                    for place, _ in documents:
+                        self.result.error(place, f'Ошибка записи: {e.orig}')
+                    return
+        else:
+            for place, _ in documents:
+                self.result.error(place, 'Не удалось выделить номера документов')
+            return
+
+        self.result.documents += len(documents)
+        self.result.items += sum(len(document['items']) for _, document in documents)
+        if self.post:
+            success, message = StockService.process_income_documents(
+                Document.query.filter(Document.id.in_(ids)).all())
+            if success:
+                self.result.posted += len(ids)
+            else:
+                self.result.error(documents[0][0], f'Документы не проведены: {message}')
+
+    def _insert(self, documents, reset):
+        numbers = self.run.numbers(len(documents), reset)
+        now = datetime.utcnow()
+        db.session.execute(Document.__table__.insert(), [{
+            'doc_type': 'income',
+            'doc_number': number,
+            'doc_date': document['date'],
+            'status': 'draft',
+            'supplier_id': document['supplier_id'],
+            'author_id': self.author_id,
+            'external_number': document['number'],
+            'comment': document['comment'],
+            'created_at': now
+        } for number, (_, document) in zip(numbers, documents)])
+        ids = dict(db.session.query(Document.doc_number, Document.id).filter(
+            Document.doc_number.in_(numbers)))
+        db.session.execute(DocumentItem.__table__.insert(), [
+            dict(item, document_id=ids[number])
+            for number, (_, document) in zip(numbers, documents) for item in document['items']
+        ])
+        db.session.commit()
+        return list(ids.values())
+
+    def _documents(self, chunk):
+        """Проверенные документы части: (место в файле, поля документа)"""
+        products = self.run.lookup([item['article'] for _, record in chunk
+                                    for item in record['items']])
+        keys = {}
+        documents = []
+        for place, record in chunk:
+            try:
+                document = self._document(record, products)
+            except ValueError as e:
+                self.result.error(place, str(e))
+                continue
+            key = (document['supplier_id'], document['number'])
+            with self.run.lock:
+                if key in self.run.loaded:
+                    self.result.error(place, f'Накладная №{document["number"]} уже есть в загрузке')
+                    continue
+                self.run.loaded.add(key)
+            keys[key] = place
+            documents.append((place, document))
+
+        # Накладные, загруженные раньше (отмененные не считаются)
+        numbers = {number for _, number in keys}
+        existing = {(supplier_id, number): doc_number for supplier_id, number, doc_number in
+                    db.session.query(Document.supplier_id, Document.external_number,
+                                     Document.doc_number).filter(
+                        Document.external_number.in_(numbers), Document.status != 'cancelled')}
+        if existing:
+            for place, document in documents:
+                doc_number = existing.get((document['supplier_id'], document['number']))
+                if doc_number:
+                    self.result.error(place, f'Накладная №{document["number"]} уже загружена '
+                                             f'(документ {doc_number})')
+            documents = [(place, document) for place, document in documents
+                         if (document['supplier_id'], document['number']) not in existing]
+        return documents
+
+    def _document(self, record, products):
+        """Поля документа из записи файла; ValueError - документ не загружается"""
+        number = (record.get('number') or '').strip()
+        if not number:
+            raise ValueError('Не указан номер накладной')
+        if len(number) > 50:
+            raise ValueError('Номер накладной длиннее 50 символов')
+        doc_date = _date(record.get('date'))
+        if self.post and self.run.closed and doc_date <= self.run.closed:
+            PeriodService.ensure_open(doc_date)
+
+        inn = (record.get('supplier_inn') or '').strip()
+        name = (record.get('supplier') or '').strip()
+        supplier_id = self.run.supplier(inn, name)
+        if supplier_id is None:
+            raise ValueError(f'Поставщик "{name or inn}" не найден')
+
+        if not record['items']:
+            raise ValueError('В накладной нет строк')
+        items = []
+        for item in record['items']:
+            if not item['article']:
+                raise ValueError('Не указан артикул в строке накладной')
+            product = products.get(item['article'])
+            if not product:
+                raise ValueError(f'Товар с артикулом "{item["article"]}" не найден')
+            quantity = _decimal(item.get('quantity'), 'количество')
+            if quantity <= 0:
+                raise ValueError(f'Количество по артикулу "{item["article"]}" должно быть больше 0')
+            price = item.get('price')
+            price = product[1] if price is None or str(price).strip() == '' \
+                else _decimal(price, 'цена')
+            if price < 0:
+                raise ValueError('Цена не может быть отрицательной')
+            expiry = (item.get('expiry') or '').strip()
+            items.append({'product_id': product[0], 'quantity': quantity, 'price': price,
+                          'lot_number': (item.get('lot') or '').strip()[:50] or None,
+                          'expiry_date': _date(expiry) if expiry else None})
+
+        comment = (record.get('comment') or '').strip()
+        return {
+            'number': number,
+            'date': doc_date,
+            'supplier_id': supplier_id,
+            'comment': (comment or f'Накладная поставщика №{number}')[:500],
+            'items': items
+        }
+
+
+def _map_files(load, paths, workers):
+    """Загрузка файлов в потоках; у каждого потока свой контекст и сессия"""
+    if workers <= 1 or len(paths) <= 1:
+        yield from map(load, paths)
+        return
+
+    app = current_app._get_current_object()
+
+    def run(path):
+        with app.app_context():
+            try:
+                return load(path)
+            finally:
+                db.session.remove()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='document-import') as pool:
+        yield from pool.map(run, paths)
+
+
+def _date(value):
+    value = (value or '').strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f'Неверная дата: "{value}"')
+
+
+def _decimal(value, title):
+    try:
+        return Decimal(str(value).strip().replace(' ', '').replace(',', '.')).quantize(
+            Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f'Неверное значение ({title}): "{value}"')
+
+
+def _read_xml(stream):
+    """(документ N, запись или текст ошибки); разобранные элементы удаляются"""
+    position = 0
+    for _, element in iterparse(stream, events=('end',)):
+        if element.tag != 'document':
+            continue
+        position += 1
+        record = {key: element.get(key) for key in ('number', 'date', 'supplier', 'supplier_inn')}
+        record['comment'] = element.findtext('comment')
+        record['items'] = [{'article': (item.get('article') or '').strip(),
+                            'quantity': item.get('quantity'),
+                            'price': item.get('price'),
+                            'lot': item.get('lot'),
+                            'expiry': item.get('expiry')}
+                           for item in element.iter('item')]
+        element.clear()
+        yield f'документ {position}', record
+
+
+def _read_csv(stream):
+    """(строка N, запись или текст ошибки); документ - соседние строки одной накладной"""
+    header = stream.readline()
+    delimiter = ';' if header.count(';') >= header.count(',') else ','
+    fields = [COLUMN_ALIASES.get(field.strip().lower())
+              for field in next(csv.reader([header], delimiter=delimiter), [])]
+    missing = {'number', 'date', 'article', 'quantity'} - set(fields)
+    if missing or not {'supplier', 'supplier_inn'} & set(fields):
+        yield 'строка 1', ('В заголовке должны быть колонки: номер, дата, поставщик или ИНН, '
+                           'артикул, количество')
+        return
+
+    reader = csv.reader(stream, delimiter=delimiter)
+    key = None
+    record = None
+    for values in reader:
+        if not any(values):
+            continue
+        row = {field: value for field, value in zip(fields, values) if field}
+        row_key = tuple((row.get(field) or '').strip()
+                        for field in ('number', 'date', 'supplier', 'supplier_inn'))
+        if row_key != key:
+            if record:
+                yield place, record
+            key = row_key
+            place = f'строка {reader.line_num + 1}'  # +1 - строка заголовка
+            record = {field: row.get(field) for field in
+                      ('number', 'date', 'supplier', 'supplier_inn', 'comment')}
+            record['items'] = []
+        record['items'].append({'article': (row.get('article') or '').strip(), 'quantity': row.get('quantity'),
+                                'price': row.get('price'), 'lot': row.get('lot'),
+                                'expiry': row.get('expiry')})
+    if record:
+        yield place, record
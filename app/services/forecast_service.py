@@ -0,0 +1,213 @@
+from app import db
+from app.analytics import get_store, day_number
+from app.models import Product, Category, DemandForecast
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, case
+import numpy as np
+
+CHUNK_SIZE = 20000
+METHODS = ('ses', 'holt')
+
+
+class ForecastService:
+    """
+    Прогноз недельного расхода товаров.
+    Простое сглаживание (SES) и метод Холта подбираются для всех товаров сразу:
+    перебираются параметры из FORECAST_ALPHAS/FORECAST_BETAS, для каждого товара
+    остается вариант с наименьшей ошибкой прогноза на неделю вперед по истории.
+    """
+
+    @staticmethod
+    def week_start(day):
+        """Понедельник недели, содержащей day"""
+        return day - timedelta(days=day.weekday())
+
+    @staticmethod
+    def weekly_history(today=None, weeks=None, product_ids=None):
+        """
+        Расход по полным неделям до текущей: (product_id, начала недель, матрица
+        товары x недели). Только товары с расходом за эти недели.
+        """
+        weeks = weeks or current_app.config['FORECAST_HISTORY_WEEKS']
+        end = ForecastService.week_start(today or date.today())
+        start = end - timedelta(weeks=weeks)
+        starts = [start + timedelta(weeks=week) for week in range(weeks)]
+
+        store = get_store()
+        mask = store.mask(start, end - timedelta(days=1), product_ids) & (store.direction == -1)
+        ids, inverse = np.unique(store.product_id[mask], return_inverse=True)
+        week = (store.day[mask] - day_number(start)) // 7
+        flat = np.bincount(inverse.astype(np.int64) * weeks + week,
+                           store.weight[mask] * store.quantity[mask], len(ids) * weeks)
+        return ids.astype(np.int64), starts, flat.reshape(len(ids), weeks)
+
+    @staticmethod
+    def fit(series, horizon=None, alphas=None, betas=None):
+        """
+        Подбор и прогноз по матрице товары x недели: словарь массивов forecast
+        (товары x horizon), error, method (0 - SES, 1 - Холт), alpha, beta
+        """
+        config = current_app.config
+        return _fit(series,
+                    horizon or config['FORECAST_HORIZON_WEEKS'],
+                    tuple(alphas or config['FORECAST_ALPHAS']),
+                    tuple(betas or config['FORECAST_BETAS']))
+
+    @staticmethod
+    def refresh(today=None, workers=4, chunk_size=CHUNK_SIZE, progress=None):
+        """
+        Пересчет таблицы прогнозов (ночная задача). Товары делятся на части
+        по chunk_size и подбираются в workers процессах. Возвращает число товаров.
+        """
+        config = current_app.config
+        horizon = config['FORECAST_HORIZON_WEEKS']
+        ids, starts, series = ForecastService.weekly_history(today)
+        first_week = starts[-1] + timedelta(weeks=1) if starts \
+            else ForecastService.week_start(today or date.today())
+        weeks = [first_week + timedelta(weeks=week) for week in range(horizon)]
+
+        chunks = [series[start:start + chunk_size] for start in range(0, len(ids), chunk_size)]
+        args = (horizon, tuple(config['FORECAST_ALPHAS']), tuple(config['FORECAST_BETAS']))
+
+        DemandForecast.query.delete(synchronize_session=False)
+        computed_at = datetime.utcnow()
+        offset = 0
+        for done, result in enumerate(_map_chunks(chunks, args, workers), 1):
+            rows = []
+            for index in range(len(result['error'])):
+                product_id = int(ids[offset + index])
+                method = METHODS[result['method'][index]]
+                error = float(result['error'][index])
+                rows.extend({
+                    'product_id': product_id,
+                    'week_start': week,
+                    'quantity': round(float(quantity), 3),
+                    'method': method,
+                    'error': error,
+                    'computed_at': computed_at
+                } for week, quantity in zip(weeks, result['forecast'][index]))
+            if rows:
+                db.session.execute(DemandForecast.__table__.insert(), rows)
+            offset += len(result['error'])
+            if progress:
+                progress(done, len(chunks))
+        db.session.commit()
+        return len(ids)
+
+    @staticmethod
+    def rows(category_id=0, limit=None):
+        """
+        Строки отчета: товар, прогноз на ближайшую неделю и на весь горизонт,
+        метод и ошибка; по убыванию прогноза на горизонт
+        """
+        next_week = db.session.query(func.min(DemandForecast.week_start)).scalar()
+        if next_week is None:
+            return []
+
+        total = func.sum(DemandForecast.quantity)
+        query = db.session.query(
+            Product.id, Product.article, Product.name, Product.unit,
+            Category.name.label('category_name'),
+            func.sum(case((DemandForecast.week_start == next_week, DemandForecast.quantity),
+                          else_=0)).label('next_week'),
+            total.label('horizon'),
+            func.max(DemandForecast.method).label('method'),
+            func.max(DemandForecast.error).label('error'),
+            func.max(DemandForecast.computed_at).label('computed_at')
+        ).join(Product, DemandForecast.product_id == Product.id
+        ).join(Category, Product.category_id == Category.id, isouter=True
+        ).group_by(Product.id, Product.article, Product.name, Product.unit, Category.name
+        ).order_by(total.desc(), Product.name)
+        if category_id:
+            query = query.filter(Product.category_id == category_id)
+        if limit:
+            query = query.limit(limit)
+
+        return [{
+            'id': row.id,
+            'article': row.article,
+            'name': row.name,
+            'unit': row.unit,
+            'category': row.category_name or '-',
+            'next_week': float(row.next_week or 0),
+            'horizon': float(row.horizon or 0),
+            'method': row.method,
+            'error': row.error,
+            'computed_at': row.computed_at
+        } for row in query]
+
+    @staticmethod
+    def product_forecast(product_id, today=None):
+        """История и сохраненный прогноз товара для графика"""
+        _, starts, series = ForecastService.weekly_history(today, product_ids=[product_id])
+        history = series[0] if len(series) else np.zeros(len(starts))
+        forecasts = DemandForecast.query.filter_by(product_id=product_id
+                                                   ).order_by(DemandForecast.week_start).all()
+        return {
+            'product_id': product_id,
+            'history': {
+                'labels': [start.isoformat() for start in starts],
+                'values': [round(float(value), 3) for value in history]
+            },
+            'forecast': {
+                'labels': [row.week_start.isoformat() for row in forecasts],
+                'values': [float(row.quantity) for row in forecasts]
+            },
+            'method': forecasts[0].method if forecasts else None,
+            'error': forecasts[0].error if forecasts else None,
+            'computed_at': forecasts[0].computed_at.isoformat() if forecasts else None
+        }
+
+
+def _map_chunks(chunks, args, workers):
+    """Подбор по частям; в несколько процессов - только чистые расчеты NumPy"""
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield _fit(chunk, *args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_fit, chunks, *([arg] * len(chunks) for arg in args))
+
+
+def _fit(series, horizon, alphas, betas):
+    """
+    Сглаживание всех строк series одновременно: цикл только по неделям.
+    Начальный уровень - среднее первых 4 недель, начальный тренд - 0.
+    """
+    size, weeks = series.shape
+    steps = np.arange(1, horizon + 1)
+    best = {
+        'forecast': np.zeros((size, horizon)),
+        'error': np.full(size, np.inf),
+        'method': np.zeros(size, dtype=np.int8),
+        'alpha': np.zeros(size),
+        'beta': np.zeros(size)
+    }
+    if not size or not weeks:
+        best['error'][:] = 0
+        return best
+
+    for alpha in alphas:
+        for beta in (0.0,) + betas:
+            level = series[:, :4].mean(axis=1)
+            trend = np.zeros(size)
+            error = np.zeros(size)
+            for week in range(weeks):
+                predicted = level + trend
+                error += np.abs(series[:, week] - predicted)
+                new_level = alpha * series[:, week] + (1 - alpha) * predicted
+                trend = beta * (new_level - level) + (1 - beta) * trend
+                level = new_level
+            error /= weeks
+
+            better = error < best['error']
+            best['forecast'][better] = np.maximum(
+                level[better, None] + trend[better, None] * steps, 0)
+            best['error'][better] = error[better]
+            best['method'][better] = 1 if beta else 0
+            best['alpha'][better] = alpha
+            best['beta'][better] = beta
+    return best
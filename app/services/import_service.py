@@ -0,0 +1,249 @@
+from app import db
+from app.models import Product, Category, Supplier
+from app.services.stock_service import dialect_insert
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+import csv
+import io
+import json
+
+# Названия колонок файла (в нижнем регистре) -> поле товара
+COLUMN_ALIASES = {
+    'article': 'article', 'артикул': 'article',
+    'name': 'name', 'наименование': 'name', 'название': 'name',
+    'unit': 'unit', 'ед.изм.': 'unit', 'ед. изм.': 'unit', 'единица': 'unit',
+    'price': 'price', 'цена': 'price',
+    'category': 'category', 'категория': 'category',
+    'supplier': 'supplier', 'поставщик': 'supplier'
+}
+FORMATS = ('csv', 'jsonl')
+MAX_ERRORS = 1000  # ошибок в результате, остальные только считаются
+
+
+class ImportResult:
+    """Итог загрузки: счетчики и ошибки по строкам файла"""
+
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []  # (номер строки, сообщение)
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def summary(self):
+        return (f'Строк: {self.rows}, добавлено: {self.inserted}, '
+                f'обновлено: {self.updated}, ошибок: {self.failed}')
+
+
+class CatalogImportService:
+    """
+    Загрузка каталога товаров из CSV/JSONL с обновлением по артикулу.
+    Файл читается потоком и обрабатывается частями по IMPORT_CHUNK_SIZE строк:
+    категории и поставщики ищутся по названию в словарях в памяти, товары
+    записываются одним INSERT ... ON CONFLICT (article) DO UPDATE на часть.
+    Ошибочные строки пропускаются и попадают в результат.
+    """
+
+    @staticmethod
+    def import_file(stream, file_format='csv', encoding='utf-8-sig', chunk_size=None,
+                    create_missing=True, progress=None):
+        """
+        Загрузка из бинарного или текстового потока. create_missing - создавать
+        отсутствующие категории и поставщиков, иначе строка считается ошибочной.
+        progress(строк обработано) вызывается после каждой части.
+        """
+        if file_format not in FORMATS:
+            raise ValueError(f'Неизвестный формат: {file_format}')
+        if not isinstance(stream, io.TextIOBase):
+            stream = io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline='')
+
+        chunk_size = chunk_size or current_app.config['IMPORT_CHUNK_SIZE']
+        records = _read_csv(stream) if file_format == 'csv' else _read_jsonl(stream)
+        importer = _Importer(create_missing)
+
+        chunk = []
+        for line, record in records:
+            importer.result.rows += 1
+            if isinstance(record, str):
+                importer.result.error(line, record)
+                continue
+            chunk.append((line, record))
+            if len(chunk) >= chunk_size:
+                importer.write(chunk)
+                chunk = []
+                if progress:
+                    progress(importer.result.rows)
+        if chunk:
+            importer.write(chunk)
+        if progress:
+            progress(importer.result.rows)
+        return importer.result
+
+
+class _Importer:
+    def __init__(self, create_missing):
+        self.create_missing = create_missing
+        self.result = ImportResult()
+        self.categories = {name.lower(): id for id, name in
+                           db.session.query(Category.id, Category.name)}
+        self.suppliers = {}
+        for id, name in db.session.query(Supplier.id, Supplier.name).order_by(Supplier.id):
+            self.suppliers.setdefault(name.lower(), id)
+        self.insert = dialect_insert(db.session.get_bind().dialect.name)
+
+    def write(self, chunk):
+        """Проверка и запись части; при ошибке БД часть пишется построчно"""
+        rows = {}
+        for line, record in chunk:
+            try:
+                row = self._row(record)
+            except ValueError as e:
+                self.result.error(line, str(e))
+                continue
+            rows[row['article']] = (line, row)
+        # Новые категории и поставщики сохраняются до товаров
+        db.session.commit()
+
+        # Наименование существующих товаров подставляется в INSERT, если его нет
+        # в файле: NOT NULL проверяется до ON CONFLICT
+        existing = dict(db.session.query(Product.article, Product.name).filter(
+            Product.article.in_(list(rows))))
+        for article, (line, row) in list(rows.items()):
+            if article not in existing and 'name' not in row:
+                self.result.error(line, 'Новый товар без наименования')
+                del rows[article]
+
+        # В одном INSERT у всех строк одинаковый набор колонок
+        groups = {}
+        for line, row in rows.values():
+            groups.setdefault(frozenset(row), []).append((line, row))
+        for columns, group in groups.items():
+            try:
+                self._upsert([row for _, row in group], columns, existing)
+            except IntegrityError:
+                db.session.rollback()
+                for line, row in group:
+                    try:
+                        self._upsert([row], columns, existing)
+                    except IntegrityError as e:
+                        db.session.rollback()
+                        self.result.error(line, f'Ошибка записи: {e.orig}')
+                        continue
+                    self._count(row, existing)
+                continue
+            for _, row in group:
+                self._count(row, existing)
+
+    def _count(self, row, existing):
+        if row['article'] in existing:
+            self.result.updated += 1
+        else:
+            self.result.inserted += 1
+
+    def _upsert(self, rows, columns, existing):
+        now = datetime.utcnow()
+        values = [dict({'unit': 'шт', 'price': 0, 'name': existing.get(row['article'])},
+                       created_at=now, updated_at=now, **row) for row in rows]
+        statement = self.insert(Product.__table__)
+        # Обновляются только колонки, которые есть в файле
+        update = {column: statement.excluded[column]
+                  for column in columns | {'updated_at'} if column != 'article'}
+        db.session.execute(statement.on_conflict_do_update(index_elements=['article'],
+                                                           set_=update), values)
+        db.session.commit()
+
+    def _row(self, record):
+        """Поля товара из записи файла; ValueError - строка не загружается"""
+        article = str(record.get('article') or '').strip()
+        if not article:
+            raise ValueError('Не указан артикул')
+        if len(article) > 50:
+            raise ValueError('Артикул длиннее 50 символов')
+        row = {'article': article}
+
+        if 'name' in record:
+            name = str(record['name'] or '').strip()
+            if not name:
+                raise ValueError('Не указано наименование')
+            row['name'] = name[:200]
+        if 'unit' in record:
+            row['unit'] = str(record['unit'] or '').strip()[:20] or 'шт'
+        if 'price' in record:
+            row['price'] = _price(record['price'])
+        if 'category' in record:
+            row['category_id'] = self._reference(record['category'], self.categories,
+                                                 Category, 'Категория')
+        if 'supplier' in record:
+            row['supplier_id'] = self._reference(record['supplier'], self.suppliers,
+                                                 Supplier, 'Поставщик')
+        return row
+
+    def _reference(self, value, known, model, title):
+        """id категории/поставщика по названию (без названия - None)"""
+        name = str(value or '').strip()
+        if not name:
+            return None
+        key = name.lower()
+        if key not in known:
+            if not self.create_missing:
+                raise ValueError(f'{title} "{name}" не найден(а)')
+            item = model(name=name[:model.name.type.length])
+            db.session.add(item)
+            db.session.flush()
+            known[key] = item.id
+        return known[key]
+
+
+def _price(value):
+    if value is None or str(value).strip() == '':
+        return 0
+    try:
+        price = float(str(value).strip().replace(' ', '').replace(',', '.'))
+    except ValueError:
+        raise ValueError(f'Неверная цена: {value}')
+    if price < 0:
+        raise ValueError('Цена не может быть отрицательной')
+    return round(price, 2)
+
+
+def _normalize(record):
+    """Ключи записи по COLUMN_ALIASES, неизвестные колонки отбрасываются"""
+    return {COLUMN_ALIASES[key.strip().lower()]: value for key, value in record.items()
+            if key and key.strip().lower() in COLUMN_ALIASES}
+
+
+def _read_csv(stream):
+    """(номер строки, запись или текст ошибки); разделитель ; или , по заголовку"""
+    header = stream.readline()
+    delimiter = ';' if header.count(';') >= header.count(',') else ','
+    fields = next(csv.reader([header], delimiter=delimiter), [])
+    reader = csv.DictReader(stream, fieldnames=fields, delimiter=delimiter)
+    normalized = [COLUMN_ALIASES.get(field.strip().lower()) for field in fields]
+    if 'article' not in normalized:
+        yield 1, 'В заголовке нет колонки "Артикул" (article)'
+        return
+    for record in reader:
+        if not any(record.values()):
+            continue
+        yield reader.line_num + 1, _normalize(record)  # +1 - строка заголовка
+
+
+def _read_jsonl(stream):
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, f'Неверный JSON: {e.msg}'
+            continue
+        if not isinstance(record, dict):
+            yield line_number, 'Ожидается объект JSON'
+            continue
+        yield line_number, _normalize(record)
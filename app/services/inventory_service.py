@@ -0,0 +1,386 @@
+from app import db, metrics
+from app.models import Document, DocumentItem, Product, Category, StockBalance, WarehouseCell
+from app.services.cell_movement_service import CellMovementService
+from app.services.import_service import ImportResult
+from app.services.lot_service import LotService
+from app.services.numbering_service import NumberingService
+from app.services.occupancy_service import OccupancyService
+from app.services.period_service import PeriodService
+from app.services.reservation_service import ReservationService
+from app.services.stock_service import dialect_insert
+from app.services.turnover_service import TurnoverService
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import and_, bindparam, case, func, literal, select, update
+from time import perf_counter
+import csv
+import io
+
+# Названия колонок файла пересчета (в нижнем регистре) -> поле
+COLUMN_ALIASES = {
+    'cell': 'cell', 'ячейка': 'cell',
+    'article': 'article', 'артикул': 'article',
+    'quantity': 'quantity', 'количество': 'quantity', 'кол-во': 'quantity'
+}
+LOOKUP_BATCH = 500  # значений в одном запросе IN
+
+
+class InventoryService:
+    """
+    Инвентаризация: документ типа inventory по диапазону ячеек и/или категории.
+    Строки документа - (ячейка, товар) с учетным (book_quantity) и фактическим
+    (quantity) количеством. Факт загружается файлом сканера, расхождения
+    считаются одним запросом с присоединением stock_balances, проведение
+    выполняется одной транзакцией набором запросов.
+
+    Сама инвентаризация в движения не попадает: при проведении излишки и
+    недостачи по товарам оформляются проведенными приходом и расходом с
+    base_id инвентаризации, поэтому отчеты и остатки на дату их учитывают.
+    Изменения ячеек (включая пересортицу) записываются движениями ячеек
+    строк самой инвентаризации.
+    """
+
+    @staticmethod
+    def create(cell_from=None, cell_to=None, category_id=0, doc_date=None, author_id=None,
+               comment=None):
+        """
+        Черновик инвентаризации: строки по всем ненулевым остаткам в ячейках с
+        названиями от cell_from до cell_to (включительно) и товарах категории.
+        Факт изначально равен учету. Строки вставляются одним INSERT ... SELECT.
+        """
+        cell_from = (cell_from or '').strip()
+        cell_to = (cell_to or '').strip()
+        if cell_from and cell_to and cell_from > cell_to:
+            raise ValueError('Начальная ячейка диапазона больше конечной')
+
+        scope = []
+        if cell_from or cell_to:
+            scope.append(f'ячейки {cell_from or "..."} - {cell_to or "..."}')
+        if category_id:
+            scope.append(f'категория {db.session.get(Category, category_id).name}')
+        document = Document(
+            doc_type='inventory',
+            doc_number=NumberingService.next_number('ИНВ'),
+            doc_date=doc_date or datetime.now().date(),
+            author_id=author_id,
+            comment=comment or 'Инвентаризация: ' + (', '.join(scope) or 'весь склад'),
+            status='draft'
+        )
+        db.session.add(document)
+        db.session.flush()
+
+        source = select(
+            literal(document.id), StockBalance.product_id, StockBalance.cell_id,
+            StockBalance.quantity, StockBalance.quantity, Product.price
+        ).join(Product, StockBalance.product_id == Product.id
+        ).join(WarehouseCell, StockBalance.cell_id == WarehouseCell.id
+        ).where(StockBalance.quantity != 0)
+        if cell_from:
+            source = source.where(WarehouseCell.name >= cell_from)
+        if cell_to:
+            source = source.where(WarehouseCell.name <= cell_to)
+        if category_id:
+            source = source.where(Product.category_id == category_id)
+        db.session.execute(DocumentItem.__table__.insert().from_select(
+            ['document_id', 'product_id', 'cell_id', 'quantity', 'book_quantity', 'price'],
+            source.order_by(WarehouseCell.name, Product.article)
+        ))
+        db.session.commit()
+        return document
+
+    @staticmethod
+    def load_counts(document, stream, encoding='utf-8-sig'):
+        """
+        Загрузка пересчета из CSV сканера: ячейка, артикул, количество (без
+        количества - 1 за скан; повторы суммируются). Ячейка из файла считается
+        пересчитанной целиком: не найденные в ней товары получают факт 0.
+        Возвращает ImportResult (добавлено/обновлено строк документа).
+        """
+        if not isinstance(stream, io.TextIOBase):
+            stream = io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline='')
+        return InventoryService.apply_counts(document, _read_csv(stream))
+
+    @staticmethod
+    def apply_counts(document, records):
+        """Пересчет из записей (номер строки, ячейка, артикул, количество)"""
+        if document.doc_type != 'inventory':
+            raise ValueError('Документ не является инвентаризацией')
+        if document.status != 'draft':
+            raise ValueError(f'Документ {document.doc_number} не в статусе черновика')
+
+        result = ImportResult()
+        counted = {}
+        for line, cell, article, quantity in records:
+            result.rows += 1
+            if isinstance(cell, str) and article is None:
+                result.error(line, cell)  # ошибка формата файла
+                continue
+            try:
+                quantity = _quantity(quantity)
+            except ValueError as e:
+                result.error(line, str(e))
+                continue
+            entry = counted.setdefault((cell, article), [[], 0])
+            entry[0].append(line)
+            entry[1] += quantity
+
+        cells = _lookup(WarehouseCell.id, WarehouseCell.name, {cell for cell, _ in counted})
+        products = {article: (id, price) for id, article, price in _lookup_rows(
+            {article for _, article in counted})}
+        rows = {}
+        for (cell, article), (lines, quantity) in counted.items():
+            if cell not in cells:
+                for line in lines:
+                    result.error(line, f'Ячейка "{cell}" не найдена')
+                continue
+            if article not in products:
+                for line in lines:
+                    result.error(line, f'Товар с артикулом "{article}" не найден')
+                continue
+            rows[(products[article][0], cells[cell])] = (quantity, products[article][1])
+        if not rows:
+            return result
+
+        counted_cells = list({cell_id for _, cell_id in rows})
+        existing = {}
+        for batch in _batches(counted_cells):
+            existing.update({(product_id, cell_id): id for id, product_id, cell_id in
+                             db.session.query(DocumentItem.id, DocumentItem.product_id,
+                                              DocumentItem.cell_id).filter(
+                                 DocumentItem.document_id == document.id,
+                                 DocumentItem.cell_id.in_(batch))})
+            db.session.query(DocumentItem).filter(
+                DocumentItem.document_id == document.id, DocumentItem.cell_id.in_(batch)
+            ).update({'quantity': 0}, synchronize_session=False)
+
+        items = DocumentItem.__table__
+        updates = [{'item_id': existing[key], 'counted': quantity}
+                   for key, (quantity, _) in rows.items() if key in existing]
+        if updates:
+            db.session.execute(update(items).where(items.c.id == bindparam('item_id')).values(
+                quantity=bindparam('counted')), updates)
+        inserts = [{'document_id': document.id, 'product_id': product_id, 'cell_id': cell_id,
+                    'quantity': quantity, 'book_quantity': 0, 'price': price}
+                   for (product_id, cell_id), (quantity, price) in rows.items()
+                   if (product_id, cell_id) not in existing]
+        if inserts:
+            db.session.execute(items.insert(), inserts)
+        db.session.commit()
+
+        result.updated = len(updates)
+        result.inserted = len(inserts)
+        return result
+
+    @staticmethod
+    def variances(document):
+        """
+        Строки с учетом по текущим остаткам: один запрос документа с
+        присоединением stock_balances по (товар, ячейка)
+        """
+        return db.session.execute(select(
+            DocumentItem.id, DocumentItem.product_id, DocumentItem.cell_id,
+            DocumentItem.quantity, DocumentItem.price,
+            func.coalesce(StockBalance.quantity, 0).label('book'),
+            func.coalesce(StockBalance.reserved, 0).label('reserved')
+        ).outerjoin(StockBalance, and_(StockBalance.product_id == DocumentItem.product_id,
+                                       StockBalance.cell_id == DocumentItem.cell_id)
+        ).where(DocumentItem.document_id == document.id)).all()
+
+    @staticmethod
+    def lines(document, limit=None):
+        """Строки для просмотра: ячейка, товар, учет, факт, расхождение"""
+        query = db.session.query(
+            WarehouseCell.name.label('cell'), Product.article, Product.name, Product.unit,
+            DocumentItem.book_quantity, DocumentItem.quantity, DocumentItem.price
+        ).join(Product, DocumentItem.product_id == Product.id
+        ).join(WarehouseCell, DocumentItem.cell_id == WarehouseCell.id
+        ).filter(DocumentItem.document_id == document.id
+        ).order_by(WarehouseCell.name, Product.article)
+        if limit:
+            query = query.limit(limit)
+        return [{
+            'cell': row.cell,
+            'article': row.article,
+            'name': row.name,
+            'unit': row.unit,
+            'book': float(row.book_quantity or 0),
+            'counted': float(row.quantity),
+            'variance': float(row.quantity - (row.book_quantity or 0)),
+            'value': float((row.quantity - (row.book_quantity or 0)) * row.price)
+        } for row in query]
+
+    @staticmethod
+    def totals(document):
+        """Итоги документа: строк, строк с расхождением, излишки и недостачи в рублях"""
+        variance = DocumentItem.quantity - func.coalesce(DocumentItem.book_quantity, 0)
+        row = db.session.query(
+            func.count(DocumentItem.id),
+            func.sum(case((variance != 0, 1), else_=0)),
+            func.sum(case((variance > 0, variance * DocumentItem.price), else_=0)),
+            func.sum(case((variance < 0, -variance * DocumentItem.price), else_=0))
+        ).filter(DocumentItem.document_id == document.id).one()
+        return {
+            'lines': row[0],
+            'differences': int(row[1] or 0),
+            'surplus': float(row[2] or 0),
+            'shortage': float(row[3] or 0)
+        }
+
+    @staticmethod
+    def process_document(document):
+        """
+        Проведение инвентаризации:
+        - фиксирует учетное количество строк по текущим остаткам
+        - снимает резервы черновиков с товаров ячеек, где факт меньше резерва
+        - устанавливает остатки ячеек равными факту (один INSERT ... ON CONFLICT)
+        - оформляет излишки приходом, недостачи расходом (по товару в целом)
+        - переводит документ в статус "проведён"
+        """
+        if document.status != 'draft':
+            raise ValueError(f'Документ {document.doc_number} не в статусе черновика')
+        if document.doc_type != 'inventory':
+            raise ValueError('Метод предназначен только для инвентаризации')
+
+        started = perf_counter()
+        try:
+            PeriodService.ensure_open(document.doc_date)
+
+            rows = InventoryService.variances(document)
+            items = DocumentItem.__table__
+            if rows:
+                db.session.execute(update(items).where(items.c.id == bindparam('item_id')).values(
+                    book_quantity=bindparam('book')),
+                    [{'item_id': row.id, 'book': row.book} for row in rows])
+
+            now = datetime.utcnow()
+            changed = [row for row in rows if row.quantity != row.book]
+            # Резерв больше факта не выполнить: черновики резервируют заново
+            released = ReservationService.release_cells(
+                [(row.product_id, row.cell_id) for row in changed if row.quantity < row.reserved])
+            if changed:
+                statement = dialect_insert(db.session.get_bind().dialect.name)(
+                    StockBalance.__table__)
+                db.session.execute(statement.on_conflict_do_update(
+                    index_elements=['product_id', 'cell_id'],
+                    set_={'quantity': statement.excluded.quantity,
+                          'last_updated': statement.excluded.last_updated}
+                ), [{'product_id': row.product_id, 'cell_id': row.cell_id,
+                     'quantity': row.quantity, 'last_updated': now} for row in changed])
+                CellMovementService.record([(row.id, row.cell_id, row.quantity - row.book)
+                                            for row in changed])
+
+            # Пересортица между ячейками одного товара движением не является
+            net = defaultdict(Decimal)
+            prices = {}
+            for row in changed:
+                net[row.product_id] += Decimal(row.quantity) - Decimal(row.book)
+                prices[row.product_id] = row.price
+            derived = []
+            for doc_type, code, title, sign in (
+                    ('income', 'ПН', 'Оприходование излишков', 1),
+                    ('expense', 'РН', 'Списание недостачи', -1)):
+                lines = [{'product_id': product_id, 'quantity': sign * quantity,
+                          'price': prices[product_id]}
+                         for product_id, quantity in sorted(net.items()) if sign * quantity > 0]
+                if lines:
+                    derived.append(_derived_document(document, doc_type, code, title, lines, now))
+
+            document.status = 'posted'
+            document.posted_at = now
+            if derived:
+                TurnoverService.apply_documents(derived)
+                LotService.allocate([item for item in derived if item.doc_type == 'expense'])
+            OccupancyService.refresh({row.cell_id for row in changed})
+
+            db.session.commit()
+            metrics.observe_posting('inventory', len(rows), perf_counter() - started)
+            if not derived:
+                message = 'Инвентаризация проведена, расхождений нет'
+            else:
+                message = ('Инвентаризация проведена, созданы документы: '
+                           + ', '.join(item.doc_number for item in derived))
+            if released:
+                message += f'. Сняты резервы черновиков: {len(released)}'
+            return True, message
+
+        except ValueError as e:
+            db.session.rollback()
+            return False, str(e)
+        except Exception as e:
+            db.session.rollback()
+            return False, f"Ошибка при проведении документа: {str(e)}"
+
+
+def _derived_document(document, doc_type, code, title, lines, posted_at):
+    """Проведенный приход/расход по результатам инвентаризации"""
+    derived = Document(
+        doc_type=doc_type,
+        doc_number=NumberingService.next_number(code),
+        doc_date=document.doc_date,
+        author_id=document.author_id,
+        base_id=document.id,
+        comment=f'{title} по инвентаризации №{document.doc_number}',
+        status='posted',
+        posted_at=posted_at
+    )
+    db.session.add(derived)
+    db.session.flush()
+    db.session.execute(DocumentItem.__table__.insert(),
+                       [dict(line, document_id=derived.id) for line in lines])
+    return derived
+
+
+def _batches(values):
+    values = list(values)
+    for start in range(0, len(values), LOOKUP_BATCH):
+        yield values[start:start + LOOKUP_BATCH]
+
+
+def _lookup(id_column, key_column, keys):
+    """{ключ: id} для ключей, найденных в таблице; запросы пачками"""
+    found = {}
+    for batch in _batches(keys):
+        found.update({key: id for id, key in db.session.query(id_column, key_column).filter(
+            key_column.in_(batch))})
+    return found
+
+
+def _lookup_rows(articles):
+    for batch in _batches(articles):
+        yield from db.session.query(Product.id, Product.article, Product.price).filter(
+            Product.article.in_(batch))
+
+
+def _quantity(value):
+    if value is None or str(value).strip() == '':
+        return Decimal(1)
+    try:
+        quantity = Decimal(str(value).strip().replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f'Неверное количество: "{value}"')
+    if quantity < 0:
+        raise ValueError('Количество не может быть отрицательным')
+    return quantity
+
+
+def _read_csv(stream):
+    """(номер строки, ячейка, артикул, количество) или (номер строки, ошибка, None, None)"""
+    header = stream.readline()
+    delimiter = ';' if header.count(';') >= header.count(',') else ','
+    fields = [COLUMN_ALIASES.get(field.strip().lower())
+              for field in next(csv.reader([header], delimiter=delimiter), [])]
+    if 'cell' not in fields or 'article' not in fields:
+        yield 1, 'В заголовке должны быть колонки: ячейка, артикул, количество', None, None
+        return
+
+    reader = csv.reader(stream, delimiter=delimiter)
+    for values in reader:
+        if not any(values):
+            continue
+        row = {field: value.strip() for field, value in zip(fields, values) if field}
+        line = reader.line_num + 1  # +1 - строка заголовка
+        if not row.get('cell') or not row.get('article'):
+            yield line, 'Не указаны ячейка или артикул', None, None
+            continue
+        yield line, row['cell'], row['article'], row.get('quantity')
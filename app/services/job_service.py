@@ -0,0 +1,278 @@
+from app import db
+from app.models import Job, Document
+from app.services.stock_service import StockService
+from app.services.inventory_service import InventoryService
+from app.services.transfer_service import TransferService
+from app.services.report_service import ReportService
+from app.services.valuation_service import ValuationService
+from app.services.classification_service import ClassificationService
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from flask import current_app
+import json
+import os
+import socket
+import threading
+
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+# Обработчики задач по типам: job_type -> функция(job), возвращающая сообщение
+JOB_HANDLERS = {}
+
+
+def job_handler(job_type):
+    """Регистрация обработчика фоновой задачи"""
+    def decorator(func):
+        JOB_HANDLERS[job_type] = func
+        return func
+    return decorator
+
+
+class JobRunner:
+    """
+    Исполнитель фоновых задач внутри процесса приложения.
+    Для каждого типа задач - свой пул потоков с ограничением JOB_CONCURRENCY.
+    Состояние задач хранится в таблице jobs, поэтому незавершенные задачи
+    подхватываются заново после перезапуска (при первом запросе).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executors = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._resumed = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['job_runner'] = self
+        app.before_request(self._resume_once)
+
+    def submit(self, job_id, job_type):
+        """Отправка задачи на выполнение"""
+        if self.app.config['JOBS_EAGER']:
+            self._execute(job_id)
+            return
+
+        future = self._executor(job_type).submit(self._execute, job_id)
+        self._futures[job_id] = future
+
+    def wait(self, job_id, timeout=None):
+        """Ожидание завершения задачи, отправленной этим процессом"""
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout=timeout)
+
+    def resume(self):
+        """Возврат в очередь задач, прерванных перезапуском"""
+        pending = Job.query.filter(Job.status.in_(['queued', 'running'])).all()
+        resumed = []
+        for job in pending:
+            if job.status == 'running' and _worker_alive(job.worker):
+                continue
+            job.status = 'queued'
+            resumed.append((job.id, job.job_type))
+        db.session.commit()
+
+        for job_id, job_type in resumed:
+            self.submit(job_id, job_type)
+        return len(resumed)
+
+    def _resume_once(self):
+        if self._resumed:
+            return
+        with self._lock:
+            if self._resumed:
+                return
+            self._resumed = True
+        self.resume()
+
+    def _executor(self, job_type):
+        with self._lock:
+            if job_type not in self._executors:
+                limits = self.app.config['JOB_CONCURRENCY']
+                self._executors[job_type] = ThreadPoolExecutor(
+                    max_workers=limits.get(job_type, 1),
+                    thread_name_prefix=f'job-{job_type}'
+                )
+            return self._executors[job_type]
+
+    def _execute(self, job_id):
+        with self.app.app_context():
+            if not _claim(job_id):
+                return  # Задачу уже взял другой исполнитель
+
+            job = db.session.get(Job, job_id)
+            try:
+                message = JOB_HANDLERS[job.job_type](job)
+                job.status = 'done'
+                job.progress = 100
+                job.message = message
+            except Exception as e:
+                db.session.rollback()
+                job = db.session.get(Job, job_id)
+                job.status = 'failed'
+                job.message = str(e)[:500]
+
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+
+def _claim(job_id):
+    """Атомарный захват задачи из очереди"""
+    claimed = Job.query.filter_by(id=job_id, status='queued').update({
+        'status': 'running',
+        'progress': 0,
+        'worker': WORKER_ID,
+        'started_at': datetime.utcnow()
+    })
+    db.session.commit()
+    return claimed == 1
+
+
+def _worker_alive(worker):
+    """Жив ли процесс-исполнитель (для других хостов считаем, что жив)"""
+    if not worker:
+        return False
+    if worker == WORKER_ID:
+        return True
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+class JobService:
+    """Сервис постановки и сопровождения фоновых задач"""
+
+    @staticmethod
+    def enqueue(job_type, params=None, author_id=None):
+        """Создание задачи и отправка ее исполнителю"""
+        if job_type not in JOB_HANDLERS:
+            raise ValueError(f'Неизвестный тип задачи: {job_type}')
+
+        params = params or {}
+        job = Job(
+            job_type=job_type,
+            params=json.dumps(params, ensure_ascii=False),
+            author_id=author_id,
+            document_id=params.get('document_id'),
+            status='queued'
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        current_app.extensions['job_runner'].submit(job.id, job_type)
+        db.session.expire(job)  # Статус меняет исполнитель в своей сессии
+        return job
+
+    @staticmethod
+    def pending_post(document_id):
+        """Незавершенная задача проведения документа или None"""
+        return Job.query.filter(Job.job_type == 'post', Job.document_id == document_id,
+                                Job.status.in_(['queued', 'running'])).first()
+
+    @staticmethod
+    def report_result(job):
+        """Строки отчета завершенной задачи 'report' или None, если результата нет"""
+        if job.job_type != 'report' or job.status != 'done' or not job.result_path \
+                or not os.path.exists(job.result_path):
+            return None
+        with open(job.result_path, encoding='utf-8') as result:
+            return json.load(result)
+
+    @staticmethod
+    def set_progress(job, progress):
+        """Сохранение прогресса выполнения (фиксирует текущую транзакцию)"""
+        job.progress = max(0, min(100, int(progress)))
+        db.session.commit()
+
+    @staticmethod
+    def result_path(job, extension):
+        """Путь к файлу результата задачи"""
+        directory = current_app.config['JOB_RESULTS_DIR'] or \
+            os.path.join(current_app.instance_path, 'jobs')
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f'job_{job.id}_{job.job_type}.{extension}')
+
+
+# ============== ОБРАБОТЧИКИ ЗАДАЧ ==============
+
+@job_handler('post')
+def post_document_job(job):
+    """Проведение документа"""
+    document = db.session.get(Document, job.get_params()['document_id'])
+    if document is None:
+        raise ValueError('Документ не найден')
+
+    if document.doc_type == 'income':
+        success, message = StockService.process_income_document(document)
+    elif document.doc_type == 'inventory':
+        success, message = InventoryService.process_document(document)
+    elif document.doc_type == 'transfer':
+        success, message = TransferService.process_document(document)
+    else:
+        success, message = StockService.process_expense_document(
+            document, partial=job.get_params().get('partial', False))
+
+    if not success:
+        raise ValueError(message)
+    return message
+
+
+@job_handler('export')
+def export_job(job):
+    """Выгрузка отчета в CSV-файл"""
+    params = job.get_params()
+    report = params.get('report')
+    if report not in ('stock', 'turnover'):
+        raise ValueError(f'Неизвестная выгрузка: {report}')
+    progress = lambda done, total: JobService.set_progress(job, 100 * done / total)
+
+    path = JobService.result_path(job, 'csv')
+    with open(path, 'w', encoding='cp1251', newline='') as output:
+        if report == 'stock':
+            ReportService.write_stock_csv(output, progress=progress)
+        else:
+            date_from = date.fromisoformat(params['date_from']) if params.get('date_from') \
+                else ReportService.period_start(params.get('period', 'month'))
+            date_to = date.fromisoformat(params['date_to']) if params.get('date_to') else None
+            ReportService.write_turnover_csv(output, date_from, date_to,
+                                             params.get('category_id', 0), progress=progress)
+
+    job.result_path = path
+    return 'Выгрузка сформирована'
+
+
+
+@job_handler('report')
+def report_job(job):
+    """Построение строк тяжелого отчета (оборот, оценка, ABC/XYZ) в JSON-файл"""
+    params = job.get_params()
+    report = params.get('report')
+    category_id = params.get('category_id', 0)
+    day = lambda key: date.fromisoformat(params[key]) if params.get(key) else None
+
+    if report == 'turnover':
+        rows = ReportService.turnover_rows(day('date_from'), category_id, day('date_to'))
+    elif report == 'valuation':
+        rows = ValuationService.rows(day('as_of'), category_id,
+                                     params.get('price_basis', 'catalog'),
+                                     with_products=bool(params.get('detail')))
+    elif report == 'abc-xyz':
+        rows = ClassificationService.rows(day('date_from'), day('date_to'), category_id)
+    else:
+        raise ValueError(f'Неизвестный отчет: {report}')
+
+    path = JobService.result_path(job, 'json')
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump(rows, output, ensure_ascii=False, default=str)
+
+    job.result_path = path
+    return f'Отчет сформирован, строк: {len(rows)}'
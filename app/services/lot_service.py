@@ -0,0 +1,180 @@
+from app import db
+from app.models import DocumentItem, LotAllocation, Product, StockLot
+from collections import defaultdict, deque
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import bindparam, delete, func, nulls_last, or_, select, update
+
+
+class LotService:
+    """
+    Партии и сроки годности. Приход со сроком или номером партии увеличивает
+    партию (stock_lots), расход списывает партии по FEFO одним упорядоченным
+    проходом по индексу (товар, срок) и запоминает списание в lot_allocations,
+    отмена возвращает списанное. Изменения попадают в текущую транзакцию,
+    фиксирует их вызывающий код.
+    """
+
+    @staticmethod
+    def receive(documents, sign=1):
+        """Партии по строкам приходов: sign=1 при проведении, sign=-1 при отмене"""
+        rows = db.session.query(
+            DocumentItem.product_id, DocumentItem.lot_number, DocumentItem.expiry_date,
+            func.sum(DocumentItem.quantity).label('quantity')
+        ).filter(DocumentItem.document_id.in_([document.id for document in documents]),
+                 or_(DocumentItem.lot_number.isnot(None), DocumentItem.expiry_date.isnot(None))
+        ).group_by(DocumentItem.product_id, DocumentItem.lot_number,
+                   DocumentItem.expiry_date).all()
+        if not rows:
+            return
+
+        lots = {(lot.product_id, lot.lot_number, lot.expiry_date): lot
+                for lot in db.session.query(StockLot.id, StockLot.product_id, StockLot.lot_number,
+                                            StockLot.expiry_date, StockLot.quantity
+                                            ).filter(StockLot.product_id.in_(
+                                                {row.product_id for row in rows}))}
+        changes, new = [], []
+        for row in rows:
+            lot = lots.get((row.product_id, row.lot_number, row.expiry_date))
+            if sign < 0 and (lot is None or lot.quantity < row.quantity):
+                raise ValueError(f'Партия {_lot_title(row)} товара '
+                                 f'{db.session.get(Product, row.product_id).name} '
+                                 'уже частично израсходована')
+            if lot is not None:
+                changes.append({'lot_id': lot.id, 'delta': sign * row.quantity})
+            else:
+                new.append({'product_id': row.product_id, 'lot_number': row.lot_number,
+                            'expiry_date': row.expiry_date, 'quantity': row.quantity,
+                            'received_at': datetime.utcnow()})
+        _change_lots(changes)
+        if new:
+            db.session.execute(StockLot.__table__.insert(), new)
+
+    @staticmethod
+    def allocate(documents):
+        """
+        Списание партий строками расходов по FEFO: сначала ближайший срок,
+        партии без срока - последними. Если партий не хватает, остаток строки
+        списывается с товара без партии. Возвращает число списаний.
+        """
+        lines = db.session.query(DocumentItem.id, DocumentItem.product_id, DocumentItem.quantity
+                                 ).filter(DocumentItem.document_id.in_(
+                                     [document.id for document in documents])
+                                 ).order_by(DocumentItem.id).all()
+        if not lines:
+            return 0
+
+        # Все партии товаров документа - одним проходом по индексу (товар, срок)
+        queues = defaultdict(deque)
+        for lot in db.session.execute(select(StockLot.id, StockLot.product_id, StockLot.quantity
+                                             ).where(StockLot.product_id.in_(
+                                                 {line.product_id for line in lines}),
+                                                 StockLot.quantity > 0
+                                             ).order_by(StockLot.product_id,
+                                                        nulls_last(StockLot.expiry_date),
+                                                        StockLot.id)):
+            queues[lot.product_id].append([lot.id, lot.quantity])
+
+        allocations, taken = [], defaultdict(Decimal)
+        for line in lines:
+            need, queue = Decimal(line.quantity), queues.get(line.product_id)
+            while need > 0 and queue:
+                lot = queue[0]
+                quantity = min(need, lot[1])
+                allocations.append({'document_item_id': line.id, 'lot_id': lot[0],
+                                    'quantity': quantity})
+                taken[lot[0]] += quantity
+                need -= quantity
+                lot[1] -= quantity
+                if not lot[1]:
+                    queue.popleft()
+
+        _change_lots([{'lot_id': lot_id, 'delta': -quantity} for lot_id, quantity in taken.items()])
+        if allocations:
+            db.session.execute(LotAllocation.__table__.insert(), allocations)
+        return len(allocations)
+
+    @staticmethod
+    def release(documents):
+        """Возврат партий, списанных строками отменяемых расходов"""
+        items = select(DocumentItem.id).where(
+            DocumentItem.document_id.in_([document.id for document in documents]))
+        rows = db.session.query(LotAllocation.lot_id, func.sum(LotAllocation.quantity)
+                                ).filter(LotAllocation.document_item_id.in_(items)
+                                ).group_by(LotAllocation.lot_id).all()
+        if not rows:
+            return
+        _change_lots([{'lot_id': lot_id, 'delta': quantity} for lot_id, quantity in rows])
+        db.session.execute(delete(LotAllocation).where(LotAllocation.document_item_id.in_(items)))
+
+    @staticmethod
+    def expiring(days, today=None, category_id=0, limit=None):
+        """
+        Партии с остатком и сроком годности не позже today + days (включая
+        истекшие) по возрастанию срока. Выборка идет по частичному индексу
+        срока, поэтому limit ограничивает и чтение.
+        """
+        today = today or date.today()
+        query = db.session.query(
+            StockLot.id, StockLot.lot_number, StockLot.expiry_date, StockLot.quantity,
+            Product.id.label('product_id'), Product.article, Product.name, Product.unit,
+            Product.price
+        ).join(Product, StockLot.product_id == Product.id
+        ).filter(StockLot.quantity > 0, StockLot.expiry_date <= today + timedelta(days=days)
+        ).order_by(StockLot.expiry_date, StockLot.id)
+        if category_id:
+            query = query.filter(Product.category_id == category_id)
+        if limit:
+            query = query.limit(limit)
+        return [{
+            'id': row.id,
+            'product_id': row.product_id,
+            'article': row.article,
+            'name': row.name,
+            'unit': row.unit,
+            'lot_number': row.lot_number,
+            'expiry_date': row.expiry_date,
+            'days_left': (row.expiry_date - today).days,
+            'quantity': row.quantity,
+            'amount': row.quantity * row.price
+        } for row in query]
+
+    @staticmethod
+    def expiring_totals(days, today=None, category_id=0):
+        """Итоги по истекающим партиям: партий, сумма по ценам карточек"""
+        today = today or date.today()
+        query = db.session.query(func.count(StockLot.id),
+                                 func.coalesce(func.sum(StockLot.quantity * Product.price), 0)
+                                 ).join(Product, StockLot.product_id == Product.id
+                                 ).filter(StockLot.quantity > 0,
+                                          StockLot.expiry_date <= today + timedelta(days=days))
+        if category_id:
+            query = query.filter(Product.category_id == category_id)
+        lots, amount = query.one()
+        return {'lots': lots, 'amount': Decimal(str(amount))}
+
+    @staticmethod
+    def item_lots(document):
+        """Списанные партии по строкам документа: {document_item_id: [(партия, количество)]}"""
+        result = defaultdict(list)
+        for allocation in LotAllocation.query.join(
+                DocumentItem, LotAllocation.document_item_id == DocumentItem.id
+                ).filter(DocumentItem.document_id == document.id
+                ).options(db.joinedload(LotAllocation.lot)).order_by(LotAllocation.id):
+            result[allocation.document_item_id].append((allocation.lot, allocation.quantity))
+        return result
+
+
+def _change_lots(changes):
+    """Изменение остатков партий одним executemany UPDATE"""
+    if changes:
+        lots = StockLot.__table__
+        db.session.execute(update(lots).where(lots.c.id == bindparam('lot_id')).values(
+            quantity=lots.c.quantity + bindparam('delta')), changes)
+
+
+def _lot_title(row):
+    parts = [f'№{row.lot_number}' if row.lot_number else 'без номера']
+    if row.expiry_date:
+        parts.append(f'со сроком до {row.expiry_date:%d.%m.%Y}')
+    return ' '.join(parts)
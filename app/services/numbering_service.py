@@ -0,0 +1,48 @@
+from app import db
+from app.models import Document
+from datetime import datetime
+from sqlalchemy import Integer, cast, func
+
+
+class NumberingService:
+    """
+    Номера документов вида <код>-<ГГГГММ>-<порядковый номер>: следующий
+    номер - наибольший номер месяца плюс один, поэтому удаление черновика не
+    приводит к повтору. Номер уникален в БД; при параллельном создании
+    совпадение распознает is_conflict().
+    """
+
+    @staticmethod
+    def prefix(code):
+        """Префикс номеров текущего месяца: ПН-202401"""
+        return f'{code}-{datetime.now():%Y%m}'
+
+    @staticmethod
+    def last_number(prefix):
+        """Наибольший порядковый номер документа с префиксом prefix"""
+        last = db.session.query(func.max(cast(
+            func.substr(Document.doc_number, len(prefix) + 2), Integer)
+        )).filter(Document.doc_number.like(f'{prefix}-%')).scalar()
+        return last or 0
+
+    @staticmethod
+    def numbers(prefix, count=1, start=None):
+        """count номеров подряд после последнего (или начиная со start)"""
+        if start is None:
+            start = NumberingService.last_number(prefix) + 1
+        return [f'{prefix}-{number:04d}' for number in range(start, start + count)]
+
+    @staticmethod
+    def next_number(code):
+        """Следующий номер документа с кодом code за текущий месяц"""
+        return NumberingService.numbers(NumberingService.prefix(code))[0]
+
+    @staticmethod
+    def is_conflict(error):
+        """IntegrityError - нарушение уникальности номера документа"""
+        orig = error.orig
+        code = getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)
+        if code:  # PostgreSQL: unique_violation по ограничению номера
+            constraint = getattr(getattr(orig, 'diag', None), 'constraint_name', None) or ''
+            return code == '23505' and 'doc_number' in constraint
+        return 'UNIQUE constraint failed: documents.doc_number' in str(orig)
@@ -0,0 +1,128 @@
+from app import db
+from app.models import CellOccupancy, Product, StockBalance, WarehouseCell
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import and_, case, delete, exists, func, literal, or_, select
+
+
+class OccupancyService:
+    """
+    Вместимость и заполненность ячеек. Заполненность ведется в таблице
+    cell_occupancy: проведение пересчитывает строки затронутых ячеек
+    (refresh) в текущей транзакции, фиксирует изменения вызывающий код.
+    Подбор ячеек под товар (candidates) идет только по этой таблице.
+    """
+
+    @staticmethod
+    def refresh(cell_ids):
+        """Пересчет заполненности ячеек cell_ids по их остаткам: DELETE и INSERT ... SELECT"""
+        cell_ids = {cell_id for cell_id in cell_ids if cell_id is not None}
+        if not cell_ids:
+            return
+        db.session.execute(delete(CellOccupancy).where(CellOccupancy.cell_id.in_(cell_ids)))
+        _insert_usage(WarehouseCell.id.in_(cell_ids))
+
+    @staticmethod
+    def refresh_product(product_id):
+        """Пересчет ячеек, где лежит товар (после изменения его размеров)"""
+        OccupancyService.refresh(cell_id for cell_id, in db.session.query(
+            StockBalance.cell_id).filter(StockBalance.product_id == product_id))
+
+    @staticmethod
+    def rebuild():
+        """Полный пересчет таблицы cell_occupancy. Возвращает число ячеек"""
+        db.session.execute(delete(CellOccupancy))
+        result = _insert_usage(None)
+        db.session.commit()
+        return result.rowcount
+
+    @staticmethod
+    def utilization():
+        """
+        Заполненность всех ячеек одним сгруппированным запросом по остаткам:
+        [{cell, rows, slots, volume, weight, percent}], percent - наибольшая
+        доля занятой вместимости (None, если ограничений нет)
+        """
+        rows, slots, volume, weight = _usage_columns()
+        query = db.session.query(WarehouseCell, rows, slots, volume, weight
+                                 ).outerjoin(StockBalance, StockBalance.cell_id == WarehouseCell.id
+                                 ).outerjoin(Product, StockBalance.product_id == Product.id
+                                 ).group_by(WarehouseCell.id).order_by(WarehouseCell.name)
+        result = []
+        for cell, rows, slots, volume, weight in query:
+            volume, weight = Decimal(str(volume)), Decimal(str(weight))
+            shares = [Decimal(used) / limit for used, limit in
+                      ((volume, cell.max_volume), (weight, cell.max_weight),
+                       (slots, cell.max_slots)) if limit]
+            result.append({
+                'cell': cell,
+                'rows': rows,
+                'slots': slots,
+                'volume': volume,
+                'weight': weight,
+                'percent': float(max(shares)) * 100 if shares else None
+            })
+        return result
+
+    @staticmethod
+    def candidates(product, quantity, limit=20):
+        """
+        Ячейки, куда поместится еще quantity единиц товара: [(ячейка, заполненность)]
+        по возрастанию свободного объема (плотнее заполняются почти полные ячейки).
+        Новый товар занимает место; ячейка, где он уже лежит, места не тратит.
+        """
+        quantity = Decimal(str(quantity))
+        volume = quantity * (product.volume or 0)
+        weight = quantity * (product.weight or 0)
+        stored = exists().where(StockBalance.cell_id == CellOccupancy.cell_id,
+                                StockBalance.product_id == product.id,
+                                StockBalance.quantity > 0)
+        return db.session.query(WarehouseCell, CellOccupancy
+                                ).join(CellOccupancy, CellOccupancy.cell_id == WarehouseCell.id
+                                ).filter(or_(CellOccupancy.free_volume.is_(None),
+                                             CellOccupancy.free_volume >= volume),
+                                         or_(CellOccupancy.free_weight.is_(None),
+                                             CellOccupancy.free_weight >= weight),
+                                         or_(CellOccupancy.free_slots.is_(None),
+                                             CellOccupancy.free_slots > 0, stored)
+                                ).order_by(CellOccupancy.free_volume.is_(None),
+                                           CellOccupancy.free_volume, WarehouseCell.name
+                                ).limit(limit).all()
+
+
+def _usage_columns():
+    """Агрегаты по остаткам ячейки: строк, товаров с остатком, объем, вес"""
+    positive = StockBalance.quantity > 0
+    return (
+        func.count(StockBalance.id).label('rows'),
+        func.count(case((positive, StockBalance.product_id))).label('slots'),
+        func.coalesce(func.sum(case(
+            (positive, StockBalance.quantity * func.coalesce(Product.volume, 0)), else_=0)), 0
+        ).label('volume'),
+        func.coalesce(func.sum(case(
+            (positive, StockBalance.quantity * func.coalesce(Product.weight, 0)), else_=0)), 0
+        ).label('weight')
+    )
+
+
+def _insert_usage(condition):
+    """Вставка заполненности ячеек (всех или по условию) одним INSERT ... SELECT"""
+    _, slots, volume, weight = _usage_columns()
+    usage = select(WarehouseCell.id.label('cell_id'), slots, volume, weight
+                   ).outerjoin(StockBalance, and_(StockBalance.cell_id == WarehouseCell.id,
+                                                  StockBalance.quantity > 0)
+                   ).outerjoin(Product, StockBalance.product_id == Product.id
+                   ).group_by(WarehouseCell.id)
+    if condition is not None:
+        usage = usage.where(condition)
+    usage = usage.subquery('usage')
+    return db.session.execute(CellOccupancy.__table__.insert().from_select(
+        ['cell_id', 'volume', 'weight', 'slots', 'free_volume', 'free_weight', 'free_slots',
+         'updated_at'],
+        select(usage.c.cell_id, usage.c.volume, usage.c.weight, usage.c.slots,
+               WarehouseCell.max_volume - usage.c.volume,
+               WarehouseCell.max_weight - usage.c.weight,
+               WarehouseCell.max_slots - usage.c.slots,
+               literal(datetime.utcnow())
+               ).join(WarehouseCell, WarehouseCell.id == usage.c.cell_id)
+    ))
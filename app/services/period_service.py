@@ -0,0 +1,179 @@
+from app import db
+from app.models import (Product, Document, DocumentItem, ClosedPeriod, BalanceSnapshot,
+                        MOVEMENT_TYPES)
+from app.services.cell_movement_service import CellMovementService
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from flask import current_app
+from sqlalchemy import func, case
+
+CHUNK_SIZE = 5000
+
+
+class PeriodService:
+    """Закрытие месяцев: снимки остатков на конец месяца и запрет проведения"""
+
+    @staticmethod
+    def month_end(day):
+        """Последний день месяца, содержащего day"""
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+    @staticmethod
+    def last_closed(before=None):
+        """Дата конца последнего закрытого месяца (не позже before) или None"""
+        query = db.session.query(func.max(ClosedPeriod.period_end))
+        if before:
+            query = query.filter(ClosedPeriod.period_end <= before)
+        return query.scalar()
+
+    @staticmethod
+    def ensure_open(day):
+        """ValueError, если дата попадает в закрытый период"""
+        closed = PeriodService.last_closed()
+        if closed and day <= closed:
+            raise ValueError(f'Период по {closed:%d.%m.%Y} закрыт, '
+                             f'проведение документов от {day:%d.%m.%Y} запрещено')
+
+    @staticmethod
+    def close(period_end, workers=4, chunk_size=CHUNK_SIZE, progress=None):
+        """
+        Закрытие месяца: снимок остатков по (товар, ячейка) на period_end.
+        Основа - предыдущий снимок плюс движения после него. Товары
+        обрабатываются частями по chunk_size в workers потоках.
+        Возвращает количество строк снимка.
+        """
+        period_end = PeriodService.month_end(period_end)
+        if db.session.get(ClosedPeriod, period_end):
+            raise ValueError(f'Период по {period_end:%d.%m.%Y} уже закрыт')
+
+        base_end = PeriodService.last_closed(before=period_end)
+        low, high = db.session.query(func.min(Product.id), func.max(Product.id)).one()
+        chunks = [(start, start + chunk_size - 1)
+                  for start in range(low or 0, (high or -1) + 1, chunk_size)]
+
+        closed = ClosedPeriod(period_end=period_end)
+        db.session.add(closed)
+        db.session.flush()
+
+        rows_written = 0
+        for done, rows in enumerate(_map_chunks(chunks, base_end, period_end, workers), 1):
+            if rows:
+                db.session.execute(BalanceSnapshot.__table__.insert(), rows)
+            rows_written += len(rows)
+            if progress:
+                progress(done, len(chunks))
+
+        closed.snapshot_rows = rows_written
+        db.session.commit()
+        return rows_written
+
+    @staticmethod
+    def reopen(period_end):
+        """
+        Открытие месяца и всех последующих закрытых (их снимки строятся на
+        основе открываемого). Возвращает даты открытых периодов.
+        """
+        period_end = PeriodService.month_end(period_end)
+        ends = [row.period_end for row in ClosedPeriod.query.filter(
+            ClosedPeriod.period_end >= period_end).order_by(ClosedPeriod.period_end)]
+        if ends:
+            BalanceSnapshot.query.filter(BalanceSnapshot.period_end >= period_end
+                                         ).delete(synchronize_session=False)
+            ClosedPeriod.query.filter(ClosedPeriod.period_end >= period_end
+                                      ).delete(synchronize_session=False)
+            db.session.commit()
+        return ends
+
+    @staticmethod
+    def rebuild(period_end, workers=4, chunk_size=CHUNK_SIZE):
+        """Пересчет снимка месяца и всех последующих после изменения истории"""
+        ends = PeriodService.reopen(period_end) or [PeriodService.month_end(period_end)]
+        return sum(PeriodService.close(end, workers, chunk_size) for end in ends)
+
+    @staticmethod
+    def balance_at(product_id, day, cell_id=None):
+        """
+        Остаток товара на конец дня day (в ячейке cell_id или по всем ячейкам):
+        ближайший снимок не позже day плюс движения после него.
+        """
+        base_end = PeriodService.last_closed(before=day)
+        quantity = Decimal(0)
+        if base_end:
+            query = db.session.query(func.sum(BalanceSnapshot.quantity)).filter(
+                BalanceSnapshot.period_end == base_end,
+                BalanceSnapshot.product_id == product_id)
+            if cell_id is not None:
+                query = query.filter(BalanceSnapshot.cell_id == cell_id)
+            quantity = query.scalar() or Decimal(0)
+
+        if cell_id is not None:
+            return quantity + CellMovementService.balances(
+                base_end, day, DocumentItem.product_id == product_id
+            ).get((product_id, cell_id), Decimal(0))
+        movement = _movement_query(base_end, day).filter(
+            DocumentItem.product_id == product_id
+        ).with_entities(func.sum(_signed_quantity())).scalar() or 0
+        return quantity + Decimal(str(movement))
+
+
+def _signed_quantity():
+    return case((Document.doc_type == 'income', DocumentItem.quantity),
+                else_=-DocumentItem.quantity)
+
+
+def _movement_query(after, until):
+    """Строки проведенных документов с датой в (after, until]"""
+    query = db.session.query(DocumentItem).join(
+        Document, DocumentItem.document_id == Document.id
+    ).filter(Document.status == 'posted', Document.doc_type.in_(MOVEMENT_TYPES),
+             Document.doc_date <= until)
+    if after:
+        query = query.filter(Document.doc_date > after)
+    return query
+
+
+def _map_chunks(chunks, base_end, period_end, workers):
+    """Расчет частей в потоках; у каждого потока свой контекст и сессия"""
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield _chunk_rows(chunk, base_end, period_end)
+        return
+
+    app = current_app._get_current_object()
+
+    def run(chunk):
+        with app.app_context():
+            try:
+                return _chunk_rows(chunk, base_end, period_end)
+            finally:
+                db.session.remove()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='period-close') as pool:
+        yield from pool.map(run, chunks)
+
+
+def _chunk_rows(chunk, base_end, period_end):
+    """Строки снимка для товаров с id в диапазоне chunk"""
+    low, high = chunk
+    balances = {}
+    if base_end:
+        for row in BalanceSnapshot.query.filter(
+                BalanceSnapshot.period_end == base_end,
+                BalanceSnapshot.product_id.between(low, high)):
+            balances[(row.product_id, row.cell_id)] = row.quantity
+
+    movements = CellMovementService.balances(base_end, period_end,
+                                             DocumentItem.product_id.between(low, high))
+    for key, quantity in movements.items():
+        balances[key] = balances.get(key, 0) + quantity
+
+    prices = dict(db.session.query(Product.id, Product.price).filter(
+        Product.id.between(low, high)))
+    return [{
+        'period_end': period_end,
+        'product_id': product_id,
+        'cell_id': cell_id,
+        'quantity': quantity,
+        'value': quantity * (prices.get(product_id) or 0)
+    } for (product_id, cell_id), quantity in sorted(balances.items()) if quantity]
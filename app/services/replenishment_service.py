@@ -0,0 +1,288 @@
+from app import db
+from app.analytics import get_store, day_number
+from app.models import Product, Supplier, StockBalance, Document, DocumentItem
+from app.services.numbering_service import NumberingService
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from statistics import NormalDist
+import numpy as np
+
+
+class ReplenishmentService:
+    """
+    Точки заказа и рекомендуемые закупки.
+    Спрос - среднее и отклонение дневного расхода за REPLENISHMENT_LOOKBACK_DAYS,
+    срок поставки - время от создания до проведения приходов поставщика.
+    Страховой запас: z * sqrt(LT * sd^2 + d^2 * sLT^2), точка заказа: d * LT + страховой
+    запас, заказ - до точки заказа плюс спрос на REPLENISHMENT_REVIEW_DAYS.
+    """
+
+    @staticmethod
+    def plan(today=None):
+        """
+        Расчет по всем товарам: словарь массивов product_id, supplier_id, price,
+        daily_demand, demand_std, lead_time, lead_time_std, safety_stock,
+        reorder_point, on_hand, on_order, order_quantity
+        """
+        today = today or date.today()
+        config = current_app.config
+
+        products = db.session.query(Product.id, Product.supplier_id, Product.price
+                                    ).order_by(Product.id).all()
+        product_ids = np.array([row.id for row in products], dtype=np.int64)
+        supplier_ids = np.array([row.supplier_id or 0 for row in products], dtype=np.int64)
+        prices = np.array([float(row.price or 0) for row in products])
+
+        store = get_store()
+        points = _reorder_points(store, product_ids, supplier_ids, today)
+        daily_demand, reorder_point = points['daily_demand'], points['reorder_point']
+
+        on_hand = _align(product_ids, *_sum_by_product(
+            db.session.query(StockBalance.product_id, func.sum(StockBalance.quantity)
+                             ).group_by(StockBalance.product_id)))
+        on_order = _align(product_ids, *_sum_by_product(
+            db.session.query(DocumentItem.product_id, func.sum(DocumentItem.quantity)
+                             ).join(Document, DocumentItem.document_id == Document.id
+                             ).filter(Document.doc_type == 'income', Document.status == 'draft'
+                             ).group_by(DocumentItem.product_id)))
+
+        position = on_hand + on_order
+        target = reorder_point + daily_demand * config['REPLENISHMENT_REVIEW_DAYS']
+        order_quantity = np.where((daily_demand > 0) & (position <= reorder_point),
+                                  np.ceil(np.maximum(target - position, 0)), 0)
+
+        return dict(
+            points,
+            product_id=product_ids,
+            supplier_id=supplier_ids,
+            price=prices,
+            on_hand=on_hand,
+            on_order=on_order,
+            order_quantity=order_quantity
+        )
+
+    @staticmethod
+    def lead_times(today=None):
+        """
+        Срок поставки по поставщикам {supplier_id: (среднее, отклонение)} в днях:
+        от создания до проведения приходов за REPLENISHMENT_LOOKBACK_DAYS
+        """
+        today = today or date.today()
+        config = current_app.config
+        since = datetime.combine(today - timedelta(days=config['REPLENISHMENT_LOOKBACK_DAYS']),
+                                 datetime.min.time())
+        rows = db.session.query(Document.supplier_id, Document.created_at, Document.posted_at
+                                ).filter(Document.doc_type == 'income',
+                                         Document.status == 'posted',
+                                         Document.supplier_id.isnot(None),
+                                         Document.created_at.isnot(None),
+                                         Document.posted_at >= since).all()
+        if not rows:
+            return {}
+
+        suppliers = np.array([row.supplier_id for row in rows], dtype=np.int64)
+        days = np.array([(row.posted_at - row.created_at).total_seconds() / 86400
+                         for row in rows])
+        days = np.maximum(days, config['REPLENISHMENT_MIN_LEAD_TIME'])
+        ids, inverse = np.unique(suppliers, return_inverse=True)
+        count = np.bincount(inverse)
+        mean = np.bincount(inverse, days) / count
+        variance = np.maximum(np.bincount(inverse, days * days) / count - mean * mean, 0)
+        return {int(supplier): (float(mean[index]), float(np.sqrt(variance[index])))
+                for index, supplier in enumerate(ids)}
+
+    @staticmethod
+    def low_stock(limit=5, today=None):
+        """
+        Товары с остатком не выше точки заказа, по возрастанию запаса в днях.
+        Считается только по товарам со спросом: их точки заказа кэшируются в
+        хранилище движений до его изменения, остатки читаются по этим товарам.
+        """
+        today = today or date.today()
+        store = get_store()
+        product_ids, daily_demand, reorder_point = store.cached(
+            ('demand_reorder_points', today, current_app.config['REPLENISHMENT_LOOKBACK_DAYS']),
+            lambda: _demand_reorder_points(store, today))
+        if not len(product_ids):
+            return []
+
+        on_hand = _align(product_ids, *_sum_by_product(
+            db.session.query(StockBalance.product_id, func.sum(StockBalance.quantity)
+                             ).filter(StockBalance.product_id.in_(product_ids.tolist())
+                             ).group_by(StockBalance.product_id)))
+        below = np.flatnonzero(on_hand <= reorder_point)
+        cover = on_hand[below] / daily_demand[below]
+        selected = below[np.argsort(cover, kind='stable')[:limit]]
+
+        products = {product.id: product for product in Product.query.filter(
+            Product.id.in_(product_ids[selected].tolist()))}
+        return [{
+            'id': int(product_ids[index]),
+            'name': products[int(product_ids[index])].name,
+            'article': products[int(product_ids[index])].article,
+            'quantity': float(on_hand[index]),
+            'reorder_point': round(float(reorder_point[index]), 2)
+        } for index in selected]
+
+    @staticmethod
+    def suggestions():
+        """Рекомендуемые заказы по поставщикам: [(supplier или None, [строки])]"""
+        plan = ReplenishmentService.plan()
+        selected = np.flatnonzero(plan['order_quantity'] > 0)
+        if not len(selected):
+            return []
+
+        products = {product.id: product for product in Product.query.filter(
+            Product.id.in_(plan['product_id'][selected].tolist()))}
+        suppliers = {supplier.id: supplier for supplier in Supplier.query.filter(
+            Supplier.id.in_(np.unique(plan['supplier_id'][selected]).tolist()))}
+
+        groups = {}
+        for index in selected:
+            product = products[int(plan['product_id'][index])]
+            quantity = float(plan['order_quantity'][index])
+            groups.setdefault(int(plan['supplier_id'][index]), []).append({
+                'id': product.id,
+                'article': product.article,
+                'name': product.name,
+                'unit': product.unit,
+                'on_hand': float(plan['on_hand'][index]),
+                'on_order': float(plan['on_order'][index]),
+                'daily_demand': round(float(plan['daily_demand'][index]), 3),
+                'lead_time': round(float(plan['lead_time'][index]), 1),
+                'safety_stock': round(float(plan['safety_stock'][index]), 2),
+                'reorder_point': round(float(plan['reorder_point'][index]), 2),
+                'order_quantity': quantity,
+                'price': float(plan['price'][index]),
+                'total': quantity * float(plan['price'][index])
+            })
+
+        result = []
+        for supplier_id, rows in groups.items():
+            rows.sort(key=lambda row: row['name'])
+            result.append((suppliers.get(supplier_id), rows))
+        result.sort(key=lambda group: group[0].name if group[0] else '')
+        return result
+
+    @staticmethod
+    def create_orders(supplier_ids, author_id=None):
+        """
+        Черновики приходов по рекомендациям для выбранных поставщиков
+        (0 - товары без поставщика). Возвращает созданные документы.
+        """
+        selected = set(supplier_ids)
+        groups = [(supplier, rows) for supplier, rows in ReplenishmentService.suggestions()
+                  if (supplier.id if supplier else 0) in selected]
+        if not groups:
+            return []
+
+        today = datetime.now()
+        numbers = NumberingService.numbers(NumberingService.prefix('ПН'), len(groups))
+
+        documents = []
+        for number, (supplier, rows) in zip(numbers, groups):
+            document = Document(
+                doc_type='income',
+                doc_number=number,
+                doc_date=today.date(),
+                supplier_id=supplier.id if supplier else None,
+                author_id=author_id,
+                comment='Создан по рекомендациям пополнения',
+                status='draft'
+            )
+            db.session.add(document)
+            db.session.flush()
+            db.session.execute(DocumentItem.__table__.insert(), [{
+                'document_id': document.id,
+                'product_id': row['id'],
+                'quantity': row['order_quantity'],
+                'price': row['price']
+            } for row in rows])
+            documents.append(document)
+        db.session.commit()
+        return documents
+
+
+def _daily_demand(store, date_from, date_to):
+    """Среднее и отклонение дневного расхода по товарам (дни без расхода - нули)"""
+    days = (date_to - date_from).days + 1
+    mask = store.mask(date_from, date_to) & (store.direction == -1)
+    ids, inverse = np.unique(store.product_id[mask], return_inverse=True)
+    keys, key_inverse = np.unique(
+        inverse.astype(np.int64) * days + (day_number(date_to) - store.day[mask]),
+        return_inverse=True
+    )
+    daily = np.bincount(key_inverse, store.weight[mask] * store.quantity[mask], len(keys))
+    owner = keys // days
+    mean = np.bincount(owner, daily, len(ids)) / days
+    variance = np.maximum(np.bincount(owner, daily * daily, len(ids)) / days - mean * mean, 0)
+    return ids.astype(np.int64), mean, np.sqrt(variance)
+
+
+def _daily_demand_cached(store, today):
+    """Дневной спрос за REPLENISHMENT_LOOKBACK_DAYS по сегодня (кэш хранилища движений)"""
+    lookback = current_app.config['REPLENISHMENT_LOOKBACK_DAYS']
+    return store.cached(
+        ('daily_demand', today, lookback),
+        lambda: _daily_demand(store, today - timedelta(days=lookback - 1), today)
+    )
+
+
+def _reorder_points(store, product_ids, supplier_ids, today):
+    """
+    Спрос, срок поставки, страховой запас и точка заказа товаров product_ids
+    (поставщики supplier_ids): словарь массивов
+    """
+    config = current_app.config
+    demand_ids, mean, std = _daily_demand_cached(store, today)
+    daily_demand = _align(product_ids, demand_ids, mean)
+    demand_std = _align(product_ids, demand_ids, std)
+
+    lead_times = ReplenishmentService.lead_times(today)
+    default = (float(config['REPLENISHMENT_DEFAULT_LEAD_TIME']), 0.0)
+    lead_time = np.array([lead_times.get(supplier, default)[0] for supplier in supplier_ids])
+    lead_time_std = np.array([lead_times.get(supplier, default)[1]
+                              for supplier in supplier_ids])
+
+    z = NormalDist().inv_cdf(config['REPLENISHMENT_SERVICE_LEVEL'])
+    safety_stock = z * np.sqrt(lead_time * demand_std ** 2
+                               + daily_demand ** 2 * lead_time_std ** 2)
+    return {
+        'daily_demand': daily_demand,
+        'demand_std': demand_std,
+        'lead_time': lead_time,
+        'lead_time_std': lead_time_std,
+        'safety_stock': safety_stock,
+        'reorder_point': daily_demand * lead_time + safety_stock
+    }
+
+
+def _demand_reorder_points(store, today):
+    """Товары со спросом за период, их дневной спрос и точки заказа"""
+    demand_ids, mean, _ = _daily_demand_cached(store, today)
+    demand_ids = demand_ids[mean > 0]
+    products = db.session.query(Product.id, Product.supplier_id).filter(
+        Product.id.in_(demand_ids.tolist())).order_by(Product.id).all()
+    if not products:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    product_ids = np.array([row.id for row in products], dtype=np.int64)
+    supplier_ids = np.array([row.supplier_id or 0 for row in products], dtype=np.int64)
+    points = _reorder_points(store, product_ids, supplier_ids, today)
+    return product_ids, points['daily_demand'], points['reorder_point']
+
+
+def _sum_by_product(query):
+    rows = query.all()
+    return (np.array([row[0] for row in rows], dtype=np.int64),
+            np.array([float(row[1] or 0) for row in rows]))
+
+
+def _align(product_ids, ids, values):
+    """Значения values (по ids) в порядке product_ids, отсутствующие - 0"""
+    result = np.zeros(len(product_ids))
+    if len(ids):
+        position = np.minimum(np.searchsorted(product_ids, ids), len(product_ids) - 1)
+        found = product_ids[position] == ids
+        result[position[found]] = values[found]
+    return result
@@ -0,0 +1,288 @@
+from app import db
+from app.models import Product, Category, StockBalance, DailyProductTurnover
+from datetime import datetime, timedelta
+from flask import current_app
+from app.services.bucket_service import BucketService
+from sqlalchemy import func, case
+import csv
+import numpy as np
+
+PERIOD_DAYS = {'week': 7, 'month': 30, 'quarter': 90, 'year': 365}
+
+# Детализация графика оборота для периода отчета
+PERIOD_GRANULARITY = {'week': 'day', 'month': 'week', 'quarter': 'month', 'year': 'month'}
+
+STOCK_CSV_HEADER = ['Артикул', 'Наименование', 'Категория', 'Ед.изм.',
+                    'Количество', 'Цена', 'Сумма']
+TURNOVER_CSV_HEADER = ['Артикул', 'Наименование', 'Категория', 'Ед.изм.',
+                       'Кол-во', 'Сумма', 'Кол-во операций']
+
+MONTH_NAMES = ['Янв', 'Фев', 'Мар', 'Апр', 'Май', 'Июн',
+               'Июл', 'Авг', 'Сен', 'Окт', 'Ноя', 'Дек']
+
+
+class ReportService:
+    """Сервис построения данных для отчетов и выгрузок"""
+
+    @staticmethod
+    def period_start(period):
+        """Дата начала периода (week, month, quarter, year) относительно сегодня"""
+        days = PERIOD_DAYS.get(period, PERIOD_DAYS['month'])
+        return datetime.now().date() - timedelta(days=days)
+
+    @staticmethod
+    def product_info(product_ids=None, category_id=0):
+        """Реквизиты товаров для строк отчета: {id: {...}} с учетом фильтра по категории"""
+        query = db.session.query(
+            Product.id, Product.article, Product.name, Category.name.label('category_name'),
+            Product.unit
+        ).join(Category, Product.category_id == Category.id, isouter=True)
+        if category_id:
+            query = query.filter(Product.category_id == category_id)
+        if product_ids is not None and len(product_ids) <= 500:
+            query = query.filter(Product.id.in_([int(product_id) for product_id in product_ids]))
+        return {row.id: {
+            'id': row.id,
+            'article': row.article,
+            'name': row.name,
+            'category': row.category_name or '-',
+            'unit': row.unit
+        } for row in query}
+
+    @staticmethod
+    def previous_range(date_from, date_to):
+        """Предыдущий период той же длины, заканчивающийся накануне date_from"""
+        length = date_to - date_from
+        previous_to = date_from - timedelta(days=1)
+        return previous_to - length, previous_to
+
+    @staticmethod
+    def turnover_rows(start_date, category_id=0, end_date=None):
+        """
+        Оборот по товарам с даты start_date: в памяти (ANALYTICS_BACKEND=numpy)
+        или из агрегата daily_product_turnover
+        """
+        if _numpy_backend():
+            from app.analytics import get_store
+
+            grouped = get_store().by_product(start_date, end_date)
+            products = ReportService.product_info(grouped['product_id'], category_id)
+            rows = []
+            for index in np.flatnonzero(np.isin(grouped['product_id'], list(products))):
+                row = dict(products[int(grouped['product_id'][index])])
+                row.update(total_quantity=float(grouped['quantity'][index]),
+                           total_sum=float(grouped['amount'][index]),
+                           operations_count=int(grouped['operations'][index]))
+                rows.append(row)
+            return sorted(rows, key=lambda row: row['name'])
+
+        turnover = db.session.query(
+            DailyProductTurnover.product_id,
+            func.sum(DailyProductTurnover.quantity).label('total_quantity'),
+            func.sum(DailyProductTurnover.total_sum).label('total_sum'),
+            func.sum(DailyProductTurnover.operations).label('operations_count')
+        ).filter(DailyProductTurnover.day >= start_date)
+        if end_date:
+            turnover = turnover.filter(DailyProductTurnover.day <= end_date)
+        turnover = turnover.group_by(DailyProductTurnover.product_id).subquery()
+
+        query = db.session.query(
+            Product.id,
+            Product.article,
+            Product.name,
+            Category.name.label('category_name'),
+            Product.unit,
+            turnover.c.total_quantity,
+            turnover.c.total_sum,
+            turnover.c.operations_count
+        ).join(turnover, Product.id == turnover.c.product_id
+        ).join(Category, Product.category_id == Category.id, isouter=True
+        )
+
+        if category_id:
+            query = query.filter(Product.category_id == category_id)
+
+        query = query.order_by(Product.name)
+
+        return [{
+            'id': row.id,
+            'article': row.article,
+            'name': row.name,
+            'category': row.category_name or '-',
+            'unit': row.unit,
+            'total_quantity': float(row.total_quantity or 0),
+            'total_sum': float(row.total_sum or 0),
+            'operations_count': int(row.operations_count or 0)
+        } for row in query.all()]
+
+    @staticmethod
+    def turnover_comparison(date_from, date_to, category_id=0):
+        """
+        Оборот по товарам за [date_from, date_to] в сравнении с предыдущим
+        периодом той же длины. Оба периода и разница считаются одним
+        запросом: условная агрегация по дате внутри общего диапазона.
+        """
+        previous_from, _ = ReportService.previous_range(date_from, date_to)
+        if _numpy_backend():
+            return _comparison_from_store(date_from, date_to, previous_from, category_id)
+
+        is_current = DailyProductTurnover.day >= date_from
+
+        def current(column):
+            return func.sum(case((is_current, column), else_=0))
+
+        def previous(column):
+            return func.sum(case((is_current, 0), else_=column))
+
+        query = db.session.query(
+            Product.id,
+            Product.article,
+            Product.name,
+            Category.name.label('category_name'),
+            Product.unit,
+            current(DailyProductTurnover.quantity).label('quantity'),
+            previous(DailyProductTurnover.quantity).label('prev_quantity'),
+            current(DailyProductTurnover.total_sum).label('total_sum'),
+            previous(DailyProductTurnover.total_sum).label('prev_total_sum'),
+            current(DailyProductTurnover.operations).label('operations'),
+            previous(DailyProductTurnover.operations).label('prev_operations'),
+            (current(DailyProductTurnover.quantity)
+             - previous(DailyProductTurnover.quantity)).label('delta_quantity'),
+            (current(DailyProductTurnover.total_sum)
+             - previous(DailyProductTurnover.total_sum)).label('delta_sum')
+        ).join(DailyProductTurnover, DailyProductTurnover.product_id == Product.id
+        ).join(Category, Product.category_id == Category.id, isouter=True
+        ).filter(DailyProductTurnover.day >= previous_from,
+                 DailyProductTurnover.day <= date_to)
+
+        if category_id:
+            query = query.filter(Product.category_id == category_id)
+
+        query = query.group_by(Product.id, Category.name).order_by(Product.name)
+
+        return [_comparison_row({
+            'id': row.id,
+            'article': row.article,
+            'name': row.name,
+            'category': row.category_name or '-',
+            'unit': row.unit
+        }, row.quantity, row.prev_quantity, row.total_sum, row.prev_total_sum,
+            row.operations, row.prev_operations, row.delta_quantity, row.delta_sum)
+            for row in query.all()]
+
+    @staticmethod
+    def turnover_chart(date_from, date_to, granularity):
+        """Точки графика оборота (labels, values) по календарным интервалам"""
+        series = BucketService.turnover_series(date_from, date_to, granularity)
+        labels = [_bucket_label(bucket['start'], granularity) for bucket in series]
+        return labels, [bucket['total_sum'] for bucket in series]
+
+    @staticmethod
+    def stock_rows():
+        """Товары в наличии с суммарным остатком по всем ячейкам"""
+        rows = []
+        for product in Product.query.all():
+            total = db.session.query(func.sum(StockBalance.quantity)).filter_by(
+                product_id=product.id
+            ).scalar() or 0
+
+            if total > 0:
+                rows.append({
+                    'id': product.id,
+                    'article': product.article,
+                    'name': product.name,
+                    'category': product.category.name if product.category else '-',
+                    'unit': product.unit,
+                    'total_quantity': float(total),
+                    'avg_price': float(product.price),
+                    'total_value': float(total * product.price)
+                })
+        return rows
+
+    @staticmethod
+    def write_stock_csv(output, progress=None):
+        """Запись выгрузки остатков в CSV"""
+        writer = csv.writer(output, delimiter=';')
+        writer.writerow(STOCK_CSV_HEADER)
+        rows = ReportService.stock_rows()
+        for number, row in enumerate(rows, 1):
+            writer.writerow([
+                row['article'],
+                row['name'],
+                row['category'],
+                row['unit'],
+                row['total_quantity'],
+                row['avg_price'],
+                row['total_value']
+            ])
+            _report_progress(progress, number, len(rows))
+
+    @staticmethod
+    def write_turnover_csv(output, start_date, end_date=None, category_id=0, progress=None):
+        """Запись выгрузки оборота за диапазон дат в CSV"""
+        writer = csv.writer(output, delimiter=';')
+        writer.writerow(TURNOVER_CSV_HEADER)
+        rows = ReportService.turnover_rows(start_date, category_id, end_date)
+        for number, row in enumerate(rows, 1):
+            writer.writerow([
+                row['article'],
+                row['name'],
+                row['category'],
+                row['unit'],
+                row['total_quantity'],
+                row['total_sum'],
+                row['operations_count']
+            ])
+            _report_progress(progress, number, len(rows))
+
+
+def _numpy_backend():
+    return current_app.config['ANALYTICS_BACKEND'] == 'numpy'
+
+
+def _comparison_from_store(date_from, date_to, previous_from, category_id):
+    from app.analytics import get_store
+
+    compared = get_store().compare(date_from, date_to, previous_from)
+    products = ReportService.product_info(compared['product_id'], category_id)
+    rows = []
+    for index, product_id in enumerate(compared['product_id'].tolist()):
+        if product_id in products:
+            rows.append(_comparison_row(dict(products[product_id]), *(
+                compared[key][index] for key in (
+                    'quantity', 'prev_quantity', 'amount', 'prev_amount', 'operations',
+                    'prev_operations', 'delta_quantity', 'delta_amount'))))
+    return sorted(rows, key=lambda row: row['name'])
+
+
+def _comparison_row(row, quantity, prev_quantity, total_sum, prev_total_sum,
+                    operations, prev_operations, delta_quantity, delta_sum):
+    prev_total_sum = float(prev_total_sum or 0)
+    delta_sum = float(delta_sum or 0)
+    row.update({
+        'quantity': float(quantity or 0),
+        'prev_quantity': float(prev_quantity or 0),
+        'total_sum': float(total_sum or 0),
+        'prev_total_sum': prev_total_sum,
+        'operations': int(operations or 0),
+        'prev_operations': int(prev_operations or 0),
+        'delta_quantity': float(delta_quantity or 0),
+        'delta_sum': delta_sum,
+        'delta_sum_percent': delta_sum / prev_total_sum * 100 if prev_total_sum else None
+    })
+    return row
+
+
+def _bucket_label(start, granularity):
+    if granularity == 'day':
+        return start.strftime('%d.%m')
+    if granularity == 'week':
+        year, week, _ = start.isocalendar()
+        return f'Неделя {week}, {year}'
+    return f'{MONTH_NAMES[start.month - 1]} {start.year}'
+
+
+def _report_progress(progress, done, total, step=1000):
+    """Сообщение о прогрессе каждые step строк и в конце"""
+    if progress is not None and (done % step == 0 or done == total):
+        progress(done, total)
@@ -0,0 +1,333 @@
+from app import db
+from app.models import DocumentItem, Product, ServiceLease, StockBalance, StockReservation
+from app.services.cell_movement_service import CellMovementService
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from flask import current_app
+from sqlalchemy import bindparam, delete, func, select, tuple_, update
+import logging
+import os
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+SWEEPER_LEASE = 'reservation-sweeper'
+
+
+class ReservationService:
+    """
+    Резервы товара черновиками расхода. Количество товара распределяется по
+    свободному остатку всех его ячеек (allocate), резерв увеличивает
+    stock_balances.reserved ячеек условным UPDATE ... WHERE available >= количество,
+    поэтому два черновика не займут одни и те же единицы; свободный остаток
+    available = quantity - reserved вычисляет сама БД. Резерв действует
+    RESERVATION_HOURS часов, просроченные снимает expire() (ReservationSweeper
+    или flask documents expire-reservations).
+    """
+
+    @staticmethod
+    def reserve(document, now=None):
+        """
+        Резерв товаров черновика расхода вместо прежнего: (успех, сообщение).
+        Резервируется весь документ или ничего; прежний резерв снимается в
+        любом случае. Фиксирует транзакцию.
+        """
+        if not document.is_draft() or document.doc_type != 'expense':
+            raise ValueError('Резервируются только черновики расхода')
+
+        now = now or datetime.utcnow()
+        try:
+            _release(StockReservation.document_id == document.id)
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            return False, str(e)
+
+        totals = db.session.query(DocumentItem.product_id, func.sum(DocumentItem.quantity)
+                                  ).filter(DocumentItem.document_id == document.id
+                                  ).group_by(DocumentItem.product_id).all()
+        if not totals:
+            return False, 'В документе нет строк'
+
+        expires_at = ReservationService.reserve_lines(
+            [(document.id, product_id, quantity) for product_id, quantity in totals], now)
+        if expires_at is None:
+            db.session.rollback()
+            return False, _shortage(totals)
+        db.session.commit()
+        return True, f'Товар зарезервирован до {expires_at:%d.%m.%Y %H:%M}'
+
+    @staticmethod
+    def reserve_lines(lines, now=None):
+        """
+        Резерв строк (документ, товар, количество) в текущей транзакции:
+        строки распределяются по ячейкам (allocate), затем один условный
+        UPDATE на ячейку товара и одна вставка резервов. Возвращает срок
+        резерва или None, если какого-то товара не хватило - тогда транзакцию
+        откатывает вызывающий код.
+        """
+        allocation = ReservationService.allocate(lines)
+        if allocation is None or not ReservationService.take(allocation, 'reserved'):
+            return None
+
+        now = now or datetime.utcnow()
+        expires_at = now + timedelta(hours=current_app.config['RESERVATION_HOURS'])
+        db.session.execute(StockReservation.__table__.insert(), [
+            {'document_id': document_id, 'product_id': product_id, 'cell_id': cell_id,
+             'quantity': quantity, 'created_at': now, 'expires_at': expires_at}
+            for document_id, product_id, cell_id, quantity in allocation])
+        return expires_at
+
+    @staticmethod
+    def allocate(lines, prefer=None):
+        """
+        Распределение строк (ключ, товар, количество) по свободному остатку
+        ячеек товара одним запросом: сначала ячейки prefer {товар: [ячейки]},
+        затем ячейка проведения, затем ячейки с большим свободным остатком.
+        Возвращает [(ключ, товар, ячейка, количество)] или None, если
+        свободного остатка не хватает.
+        """
+        from app.services.stock_service import DEFAULT_CELL_ID
+
+        lines = [(key, product_id, Decimal(str(quantity)))
+                 for key, product_id, quantity in lines if quantity > 0]
+        if not lines:
+            return []
+        prefer = prefer or {}
+        free = defaultdict(list)
+        for product_id, cell_id, available in db.session.query(
+                StockBalance.product_id, StockBalance.cell_id, StockBalance.available
+        ).filter(StockBalance.product_id.in_({product_id for _, product_id, _ in lines}),
+                 StockBalance.available > 0):
+            free[product_id].append([cell_id, Decimal(str(available))])
+        for product_id, cells in free.items():
+            preferred = prefer.get(product_id, [])
+            cells.sort(key=lambda cell: (cell[0] not in preferred, cell[0] != DEFAULT_CELL_ID,
+                                         -cell[1], cell[0]))
+
+        allocation = []
+        for key, product_id, quantity in lines:
+            for cell in free[product_id]:
+                if not quantity:
+                    break
+                taken = min(cell[1], quantity)
+                if taken:
+                    cell[1] -= taken
+                    quantity -= taken
+                    allocation.append((key, product_id, cell[0], taken))
+            if quantity:
+                return None
+        return allocation
+
+    @staticmethod
+    def take(allocation, column):
+        """
+        Условное изменение остатков ячеек на распределенное allocate():
+        column='reserved' - резерв, 'quantity' - списание. Один UPDATE на
+        ячейку товара с условием available >= количество; False - остаток
+        изменился параллельно, транзакцию откатывает вызывающий код.
+        Списание записывается в движения ячеек по строкам документа - ключам
+        allocation.
+        """
+        totals = defaultdict(Decimal)
+        for _, product_id, cell_id, quantity in allocation:
+            totals[(product_id, cell_id)] += quantity
+        if not totals:
+            return True
+        balances = StockBalance.__table__
+        if column == 'reserved':
+            value = balances.c.reserved + bindparam('need')
+        else:
+            value = balances.c.quantity - bindparam('need')
+        result = db.session.execute(update(balances).where(
+            balances.c.product_id == bindparam('p_id'), balances.c.cell_id == bindparam('c_id'),
+            balances.c.available >= bindparam('need')
+        ).values({column: value}), [
+            {'p_id': product_id, 'c_id': cell_id, 'need': quantity}
+            for (product_id, cell_id), quantity in totals.items()])
+        if result.rowcount != len(totals):
+            return False
+        if column == 'quantity':
+            CellMovementService.record([(item_id, cell_id, -quantity)
+                                        for item_id, _, cell_id, quantity in allocation])
+        return True
+
+    @staticmethod
+    def release(documents):
+        """Снятие резервов документов в текущей транзакции (проведение, удаление)"""
+        _release(StockReservation.document_id.in_([document.id for document in documents]))
+
+    @staticmethod
+    def release_cells(pairs):
+        """
+        Снятие в текущей транзакции резервов документов, занимающих товары
+        pairs [(товар, ячейка)], - когда остаток ячейки стал меньше резерва.
+        Возвращает id документов.
+        """
+        if not pairs:
+            return set()
+        documents = select(StockReservation.document_id).where(
+            tuple_(StockReservation.product_id, StockReservation.cell_id).in_(pairs))
+        return _release(StockReservation.document_id.in_(documents))
+
+    @staticmethod
+    def expire(now=None):
+        """Снятие просроченных резервов. Возвращает число документов"""
+        now = now or datetime.utcnow()
+        try:
+            documents = _release(StockReservation.expires_at <= now)
+            db.session.commit()
+        except ValueError:
+            db.session.rollback()  # Те же резервы снял другой процесс
+            return 0
+        return len(documents)
+
+    @staticmethod
+    def document_reserved(document):
+        """Резерв документа по товарам: {product_id: количество}"""
+        return dict(db.session.query(StockReservation.product_id,
+                                     func.sum(StockReservation.quantity)
+                                     ).filter(StockReservation.document_id == document.id
+                                     ).group_by(StockReservation.product_id).all())
+
+    @staticmethod
+    def reserved_until(document):
+        """Срок резерва документа или None, если резерва нет"""
+        return db.session.query(func.min(StockReservation.expires_at)).filter(
+            StockReservation.document_id == document.id).scalar()
+
+    @staticmethod
+    def document_cells(document):
+        """Ячейки резерва документа по товарам: {product_id: [cell_id]}"""
+        cells = defaultdict(list)
+        for product_id, cell_id in db.session.query(
+                StockReservation.product_id, StockReservation.cell_id
+        ).filter(StockReservation.document_id == document.id).distinct():
+            cells[product_id].append(cell_id)
+        return dict(cells)
+
+    @staticmethod
+    def available(product_ids=None):
+        """Свободный остаток товаров по всем ячейкам: {product_id: количество}"""
+        query = db.session.query(StockBalance.product_id, func.sum(StockBalance.available)
+                                 ).group_by(StockBalance.product_id)
+        if product_ids is not None:
+            query = query.filter(StockBalance.product_id.in_(list(product_ids)))
+        return dict(query.all())
+
+
+class ReservationSweeper:
+    """
+    Фоновый поток процесса, снимающий просроченные резервы раз в
+    RESERVATION_SWEEP_INTERVAL секунд. Запускается при первом запросе
+    каждого процесса, но снимает резервы только процесс, держащий аренду
+    service_leases (acquire): при нескольких процессах работает один, а
+    после его остановки аренду через 3 интервала забирает другой. В тестах
+    (app.testing) не запускается - там вызывается expire().
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.holder = f'{socket.gethostname()}:{os.getpid()}'
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['reservation_sweeper'] = self
+        app.before_request(self._start_once)
+
+    def stop(self):
+        self._stop.set()
+
+    def acquire(self, interval, now=None):
+        """
+        Взятие или продление аренды на 3 интервала в отдельной транзакции:
+        True, если аренда свободна, истекла или уже принадлежит процессу.
+        Условный UPDATE (или вставка, если строки нет) выполняется атомарно,
+        поэтому аренду получит один процесс.
+        """
+        from app.services.stock_service import dialect_insert
+
+        now = now or datetime.utcnow()
+        expires_at = now + timedelta(seconds=3 * interval)
+        table = ServiceLease.__table__
+        result = db.session.execute(table.update().where(
+            table.c.name == SWEEPER_LEASE,
+            (table.c.holder == self.holder) | (table.c.expires_at <= now)
+        ).values(holder=self.holder, expires_at=expires_at))
+        if not result.rowcount:
+            statement = dialect_insert(db.session.get_bind().dialect.name)(table)
+            result = db.session.execute(statement.values(
+                name=SWEEPER_LEASE, holder=self.holder, expires_at=expires_at
+            ).on_conflict_do_nothing())
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _start_once(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            interval = self.app.config['RESERVATION_SWEEP_INTERVAL']
+            if not interval or self.app.testing:
+                self._thread = False
+                return
+            self._thread = threading.Thread(target=self._run, args=(interval,),
+                                            name='reservation-sweeper', daemon=True)
+            self._thread.start()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            with self.app.app_context():
+                try:
+                    if self.acquire(interval):
+                        ReservationService.expire()
+                except Exception:
+                    logger.exception('Ошибка снятия просроченных резервов')
+                finally:
+                    db.session.remove()
+
+
+def _release(condition):
+    """
+    Удаление резервов по условию с уменьшением reserved остатков. ValueError,
+    если часть резервов уже удалена параллельно. Возвращает id документов.
+    """
+    rows = db.session.query(StockReservation.id, StockReservation.document_id,
+                            StockReservation.product_id, StockReservation.cell_id,
+                            StockReservation.quantity).filter(condition).all()
+    if not rows:
+        return set()
+    deleted = db.session.execute(delete(StockReservation).where(
+        StockReservation.id.in_([row.id for row in rows])))
+    if deleted.rowcount != len(rows):
+        raise ValueError('Резервы изменились, повторите попытку')
+
+    totals = defaultdict(int)
+    for row in rows:
+        totals[(row.product_id, row.cell_id)] += row.quantity
+    balances = StockBalance.__table__
+    db.session.execute(update(balances).where(
+        balances.c.product_id == bindparam('p_id'), balances.c.cell_id == bindparam('c_id')
+    ).values(reserved=balances.c.reserved - bindparam('freed')), [
+        {'p_id': product_id, 'c_id': cell_id, 'freed': quantity}
+        for (product_id, cell_id), quantity in totals.items()])
+    return {row.document_id for row in rows}
+
+
+def _shortage(totals):
+    """Сообщение о первом товаре, которого не хватает для резерва"""
+    free = ReservationService.available([product_id for product_id, _ in totals])
+    for product_id, quantity in totals:
+        if free.get(product_id, 0) < quantity:
+            product = db.session.get(Product, product_id)
+            return (f'Недостаточно свободного товара {product.name} (арт. {product.article}). '
+                    f'Требуется: {quantity}, свободно: {free.get(product_id, 0)}')
+    return 'Остатки изменились во время резервирования, повторите попытку'
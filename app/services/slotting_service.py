@@ -0,0 +1,173 @@
+from app import db
+from app.models import Document, DocumentItem, StockBalance, WarehouseCell
+from app.services.report_service import ReportService
+from app.services.transfer_service import TransferService
+from datetime import date, timedelta
+from flask import current_app
+from sqlalchemy import func
+import numpy as np
+import re
+
+CELL_NAME = re.compile(r'^([A-Za-z]+)[-_ ]?(\d+)')
+
+
+class SlottingService:
+    """
+    Размещение товаров по ячейкам: часто подбираемые товары - ближе к зоне
+    отгрузки. Частота подбора - число строк проведенных расходов за
+    SLOTTING_LOOKBACK_DAYS, стоимость доступа к ячейке - расстояние от
+    SLOTTING_DISPATCH до ее координаты (SLOTTING_CELL_COORDINATES или ряд и
+    место из имени: A-01, B-12). Место товара - ячейка с наибольшим его
+    остатком, в ячейке SLOTTING_CELL_SLOTS мест (не меньше занятых сейчас).
+
+    Ожидаемый путь - сумма частота * расстояние. Он линеен по расстоянию,
+    поэтому минимум дает сопоставление по рангам: самый частый товар - на
+    самое близкое место, и так далее. Это сортировка O(n log n), без
+    решения задачи о назначениях.
+    """
+
+    @staticmethod
+    def cell_distances():
+        """Расстояние от зоны отгрузки по ячейкам {id: (имя, метры)}; ячейки без координат пропускаются"""
+        config = current_app.config
+        coordinates = config['SLOTTING_CELL_COORDINATES']
+        dispatch_x, dispatch_y = config['SLOTTING_DISPATCH']
+        result = {}
+        for cell_id, name in db.session.query(WarehouseCell.id, WarehouseCell.name):
+            point = coordinates.get(name) or _name_coordinate(name)
+            if point is not None:
+                result[cell_id] = (name, abs(point[0] - dispatch_x) + abs(point[1] - dispatch_y))
+        return result
+
+    @staticmethod
+    def pick_frequency(today=None):
+        """Число строк проведенных расходов по товарам за SLOTTING_LOOKBACK_DAYS: {product_id: строк}"""
+        today = today or date.today()
+        since = today - timedelta(days=current_app.config['SLOTTING_LOOKBACK_DAYS'] - 1)
+        return dict(db.session.query(DocumentItem.product_id, func.count(DocumentItem.id)
+                                     ).join(Document, DocumentItem.document_id == Document.id
+                                     ).filter(Document.doc_type == 'expense',
+                                              Document.status == 'posted',
+                                              Document.doc_date >= since,
+                                              Document.doc_date <= today
+                                     ).group_by(DocumentItem.product_id).all())
+
+    @staticmethod
+    def plan(today=None):
+        """
+        Рекомендуемое размещение: словарь moves (перемещения по убыванию
+        экономии), products (товаров в расчете), current и planned
+        (ожидаемый путь за период, м), savings (их разница)
+        """
+        cells = SlottingService.cell_distances()
+        frequency = SlottingService.pick_frequency(today)
+
+        rows = db.session.query(StockBalance.product_id, StockBalance.cell_id,
+                                StockBalance.quantity, StockBalance.available
+                                ).filter(StockBalance.quantity > 0,
+                                         StockBalance.cell_id.in_(list(cells))).all()
+        empty = {'moves': [], 'products': 0, 'current': 0.0, 'planned': 0.0, 'savings': 0.0}
+        if not rows:
+            return empty
+
+        # Место товара - ячейка с наибольшим остатком (при равенстве - меньший id)
+        product_ids = np.array([row.product_id for row in rows], dtype=np.int64)
+        cell_ids = np.array([row.cell_id for row in rows], dtype=np.int64)
+        quantities = np.array([float(row.quantity) for row in rows])
+        available = np.array([float(row.available) for row in rows])
+        order = np.lexsort((cell_ids, -quantities, product_ids))
+        first = order[np.unique(product_ids[order], return_index=True)[1]]
+        product_ids, cell_ids = product_ids[first], cell_ids[first]
+        quantities, available = quantities[first], available[first]
+
+        picks = np.array([frequency.get(int(product_id), 0) for product_id in product_ids],
+                         dtype=np.float64)
+        distance = np.array([cells[int(cell_id)][1] for cell_id in cell_ids])
+
+        # Места ячеек по возрастанию расстояния
+        slots = current_app.config['SLOTTING_CELL_SLOTS']
+        occupied = dict(zip(*np.unique(cell_ids, return_counts=True)))
+        ranked = sorted(cells, key=lambda cell_id: (cells[cell_id][1], cells[cell_id][0]))
+        capacity = {cell_id: max(int(occupied.get(cell_id, 0)), slots) for cell_id in ranked}
+        slot_distance = np.repeat([cells[cell_id][1] for cell_id in ranked],
+                                  [capacity[cell_id] for cell_id in ranked])
+
+        # Частые - на ближние места; при равной частоте первыми идут уже стоящие ближе,
+        # чтобы не переставлять равноценные товары
+        order = np.lexsort((distance, -picks))
+        target = np.empty(len(order))
+        target[order] = slot_distance[:len(order)]
+
+        # Расстояние задает только уровень: товар остается в своей ячейке, если она
+        # на нужном уровне, остальные занимают свободные места ячеек этого уровня
+        moved = np.flatnonzero(~np.isclose(distance, target))
+        for cell_id in cell_ids[np.isclose(distance, target)]:
+            capacity[int(cell_id)] -= 1
+        free = {}
+        for cell_id in ranked:
+            if capacity[cell_id] > 0:
+                free.setdefault(round(cells[cell_id][1], 6), []).append(cell_id)
+        destination = {}
+        for index in moved:
+            level = free[round(target[index], 6)]
+            destination[index] = level[0]
+            capacity[level[0]] -= 1
+            if not capacity[level[0]]:
+                level.pop(0)
+
+        products = ReportService.product_info(product_ids[moved])
+        moves = []
+        for index, dest_cell_id in destination.items():
+            product = products[int(product_ids[index])]
+            moves.append({
+                'product_id': product['id'],
+                'article': product['article'],
+                'name': product['name'],
+                'unit': product['unit'],
+                'picks': int(picks[index]),
+                'cell_id': int(cell_ids[index]),
+                'cell': cells[int(cell_ids[index])][0],
+                'dest_cell_id': dest_cell_id,
+                'dest_cell': cells[dest_cell_id][0],
+                'quantity': quantities[index],
+                'available': available[index],
+                'distance': distance[index],
+                'dest_distance': target[index],
+                'savings': picks[index] * (distance[index] - target[index])
+            })
+        moves.sort(key=lambda move: (-move['savings'], move['article']))
+
+        current = float(picks @ distance)
+        planned = float(picks @ target)
+        return {'moves': moves, 'products': len(product_ids), 'current': current,
+                'planned': planned, 'savings': current - planned}
+
+    @staticmethod
+    def create_transfer(product_ids=None, author_id=None, today=None):
+        """
+        Черновик перемещения по рекомендациям (только product_ids, если заданы).
+        Перемещается свободный остаток: зарезервированное черновиками остается
+        в ячейке. Возвращает документ или None, если перемещать нечего.
+        """
+        moves = SlottingService.plan(today)['moves']
+        if product_ids is not None:
+            selected = set(product_ids)
+            moves = [move for move in moves if move['product_id'] in selected]
+        moves = [dict(move, quantity=move['available']) for move in moves if move['available'] > 0]
+        if not moves:
+            return None
+        return TransferService.create(moves, author_id=author_id,
+                                      comment='Перемещение по оптимизации размещения')
+
+
+def _name_coordinate(name):
+    """Координата ячейки по имени: ряд (A, B, ..., AA) * SLOTTING_AISLE_PITCH, место * SLOTTING_CELL_PITCH"""
+    match = CELL_NAME.match(name)
+    if not match:
+        return None
+    row = 0
+    for letter in match.group(1).upper():
+        row = row * 26 + ord(letter) - ord('A') + 1
+    config = current_app.config
+    return ((row - 1) * config['SLOTTING_AISLE_PITCH'],
+            int(match.group(2)) * config['SLOTTING_CELL_PITCH'])
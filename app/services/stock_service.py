@@ -1,7 +1,38 @@
-from app import db
-from app.models import StockBalance, Document, DocumentItem, Product, WarehouseCell
+from app import db, metrics
+from app.models import (StockBalance, Document, DocumentItem, WarehouseCell,
+                        MOVEMENT_TYPES)
+from app.services.backorder_service import BackorderService
+from app.services.cell_movement_service import CellMovementService
+from app.services.period_service import PeriodService
+from app.services.lot_service import LotService
+from app.services.occupancy_service import OccupancyService
+from app.services.reservation_service import ReservationService
+from app.services.turnover_service import TurnoverService
+from collections import defaultdict
 from datetime import datetime
 from decimal import Decimal
+from flask import current_app
+from sqlalchemy import func
+from time import perf_counter
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ячейка приемки: в нее проводятся приходы; расход списывается из свободного
+# остатка всех ячеек товара, отмена расхода возвращает товар в те же ячейки
+DEFAULT_CELL_ID = 1
+
+
+def dialect_insert(dialect):
+    """insert() с поддержкой ON CONFLICT для диалекта БД"""
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f'Операция не поддерживает БД {dialect}')
+    return insert
+
 
 class StockService:
     """Сервис для управления остатками товаров"""
@@ -19,13 +50,18 @@ class StockService:
         if document.doc_type != 'income':
             raise ValueError('Метод предназначен только для приходных документов')
         
+        started = perf_counter()
+        lines = 0
         try:
+            PeriodService.ensure_open(document.doc_date)
+            
             # Начинаем транзакцию
             for item in document.items:
+                lines += 1
                 # Ищем или создаём запись остатка
                 balance = StockBalance.query.filter_by(
                     product_id=item.product_id,
-                    cell_id=1  # По умолчанию ячейка №1, в реальной системе нужно выбирать
+                    cell_id=DEFAULT_CELL_ID
                 ).first()
                 
                 if balance:
@@ -35,7 +71,7 @@ class StockService:
                     # Создаём новую запись остатка
                     balance = StockBalance(
                         product_id=item.product_id,
-                        cell_id=1,
+                        cell_id=DEFAULT_CELL_ID,
                         quantity=item.quantity
                     )
                     db.session.add(balance)
@@ -43,21 +79,32 @@ class StockService:
             # Меняем статус документа
             document.status = 'posted'
             document.posted_at = datetime.utcnow()
+            CellMovementService.record_lines([document], DEFAULT_CELL_ID)
+            TurnoverService.apply_document(document)
+            OccupancyService.refresh([DEFAULT_CELL_ID])
+            LotService.receive([document])
             
             db.session.commit()
-            return True, "Документ успешно проведён"
+            metrics.observe_posting('income', lines, perf_counter() - started)
             
+        except ValueError as e:
+            db.session.rollback()
+            return False, str(e)
         except Exception as e:
             db.session.rollback()
             return False, f"Ошибка при проведении документа: {str(e)}"
+        
+        return True, "Документ успешно проведён" + _backorders_message([document])
     
     @staticmethod
-    def process_expense_document(document):
+    def process_expense_document(document, partial=False):
         """
         Обработка расходного документа:
         - Проверяет наличие товара
         - Уменьшает остатки
         - Переводит документ в статус "проведён"
+        С partial=True проводится то, что есть в наличии, а нехватка строк
+        переносится в связанный черновик-недопоставку.
         """
         if document.status != 'draft':
             raise ValueError(f'Документ {document.doc_number} не в статусе черновика')
@@ -65,36 +112,50 @@ class StockService:
         if document.doc_type != 'expense':
             raise ValueError('Метод предназначен только для расходных документов')
         
+        started = perf_counter()
+        lines = 0
+        backorder = None
         try:
-            # Сначала проверяем наличие всех товаров
-            for item in document.items:
-                balance = StockBalance.query.filter_by(
-                    product_id=item.product_id,
-                    cell_id=1
-                ).first()
-                
-                if not balance or balance.quantity < item.quantity:
-                    product = Product.query.get(item.product_id)
-                    available = balance.quantity if balance else 0
-                    raise ValueError(
-                        f'Недостаточно товара {product.name} (арт. {product.article}). '
-                        f'Требуется: {item.quantity}, доступно: {available}'
-                    )
+            PeriodService.ensure_open(document.doc_date)
             
-            # Если всё есть - списываем
-            for item in document.items:
-                balance = StockBalance.query.filter_by(
-                    product_id=item.product_id,
-                    cell_id=1
-                ).first()
-                
-                balance.quantity -= item.quantity
+            # Сначала проверяем наличие всех товаров: свободный остаток
+            # и собственный резерв документа, одним запросом по всем строкам
+            shippable = BackorderService.shippable(document)
+            if partial:
+                if not any(quantity for _, quantity in shippable):
+                    raise ValueError('Нет свободного остатка ни по одной строке документа')
+                backorder = BackorderService.split(document, shippable)
+            else:
+                for item, quantity in shippable:
+                    if quantity < item.quantity:
+                        product = item.product
+                        raise ValueError(
+                            f'Недостаточно товара {product.name} (арт. {product.article}). '
+                            f'Требуется: {item.quantity}, доступно: {quantity}'
+                        )
+            
+            # Если всё есть - списываем: сначала из ячеек собственного резерва,
+            # затем из свободного остатка других ячеек товара
+            reserved_cells = ReservationService.document_cells(document)
+            ReservationService.release([document])
+            items = [(item.id, item.product_id, item.quantity) for item in document.items]
+            lines = len(items)
+            allocation = ReservationService.allocate(items, prefer=reserved_cells)
+            if allocation is None or not ReservationService.take(allocation, 'quantity'):
+                raise ValueError('Остатки изменились во время проведения, повторите попытку')
             
             # Меняем статус документа
             document.status = 'posted'
             document.posted_at = datetime.utcnow()
+            TurnoverService.apply_document(document)
+            OccupancyService.refresh({cell_id for _, _, cell_id, _ in allocation})
+            LotService.allocate([document])
             
             db.session.commit()
+            metrics.observe_posting('expense', lines, perf_counter() - started)
+            if backorder is not None:
+                return True, (f'Документ проведён частично, недостающее перенесено '
+                              f'в документ №{backorder.doc_number}')
             return True, "Документ успешно проведён"
             
         except ValueError as e:
@@ -104,6 +165,75 @@ class StockService:
             db.session.rollback()
             return False, f"Ошибка при проведении документа: {str(e)}"
     
+    @staticmethod
+    def process_income_documents(documents):
+        """
+        Проведение пачки приходных черновиков набором запросов, а не по
+        документу: строки суммируются по товарам одним GROUP BY, остатки
+        увеличиваются одним INSERT ... ON CONFLICT на все товары. Пачка
+        проводится целиком или не проводится.
+        """
+        documents = list(documents)
+        for document in documents:
+            if document.status != 'draft':
+                raise ValueError(f'Документ {document.doc_number} не в статусе черновика')
+            if document.doc_type != 'income':
+                raise ValueError('Метод предназначен только для приходных документов')
+        if not documents:
+            return True, 'Нет документов для проведения'
+        
+        started = perf_counter()
+        ids = [document.id for document in documents]
+        try:
+            PeriodService.ensure_open(min(document.doc_date for document in documents))
+            
+            totals = db.session.query(
+                DocumentItem.product_id, func.sum(DocumentItem.quantity)
+            ).filter(DocumentItem.document_id.in_(ids)).group_by(DocumentItem.product_id).all()
+            if totals:
+                statement = dialect_insert(db.session.get_bind().dialect.name)(
+                    StockBalance.__table__)
+                db.session.execute(statement.on_conflict_do_update(
+                    index_elements=['product_id', 'cell_id'],
+                    set_={'quantity': StockBalance.__table__.c.quantity
+                          + statement.excluded.quantity,
+                          'last_updated': statement.excluded.last_updated}
+                ), [{'product_id': product_id, 'cell_id': DEFAULT_CELL_ID,
+                     'quantity': quantity, 'last_updated': datetime.utcnow()}
+                    for product_id, quantity in totals])
+            
+            # Статус меняется только у черновиков: параллельное проведение
+            # того же документа откатит пачку
+            now = datetime.utcnow()
+            posted = Document.query.filter(Document.id.in_(ids), Document.status == 'draft'
+                                           ).update({'status': 'posted', 'posted_at': now},
+                                                    synchronize_session=False)
+            if posted != len(ids):
+                raise ValueError('Часть документов уже проведена или изменена')
+            for document in documents:
+                db.session.refresh(document)
+            CellMovementService.record_lines(documents, DEFAULT_CELL_ID)
+            TurnoverService.apply_documents(documents)
+            OccupancyService.refresh([DEFAULT_CELL_ID])
+            LotService.receive(documents)
+            
+            db.session.commit()
+            lines = dict(db.session.query(DocumentItem.document_id, func.count(DocumentItem.id)
+                                          ).filter(DocumentItem.document_id.in_(ids)
+                                          ).group_by(DocumentItem.document_id).all())
+            elapsed = (perf_counter() - started) / len(documents)
+            for document_id in ids:
+                metrics.observe_posting('income', lines.get(document_id, 0), elapsed)
+            
+        except ValueError as e:
+            db.session.rollback()
+            return False, str(e)
+        except Exception as e:
+            db.session.rollback()
+            return False, f"Ошибка при проведении документов: {str(e)}"
+        
+        return True, f'Проведено документов: {len(documents)}' + _backorders_message(documents)
+    
     @staticmethod
     def cancel_document(document):
         """
@@ -115,46 +245,48 @@ class StockService:
             raise ValueError(f'Документ {document.doc_number} не в статусе "проведён"')
         
         try:
+            if document.doc_type == 'inventory':
+                raise ValueError('Отмена инвентаризации не поддерживается')
+            if document.doc_type not in MOVEMENT_TYPES:
+                raise ValueError('Метод предназначен только для приходных и расходных документов')
+            if document.base_id:
+                raise ValueError(f'Документ создан по инвентаризации №{document.base.doc_number} '
+                                 f'и отдельно не отменяется')
+            PeriodService.ensure_open(document.doc_date)
+            
             if document.doc_type == 'income':
-                # Отмена прихода - списываем товары
-                for item in document.items:
-                    balance = StockBalance.query.filter_by(
-                        product_id=item.product_id,
-                        cell_id=1
-                    ).first()
-                    
-                    if not balance or balance.quantity < item.quantity:
-                        raise ValueError(
-                            f'Невозможно отменить документ: недостаточно товара для списания'
-                        )
-                    
-                    balance.quantity -= item.quantity
+                # Отмена прихода - списываем товары из свободного остатка ячеек,
+                # зарезервированный черновиками товар не списывается
+                allocation = ReservationService.allocate(
+                    [(item.id, item.product_id, item.quantity) for item in document.items])
+                if allocation is None or not ReservationService.take(allocation, 'quantity'):
+                    raise ValueError(
+                        f'Невозможно отменить документ: недостаточно товара для списания'
+                    )
                     
             else:  # expense
-                # Отмена расхода - возвращаем товары
-                for item in document.items:
-                    balance = StockBalance.query.filter_by(
-                        product_id=item.product_id,
-                        cell_id=1
-                    ).first()
-                    
-                    if balance:
-                        balance.quantity += item.quantity
-                    else:
-                        # Если записи не было (странно, но вдруг), создаём
-                        balance = StockBalance(
-                            product_id=item.product_id,
-                            cell_id=1,
-                            quantity=item.quantity
-                        )
-                        db.session.add(balance)
+                # Отмена расхода - возвращаем товары в ячейки, из которых они списаны
+                allocation = CellMovementService.written_off(document)
+                _add_to_cells(allocation)
+                CellMovementService.record([(item_id, cell_id, quantity)
+                                            for item_id, _, cell_id, quantity in allocation])
+            cells = {cell_id for _, _, cell_id, _ in allocation}
             
             document.status = 'cancelled'
             document.cancelled_at = datetime.utcnow()
+            TurnoverService.apply_document(document, sign=-1)
+            OccupancyService.refresh(cells)
+            if document.doc_type == 'income':
+                LotService.receive([document], sign=-1)
+            else:
+                LotService.release([document])
             
             db.session.commit()
             return True, "Документ успешно отменён"
             
+        except ValueError as e:
+            db.session.rollback()
+            return False, str(e)
         except Exception as e:
             db.session.rollback()
             return False, f"Ошибка при отмене документа: {str(e)}"
@@ -190,7 +322,7 @@ class StockService:
         movements = []
         for item in items:
             doc = Document.query.get(item.document_id)
-            if doc and doc.status == 'posted':  # Только проведенные документы
+            if doc and doc.status == 'posted' and doc.doc_type in MOVEMENT_TYPES:
                 # Проверяем фильтры по дате
                 if start_date and doc.doc_date < start_date:
                     continue
@@ -208,4 +340,43 @@ class StockService:
                     'supplier': doc.supplier.name if doc.supplier else '-'
                 })
         
-        return sorted(movements, key=lambda x: x['date'])
\ No newline at end of file
+        return sorted(movements, key=lambda x: x['date'])
+
+
+def _add_to_cells(allocation):
+    """Зачисление [(строка, товар, ячейка, количество)] одним INSERT ... ON CONFLICT"""
+    totals = defaultdict(Decimal)
+    for _, product_id, cell_id, quantity in allocation:
+        totals[(product_id, cell_id)] += quantity
+    if not totals:
+        return
+    statement = dialect_insert(db.session.get_bind().dialect.name)(StockBalance.__table__)
+    now = datetime.utcnow()
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['product_id', 'cell_id'],
+        set_={'quantity': StockBalance.__table__.c.quantity + statement.excluded.quantity,
+              'last_updated': statement.excluded.last_updated}
+    ), [{'product_id': product_id, 'cell_id': cell_id, 'quantity': quantity,
+         'last_updated': now} for (product_id, cell_id), quantity in totals.items()])
+
+
+def _backorders_message(documents):
+    """
+    Пересмотр недопоставок по товарам проведенных приходов в отдельном
+    контексте приложения - своей сессии и транзакции, поэтому ошибка не
+    откатывает и не сбрасывает объекты проведенных документов. Приходы уже
+    зафиксированы: ошибка пишется в журнал и в сообщение, недопоставки
+    пересмотрит следующий приход.
+    """
+    ids = [document.id for document in documents]
+    with current_app._get_current_object().app_context():
+        try:
+            backorders = BackorderService.reevaluate(
+                Document.query.filter(Document.id.in_(ids)).all())
+        except Exception:
+            db.session.rollback()
+            logger.exception('Ошибка пересмотра недопоставок')
+            return '. Недопоставки не пересмотрены из-за ошибки, их пересмотрит следующий приход'
+        finally:
+            db.session.remove()
+    return f'. Зарезервированы недопоставки: {backorders}' if backorders else ''
@@ -0,0 +1,221 @@
+from app import db, metrics
+from app.models import Document, DocumentItem, Product, StockBalance, WarehouseCell
+from app.services.cell_movement_service import CellMovementService
+from app.services.numbering_service import NumberingService
+from app.services.occupancy_service import OccupancyService
+from app.services.period_service import PeriodService
+from app.services.stock_service import dialect_insert
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import and_, bindparam, func, literal, select, tuple_, update
+from sqlalchemy.orm import aliased
+from time import perf_counter
+
+
+class TransferService:
+    """
+    Перемещение товара между ячейками: документ типа transfer, в каждой строке
+    ячейка-источник (cell_id) и ячейка-получатель (dest_cell_id). Количество
+    товара на складе не меняется, поэтому перемещения не попадают в движения,
+    оборот и отчеты. Проведение - набор пакетных запросов на весь документ:
+    проверка наличия одним запросом, списание одним executemany UPDATE,
+    зачисление одним INSERT ... ON CONFLICT.
+    """
+
+    @staticmethod
+    def create(lines, doc_date=None, author_id=None, comment=None):
+        """
+        Черновик перемещения. lines - словари product_id, cell_id, dest_cell_id,
+        quantity; строки одного товара между одной парой ячеек складываются.
+        """
+        merged = defaultdict(Decimal)
+        for line in lines:
+            if line['cell_id'] == line['dest_cell_id']:
+                raise ValueError('Ячейки источника и получателя совпадают')
+            quantity = Decimal(str(line['quantity']))
+            if quantity <= 0:
+                raise ValueError('Количество должно быть больше 0')
+            merged[(line['product_id'], line['cell_id'], line['dest_cell_id'])] += quantity
+        if not merged:
+            raise ValueError('В документе нет строк')
+
+        document = _new_document(doc_date, author_id, comment or 'Перемещение между ячейками')
+        prices = dict(db.session.query(Product.id, Product.price).filter(
+            Product.id.in_({product_id for product_id, _, _ in merged})))
+        db.session.execute(DocumentItem.__table__.insert(), [{
+            'document_id': document.id,
+            'product_id': product_id,
+            'cell_id': cell_id,
+            'dest_cell_id': dest_cell_id,
+            'quantity': quantity,
+            'price': prices.get(product_id) or 0
+        } for (product_id, cell_id, dest_cell_id), quantity in merged.items()])
+        db.session.commit()
+        return document
+
+    @staticmethod
+    def create_cell_transfer(cell_id, dest_cell_id, doc_date=None, author_id=None,
+                             comment=None):
+        """
+        Перемещение всего содержимого ячейки cell_id в dest_cell_id одной
+        операцией: строки документа вставляются одним INSERT ... SELECT
+        из свободных остатков ячейки (зарезервированный черновиками товар
+        остается в ячейке).
+        """
+        if cell_id == dest_cell_id:
+            raise ValueError('Ячейки источника и получателя совпадают')
+        source, dest = db.session.get(WarehouseCell, cell_id), db.session.get(WarehouseCell,
+                                                                             dest_cell_id)
+        if source is None or dest is None:
+            raise ValueError('Ячейка не найдена')
+
+        document = _new_document(doc_date, author_id,
+                                 comment or f'Перемещение всего из {source.name} в {dest.name}')
+        result = db.session.execute(DocumentItem.__table__.insert().from_select(
+            ['document_id', 'product_id', 'cell_id', 'dest_cell_id', 'quantity', 'price'],
+            select(literal(document.id), StockBalance.product_id, StockBalance.cell_id,
+                   literal(dest_cell_id), StockBalance.available, Product.price
+                   ).join(Product, StockBalance.product_id == Product.id
+                   ).where(StockBalance.cell_id == cell_id, StockBalance.available > 0
+                   ).order_by(Product.article)
+        ))
+        if not result.rowcount:
+            db.session.rollback()
+            if db.session.query(StockBalance.id).filter(StockBalance.cell_id == cell_id,
+                                                        StockBalance.quantity > 0).first():
+                raise ValueError(f'Товар ячейки {source.name} зарезервирован черновиками')
+            raise ValueError(f'Ячейка {source.name} пуста')
+        db.session.commit()
+        return document
+
+    @staticmethod
+    def process_document(document):
+        """
+        Проведение перемещения:
+        - проверяет наличие в ячейках-источниках
+        - списывает из источников и зачисляет в получатели
+        - переводит документ в статус "проведён"
+        """
+        if document.status != 'draft':
+            raise ValueError(f'Документ {document.doc_number} не в статусе черновика')
+        if document.doc_type != 'transfer':
+            raise ValueError('Метод предназначен только для перемещений')
+
+        started = perf_counter()
+        try:
+            PeriodService.ensure_open(document.doc_date)
+            lines = _move(document, reverse=False)
+            document.status = 'posted'
+            document.posted_at = datetime.utcnow()
+            db.session.commit()
+            metrics.observe_posting('transfer', lines, perf_counter() - started)
+            return True, "Документ успешно проведён"
+
+        except ValueError as e:
+            db.session.rollback()
+            return False, str(e)
+        except Exception as e:
+            db.session.rollback()
+            return False, f"Ошибка при проведении документа: {str(e)}"
+
+    @staticmethod
+    def cancel_document(document):
+        """Отмена перемещения: товар возвращается из получателей в источники"""
+        if document.status != 'posted':
+            raise ValueError(f'Документ {document.doc_number} не в статусе "проведён"')
+        if document.doc_type != 'transfer':
+            raise ValueError('Метод предназначен только для перемещений')
+
+        try:
+            PeriodService.ensure_open(document.doc_date)
+            _move(document, reverse=True)
+            document.status = 'cancelled'
+            document.cancelled_at = datetime.utcnow()
+            db.session.commit()
+            return True, "Документ успешно отменён"
+
+        except ValueError as e:
+            db.session.rollback()
+            return False, str(e)
+        except Exception as e:
+            db.session.rollback()
+            return False, f"Ошибка при отмене документа: {str(e)}"
+
+
+def _new_document(doc_date, author_id, comment):
+    document = Document(
+        doc_type='transfer',
+        doc_number=NumberingService.next_number('ПМ'),
+        doc_date=doc_date or datetime.now().date(),
+        author_id=author_id,
+        comment=comment[:500],
+        status='draft'
+    )
+    db.session.add(document)
+    db.session.flush()
+    return document
+
+
+def _move(document, reverse):
+    """
+    Перенос остатков по строкам документа (reverse - обратно). Возвращает
+    число строк. ValueError, если в ячейке-источнике не хватает товара.
+    """
+    source = DocumentItem.dest_cell_id if reverse else DocumentItem.cell_id
+    dest = DocumentItem.cell_id if reverse else DocumentItem.dest_cell_id
+
+    # Потребность по (товар, ячейка-источник) и наличие - одним запросом
+    need = select(
+        DocumentItem.product_id, source.label('cell_id'),
+        func.sum(DocumentItem.quantity).label('quantity')
+    ).where(DocumentItem.document_id == document.id
+    ).group_by(DocumentItem.product_id, source).subquery('need')
+    cell = aliased(WarehouseCell)
+    rows = db.session.execute(select(
+        need.c.product_id, need.c.cell_id, need.c.quantity,
+        func.coalesce(StockBalance.available, 0).label('available'),
+        Product.article, Product.name, cell.name.label('cell')
+    ).join(Product, Product.id == need.c.product_id
+    ).join(cell, cell.id == need.c.cell_id
+    ).outerjoin(StockBalance, and_(StockBalance.product_id == need.c.product_id,
+                                   StockBalance.cell_id == need.c.cell_id))).all()
+    if not rows:
+        raise ValueError('В документе нет строк')
+    for row in rows:
+        if row.available < row.quantity:
+            raise ValueError(
+                f'Недостаточно товара {row.name} (арт. {row.article}) в ячейке {row.cell}. '
+                f'Требуется: {row.quantity}, доступно: {row.available}'
+            )
+
+    balances = StockBalance.__table__
+    now = datetime.utcnow()
+    db.session.execute(update(balances).where(
+        balances.c.product_id == bindparam('p_id'), balances.c.cell_id == bindparam('c_id')
+    ).values(quantity=balances.c.quantity - bindparam('moved'), last_updated=now), [
+        {'p_id': row.product_id, 'c_id': row.cell_id, 'moved': row.quantity} for row in rows])
+
+    incoming = db.session.execute(select(
+        DocumentItem.product_id, dest.label('cell_id'), func.sum(DocumentItem.quantity)
+    ).where(DocumentItem.document_id == document.id
+    ).group_by(DocumentItem.product_id, dest)).all()
+    statement = dialect_insert(db.session.get_bind().dialect.name)(balances)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['product_id', 'cell_id'],
+        set_={'quantity': balances.c.quantity + statement.excluded.quantity,
+              'last_updated': statement.excluded.last_updated}
+    ), [{'product_id': product_id, 'cell_id': cell_id, 'quantity': quantity,
+         'last_updated': now} for product_id, cell_id, quantity in incoming])
+    CellMovementService.record_lines([document], source, sign=-1)
+    CellMovementService.record_lines([document], dest)
+
+    # Параллельное проведение могло списать тот же остаток
+    if db.session.query(StockBalance.id).filter(
+            tuple_(StockBalance.product_id, StockBalance.cell_id).in_(
+                [(row.product_id, row.cell_id) for row in rows]),
+            StockBalance.quantity < 0).first():
+        raise ValueError('Остатки изменились во время проведения, повторите попытку')
+    OccupancyService.refresh({row.cell_id for row in rows}
+                             | {cell_id for _, cell_id, _ in incoming})
+    return document.items.count()
@@ -0,0 +1,133 @@
+from app.analytics import get_store, day_number
+from app.services.report_service import ReportService
+import csv
+import io
+import numpy as np
+
+TURNOVER_RATIO_CSV_HEADER = ['Артикул', 'Наименование', 'Категория', 'Ед.изм.',
+                             'Остаток на начало', 'Остаток на конец', 'Средний остаток',
+                             'Расход', 'Оборачиваемость', 'Дней оборота', 'Запас, дней']
+
+
+class TurnoverRatioService:
+    """
+    Оборачиваемость запасов за период: средний остаток (среднее остатков на
+    конец каждого дня), расход, коэффициент оборачиваемости (расход / средний
+    остаток), оборот в днях и запас в днях (конечный остаток / средний дневной
+    расход). Расчет векторный по хранилищу движений (app/analytics.py).
+    """
+
+    @staticmethod
+    def by_product(date_from, date_to):
+        """
+        Показатели по товарам с остатком или расходом в периоде: словарь
+        массивов product_id, opening, closing, average, outflow.
+        Результат кэшируется до изменения движений.
+        """
+        store = get_store()
+        return store.cached(('turnover_ratio', date_from, date_to),
+                            lambda: _balances(store, date_from, date_to))
+
+    @staticmethod
+    def rows(date_from, date_to, category_id=0):
+        """
+        Строки по товарам и итоги по категориям: (товары по возрастанию
+        оборачиваемости, категории по названию, общий итог)
+        """
+        days = (date_to - date_from).days + 1
+        result = TurnoverRatioService.by_product(date_from, date_to)
+        products = ReportService.product_info(result['product_id'], category_id)
+        selected = np.flatnonzero(np.isin(result['product_id'], list(products)))
+
+        rows = [dict(products[int(result['product_id'][index])],
+                     **_measures(result['opening'][index], result['closing'][index],
+                                 result['average'][index], result['outflow'][index], days))
+                for index in selected]
+
+        # Итоги категорий - по суммам остатков и расхода их товаров
+        categories = {}
+        names = [row['category'] for row in rows]
+        keys, inverse = np.unique(np.array(names, dtype=object), return_inverse=True)
+        sums = {column: np.bincount(inverse, result[column][selected], len(keys))
+                for column in ('opening', 'closing', 'average', 'outflow')}
+        for position, name in enumerate(keys):
+            categories[name] = dict(category=name, products=int((inverse == position).sum()),
+                                    **_measures(*(sums[column][position] for column in
+                                                  ('opening', 'closing', 'average', 'outflow')),
+                                                days))
+        total = dict(category='Итого', products=len(rows),
+                     **_measures(*(result[column][selected].sum() for column in
+                                   ('opening', 'closing', 'average', 'outflow')), days))
+        rows.sort(key=lambda row: (row['ratio'] is None, row['ratio'] or 0, row['name']))
+        return rows, [categories[name] for name in sorted(categories)], total
+
+    @staticmethod
+    def iter_csv(date_from, date_to, category_id=0, encoding='cp1251'):
+        """Выгрузка в CSV по частям: товары, затем итоги категорий и общий"""
+        rows, categories, total = TurnoverRatioService.rows(date_from, date_to, category_id)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+        writer.writerow(TURNOVER_RATIO_CSV_HEADER)
+        lines = [(row['article'], row['name'], row['category'], row['unit'], row)
+                 for row in rows]
+        lines += [('', f'Итого по категории ({row["products"]})', row['category'], '', row)
+                  for row in categories]
+        lines.append(('', f'Итого ({total["products"]})', '', '', total))
+        for number, (article, name, category, unit, row) in enumerate(lines, 1):
+            writer.writerow([
+                article, name, category, unit,
+                round(row['opening'], 3),
+                round(row['closing'], 3),
+                round(row['average'], 3),
+                round(row['outflow'], 3),
+                '' if row['ratio'] is None else round(row['ratio'], 3),
+                '' if row['days_of_inventory'] is None else round(row['days_of_inventory'], 1),
+                '' if row['days_of_supply'] is None else round(row['days_of_supply'], 1)
+            ])
+            if number % 1000 == 0:
+                yield buffer.getvalue().encode(encoding, errors='replace')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode(encoding, errors='replace')
+
+
+def _balances(store, date_from, date_to):
+    first, last = day_number(date_from), day_number(date_to)
+    days = last - first + 1
+    mask = store.mask(date_to=date_to)
+    ids, inverse = np.unique(store.product_id[mask], return_inverse=True)
+    size = len(ids)
+    day = store.day[mask]
+    signed = store.weight[mask] * store.direction[mask] * store.quantity[mask]
+    before = day < first
+
+    # Движение дня входит в остатки на конец этого и всех следующих дней периода
+    opening = np.bincount(inverse, signed * before, size)
+    change = np.bincount(inverse, signed * ~before, size)
+    average = opening + np.bincount(inverse, signed * ~before * (last - day + 1), size) / days
+    outflow = np.bincount(inverse, store.weight[mask] * store.quantity[mask]
+                          * (~before & (store.direction[mask] == -1)), size)
+
+    active = (opening != 0) | (change != 0) | (outflow != 0)
+    return {
+        'product_id': ids[active],
+        'opening': opening[active],
+        'closing': (opening + change)[active],
+        'average': average[active],
+        'outflow': outflow[active]
+    }
+
+
+def _measures(opening, closing, average, outflow, days):
+    """Оборачиваемость и дни оборота/запаса; None - показатель не определен"""
+    opening, closing, average, outflow = map(float, (opening, closing, average, outflow))
+    ratio = outflow / average if average > 0 else None
+    return {
+        'opening': opening,
+        'closing': closing,
+        'average': average,
+        'outflow': outflow,
+        'ratio': ratio,
+        'days_of_inventory': days / ratio if ratio else None,
+        'days_of_supply': closing / (outflow / days) if outflow > 0 else None
+    }
@@ -0,0 +1,97 @@
+from app import db
+from app.models import Document, DocumentItem, DailyProductTurnover, MOVEMENT_TYPES
+from app.services.bucket_service import BucketService
+from sqlalchemy import func, insert, select
+
+
+class TurnoverService:
+    """Ведение агрегата дневного оборота товаров (daily_product_turnover)"""
+
+    @staticmethod
+    def apply_document(document, sign=1):
+        """
+        Учет строк документа в дневном обороте: sign=1 при проведении,
+        sign=-1 при отмене. Изменения попадают в текущую транзакцию,
+        фиксирует их вызывающий код.
+        """
+        TurnoverService.apply_documents([document], sign)
+
+    @staticmethod
+    def apply_documents(documents, sign=1):
+        """Учет пачки документов: строки группируются по (день, товар, тип) одним запросом"""
+        rows = db.session.query(
+            Document.doc_date,
+            DocumentItem.product_id,
+            Document.doc_type,
+            func.sum(DocumentItem.quantity).label('quantity'),
+            func.sum(DocumentItem.quantity * DocumentItem.price).label('total_sum'),
+            func.count(DocumentItem.id).label('operations')
+        ).join(Document, DocumentItem.document_id == Document.id
+        ).filter(DocumentItem.document_id.in_([document.id for document in documents]),
+                 Document.doc_type.in_(MOVEMENT_TYPES)
+        ).group_by(Document.doc_date, DocumentItem.product_id, Document.doc_type).all()
+        if not rows:
+            return
+
+        existing = {(fact.day, fact.product_id, fact.doc_type): fact
+                    for fact in DailyProductTurnover.query.filter(
+                        DailyProductTurnover.day.in_({row.doc_date for row in rows}),
+                        DailyProductTurnover.doc_type.in_({row.doc_type for row in rows}),
+                        DailyProductTurnover.product_id.in_({row.product_id for row in rows})
+                    )}
+
+        for day in sorted({row.doc_date for row in rows}):
+            BucketService.invalidate(day)
+        for row in rows:
+            key = (row.doc_date, row.product_id, row.doc_type)
+            fact = existing.get(key)
+            if fact is None and sign < 0:
+                continue  # Документ не попал в агрегат (проведен до его заполнения)
+            if fact is None:
+                fact = existing[key] = DailyProductTurnover(
+                    day=row.doc_date, product_id=row.product_id, doc_type=row.doc_type,
+                    quantity=0, total_sum=0, operations=0)
+                db.session.add(fact)
+
+            fact.quantity += sign * row.quantity
+            fact.total_sum += sign * row.total_sum
+            fact.operations += sign * row.operations
+            if fact.operations <= 0:
+                if fact in db.session.new:
+                    db.session.expunge(fact)
+                else:
+                    db.session.delete(fact)
+
+    @staticmethod
+    def rebuild(since=None):
+        """
+        Пересчет агрегата по проведенным документам (с даты since или полностью).
+        Возвращает количество записанных строк агрегата.
+        """
+        delete = DailyProductTurnover.query
+        if since:
+            delete = delete.filter(DailyProductTurnover.day >= since)
+        delete.delete(synchronize_session=False)
+        if since:
+            BucketService.invalidate(since, onwards=True)
+        else:
+            BucketService.invalidate_all()
+
+        source = select(
+            Document.doc_date,
+            DocumentItem.product_id,
+            Document.doc_type,
+            func.sum(DocumentItem.quantity),
+            func.sum(DocumentItem.quantity * DocumentItem.price),
+            func.count(DocumentItem.id)
+        ).join(Document, DocumentItem.document_id == Document.id
+        ).where(Document.status == 'posted', Document.doc_type.in_(MOVEMENT_TYPES)
+        ).group_by(Document.doc_date, DocumentItem.product_id, Document.doc_type)
+        if since:
+            source = source.where(Document.doc_date >= since)
+
+        result = db.session.execute(insert(DailyProductTurnover).from_select(
+            ['day', 'product_id', 'doc_type', 'quantity', 'total_sum', 'operations'], source
+        ))
+        db.session.commit()
+        return result.rowcount
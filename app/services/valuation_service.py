@@ -0,0 +1,175 @@
+from app import db
+from app.models import (Product, Category, StockBalance, Document, DocumentItem,
+                        BalanceSnapshot, MOVEMENT_TYPES)
+from app.services.period_service import PeriodService
+from sqlalchemy import Integer, Numeric, String, case, cast, func, literal, null, select, union_all
+import csv
+import io
+
+VALUATION_CSV_HEADER = ['Категория', 'Артикул', 'Наименование', 'Ед. изм.',
+                        'Количество', 'Цена', 'Стоимость']
+
+# Уровни строк оценки: товар, итог по категории, общий итог
+PRODUCT, CATEGORY, TOTAL = 0, 1, 2
+PRICE_BASES = ('catalog', 'purchase')
+
+
+class ValuationService:
+    """
+    Оценка остатков с итогами по категориям и общим итогом (как ROLLUP).
+    Строки всех уровней получаются одним запросом UNION ALL, поэтому число
+    запросов не зависит от размера каталога.
+    """
+
+    @staticmethod
+    def statement(as_of=None, category_id=0, price_basis='catalog', with_products=True):
+        """
+        Запрос строк оценки: level, category_id, category, product_id, article,
+        name, unit, quantity, price, value, products (товаров в строке).
+        as_of - остатки на конец дня (по снимку закрытого месяца и движениям),
+        иначе текущие. price_basis: 'catalog' - цена карточки, 'purchase' -
+        цена последнего прихода не позже as_of (без приходов - цена карточки).
+        """
+        if price_basis not in PRICE_BASES:
+            raise ValueError(f'Неизвестная база оценки: {price_basis}')
+
+        quantities = _quantities(as_of)
+        price = Product.price
+        query = select(
+            Product.id.label('product_id'), Product.article, Product.name, Product.unit,
+            Product.category_id,
+            func.coalesce(Category.name, 'Без категории').label('category'),
+            quantities.c.quantity
+        ).join(quantities, quantities.c.product_id == Product.id
+        ).join(Category, Product.category_id == Category.id, isouter=True
+        ).where(quantities.c.quantity != 0)
+        if price_basis == 'purchase':
+            purchase = _purchase_prices(as_of)
+            price = func.coalesce(purchase.c.price, Product.price)
+            query = query.join(purchase, purchase.c.product_id == Product.id, isouter=True)
+        if category_id:
+            query = query.where(Product.category_id == category_id)
+        valued = query.add_columns(price.label('price'),
+                                   (quantities.c.quantity * price).label('value')).cte('valued')
+
+        no_product = [cast(null(), Integer).label('product_id'),
+                      cast(null(), String).label('article'),
+                      cast(null(), String).label('name'),
+                      cast(null(), String).label('unit')]
+        totals = [func.sum(valued.c.quantity).label('quantity'),
+                  cast(null(), Numeric).label('price'),
+                  func.sum(valued.c.value).label('value'),
+                  func.count().label('products')]
+        parts = []
+        if with_products:
+            parts.append(select(
+                literal(PRODUCT).label('level'), valued.c.category_id, valued.c.category,
+                valued.c.product_id, valued.c.article, valued.c.name, valued.c.unit,
+                valued.c.quantity, valued.c.price, valued.c.value,
+                literal(1).label('products')
+            ))
+        parts.append(select(
+            literal(CATEGORY).label('level'), valued.c.category_id,
+            func.max(valued.c.category).label('category'), *no_product, *totals
+        ).group_by(valued.c.category_id))
+        parts.append(select(
+            literal(TOTAL).label('level'), cast(null(), Integer).label('category_id'),
+            cast(null(), String).label('category'), *no_product, *totals
+        ))
+
+        rows = union_all(*parts).subquery('valuation_rows')
+        return select(rows).order_by(
+            case((rows.c.level == TOTAL, 1), else_=0),
+            rows.c.category, rows.c.category_id, rows.c.level, rows.c.name
+        )
+
+    @staticmethod
+    def rows(as_of=None, category_id=0, price_basis='catalog', with_products=True):
+        """Строки оценки: товары, после них итог категории, в конце общий итог"""
+        return [_row(row) for row in db.session.execute(
+            ValuationService.statement(as_of, category_id, price_basis, with_products))]
+
+    @staticmethod
+    def iter_csv(as_of=None, category_id=0, price_basis='catalog', encoding='cp1251'):
+        """Выгрузка в CSV по частям: строки читаются из БД порциями"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+        writer.writerow(VALUATION_CSV_HEADER)
+        result = db.session.execute(
+            ValuationService.statement(as_of, category_id, price_basis
+                                       ).execution_options(yield_per=1000))
+        for partition in result.partitions():
+            for row in map(_row, partition):
+                if row['level'] == PRODUCT:
+                    writer.writerow([row['category'], row['article'], row['name'], row['unit'],
+                                     row['quantity'], round(row['price'], 2),
+                                     round(row['value'], 2)])
+                elif row['level'] == CATEGORY:
+                    writer.writerow([row['category'], '', f'Итого по категории ({row["products"]})',
+                                     '', row['quantity'], '', round(row['value'], 2)])
+                else:
+                    writer.writerow(['', '', f'Итого ({row["products"]})', '',
+                                     row['quantity'], '', round(row['value'], 2)])
+            yield buffer.getvalue().encode(encoding, errors='replace')
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode(encoding, errors='replace')
+
+
+def _row(row):
+    return {
+        'level': row.level,
+        'category_id': row.category_id,
+        'category': row.category,
+        'id': row.product_id,
+        'article': row.article,
+        'name': row.name,
+        'unit': row.unit,
+        'quantity': float(row.quantity or 0),
+        'price': float(row.price) if row.price is not None else None,
+        'value': float(row.value or 0),
+        'products': row.products
+    }
+
+
+def _quantities(as_of):
+    """Подзапрос (product_id, quantity): текущие остатки или на конец дня as_of"""
+    if as_of is None:
+        return select(
+            StockBalance.product_id, func.sum(StockBalance.quantity).label('quantity')
+        ).group_by(StockBalance.product_id).subquery('quantities')
+
+    base_end = PeriodService.last_closed(before=as_of)
+    signed = case((Document.doc_type == 'income', DocumentItem.quantity),
+                  else_=-DocumentItem.quantity)
+    movements = select(DocumentItem.product_id, signed.label('quantity')).join(
+        Document, DocumentItem.document_id == Document.id
+    ).where(Document.status == 'posted', Document.doc_type.in_(MOVEMENT_TYPES),
+            Document.doc_date <= as_of)
+    parts = [movements]
+    if base_end:
+        parts[0] = movements.where(Document.doc_date > base_end)
+        parts.append(select(BalanceSnapshot.product_id, BalanceSnapshot.quantity).where(
+            BalanceSnapshot.period_end == base_end))
+
+    lines = union_all(*parts).subquery('lines')
+    return select(
+        lines.c.product_id, func.sum(lines.c.quantity).label('quantity')
+    ).group_by(lines.c.product_id).subquery('quantities')
+
+
+def _purchase_prices(as_of):
+    """Подзапрос (product_id, price): цена последнего проведенного прихода"""
+    ranked = select(
+        DocumentItem.product_id, DocumentItem.price,
+        func.row_number().over(
+            partition_by=DocumentItem.product_id,
+            order_by=(Document.doc_date.desc(), Document.id.desc())
+        ).label('position')
+    ).join(Document, DocumentItem.document_id == Document.id
+    ).where(Document.doc_type == 'income', Document.status == 'posted')
+    if as_of is not None:
+        ranked = ranked.where(Document.doc_date <= as_of)
+    ranked = ranked.subquery('ranked')
+    return select(ranked.c.product_id, ranked.c.price).where(
+        ranked.c.position == 1).subquery('purchase_prices')
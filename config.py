@@ -9,6 +9,66 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///warehouse.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Реплика для отчетов и выгрузок (необязательно)
+    REPLICA_DATABASE_URI = os.environ.get('REPLICA_DATABASE_URL')
+    # Максимальное отставание реплики, сек (None - не проверять)
+    REPLICA_MAX_LAG = int(os.environ.get('REPLICA_MAX_LAG', 300))
+    REPLICA_CHECK_INTERVAL = 10  # сек, на которые запоминается результат проверки отставания
+    
+    # Фоновые задачи
+    JOB_CONCURRENCY = {'post': 2, 'export': 2, 'report': 1}  # потоков на тип задачи
+    JOB_POST_MIN_ITEMS = 200  # документы от стольких строк проводятся в фоне
+    JOB_RESULTS_DIR = os.environ.get('JOB_RESULTS_DIR')  # по умолчанию instance/jobs
+    JOBS_EAGER = False  # выполнять задачи сразу, в текущем потоке (для тестов)
+    
+    # Учет SQL-запросов: заголовок Server-Timing и панель отладки
+    SQL_INSTRUMENTATION = True
+    SQL_DEBUG_PANEL = os.environ.get('SQL_DEBUG_PANEL') == '1'
+    SQL_N_PLUS_ONE_THRESHOLD = 5  # одинаковых запросов за HTTP-запрос
+    
+    # Метрики Prometheus: каталог для суммирования по процессам (очищать при деплое)
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5  # сек между сохранениями снимка процесса
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # Bearer-токен для /metrics
+    
+    # Расчеты отчетов: 'numpy' - в памяти процесса (app/analytics.py), 'sql' - запросами к БД
+    ANALYTICS_BACKEND = os.environ.get('ANALYTICS_BACKEND', 'numpy')
+    ANALYTICS_MAX_AGE = 600  # сек до полной перезагрузки движений в память
+    ANALYTICS_OVERLAP = 60  # сек перекрытия дозагрузки (транзакции, зафиксированные позже)
+    ABC_THRESHOLDS = (0.8, 0.95)  # накопленная доля расхода для классов A и B
+    XYZ_THRESHOLDS = (0.1, 0.25)  # коэффициент вариации недельного спроса для X и Y
+    
+    # Пополнение запасов: точки заказа и рекомендуемые закупки
+    REPLENISHMENT_LOOKBACK_DAYS = 90  # дней истории для спроса и сроков поставки
+    REPLENISHMENT_SERVICE_LEVEL = 0.95  # вероятность не уйти в ноль за срок поставки
+    REPLENISHMENT_REVIEW_DAYS = 14  # на сколько дней спроса заказывать сверх точки заказа
+    REPLENISHMENT_DEFAULT_LEAD_TIME = 7  # дней, если по поставщику нет проведенных приходов
+    REPLENISHMENT_MIN_LEAD_TIME = 1  # дней, минимальный срок поставки
+    
+    # Прогноз спроса: экспоненциальное сглаживание недельного расхода
+    FORECAST_HISTORY_WEEKS = 52  # полных недель истории для подбора
+    FORECAST_HORIZON_WEEKS = 8  # недель прогноза
+    FORECAST_ALPHAS = (0.1, 0.3, 0.5)  # сглаживание уровня (перебираются)
+    FORECAST_BETAS = (0.05, 0.2)  # сглаживание тренда для Холта (перебираются)
+    
+    # Загрузка каталога товаров из CSV/JSONL
+    IMPORT_CHUNK_SIZE = 2000  # строк файла в одном INSERT ... ON CONFLICT
+    BARCODE_CACHE_SIZE = 100000  # отсканированных кодов в кэше процесса
+    BARCODE_CACHE_TTL = 300  # сек жизни записи кэша (правки из других процессов)
+    DOCUMENT_IMPORT_CHUNK_SIZE = 200  # накладных в одной вставке и проведении
+    INVENTORY_PAGE_ROWS = 1000  # строк инвентаризации на странице документа
+    RESERVATION_HOURS = 24  # сколько действует резерв черновика расхода
+    RESERVATION_SWEEP_INTERVAL = 60  # сек между снятиями просроченных резервов (0 - не снимать)
+    EXPIRY_REPORT_DAYS = 30  # горизонт отчета об истекающих сроках годности, дней
+    
+    # Размещение товаров: часто подбираемые - ближе к зоне отгрузки
+    SLOTTING_LOOKBACK_DAYS = 90  # дней истории расходов для частоты подбора
+    SLOTTING_DISPATCH = (0, 0)  # координата зоны отгрузки, м
+    SLOTTING_CELL_COORDINATES = {}  # {'A-01': (x, y)} - вместо координаты из имени ячейки
+    SLOTTING_AISLE_PITCH = 3.0  # м между рядами (A, B, ...)
+    SLOTTING_CELL_PITCH = 1.0  # м между соседними местами ряда
+    SLOTTING_CELL_SLOTS = 1  # товаров в ячейке (не меньше уже размещенных)
+    
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-key'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     WTF_CSRF_ENABLED = True
\ No newline at end of file
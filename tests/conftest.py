@@ -1,5 +1,7 @@
 import pytest
+from contextlib import contextmanager
 from app import create_app, db
+from app.instrumentation import capture_queries
 from app.models import User, Category, Supplier, Product, WarehouseCell, StockBalance, Document, DocumentItem
 from datetime import datetime, date
 
@@ -51,6 +53,18 @@ def runner(app):
     """Тестовый runner для команд"""
     return app.test_cli_runner()
 
+@pytest.fixture
+def query_budget():
+    """Бюджет SQL-запросов: with query_budget(10): client.get(...)"""
+    @contextmanager
+    def budget(max_queries):
+        with capture_queries() as stats:
+            yield stats
+        assert stats.count <= max_queries, (
+            f'Превышен бюджет SQL-запросов ({max_queries}):\n{stats.report()}'
+        )
+    return budget
+
 @pytest.fixture
 def auth(client):
     """Вспомогательный класс для аутентификации"""
@@ -140,4 +154,26 @@ def test_cells(app):
             db.session.add(cell)
             cells.append(cell)
         db.session.commit()
-        return [cell.id for cell in cells]
\ No newline at end of file
+        return [cell.id for cell in cells]
+
+@pytest.fixture
+def make_document(app):
+    """
+    Фабрика документов со строками (в контексте приложения):
+    make_document('income', 'ПН-1', [(product_id, quantity), ...]).
+    Строка - (товар, количество[, цена]) или словарь полей DocumentItem;
+    цена по умолчанию 10. Дата по умолчанию - сегодня, статус - черновик,
+    остальные поля документа - именованными аргументами.
+    """
+    def make(doc_type, number, lines, doc_date=None, status='draft', **fields):
+        document = Document(doc_type=doc_type, doc_number=number,
+                            doc_date=doc_date or date.today(), status=status, **fields)
+        db.session.add(document)
+        db.session.flush()
+        for line in lines:
+            if not isinstance(line, dict):
+                line = dict(zip(('product_id', 'quantity', 'price'), line))
+            db.session.add(DocumentItem(document_id=document.id, **dict({'price': 10}, **line)))
+        db.session.commit()
+        return document
+    return make
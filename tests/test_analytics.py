@@ -0,0 +1,122 @@
+from app import db
+from app.analytics import MovementStore, get_store, day_number
+from app.services.report_service import ReportService
+from app.services.stock_service import StockService
+from datetime import date, timedelta
+
+
+def test_store_group_by_and_totals(app, test_products, make_document):
+    """Группировка по товарам и итоги за период"""
+    first, second = test_products
+    with app.app_context():
+        make_document('income', 'AN-001', [(first, 10, 5), (second, 4, 2)], date(2024, 1, 5),
+                      status='posted')
+        make_document('expense', 'AN-002', [(first, 3, 5)], date(2024, 1, 20), status='posted')
+        make_document('income', 'AN-003', [(first, 1, 5)], date(2024, 1, 25), status='draft')
+
+        store = MovementStore()
+        store.load()
+        assert len(store) == 3
+
+        grouped = store.by_product(date(2024, 1, 1), date(2024, 1, 31))
+        assert grouped['product_id'].tolist() == sorted([first, second])
+        assert dict(zip(grouped['product_id'].tolist(), grouped['quantity'].tolist())) == \
+            {first: 13.0, second: 4.0}
+        assert store.totals(date(2024, 1, 10)) == (3.0, 15.0, 1)
+
+        ids, quantities = store.balances(date(2024, 1, 31))
+        assert dict(zip(ids.tolist(), quantities.tolist())) == {first: 7.0, second: 4.0}
+
+
+def test_store_running_balance(app, test_products, make_document):
+    """Бегущий остаток с начальным остатком до периода"""
+    first, _ = test_products
+    with app.app_context():
+        make_document('income', 'AN-004', [(first, 10, 1)], date(2024, 1, 1), status='posted')
+        make_document('expense', 'AN-005', [(first, 4, 1)], date(2024, 1, 10), status='posted')
+        make_document('expense', 'AN-006', [(first, 1, 1)], date(2024, 1, 10), status='posted')
+        make_document('income', 'AN-007', [(first, 2, 1)], date(2024, 1, 15), status='posted')
+
+        store = MovementStore()
+        store.load()
+        days, balance = store.running_balance(first, date_from=date(2024, 1, 5))
+        assert days.tolist() == [day_number(date(2024, 1, 10)), day_number(date(2024, 1, 15))]
+        assert balance.tolist() == [5.0, 7.0]
+
+
+def test_store_appends_new_postings_and_cancels(app, test_products, admin_user, make_document):
+    """Проведение и отмена после загрузки дописываются без полной перезагрузки"""
+    first, _ = test_products
+    with app.app_context():
+        app.config['ANALYTICS_MAX_AGE'] = None
+        make_document('income', 'AN-008', [(first, 10, 1)], date.today(), status='posted')
+        store = get_store()
+        loaded_at = store.loaded_at
+        assert store.totals()[0] == 10.0
+
+        doc = make_document('income', 'AN-009', [(first, 5, 1)], date.today(),
+                            status='draft', author_id=admin_user)
+        StockService.process_income_document(doc)
+        assert get_store().totals() == (15.0, 15.0, 2)
+
+        StockService.cancel_document(doc)
+        store = get_store()
+        assert store.totals() == (10.0, 10.0, 1)
+        assert store.loaded_at == loaded_at
+        assert len(store) == 3
+
+
+def test_numpy_backend_matches_sql(app, test_products, make_document):
+    """Оборот по товарам в памяти совпадает с расчетом по агрегату"""
+    first, second = test_products
+    with app.app_context():
+        from app.services.turnover_service import TurnoverService
+
+        make_document('income', 'AN-010', [(first, 10, 5), (second, 4, 2)], date(2024, 1, 5),
+                      status='posted')
+        make_document('expense', 'AN-011', [(first, 3, 5), (first, 1, 5)], date(2024, 2, 1),
+                      status='posted')
+        TurnoverService.rebuild()
+
+        app.config['ANALYTICS_BACKEND'] = 'sql'
+        expected = ReportService.turnover_rows(date(2024, 1, 1), end_date=date(2024, 2, 28))
+        app.config['ANALYTICS_BACKEND'] = 'numpy'
+        assert ReportService.turnover_rows(date(2024, 1, 1), end_date=date(2024, 2, 28)) == expected
+        assert expected[0]['operations_count'] + expected[1]['operations_count'] == 4
+
+
+def test_reload_does_not_replay_cancellations(app, test_products, admin_user, make_document):
+    """Отмены до полной загрузки не дописываются повторно при дозагрузке"""
+    first, _ = test_products
+    with app.app_context():
+        second = make_document('income', 'AN-010', [(first, 5, 10)], date.today(),
+                               status='draft', author_id=admin_user)
+        StockService.process_income_document(second)
+        kept = make_document('income', 'AN-011', [(first, 3, 10)], date.today(),
+                             status='draft', author_id=admin_user)
+        StockService.process_income_document(kept)
+        StockService.cancel_document(second)
+
+        store = MovementStore()
+        store.load()
+        store.refresh()
+        assert store.totals() == (3.0, 30.0, 1)
+
+
+def test_refresh_picks_up_late_commits_once(app, test_products, admin_user, make_document):
+    """Документ с posted_at раньше отметки, зафиксированный позже, учитывается один раз"""
+    first, _ = test_products
+    with app.app_context():
+        doc = make_document('income', 'AN-012', [(first, 2, 1)], date.today(),
+                            status='draft', author_id=admin_user)
+        StockService.process_income_document(doc)
+        store = MovementStore()
+        store.load()
+
+        late = make_document('income', 'AN-013', [(first, 4, 1)], date.today(), status='posted')
+        late.posted_at = store.watermark - timedelta(seconds=5)
+        db.session.commit()
+
+        store.refresh()
+        store.refresh()
+        assert store.totals() == (6.0, 6.0, 2)
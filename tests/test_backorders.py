@@ -0,0 +1,95 @@
+from app import db
+from app.instrumentation import capture_queries
+from app.models import Document, DocumentItem, StockBalance, StockReservation
+from app.services.backorder_service import BackorderService
+from app.services.reservation_service import ReservationService
+from app.services.stock_service import DEFAULT_CELL_ID, StockService
+
+
+def quantities(document):
+    return [(item.product_id, float(item.quantity))
+            for item in document.items.order_by(DocumentItem.id)]
+
+
+def test_partial_posting_splits_backorder(app, test_products, test_cells, make_document):
+    """Проводится наличие, нехватка строк уходит в связанный черновик"""
+    with app.app_context():
+        first, second = test_products
+        assert StockService.process_income_document(
+            make_document('income', 'ПН-B1', [(first, 10)]))[0]
+        expense = make_document('expense', 'РН-B1', [(first, 6), (first, 6), (second, 2)])
+        assert expense.id
+
+        with capture_queries() as stats:
+            shippable = BackorderService.shippable(expense)
+        assert stats.count == 1
+        assert [float(quantity) for _, quantity in shippable] == [6, 4, 0]
+
+        # Без partial сумма строк одного товара сверх остатка не проводится
+        success, message = StockService.process_expense_document(expense)
+        assert not success and 'Требуется: 6.00, доступно: 4' in message
+
+        success, message = StockService.process_expense_document(expense, partial=True)
+        assert success and 'проведён частично' in message
+        assert expense.status == 'posted'
+        assert quantities(expense) == [(first, 6), (first, 4)]
+        backorder = expense.backorders.one()
+        assert [float(item.price) for item in backorder.items.order_by(DocumentItem.id)] == \
+            [10, 10]
+        assert (backorder.status, backorder.backorder_for_id) == ('draft', expense.id)
+        assert quantities(backorder) == [(first, 2), (second, 2)]
+        assert float(StockBalance.query.filter_by(product_id=first,
+                                                  cell_id=DEFAULT_CELL_ID).one().quantity) == 0
+
+        success, message = StockService.process_expense_document(backorder, partial=True)
+        assert not success and 'Нет свободного остатка' in message
+        assert backorder.status == 'draft'
+
+
+def test_income_reserves_backorders(app, test_products, test_cells, make_document):
+    """Приход резервирует недопоставки по порядку, если хватает на весь черновик"""
+    with app.app_context():
+        first, second = test_products
+        for number, short in ((2, 4), (3, 5)):
+            # Единицы прихода недопоставке не хватает - она остается без резерва
+            success, message = StockService.process_income_document(
+                make_document('income', f'ПН-B{number}', [(first, 1)]))
+            assert success and 'недопоставки' not in message
+            assert StockService.process_expense_document(make_document(
+                'expense', f'РН-B{number}', [(first, 1), (first, short)]), partial=True)[0]
+        older, newer = Document.query.filter(Document.backorder_for_id.isnot(None)
+                                             ).order_by(Document.id).all()
+        assert quantities(older) == [(first, 4)] and quantities(newer) == [(first, 5)]
+
+        # Приход другого товара недопоставки не трогает
+        success, message = StockService.process_income_document(
+            make_document('income', 'ПН-B4', [(second, 100)]))
+        assert success and 'недопоставки' not in message
+        success, message = StockService.process_income_document(
+            make_document('income', 'ПН-B5', [(first, 7)]))
+        assert success and 'Зарезервированы недопоставки: 1' in message
+        assert ReservationService.document_reserved(older) == {first: 4}
+        assert ReservationService.document_reserved(newer) == {}
+
+        success, message = StockService.process_income_documents(
+            [make_document('income', 'ПН-B6', [(first, 2)])])
+        assert success and 'Зарезервированы недопоставки: 1' in message
+        assert ReservationService.document_reserved(newer) == {first: 5}
+        assert StockReservation.query.count() == 2
+        assert StockService.process_expense_document(older)[0]
+
+
+def test_backorder_failure_keeps_income_posted(app, test_products, test_cells, make_document,
+                                               monkeypatch):
+    """Ошибка пересмотра недопоставок не отменяет проведенный приход, но сообщается"""
+    def broken(documents, now=None):
+        raise RuntimeError('сбой')
+
+    monkeypatch.setattr(BackorderService, 'reevaluate', staticmethod(broken))
+    with app.app_context():
+        income = make_document('income', 'ПН-B9', [(test_products[0], 5)])
+        success, message = StockService.process_income_document(income)
+        assert success, message
+        assert message.startswith('Документ успешно проведён. Недопоставки не пересмотрены')
+        assert income.status == 'posted'
+        assert db.session.get(Document, income.id).status == 'posted'
@@ -0,0 +1,78 @@
+import io
+import pytest
+from app import db
+from app.instrumentation import capture_queries
+from app.models import Product, ProductBarcode
+from app.services.barcode_service import BarcodeCache, BarcodeService
+
+
+def test_validate_barcode():
+    """Пробелы убираются, UPC-A дополняется до EAN-13, контрольная цифра проверяется"""
+    assert BarcodeService.validate(' 4006381 333931 ') == '4006381333931'
+    assert BarcodeService.validate('036000291452') == '0036000291452'
+    assert BarcodeService.validate('96385074') == '96385074'
+    assert BarcodeService.validate('INT-0001') == 'INT-0001'
+    with pytest.raises(ValueError, match='контрольная цифра'):
+        BarcodeService.validate('4006381333932')
+    with pytest.raises(ValueError, match='Не указан'):
+        BarcodeService.validate('  ')
+
+
+def test_resolve_cached_and_invalidated(app, test_products):
+    """Повторное сканирование идет из кэша; правка товара сбрасывает его записи"""
+    with app.app_context():
+        product = db.session.get(Product, test_products[0])
+        BarcodeService.add(product, '4006381333931')
+        BarcodeService.add(product, '5901234123457', multiplier=12)
+
+        with capture_queries() as stats:
+            pack = BarcodeService.resolve('5901234123457')
+            assert BarcodeService.resolve('5901234123457') == pack
+            assert BarcodeService.resolve('NOPE') is None
+            assert BarcodeService.resolve('NOPE') is None
+        # Код - один запрос; неизвестный код - код и артикул; повторы - из кэша
+        assert stats.count == 3
+        assert (pack['article'], pack['multiplier']) == ('TEST001', 12.0)
+        # Внутренняя этикетка с артикулом
+        assert BarcodeService.resolve('TEST002')['multiplier'] == 1.0
+
+        product.name = 'Новое название'
+        db.session.commit()
+        BarcodeService.invalidate(product.id)
+        assert BarcodeService.resolve('4006381333931')['name'] == 'Новое название'
+
+        with pytest.raises(ValueError, match='уже привязан'):
+            BarcodeService.add(db.session.get(Product, test_products[1]), '4006381333931')
+
+    cache = BarcodeCache(size=2, ttl=60)
+    cache.put('a', {'product_id': 1})
+    cache.put('b', {'product_id': 2})
+    cache.get('a')
+    cache.put('c', None)
+    assert (cache.get('a')[0], cache.get('b')[0], cache.get('c')) == (True, False, (True, None))
+    # Код перешел к другому товару: сброс прежнего товара снимает только ненайденные
+    cache.put('a', {'product_id': 3})
+    cache.invalidate(1)
+    assert (len(cache), cache.get('a')) == (1, (True, {'product_id': 3}))
+    cache.invalidate(3)
+    assert len(cache) == 0
+
+
+def test_import_barcodes(app, test_products):
+    """Загрузка кодов из CSV: ошибки по строкам, повторная загрузка переносит код"""
+    with app.app_context():
+        data = ('Артикул;Штрихкод;Кратность\n'
+                'TEST001;4006381333931;\n'
+                'TEST001;5901234123457;6\n'
+                'NOPE;96385074;1\n'
+                'TEST002;4006381333932;1\n')
+        result = BarcodeService.import_file(io.BytesIO(data.encode('utf-8')), chunk_size=2)
+        assert (result.rows, result.inserted, result.updated, result.failed) == (4, 2, 0, 2)
+        assert [line for line, _ in result.errors] == [4, 5]
+
+        BarcodeService.resolve('4006381333931')
+        result = BarcodeService.import_file(io.StringIO('article,barcode\nTEST002,4006381333931\n'))
+        assert (result.inserted, result.updated) == (0, 1)
+        # Загрузка сбрасывает кэш
+        assert BarcodeService.resolve('4006381333931')['article'] == 'TEST002'
+        assert ProductBarcode.query.count() == 2
@@ -0,0 +1,59 @@
+import json
+from app import db
+from app.models import Product, Document, DocumentItem, StockBalance, WarehouseCell
+from app.services.dataset_service import DatasetService
+from app.services.benchmark_service import BenchmarkService
+from sqlalchemy import func, case
+
+
+def test_generate_dataset(app):
+    """Генерация заданных объемов с остатками, согласованными с движениями"""
+    with app.app_context():
+        summary = DatasetService.generate(products=40, cells=8, lines=1500,
+                                          categories=3, suppliers=2, seed=1)
+
+        assert Product.query.count() == 40
+        assert WarehouseCell.query.count() == 8
+        assert summary['lines'] == DocumentItem.query.count()
+        assert summary['documents'] == Document.query.count()
+
+        signed = case((Document.doc_type == 'income', DocumentItem.quantity),
+                      else_=-DocumentItem.quantity)
+        movements = db.session.query(func.sum(signed)).join(Document).scalar()
+        balances = db.session.query(func.sum(StockBalance.quantity)).scalar()
+        assert float(movements) == float(balances)
+        assert StockBalance.query.filter(StockBalance.quantity < 0).count() == 0
+
+
+def test_generate_is_skewed(app):
+    """Популярные товары встречаются в строках намного чаще остальных"""
+    with app.app_context():
+        DatasetService.generate(products=100, cells=1, lines=5000, seed=2)
+        counts = [row[0] for row in db.session.query(func.count(DocumentItem.id))
+                  .group_by(DocumentItem.product_id).order_by(func.count(DocumentItem.id).desc())]
+        assert counts[0] > 10 * counts[-1]
+
+
+def test_benchmark_run_and_compare(app, tmp_path):
+    """Замеры маршрутов и сервиса сохраняются в JSON и сравниваются"""
+    with app.app_context():
+        DatasetService.generate(products=20, cells=3, lines=200, seed=3)
+        report = BenchmarkService.run(app, repeat=1, posting_lines=5)
+
+        names = {row['name'] for row in report['results']}
+        assert 'GET /reports/stock' in names
+        assert 'GET /products/<int:id>/movement' in names
+        assert any(name.startswith('StockService.process_income_document') for name in names)
+        assert Document.query.filter(Document.doc_number.like('BENCH-%')).count() == 0
+
+        path = tmp_path / 'bench.json'
+        BenchmarkService.save(report, path)
+        saved = json.loads(path.read_text(encoding='utf-8'))
+        assert saved['dataset']['products'] == 20
+
+    slower = json.loads(json.dumps(saved))
+    for row in slower['results']:
+        if 'error' not in row:
+            row['median_ms'] = row['median_ms'] * 2 + 1
+    rows = BenchmarkService.compare(saved, slower)
+    assert rows and all(regressed for *_, regressed in rows)
@@ -0,0 +1,115 @@
+import pytest
+from app import db
+from app.instrumentation import capture_queries
+from app.models import TurnoverBucket
+from app.services.bucket_service import BucketService
+from app.services.stock_service import StockService
+from app.services.turnover_service import TurnoverService
+from datetime import date, timedelta
+
+
+def test_bucket_boundaries():
+    """Границы интервалов: неделя с понедельника, месяц с 1-го числа"""
+    assert BucketService.bucket_start(date(2025, 1, 1), 'week') == date(2024, 12, 30)
+    assert BucketService.bucket_start(date(2024, 2, 29), 'month') == date(2024, 2, 1)
+    assert BucketService.next_bucket(date(2024, 1, 1), 'month') == date(2024, 2, 1)
+    assert BucketService.next_bucket(date(2024, 12, 1), 'month') == date(2025, 1, 1)
+    assert BucketService.bucket_starts(date(2024, 11, 15), date(2025, 1, 10), 'month') == [
+        date(2024, 11, 1), date(2024, 12, 1), date(2025, 1, 1)]
+
+    with pytest.raises(ValueError):
+        BucketService.bucket_start(date(2024, 1, 1), 'year')
+    with pytest.raises(ValueError):
+        BucketService.bucket_starts(date(2024, 2, 1), date(2024, 1, 1), 'day')
+
+
+def test_series_fills_gaps_and_keeps_years_apart(app, test_products, make_document):
+    """Пустые интервалы заполняются нулями, одинаковые месяцы разных лет не сливаются"""
+    with app.app_context():
+        product_id = test_products[0]
+        make_document('income', 'BK-001', [(product_id, 1)], date(2023, 3, 10), status='posted')
+        make_document('income', 'BK-002', [(product_id, 2)], date(2024, 3, 10), status='posted')
+        TurnoverService.rebuild()
+
+        series = BucketService.turnover_series(date(2023, 2, 1), date(2024, 3, 31), 'month',
+                                               today=date(2024, 6, 1))
+        totals = {bucket['start']: bucket['total_sum'] for bucket in series}
+
+        assert len(series) == 14
+        assert totals[date(2023, 3, 1)] == 10.0
+        assert totals[date(2024, 3, 1)] == 20.0
+        assert totals[date(2023, 4, 1)] == 0.0
+        assert series[1]['end'] == date(2023, 3, 31)
+
+
+def test_closed_buckets_cached_and_invalidated(app, test_products, admin_user, make_document):
+    """Закрытые интервалы берутся из кэша и сбрасываются при проведении задним числом"""
+    with app.app_context():
+        product_id = test_products[0]
+        last_week = date.today() - timedelta(days=7)
+        make_document('income', 'BK-003', [(product_id, 3)], last_week, status='posted')
+        TurnoverService.rebuild()
+
+        first = BucketService.turnover_series(last_week, date.today(), 'week')
+        assert TurnoverBucket.query.filter_by(granularity='week').count() == 1
+
+        with capture_queries() as stats:
+            second = BucketService.turnover_series(last_week, date.today(), 'week')
+        assert second == first
+        # Кэш закрытой недели + пересчет только текущей
+        assert stats.count == 2
+
+        doc = make_document('income', 'BK-004', [(product_id, 1)], last_week,
+                            author_id=admin_user)
+        StockService.process_income_document(doc)
+
+        assert TurnoverBucket.query.filter_by(granularity='week').count() == 0
+        third = BucketService.turnover_series(last_week, date.today(), 'week')
+        assert third[0]['total_sum'] == first[0]['total_sum'] + 10.0
+
+
+def test_buckets_computed_before_invalidation_not_cached(app, test_products, make_document,
+                                                         monkeypatch):
+    """Интервал, посчитанный до проведения задним числом, в кэш не попадает"""
+    from app.services import bucket_service
+
+    with app.app_context():
+        last_week = date.today() - timedelta(days=7)
+        make_document('income', 'BK-005', [(test_products[0], 3)], last_week, status='posted')
+        TurnoverService.rebuild()
+        daily_totals = bucket_service._daily_totals
+
+        def posted_meanwhile(start, end):
+            totals = daily_totals(start, end)
+            BucketService.invalidate(last_week)
+            db.session.commit()
+            return totals
+
+        monkeypatch.setattr(bucket_service, '_daily_totals', posted_meanwhile)
+        BucketService._closed_buckets([BucketService.bucket_start(last_week, 'week')], 'week')
+        monkeypatch.setattr(bucket_service, '_daily_totals', daily_totals)
+        assert TurnoverBucket.query.filter_by(granularity='week').count() == 0
+
+        BucketService.turnover_series(last_week, date.today(), 'week')
+        assert TurnoverBucket.query.filter_by(granularity='week').count() == 1
+
+
+def test_turnover_chart_api(client, auth, app):
+    """API графика: явный диапазон и ошибка детализации"""
+    auth.login()
+    response = client.get('/reports/api/chart/turnover?date_from=2024-01-01'
+                          '&date_to=2024-03-15&granularity=month')
+    assert response.status_code == 200
+    assert response.json['labels'] == ['Янв 2024', 'Фев 2024', 'Мар 2024']
+    assert response.json['values'] == [0.0, 0.0, 0.0]
+
+    response = client.get('/reports/api/chart/turnover?date_from=2024-12-23'
+                          '&date_to=2025-01-05&granularity=week')
+    assert response.json['labels'] == ['Неделя 52, 2024', 'Неделя 1, 2025']
+
+    response = client.get('/reports/api/chart/turnover?granularity=year')
+    assert response.status_code == 400
+
+    response = client.get('/reports/api/chart/turnover?period=week')
+    assert response.json['granularity'] == 'day'
+    assert len(response.json['labels']) == 8
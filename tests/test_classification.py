@@ -0,0 +1,66 @@
+import pytest
+from app import db
+from app.models import Product
+from app.services.classification_service import ClassificationService
+from datetime import date, datetime, timedelta
+
+MONDAY = date(2024, 1, 1)
+SUNDAY = date(2024, 1, 28)  # ровно 4 недели
+
+
+@pytest.fixture
+def demand(app, test_products, make_document):
+    """Стабильный дорогой товар, нерегулярный средний, стабильный дешевый и товар без расхода"""
+    with app.app_context():
+        stable, irregular = test_products
+        cheap = Product(article='TEST003', name='Дешевый товар', unit='шт', price=1)
+        idle = Product(article='TEST004', name='Товар без расхода', unit='шт', price=1)
+        db.session.add_all([cheap, idle])
+        db.session.flush()
+        cheap, idle = cheap.id, idle.id
+        for week in range(4):
+            make_document('expense', f'CL-{week}', [(stable, 10, 20), (cheap, 4, 2.5)],
+                          MONDAY + timedelta(days=week * 7 + 2), status='posted')
+        make_document('expense', 'CL-9', [(irregular, 16, 10)], MONDAY + timedelta(days=15),
+                      status='posted')
+        db.session.commit()
+        return stable, irregular, cheap, idle
+
+
+def test_abc_xyz_classes(app, demand):
+    """Классы по доле расхода и вариации недельного спроса"""
+    stable, irregular, cheap, idle = demand
+    with app.app_context():
+        rows = ClassificationService.rows(MONDAY, SUNDAY)
+        by_id = {row['id']: row for row in rows}
+
+        assert [row['id'] for row in rows] == [stable, irregular, cheap, idle]
+        assert (by_id[stable]['abc'], by_id[stable]['xyz']) == ('A', 'X')
+        assert (by_id[irregular]['abc'], by_id[irregular]['xyz']) == ('B', 'Z')
+        assert (by_id[cheap]['abc'], by_id[cheap]['xyz']) == ('C', 'X')
+        assert (by_id[idle]['abc'], by_id[idle]['xyz']) == ('C', 'Z')
+
+        assert by_id[stable]['share'] == pytest.approx(80)
+        assert by_id[irregular]['cumulative_share'] == pytest.approx(96)
+        assert by_id[stable]['variation'] == pytest.approx(0)
+        assert by_id[irregular]['mean_demand'] == pytest.approx(4)
+        # Спрос 16 в одну из 4 недель: sd = sqrt(64 - 16) = 6.93
+        assert by_id[irregular]['variation'] == pytest.approx(173.2, abs=0.1)
+        assert by_id[idle]['variation'] is None
+
+        matrix = ClassificationService.matrix(rows)
+        assert matrix[('A', 'X')] == [1, 800.0]
+        assert matrix[('C', 'Z')][0] == 1
+
+
+def test_abc_xyz_cached_until_movement_changes(app, demand, make_document):
+    """Результат кэшируется, новое проведение сбрасывает кэш"""
+    stable, *_ = demand
+    with app.app_context():
+        first = ClassificationService.abc_xyz(MONDAY, SUNDAY)
+        assert ClassificationService.abc_xyz(MONDAY, SUNDAY) is first
+
+        make_document('expense', 'CL-10', [(stable, 1, 20)], SUNDAY, status='posted',
+                      posted_at=datetime.utcnow())
+
+        assert ClassificationService.abc_xyz(MONDAY, SUNDAY) is not first
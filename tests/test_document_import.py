@@ -0,0 +1,205 @@
+import io
+from datetime import date
+from app import db
+from app.models import (Document, Product, StockBalance, StockLot,
+                        DailyProductTurnover)
+from app.services.document_import_service import DocumentImportService
+from app.services.stock_service import StockService
+
+XML = '''<?xml version="1.0" encoding="utf-8"?>
+<documents>
+    <document number="Н-1" date="2024-03-01" supplier_inn="1234567890">
+        <comment>Поставка по договору</comment>
+        <item article="TEST001" quantity="10" price="900"/>
+        <item article="TEST002" quantity="5,5"/>
+    </document>
+    <document number="Н-2" date="02.03.2024" supplier="тестовый поставщик">
+        <item article="TEST001" quantity="3" price="950.50"/>
+    </document>
+    <document number="Н-3" date="2024-03-03" supplier="Нет такого">
+        <item article="TEST001" quantity="1"/>
+    </document>
+    <document number="Н-4" date="2024-03-04" supplier_inn="1234567890">
+        <item article="NOPE" quantity="1"/>
+    </document>
+</documents>
+'''
+
+
+def import_text(text, file_format='xml', **kwargs):
+    return DocumentImportService.import_file(io.BytesIO(text.encode('utf-8')), file_format,
+                                             **kwargs)
+
+
+def test_xml_creates_drafts(app, test_products, test_supplier):
+    """Накладные становятся черновиками приходов, ошибочные пропускаются"""
+    with app.app_context():
+        result = import_text(XML, chunk_size=2)
+        assert (result.documents, result.items, result.posted, result.failed) == (2, 3, 0, 2)
+        assert result.errors == [
+            ('документ 3', 'Поставщик "Нет такого" не найден'),
+            ('документ 4', 'Товар с артикулом "NOPE" не найден')
+        ]
+
+        documents = Document.query.order_by(Document.doc_number).all()
+        assert [document.external_number for document in documents] == ['Н-1', 'Н-2']
+        assert all(document.status == 'draft' and document.doc_type == 'income'
+                   and document.supplier_id == test_supplier for document in documents)
+        assert documents[0].doc_number.endswith('-0001')
+        assert documents[1].doc_number.endswith('-0002')
+        assert documents[0].comment == 'Поставка по договору'
+        assert documents[1].doc_date == date(2024, 3, 2)
+
+        items = {item.product_id: item for item in documents[0].items}
+        assert float(items[test_products[0]].quantity) == 10
+        assert float(items[test_products[1]].quantity) == 5.5
+        # Без цены в файле - цена карточки товара
+        assert float(items[test_products[1]].price) == 500
+
+
+def test_repeated_file_skipped(app, test_products):
+    """Повторная загрузка той же накладной не создает документ"""
+    with app.app_context():
+        import_text(XML)
+        result = import_text(XML)
+        assert result.documents == 0
+        assert ('документ 1', 'Накладная №Н-1 уже загружена (документ '
+                f'{Document.query.filter_by(external_number="Н-1").one().doc_number})'
+                ) in result.errors
+        assert Document.query.count() == 2
+
+
+def test_numbers_continue_existing(app, test_products, test_supplier, make_document):
+    """Номера выдаются после уже существующих за месяц"""
+    with app.app_context():
+        prefix = f'ПН-{date.today():%Y%m}'
+        make_document('income', f'{prefix}-0007', [])
+
+        import_text(XML)
+        numbers = sorted(number for number, in db.session.query(Document.doc_number).filter(
+            Document.external_number.isnot(None)))
+        assert numbers == [f'{prefix}-0008', f'{prefix}-0009']
+
+
+def test_numbering_shared_and_conflicts(app, test_products, make_document):
+    """Все документы нумеруются после наибольшего номера месяца"""
+    import pytest
+    from sqlalchemy.exc import IntegrityError
+    from app.services.backorder_service import BackorderService
+    from app.services.numbering_service import NumberingService
+
+    with app.app_context():
+        prefix = NumberingService.prefix('РН')
+        make_document('expense', f'{prefix}-0001', [])
+        make_document('expense', f'{prefix}-0005', [])
+        order = make_document('expense', 'РН-T-1', [(test_products[0], 3)])
+        item = order.items.one()
+        assert BackorderService.split(order, [(item, 1)]).doc_number == f'{prefix}-0006'
+        db.session.commit()
+
+        db.session.add(Document(doc_type='expense', doc_number=f'{prefix}-0006'))
+        with pytest.raises(IntegrityError) as error:
+            db.session.flush()
+        db.session.rollback()
+        assert NumberingService.is_conflict(error.value)
+
+        db.session.add(Document(doc_type='expense', doc_number=None))
+        with pytest.raises(IntegrityError) as error:
+            db.session.flush()
+        db.session.rollback()
+        assert not NumberingService.is_conflict(error.value)
+
+
+def test_csv_groups_rows(app, test_products):
+    """Соседние строки одной накладной - один документ"""
+    with app.app_context():
+        result = import_text(
+            'Номер;Дата;ИНН;Артикул;Количество;Цена\n'
+            'A-1;2024-03-01;1234567890;TEST001;2;100\n'
+            'A-1;2024-03-01;1234567890;TEST002;3;50\n'
+            'A-2;2024-03-01;1234567890;TEST001;1;100\n'
+            'A-3;2024-03-01;1234567890;TEST001;0;100\n',
+            'csv'
+        )
+        assert (result.documents, result.items) == (2, 3)
+        assert result.errors == [
+            ('строка 5', 'Количество по артикулу "TEST001" должно быть больше 0')]
+        assert Document.query.filter_by(external_number='A-1').one().items.count() == 2
+
+
+def test_import_with_posting(app, test_products, test_cells):
+    """Проведение загруженных документов одной пачкой"""
+    with app.app_context():
+        result = import_text(XML, post=True)
+        assert (result.documents, result.posted) == (2, 2)
+        assert Document.query.filter_by(status='posted').count() == 2
+
+        balances = {balance.product_id: float(balance.quantity)
+                    for balance in StockBalance.query.all()}
+        assert balances == {test_products[0]: 13, test_products[1]: 5.5}
+        turnover = db.session.query(db.func.sum(DailyProductTurnover.quantity)).filter(
+            DailyProductTurnover.product_id == test_products[0]).scalar()
+        assert float(turnover) == 13
+
+
+def test_batch_posting_matches_single(app, test_products, test_cells, test_supplier,
+                                      make_document):
+    """Пачечное проведение дает те же остатки, что и по одному документу"""
+    with app.app_context():
+        db.session.add(StockBalance(product_id=test_products[0], cell_id=test_cells[0],
+                                    quantity=4))
+        documents = []
+        for number in range(3):
+            documents.append(make_document(
+                'income', f'ПН-T-{number}',
+                [(product_id, number + 1) for product_id in test_products],
+                supplier_id=test_supplier))
+        db.session.commit()
+
+        success, _ = StockService.process_income_documents(documents)
+        assert success
+        balances = {balance.product_id: float(balance.quantity)
+                    for balance in StockBalance.query.all()}
+        assert balances == {test_products[0]: 10, test_products[1]: 6}
+
+        # Уже проведенные документы повторно не проводятся
+        try:
+            StockService.process_income_documents(documents)
+        except ValueError as e:
+            assert 'не в статусе черновика' in str(e)
+        else:
+            assert False
+
+
+def test_import_files_cli(app, runner, test_products, tmp_path):
+    """Загрузка нескольких файлов из командной строки"""
+    first = tmp_path / 'first.xml'
+    first.write_text(XML, encoding='utf-8')
+    second = tmp_path / 'second.csv'
+    second.write_text('number;date;supplier;article;quantity\n'
+                      'B-1;2024-03-05;Тестовый поставщик;TEST002;7\n', encoding='cp1251')
+
+    result = runner.invoke(args=['documents', 'import', str(first), str(second),
+                                 '--workers', '1', '--encoding', 'cp1251'])
+    assert result.exit_code == 0, result.output
+    assert 'Документов: 3, строк: 4, проведено: 0, ошибок: 2' in result.output
+    assert 'first.xml: документ 4' in result.output
+    with app.app_context():
+        assert Document.query.filter_by(external_number='B-1').count() == 1
+
+
+def test_lots_from_file(app, test_products, test_cells):
+    """Партия и срок годности из накладной попадают в строки и партии"""
+    with app.app_context():
+        result = import_text(
+            'Номер;Дата;ИНН;Артикул;Количество;Партия;Годен до\n'
+            'C-1;2024-03-01;1234567890;TEST001;2;L-7;01.06.2030\n'
+            'C-1;2024-03-01;1234567890;TEST002;3;;\n', 'csv', post=True)
+        assert (result.documents, result.posted) == (1, 1)
+        items = {item.product_id: item for item in
+                 Document.query.filter_by(external_number='C-1').one().items}
+        assert (items[test_products[0]].lot_number,
+                items[test_products[0]].expiry_date) == ('L-7', date(2030, 6, 1))
+        assert items[test_products[1]].lot_number is None
+        lot = StockLot.query.one()
+        assert (lot.product_id, float(lot.quantity)) == (test_products[0], 2)
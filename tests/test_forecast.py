@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from app.models import DemandForecast
+from app.services.forecast_service import ForecastService, _fit, _map_chunks
+from datetime import date, datetime, timedelta
+
+TODAY = date(2024, 3, 6)  # среда
+MONDAY = date(2024, 3, 4)
+
+
+def test_fit_constant_and_trend(app):
+    """Постоянный спрос - простое сглаживание, растущий - метод Холта"""
+    with app.app_context():
+        series = np.array([[10.0] * 20, [float(week) for week in range(20)], [0.0] * 20])
+        result = ForecastService.fit(series, horizon=3)
+
+        assert list(result['method']) == [0, 1, 0]
+        assert result['forecast'][0] == pytest.approx([10, 10, 10])
+        assert result['error'][0] == pytest.approx(0)
+        assert result['forecast'][2] == pytest.approx([0, 0, 0])
+        # Тренд продолжается, прогноз растет неделя к неделе
+        assert np.all(np.diff(result['forecast'][1]) > 0)
+        assert result['forecast'][1][0] > 15
+
+
+def test_process_pool_matches_single_process():
+    """Подбор в процессах дает тот же результат, что и в одном"""
+    series = np.random.default_rng(1).poisson(5, size=(30, 12)).astype(float)
+    args = (4, (0.1, 0.5), (0.2,))
+    chunks = [series[:10], series[10:20], series[20:]]
+    single = list(_map_chunks(chunks, args, workers=1))
+    pooled = list(_map_chunks(chunks, args, workers=2))
+    for left, right in zip(single, pooled):
+        assert np.array_equal(left['forecast'], right['forecast'])
+        assert np.array_equal(left['method'], right['method'])
+    assert np.array_equal(np.concatenate([part['error'] for part in single]),
+                          _fit(series, *args)['error'])
+
+
+@pytest.fixture
+def weekly_expense(app, test_products, make_document):
+    """8 недель расхода: товар 1 - по 10 в неделю, товар 2 - нет расхода"""
+    app.config['FORECAST_HISTORY_WEEKS'] = 8
+    app.config['FORECAST_HORIZON_WEEKS'] = 4
+    product_id = test_products[0]
+    with app.app_context():
+        for week in range(1, 9):
+            make_document('expense', f'FC-{week}', [(product_id, 10, 100)],
+                          MONDAY - timedelta(weeks=week) + timedelta(days=2),
+                          status='posted', posted_at=datetime(2024, 3, 1))
+    return test_products
+
+
+def test_refresh_stores_forecasts(app, weekly_expense):
+    """Ночной пересчет: строки прогноза по неделям горизонта"""
+    steady, idle = weekly_expense
+    with app.app_context():
+        assert ForecastService.refresh(TODAY, workers=1) == 1
+
+        forecasts = DemandForecast.query.filter_by(product_id=steady
+                                                   ).order_by(DemandForecast.week_start).all()
+        assert [row.week_start for row in forecasts] == \
+            [MONDAY + timedelta(weeks=week) for week in range(4)]
+        assert [float(row.quantity) for row in forecasts] == pytest.approx([10] * 4)
+        assert forecasts[0].method == 'ses'
+        assert DemandForecast.query.filter_by(product_id=idle).count() == 0
+
+        rows = ForecastService.rows()
+        assert [(row['id'], row['next_week'], row['horizon']) for row in rows] == \
+            [(steady, pytest.approx(10), pytest.approx(40))]
+
+        data = ForecastService.product_forecast(steady, TODAY)
+        assert data['history']['values'] == [10.0] * 8
+        assert data['history']['labels'][-1] == (MONDAY - timedelta(weeks=1)).isoformat()
+        assert data['forecast']['values'] == pytest.approx([10] * 4)
+
+        # Повторный пересчет заменяет прогноз
+        assert ForecastService.refresh(TODAY, workers=1) == 1
+        assert DemandForecast.query.count() == 4
+
+
+def test_forecast_cli(app, runner, weekly_expense):
+    """flask forecast refresh"""
+    result = runner.invoke(args=['forecast', 'refresh', '--workers', '1'])
+    assert result.exit_code == 0
+    assert 'Прогноз пересчитан для 0 товаров' in result.output  # история до текущей недели пуста
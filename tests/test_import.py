@@ -0,0 +1,93 @@
+import io
+import json
+from app import db
+from app.models import Product, Category, Supplier
+from app.services.import_service import CatalogImportService
+
+
+def import_text(text, file_format='csv', **kwargs):
+    return CatalogImportService.import_file(io.BytesIO(text.encode('utf-8')), file_format,
+                                            **kwargs)
+
+
+def test_csv_insert_and_update(app, test_products, test_categories):
+    """Новые товары добавляются, существующие обновляются по артикулу"""
+    with app.app_context():
+        result = import_text(
+            'Артикул;Наименование;Ед.изм.;Цена;Категория;Поставщик\n'
+            'TEST001;Перфоратор;шт;1 250,50;электроинструмент;Тестовый поставщик\n'
+            'NEW-1;Саморез;уп;99.9;Крепеж;Новый поставщик\n'
+            'NEW-2;Шуруп;;;Крепеж;\n',
+            chunk_size=2
+        )
+        assert (result.rows, result.inserted, result.updated, result.failed) == (3, 2, 1, 0)
+
+        updated = Product.query.filter_by(article='TEST001').one()
+        assert updated.name == 'Перфоратор'
+        assert float(updated.price) == 1250.5
+        assert updated.category_id == test_categories[0]
+
+        screw = Product.query.filter_by(article='NEW-1').one()
+        assert screw.category.name == 'Крепеж'
+        assert Supplier.query.get(screw.supplier_id).name == 'Новый поставщик'
+        assert Product.query.filter_by(article='NEW-2').one().unit == 'шт'
+        assert Category.query.filter_by(name='Крепеж').count() == 1
+
+
+def test_only_file_columns_updated(app, test_products):
+    """Колонки, которых нет в файле, у существующих товаров не меняются"""
+    with app.app_context():
+        result = import_text('article,price\nTEST002,777\nNEW-3,5\n')
+        assert (result.inserted, result.updated) == (0, 1)
+        assert result.errors == [(3, 'Новый товар без наименования')]
+
+        product = Product.query.filter_by(article='TEST002').one()
+        assert float(product.price) == 777
+        assert product.name == 'Тестовый товар 2'
+        assert product.category_id is not None
+
+
+def test_row_errors_do_not_abort(app, test_products):
+    """Ошибочные строки пропускаются, остальные загружаются"""
+    with app.app_context():
+        result = import_text(
+            'article;name;price;category\n'
+            ';Без артикула;1;\n'
+            'BAD-1;Цена;abc;\n'
+            'BAD-2;Минус;-5;\n'
+            'OK-1;Нормальный;10;Нет такой\n'
+            'OK-2;Нормальный 2;10;\n',
+            create_missing=False
+        )
+        assert result.rows == 5
+        assert result.inserted == 1
+        assert [line for line, _ in result.errors] == [2, 3, 4, 5]
+        assert 'Нет такой' in result.errors[3][1]
+        assert Product.query.filter_by(article='OK-2').count() == 1
+
+
+def test_jsonl(app, test_categories):
+    """JSONL: по объекту в строке, неверные строки - ошибки"""
+    with app.app_context():
+        lines = [json.dumps({'article': 'J-1', 'name': 'Клей', 'price': 12.5,
+                             'category': 'Строительные материалы'}, ensure_ascii=False),
+                 '{broken',
+                 json.dumps({'article': 'J-2', 'name': 'Лента'}, ensure_ascii=False)]
+        result = import_text('\n'.join(lines) + '\n', 'jsonl')
+        assert (result.inserted, result.failed) == (2, 1)
+        assert result.errors[0][0] == 2
+        assert Product.query.filter_by(article='J-1').one().category_id == test_categories[2]
+
+
+def test_catalog_cli(app, runner, tmp_path):
+    """flask catalog import"""
+    path = tmp_path / 'catalog.csv'
+    path.write_text('Артикул;Наименование;Цена\n' +
+                    ''.join(f'CLI-{number};Товар {number};{number}\n' for number in range(250)),
+                    encoding='cp1251')
+    result = runner.invoke(args=['catalog', 'import', str(path), '--encoding', 'cp1251',
+                                 '--chunk-size', '100'])
+    assert result.exit_code == 0
+    assert 'добавлено: 250' in result.output
+    with app.app_context():
+        assert Product.query.filter(Product.article.like('CLI-%')).count() == 250
@@ -0,0 +1,66 @@
+import pytest
+from app import db
+from app.instrumentation import capture_queries, statement_shape
+from app.models import Product, StockBalance
+
+
+def add_stock(app, product_ids):
+    with app.app_context():
+        for product_id in product_ids:
+            db.session.add(StockBalance(product_id=product_id, cell_id=1, quantity=5))
+        db.session.commit()
+
+
+def test_statement_shape():
+    """Литералы и списки IN сворачиваются в одну форму"""
+    assert statement_shape('SELECT * FROM t WHERE id IN (?, ?, ?)') == \
+        statement_shape('SELECT *\n FROM t WHERE id IN (?, ?)')
+    assert statement_shape('SELECT 1 LIMIT 10') == 'SELECT ? LIMIT ?'
+
+
+def test_server_timing_header(client, auth):
+    """Каждый ответ содержит заголовок Server-Timing с временем SQL"""
+    auth.login()
+    response = client.get('/reports/stock')
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('db;dur=')
+    assert 'queries' in timing
+
+
+def test_repeated_queries_detected(client, auth, test_products, app):
+    """Запрос остатка по каждому товару определяется как повторяющийся"""
+    add_stock(app, test_products)
+    auth.login()
+
+    with capture_queries() as stats:
+        client.get('/reports/stock')
+
+    repeated = stats.repeated()
+    assert repeated
+    assert any('stock_balances' in shape for shape, count, _ in repeated)
+
+
+def test_debug_panel(client, auth, app):
+    """Панель SQL встраивается в HTML-страницу"""
+    app.config['SQL_DEBUG_PANEL'] = True
+    auth.login()
+    response = client.get('/reports/stock')
+    assert b'sql-debug-panel' in response.data
+
+
+def test_query_budget_exceeded(client, auth, test_products, app, query_budget):
+    """Фикстура бюджета падает при превышении числа запросов"""
+    add_stock(app, test_products)
+    auth.login()
+
+    with pytest.raises(AssertionError, match='Превышен бюджет'):
+        with query_budget(1):
+            client.get('/reports/stock')
+
+
+def test_query_budget_within_limit(client, auth, query_budget):
+    """Фикстура бюджета пропускает запрос в пределах лимита"""
+    auth.login()
+    with query_budget(20) as stats:
+        client.get('/auth/profile')
+    assert stats.count > 0
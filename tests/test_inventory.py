@@ -0,0 +1,184 @@
+import io
+from datetime import date
+from app import db
+from app.analytics import get_store
+from app.models import DocumentItem, StockBalance, StockReservation, DailyProductTurnover
+from app.instrumentation import capture_queries
+from app.services.inventory_service import InventoryService
+from app.services.period_service import PeriodService
+from app.services.reservation_service import ReservationService
+from app.services.stock_service import StockService
+
+
+def put_stock(product_id, cell_id, quantity):
+    db.session.add(StockBalance(product_id=product_id, cell_id=cell_id, quantity=quantity))
+
+
+def counts(document, text):
+    return InventoryService.load_counts(document, io.BytesIO(text.encode('utf-8')))
+
+
+def balances():
+    return {(balance.product_id, balance.cell_id): float(balance.quantity)
+            for balance in StockBalance.query.all()}
+
+
+def test_create_by_cell_range(app, test_products, test_cells):
+    """В инвентаризацию попадают ненулевые остатки ячеек диапазона"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[0], 10)
+        put_stock(test_products[1], test_cells[1], 5)
+        put_stock(test_products[1], test_cells[2], 0)
+        db.session.commit()
+
+        document = InventoryService.create('A-01', 'A-02')
+        assert document.doc_type == 'inventory'
+        assert document.doc_number.startswith('ИНВ-')
+        lines = {(item.product_id, item.cell_id): (float(item.book_quantity), float(item.quantity))
+                 for item in document.items}
+        assert lines == {(test_products[0], test_cells[0]): (10, 10),
+                         (test_products[1], test_cells[1]): (5, 5)}
+
+        category_id = db.session.get(DocumentItem, document.items.first().id).product.category_id
+        by_category = InventoryService.create(category_id=category_id)
+        assert by_category.items.count() == 1
+
+
+def test_counts_upload(app, test_products, test_cells):
+    """Повторы суммируются, ненайденное в пересчитанной ячейке - ноль"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[0], 10)
+        put_stock(test_products[1], test_cells[0], 4)
+        put_stock(test_products[1], test_cells[1], 5)
+        db.session.commit()
+        document = InventoryService.create()
+
+        result = counts(document, 'Ячейка;Артикул;Количество\n'
+                                  'A-01;TEST001;6\n'
+                                  'A-01;TEST001;\n'
+                                  'B-01;TEST002;2\n'
+                                  'Z-99;TEST002;1\n'
+                                  'A-01;NOPE;1\n')
+        assert (result.rows, result.updated, result.inserted, result.failed) == (5, 1, 1, 2)
+        lines = {(item.product_id, item.cell_id): float(item.quantity) for item in document.items}
+        assert lines == {(test_products[0], test_cells[0]): 7,
+                         (test_products[1], test_cells[0]): 0,
+                         (test_products[1], test_cells[1]): 5,
+                         (test_products[1], test_cells[2]): 2}
+
+
+def test_posting_sets_balances_and_adjustments(app, test_products, test_cells):
+    """Остатки ячеек равны факту, излишки и недостачи - проведенные приход и расход"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[0], 10)
+        put_stock(test_products[1], test_cells[0], 4)
+        db.session.commit()
+        store = get_store()
+        store.load()
+        document = InventoryService.create()
+        counts(document, 'cell;article;quantity\nA-01;TEST001;7\nB-01;TEST002;6\n')
+
+        with capture_queries() as stats:
+            success, message = InventoryService.process_document(document)
+        assert success, message
+        assert stats.count < 27
+
+        # TEST002 не нашли в пересчитанной A-01, зато нашли в B-01
+        assert balances() == {(test_products[0], test_cells[0]): 7,
+                              (test_products[1], test_cells[0]): 0,
+                              (test_products[1], test_cells[2]): 6}
+        assert document.status == 'posted'
+
+        derived = {item.doc_type: item for item in document.derived}
+        assert set(derived) == {'income', 'expense'}
+        assert all(item.status == 'posted' and item.base_id == document.id
+                   for item in derived.values())
+        income = derived['income'].items.one()
+        expense = derived['expense'].items.one()
+        assert (income.product_id, float(income.quantity)) == (test_products[1], 2)
+        assert (expense.product_id, float(expense.quantity)) == (test_products[0], 3)
+
+        # Учет зафиксирован на момент проведения
+        item = document.items.filter_by(product_id=test_products[0]).one()
+        assert (float(item.book_quantity), float(item.variance())) == (10, -3)
+
+        # Сама инвентаризация в оборот не попадает
+        assert DailyProductTurnover.query.filter_by(doc_type='inventory').count() == 0
+        assert DailyProductTurnover.query.filter_by(doc_type='expense').one().quantity == 3
+        store.refresh()
+        assert sorted(store.direction.tolist()) == [-1, 1]
+
+
+def test_posting_uses_current_balance(app, test_products, test_cells):
+    """Учет берется по остаткам на момент проведения, а не создания"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[0], 10)
+        db.session.commit()
+        document = InventoryService.create()
+        StockBalance.query.filter_by(product_id=test_products[0]).one().quantity = 12
+        db.session.commit()
+
+        success, message = InventoryService.process_document(document)
+        assert success
+        assert message == 'Инвентаризация проведена, созданы документы: ' \
+            + document.derived.one().doc_number
+        assert document.derived.one().doc_type == 'expense'
+        assert balances() == {(test_products[0], test_cells[0]): 10}
+
+
+def test_count_below_reserved_releases_reservations(app, test_products, test_cells, make_document):
+    """Факт меньше резерва: резервы черновиков на товар ячейки снимаются"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[0], 10)
+        db.session.commit()
+        draft = make_document('expense', 'РН-INV1', [(test_products[0], 8)])
+        assert ReservationService.reserve(draft)[0]
+
+        document = InventoryService.create()
+        counts(document, 'cell;article;quantity\nA-01;TEST001;5\n')
+        success, message = InventoryService.process_document(document)
+        assert success, message
+        assert 'Сняты резервы черновиков: 1' in message
+
+        balance = StockBalance.query.filter_by(product_id=test_products[0],
+                                               cell_id=test_cells[0]).one()
+        db.session.refresh(balance)
+        assert (float(balance.quantity), float(balance.reserved), float(balance.available)) == \
+            (5, 0, 5)
+        assert StockReservation.query.count() == 0
+
+
+def test_misplacement_is_not_movement(app, test_products, test_cells):
+    """Пересортица между ячейками одного товара не создает приход и расход"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[0], 5)
+        db.session.commit()
+        document = InventoryService.create()
+        counts(document, 'cell;article;quantity\nA-01;TEST001;3\nA-02;TEST001;2\n')
+
+        success, message = InventoryService.process_document(document)
+        assert success
+        assert message == 'Инвентаризация проведена, расхождений нет'
+        assert document.derived.count() == 0
+        assert balances() == {(test_products[0], test_cells[0]): 3,
+                              (test_products[0], test_cells[1]): 2}
+
+
+def test_closed_period_and_cancel(app, test_products, test_cells):
+    """Проведение в закрытом периоде запрещено; инвентаризация и ее документы не отменяются"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[0], 5)
+        db.session.commit()
+        old = InventoryService.create(doc_date=date(2024, 1, 15))
+        PeriodService.close(date(2024, 1, 31), workers=1)
+        success, message = InventoryService.process_document(old)
+        assert not success and 'закрыт' in message
+
+        document = InventoryService.create()
+        counts(document, 'cell;article\nA-01;TEST001\n')
+        assert InventoryService.process_document(document)[0]
+
+        assert StockService.cancel_document(document) == \
+            (False, 'Отмена инвентаризации не поддерживается')
+        success, message = StockService.cancel_document(document.derived.one())
+        assert not success and 'по инвентаризации' in message
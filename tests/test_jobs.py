@@ -0,0 +1,100 @@
+import pytest
+from app import db
+from app.models import Job, StockBalance
+from app.services.job_service import JobService, WORKER_ID
+from app.services.valuation_service import TOTAL
+import json
+
+
+def test_post_job_eager(app, test_products, admin_user, make_document):
+    """Задача проведения в синхронном режиме"""
+    app.config['JOBS_EAGER'] = True
+    with app.app_context():
+        doc = make_document('income', 'JOB-001', [(test_products[0], 10, 100)],
+                            author_id=admin_user)
+        job = JobService.enqueue('post', {'document_id': doc.id}, author_id=admin_user)
+
+        assert job.status == 'done'
+        assert job.progress == 100
+        db.session.refresh(doc)
+        assert doc.status == 'posted'
+        assert float(StockBalance.query.filter_by(product_id=test_products[0]).first().quantity) == 10
+
+
+def test_post_job_failure_recorded(app, test_products, admin_user, make_document):
+    """Ошибка проведения фиксируется в задаче"""
+    app.config['JOBS_EAGER'] = True
+    with app.app_context():
+        doc = make_document('income', 'JOB-001', [(test_products[0], 10, 100)],
+                            author_id=admin_user)
+        doc.status = 'posted'
+        db.session.commit()
+
+        job = JobService.enqueue('post', {'document_id': doc.id})
+        assert job.status == 'failed'
+        assert 'черновика' in job.message
+
+
+def test_export_job_in_thread(app, test_products, tmp_path):
+    """Выгрузка выполняется в пуле потоков и сохраняет файл"""
+    app.config['JOB_RESULTS_DIR'] = str(tmp_path)
+    with app.app_context():
+        db.session.add(StockBalance(product_id=test_products[0], cell_id=1, quantity=7))
+        db.session.commit()
+
+        job = JobService.enqueue('export', {'report': 'stock'})
+        app.extensions['job_runner'].wait(job.id, timeout=10)
+        db.session.refresh(job)
+
+        assert job.status == 'done'
+        with open(job.result_path, encoding='cp1251') as f:
+            content = f.read()
+        assert 'TEST001' in content
+
+
+def test_report_job_writes_json(app, test_products, tmp_path):
+    """Задача отчета сохраняет строки в JSON"""
+    app.config['JOBS_EAGER'] = True
+    app.config['JOB_RESULTS_DIR'] = str(tmp_path)
+    with app.app_context():
+        job = JobService.enqueue('report', {'report': 'valuation', 'detail': 1})
+        assert job.status == 'done'
+        rows = JobService.report_result(job)
+        assert rows[-1]['level'] == TOTAL
+        with open(job.result_path, encoding='utf-8') as f:
+            assert json.load(f) == rows
+
+        job = JobService.enqueue('report', {'report': 'unknown'})
+        assert job.status == 'failed' and 'Неизвестный отчет' in job.message
+
+
+def test_unknown_job_type(app):
+    """Неизвестный тип задачи"""
+    with app.app_context():
+        with pytest.raises(ValueError, match='Неизвестный тип'):
+            JobService.enqueue('unknown')
+
+
+def test_resume_interrupted_jobs(app, test_products, admin_user, make_document):
+    """Задачи умершего исполнителя возвращаются в очередь"""
+    app.config['JOBS_EAGER'] = True
+    with app.app_context():
+        doc = make_document('income', 'JOB-001', [(test_products[0], 10, 100)],
+                            author_id=admin_user)
+        dead = Job(job_type='post', status='running', worker='nohost-x:1',
+                   params=json.dumps({'document_id': doc.id}))
+        alive = Job(job_type='post', status='running', worker=WORKER_ID, params='{}')
+        db.session.add_all([dead, alive])
+        db.session.commit()
+
+        # Хост другой - считаем исполнителя живым
+        assert app.extensions['job_runner'].resume() == 0
+
+        dead.worker = WORKER_ID.rsplit(':', 1)[0] + ':999999999'
+        db.session.commit()
+        assert app.extensions['job_runner'].resume() == 1
+
+        db.session.refresh(dead)
+        db.session.refresh(alive)
+        assert dead.status == 'done'
+        assert alive.status == 'running'
@@ -0,0 +1,116 @@
+from datetime import date, timedelta
+from app import db
+from app.instrumentation import capture_queries
+from app.models import DocumentItem, LotAllocation, StockLot
+from app.services.lot_service import LotService
+from app.services.stock_service import StockService
+
+TODAY = date.today()
+
+
+def line(product_id, quantity, lot_number=None, expiry_date=None):
+    return {'product_id': product_id, 'quantity': quantity, 'lot_number': lot_number,
+            'expiry_date': expiry_date}
+
+
+def lots():
+    return {(lot.lot_number, lot.expiry_date): float(lot.quantity)
+            for lot in StockLot.query.order_by(StockLot.id)}
+
+
+def test_fefo_allocation_and_cancel(app, test_products, test_cells, test_supplier,
+                                    make_document):
+    """Расход списывает партии с ближайшим сроком, отмена возвращает их"""
+    with app.app_context():
+        late, soon = TODAY + timedelta(days=60), TODAY + timedelta(days=5)
+        income = make_document('income', 'ПН-L1', [
+            line(test_products[0], 5, 'L-60', late),
+            line(test_products[0], 3, 'L-5', soon),
+            line(test_products[0], 2, 'L-NA'),
+            line(test_products[0], 4),
+            line(test_products[1], 1, expiry_date=soon)
+        ], supplier_id=test_supplier)
+        assert StockService.process_income_document(income)[0]
+        # Строка без партии и срока партию не создает
+        assert lots() == {('L-60', late): 5, ('L-5', soon): 3, ('L-NA', None): 2,
+                          (None, soon): 1}
+
+        expense = make_document('expense', 'РН-L1', [line(test_products[0], 4),
+                                                     line(test_products[0], 5)])
+        assert expense.id
+        with capture_queries() as stats:
+            assert LotService.allocate([expense]) == 4
+        # Строки документа и все партии его товаров - по одному запросу
+        assert stats.count == 4
+        db.session.rollback()
+
+        assert StockService.process_expense_document(expense)[0]
+        assert lots() == {('L-60', late): 0, ('L-5', soon): 0, ('L-NA', None): 1,
+                          (None, soon): 1}
+        first, second = expense.items.order_by(DocumentItem.id).all()
+        assert [(lot.lot_number, float(quantity))
+                for lot, quantity in LotService.item_lots(expense)[first.id]] == \
+            [('L-5', 3), ('L-60', 1)]
+        assert [(lot.lot_number, float(quantity))
+                for lot, quantity in LotService.item_lots(expense)[second.id]] == \
+            [('L-60', 4), ('L-NA', 1)]
+
+        # Партии кончились - остаток строки списывается с товара без партии
+        rest = make_document('expense', 'РН-L2', [line(test_products[0], 3)])
+        assert StockService.process_expense_document(rest)[0]
+        assert lots()[('L-NA', None)] == 0
+
+        # Приход с израсходованной партией не отменяется, даже если остатка хватает
+        extra = make_document('income', 'ПН-L2', [line(test_products[0], 20)],
+                              supplier_id=test_supplier)
+        assert StockService.process_income_document(extra)[0]
+        success, message = StockService.cancel_document(income)
+        assert not success and 'уже частично израсходована' in message
+
+        assert StockService.cancel_document(rest)[0]
+        assert StockService.cancel_document(expense)[0]
+        assert LotAllocation.query.count() == 0
+        assert lots() == {('L-60', late): 5, ('L-5', soon): 3, ('L-NA', None): 2,
+                          (None, soon): 1}
+        assert StockService.cancel_document(income)[0]
+        assert set(lots().values()) == {0}
+
+
+def test_repeated_lot_is_added_up(app, test_products, test_cells, test_supplier,
+                                  make_document):
+    """Повторный приход той же партии увеличивает ее остаток"""
+    with app.app_context():
+        expiry = TODAY + timedelta(days=10)
+        for number in range(2):
+            document = make_document('income', f'ПН-R{number}',
+                                     [line(test_products[0], 2, 'L-1', expiry)],
+                                     supplier_id=test_supplier)
+            assert StockService.process_income_document(document)[0]
+        assert lots() == {('L-1', expiry): 4}
+
+
+def test_expiring_report(app, test_products, test_categories):
+    """Истекающие и истекшие партии с остатком по возрастанию срока"""
+    with app.app_context():
+        db.session.add_all([
+            StockLot(product_id=test_products[0], lot_number='OLD', quantity=1,
+                     expiry_date=TODAY - timedelta(days=2)),
+            StockLot(product_id=test_products[1], lot_number='SOON', quantity=2,
+                     expiry_date=TODAY + timedelta(days=3)),
+            StockLot(product_id=test_products[0], lot_number='EMPTY', quantity=0,
+                     expiry_date=TODAY + timedelta(days=1)),
+            StockLot(product_id=test_products[0], lot_number='LATER', quantity=5,
+                     expiry_date=TODAY + timedelta(days=40)),
+            StockLot(product_id=test_products[0], lot_number='NONE', quantity=5)
+        ])
+        db.session.commit()
+
+        rows = LotService.expiring(30)
+        assert [(row['lot_number'], row['days_left']) for row in rows] == \
+            [('OLD', -2), ('SOON', 3)]
+        assert float(rows[1]['amount']) == 1000
+        assert [row['lot_number'] for row in LotService.expiring(30, limit=1)] == ['OLD']
+        assert [row['lot_number'] for row in
+                LotService.expiring(30, category_id=test_categories[1])] == ['SOON']
+        totals = LotService.expiring_totals(30)
+        assert (totals['lots'], float(totals['amount'])) == (2, 2000)
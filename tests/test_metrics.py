@@ -0,0 +1,101 @@
+import gc
+import json
+import os
+import threading
+from app import metrics
+from app.services.stock_service import StockService
+
+
+def counter_value(name, **labels):
+    counters, _ = metrics.snapshot()
+    key = (name, tuple(labels.items()))
+    return counters.get(key, 0)
+
+
+def test_metrics_endpoint_prometheus_format(client):
+    """Счетчики и гистограммы запросов в формате Prometheus"""
+    client.get('/auth/login')
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    text = response.get_data(as_text=True)
+    assert '# TYPE warehouse_http_requests_total counter' in text
+    assert 'warehouse_http_requests_total{endpoint="auth.login",method="GET",status="200"}' in text
+    assert 'warehouse_http_request_duration_seconds_bucket{endpoint="auth.login",le="+Inf"}' in text
+    assert 'warehouse_http_request_db_queries_total{endpoint="auth.login"}' in text
+
+
+def test_posting_counters(app, test_products, admin_user, make_document):
+    """StockService учитывает проведенные документы и строки"""
+    before_docs = counter_value('warehouse_documents_posted_total', doc_type='income')
+    before_lines = counter_value('warehouse_document_lines_processed_total', doc_type='income')
+
+    with app.app_context():
+        doc = make_document('income', 'MET-001',
+                            [(product_id, 1, 1) for product_id in test_products],
+                            author_id=admin_user)
+        StockService.process_income_document(doc)
+
+    assert counter_value('warehouse_documents_posted_total', doc_type='income') == before_docs + 1
+    assert counter_value('warehouse_document_lines_processed_total',
+                         doc_type='income') == before_lines + 2
+
+
+def test_thread_shards_are_summed():
+    """Счетчики разных потоков суммируются при сборе"""
+    before = counter_value('warehouse_test_total')
+
+    threads = [threading.Thread(target=lambda: [metrics.inc('warehouse_test_total')
+                                                for _ in range(100)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter_value('warehouse_test_total') == before + 400
+
+
+def test_finished_thread_shards_are_retired():
+    """Счетчики завершившихся потоков переносятся в итог, наборы не копятся"""
+    before = counter_value('warehouse_retired_total')
+    shards = len(metrics._shards)
+
+    for _ in range(5):
+        thread = threading.Thread(target=metrics.inc, args=('warehouse_retired_total',))
+        thread.start()
+        thread.join()
+    gc.collect()
+
+    assert len(metrics._shards) == shards
+    assert counter_value('warehouse_retired_total') == before + 5
+
+
+def test_metrics_aggregated_across_processes(client, app, tmp_path):
+    """Снимки других процессов из METRICS_DIR складываются с текущим"""
+    app.config['METRICS_DIR'] = str(tmp_path)
+    labels = [['endpoint', 'index'], ['method', 'GET'], ['status', '200']]
+    other = {
+        'counters': [['warehouse_http_requests_total', labels, 1000]],
+        'histograms': [['warehouse_http_request_duration_seconds', [['endpoint', 'index']],
+                        [1] * len(metrics.BUCKETS) + [0.5, 1]]]
+    }
+    (tmp_path / f'metrics_{os.getppid()}.json').write_text(json.dumps(other), encoding='utf-8')
+    (tmp_path / 'metrics_999999999.json').write_text(json.dumps(other), encoding='utf-8')
+
+    own = counter_value('warehouse_http_requests_total', endpoint='index', method='GET',
+                        status='200')
+    text = client.get('/metrics').get_data(as_text=True)
+
+    assert f'warehouse_http_requests_total{{endpoint="index",method="GET",status="200"}} {own + 1000}' in text
+    # Снимок завершившегося процесса удален, свой снимок сохранен
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        [f'metrics_{os.getppid()}.json', f'metrics_{os.getpid()}.json'])
+
+
+def test_metrics_token(client, app):
+    """При METRICS_TOKEN метрики отдаются только с токеном"""
+    app.config['METRICS_TOKEN'] = 'secret'
+    assert client.get('/metrics').status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
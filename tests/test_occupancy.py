@@ -0,0 +1,98 @@
+from app import db
+from app.instrumentation import capture_queries
+from app.models import CellOccupancy, Product, StockBalance, WarehouseCell
+from app.services.occupancy_service import OccupancyService
+from app.services.stock_service import StockService
+from app.services.transfer_service import TransferService
+
+
+def setup_capacity(test_products, test_cells):
+    """TEST001 - 0.1 м³ и 2 кг, TEST002 - 0.5 м³; A-01 на 1 м³ и 2 товара, A-02 на 10 кг"""
+    first, second = (db.session.get(Product, product_id) for product_id in test_products)
+    first.volume, first.weight = 0.1, 2
+    second.volume = 0.5
+    a01, a02, _ = (db.session.get(WarehouseCell, cell_id) for cell_id in test_cells)
+    a01.max_volume, a01.max_slots = 1, 2
+    a02.max_weight = 10
+
+
+def occupancy(cell_id):
+    row = db.session.get(CellOccupancy, cell_id)
+    db.session.refresh(row)
+    return (float(row.volume), float(row.weight), row.slots,
+            None if row.free_volume is None else float(row.free_volume),
+            None if row.free_weight is None else float(row.free_weight), row.free_slots)
+
+
+def test_utilization_in_one_query(app, test_products, test_cells):
+    """Заполненность всех ячеек считается одним запросом"""
+    with app.app_context():
+        setup_capacity(test_products, test_cells)
+        db.session.add_all([
+            StockBalance(product_id=test_products[0], cell_id=test_cells[0], quantity=5),
+            StockBalance(product_id=test_products[1], cell_id=test_cells[0], quantity=1),
+            StockBalance(product_id=test_products[0], cell_id=test_cells[1], quantity=4),
+            StockBalance(product_id=test_products[1], cell_id=test_cells[2], quantity=0)
+        ])
+        db.session.commit()
+
+        with capture_queries() as stats:
+            rows = {row['cell'].name: row for row in OccupancyService.utilization()}
+        assert stats.count == 1
+        assert (rows['A-01']['slots'], float(rows['A-01']['volume']),
+                rows['A-01']['percent']) == (2, 1.0, 100.0)
+        assert (float(rows['A-02']['weight']), rows['A-02']['percent']) == (8.0, 80.0)
+        # Нулевой остаток места не занимает, но ячейку не даст удалить
+        assert (rows['B-01']['rows'], rows['B-01']['slots'], rows['B-01']['percent']) == \
+            (1, 0, None)
+
+
+def test_posting_refreshes_occupancy(app, test_products, test_cells, test_supplier, make_document):
+    """Проведение и отмена пересчитывают заполненность затронутых ячеек"""
+    with app.app_context():
+        setup_capacity(test_products, test_cells)
+        db.session.commit()
+        OccupancyService.rebuild()
+        assert occupancy(test_cells[0]) == (0, 0, 0, 1, None, 2)
+
+        document = make_document('income', 'ПН-OCC', [(test_products[0], 3, 1),
+                                                       (test_products[1], 1, 1)],
+                                 supplier_id=test_supplier)
+        assert StockService.process_income_document(document)[0]
+        assert occupancy(test_cells[0]) == (0.8, 6, 2, 0.2, None, 0)
+
+        transfer = TransferService.create([{'product_id': test_products[0],
+                                            'cell_id': test_cells[0],
+                                            'dest_cell_id': test_cells[1], 'quantity': 3}])
+        assert TransferService.process_document(transfer)[0]
+        assert occupancy(test_cells[0]) == (0.5, 0, 1, 0.5, None, 1)
+        assert occupancy(test_cells[1]) == (0.3, 6, 1, None, 4, None)
+
+        assert TransferService.cancel_document(transfer)[0]
+        assert StockService.cancel_document(document)[0]
+        assert occupancy(test_cells[0]) == (0, 0, 0, 1, None, 2)
+
+
+def test_candidates(app, test_products, test_cells):
+    """Подбор ячеек идет по свободной вместимости, без суммирования остатков"""
+    with app.app_context():
+        setup_capacity(test_products, test_cells)
+        db.session.add_all([
+            StockBalance(product_id=test_products[1], cell_id=test_cells[0], quantity=1),
+            StockBalance(product_id=test_products[1], cell_id=test_cells[2], quantity=1)])
+        db.session.get(WarehouseCell, test_cells[0]).max_slots = 1
+        db.session.commit()
+        OccupancyService.rebuild()
+        first, second = (db.session.get(Product, product_id) for product_id in test_products)
+
+        with capture_queries() as stats:
+            cells = [cell.name for cell, _ in OccupancyService.candidates(first, 4)]
+        assert stats.count == 1
+        # A-01 занята другим товаром, в A-02 поместится не больше 5 кг
+        assert cells == ['A-02', 'B-01']
+        assert [cell.name for cell, _ in OccupancyService.candidates(first, 6)] == ['B-01']
+        # Товар, который уже лежит в ячейке, места не занимает
+        assert [cell.name for cell, _ in OccupancyService.candidates(second, 1)] == \
+            ['A-01', 'A-02', 'B-01']
+        assert [cell.name for cell, _ in OccupancyService.candidates(second, 2)] == \
+            ['A-02', 'B-01']
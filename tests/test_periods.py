@@ -0,0 +1,159 @@
+import pytest
+from app import db
+from app.models import Document, ClosedPeriod, BalanceSnapshot
+from app.services.period_service import PeriodService
+from app.services.stock_service import StockService
+from datetime import date
+from decimal import Decimal
+
+
+@pytest.fixture
+def history(app, test_products, make_document):
+    """Движения за январь-март 2024"""
+    with app.app_context():
+        first, second = test_products
+        make_document('income', 'PC-001', [(first, 100)], date(2024, 1, 10), status='posted')
+        make_document('expense', 'PC-002', [(first, 30)], date(2024, 1, 20), status='posted')
+        make_document('income', 'PC-003', [(second, 5)], date(2024, 1, 31), status='posted')
+        make_document('expense', 'PC-004', [(first, 20)], date(2024, 2, 15), status='posted')
+        make_document('income', 'PC-005', [(first, 7)], date(2024, 3, 3), status='posted')
+    return test_products
+
+
+def snapshot(period_end):
+    totals = {}
+    for row in BalanceSnapshot.query.filter_by(period_end=period_end):
+        totals[row.product_id] = totals.get(row.product_id, 0) + row.quantity
+    return totals
+
+
+def cell_snapshot(period_end):
+    return {(row.product_id, row.cell_id): row.quantity for row in
+            BalanceSnapshot.query.filter_by(period_end=period_end)}
+
+
+def test_month_end():
+    assert PeriodService.month_end(date(2024, 2, 10)) == date(2024, 2, 29)
+    assert PeriodService.month_end(date(2023, 12, 31)) == date(2023, 12, 31)
+
+
+def test_close_chains_snapshots(app, history):
+    """Снимок месяца строится на предыдущем снимке и движениях месяца"""
+    first, second = history
+    with app.app_context():
+        assert PeriodService.close(date(2024, 1, 1), workers=1, chunk_size=1) == 2
+        assert PeriodService.close(date(2024, 2, 1), workers=1, chunk_size=1) == 2
+
+        assert snapshot(date(2024, 1, 31)) == {first: Decimal('70'), second: Decimal('5')}
+        assert snapshot(date(2024, 2, 29)) == {first: Decimal('50'), second: Decimal('5')}
+        assert db.session.get(ClosedPeriod, date(2024, 2, 29)).snapshot_rows == 2
+
+        with pytest.raises(ValueError, match='уже закрыт'):
+            PeriodService.close(date(2024, 2, 29))
+
+
+def test_snapshot_by_cell(app, test_products, test_cells, make_document):
+    """Снимок ведется по ячейкам: перемещения и расход из нескольких ячеек"""
+    from app.models import StockBalance
+    from app.services.transfer_service import TransferService
+
+    first, _ = test_products
+    with app.app_context():
+        draft = make_document('income', 'PC-010', [(first, 10)], date(2024, 1, 10), status='draft')
+        assert StockService.process_income_document(draft)[0]
+        moved = TransferService.create([{'product_id': first, 'cell_id': test_cells[0],
+                                         'dest_cell_id': test_cells[2], 'quantity': 6}],
+                                       doc_date=date(2024, 1, 12))
+        assert TransferService.process_document(moved)[0]
+        shipped = make_document('expense', 'PC-011', [(first, 7)], date(2024, 1, 15))
+        assert StockService.process_expense_document(shipped)[0]
+
+        PeriodService.close(date(2024, 1, 31), workers=1)
+        assert cell_snapshot(date(2024, 1, 31)) == {(first, test_cells[2]): Decimal('3')}
+        assert PeriodService.balance_at(first, date(2024, 1, 12), test_cells[2]) == 6
+        assert PeriodService.balance_at(first, date(2024, 1, 12), test_cells[0]) == 4
+        assert sum(row.quantity for row in StockBalance.query.filter_by(product_id=first)) == 3
+
+
+def test_expense_cancel_restores_cells(app, test_products, test_cells, make_document):
+    """Отмена расхода возвращает товар в ячейки, из которых он списан"""
+    from app.models import StockBalance
+    from app.services.transfer_service import TransferService
+
+    first, _ = test_products
+    with app.app_context():
+        draft = make_document('income', 'PC-020', [(first, 10)], date(2024, 1, 10), status='draft')
+        assert StockService.process_income_document(draft)[0]
+        moved = TransferService.create([{'product_id': first, 'cell_id': test_cells[0],
+                                         'dest_cell_id': test_cells[2], 'quantity': 10}],
+                                       doc_date=date(2024, 1, 12))
+        assert TransferService.process_document(moved)[0]
+        shipped = make_document('expense', 'PC-021', [(first, 4)], date(2024, 1, 15))
+        assert StockService.process_expense_document(shipped)[0]
+
+        assert StockService.cancel_document(shipped)[0]
+        assert {row.cell_id: row.quantity for row in StockBalance.query.filter_by(
+            product_id=first) if row.quantity} == {test_cells[2]: 10}
+
+        PeriodService.close(date(2024, 1, 31), workers=1)
+        assert cell_snapshot(date(2024, 1, 31)) == {(first, test_cells[2]): Decimal('10')}
+
+
+def test_balance_at_uses_nearest_snapshot(app, history):
+    """Исторический остаток: снимок + движения после него"""
+    first, _ = history
+    with app.app_context():
+        before_close = [PeriodService.balance_at(first, day) for day in
+                        (date(2024, 1, 15), date(2024, 2, 20), date(2024, 3, 5))]
+        PeriodService.close(date(2024, 1, 31), workers=1)
+
+        # Движения января больше не читаются - сумма из снимка
+        BalanceSnapshot.query.filter_by(product_id=first).update({'quantity': 1000})
+        db.session.commit()
+        assert PeriodService.balance_at(first, date(2024, 2, 20)) == 980
+        assert PeriodService.balance_at(first, date(2024, 1, 15)) == before_close[0] == 100
+        assert before_close[1:] == [50, 57]
+
+
+def test_posting_into_closed_period_rejected(app, history, admin_user, make_document):
+    """Проведение и отмена документов закрытого периода запрещены"""
+    first, _ = history
+    with app.app_context():
+        PeriodService.close(date(2024, 2, 1), workers=1)
+
+        draft = make_document('income', 'PC-006', [(first, 1)], date(2024, 2, 10), status='draft')
+        success, message = StockService.process_income_document(draft)
+        assert not success
+        assert 'закрыт' in message
+        assert db.session.get(Document, draft.id).status == 'draft'
+
+        posted = Document.query.filter_by(doc_number='PC-004').first()
+        success, message = StockService.cancel_document(posted)
+        assert not success
+
+        PeriodService.reopen(date(2024, 2, 1))
+        success, _ = StockService.process_income_document(draft)
+        assert success
+
+
+def test_period_cli(app, history, runner, make_document):
+    """Команды закрытия, пересчета и открытия месяца"""
+    first, _ = history
+    result = runner.invoke(args=['period', 'close', '--month', '2024-01', '--workers', '1'])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(args=['period', 'close', '--month', '2024-02', '--workers', '1'])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        make_document('income', 'PC-007', [(first, 3)], date(2024, 1, 5), status='posted')
+    result = runner.invoke(args=['period', 'close', '--month', '2024-01', '--rebuild',
+                                 '--workers', '1'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert snapshot(date(2024, 1, 31))[first] == 73
+        assert snapshot(date(2024, 2, 29))[first] == 53
+
+    result = runner.invoke(args=['period', 'reopen', '2024-01'])
+    assert 'Открыты периоды: 01.2024, 02.2024' in result.output
+    result = runner.invoke(args=['period', 'reopen', '2024-01'])
+    assert result.exit_code != 0
@@ -0,0 +1,134 @@
+import pytest
+from app import db
+from app.models import StockBalance
+from app.services.replenishment_service import ReplenishmentService
+from datetime import date, datetime, timedelta
+from statistics import NormalDist
+
+Z = NormalDist().inv_cdf(0.95)
+
+
+@pytest.fixture
+def document(make_document):
+    """Документ по цене 100, созданный за lead_days до проведения"""
+    def make(doc_type, number, doc_date, lines, status='posted', lead_days=0, posted_at=None,
+             **fields):
+        if status == 'posted' and posted_at is None:
+            posted_at = datetime.combine(doc_date, datetime.min.time())
+        created_at = (posted_at or datetime.now()) - timedelta(days=lead_days)
+        lines = [(product_id, quantity, 100) for product_id, quantity in lines]
+        return make_document(doc_type, number, lines, doc_date, status=status,
+                             posted_at=posted_at, created_at=created_at, **fields)
+    return make
+
+
+@pytest.fixture
+def history(app, test_products, test_supplier, test_cells, document):
+    """
+    10 дней истории: товар 1 - расход 5 в день, товар 2 - 20 за один день;
+    приходы поставщика со сроками 4 и 2 дня; остатки 20 и 100
+    """
+    app.config['REPLENISHMENT_LOOKBACK_DAYS'] = 10
+    today = date.today()
+    steady, spiky = test_products
+    with app.app_context():
+        for day in range(10):
+            document('expense', f'RP-{day}', today - timedelta(days=day), [(steady, 5)])
+        document('expense', 'RP-10', today - timedelta(days=3), [(spiky, 20)])
+        document('income', 'RP-11', today - timedelta(days=8), [(steady, 60)],
+                 supplier_id=test_supplier, lead_days=4)
+        document('income', 'RP-12', today - timedelta(days=5), [(spiky, 120)],
+                 supplier_id=test_supplier, lead_days=2)
+        db.session.add_all([
+            StockBalance(product_id=steady, cell_id=test_cells[0], quantity=20),
+            StockBalance(product_id=spiky, cell_id=test_cells[0], quantity=100)
+        ])
+        db.session.commit()
+    return steady, spiky
+
+
+def test_reorder_points(app, history, test_supplier):
+    """Спрос, срок поставки, страховой запас и точка заказа"""
+    steady, spiky = history
+    with app.app_context():
+        assert ReplenishmentService.lead_times()[test_supplier] == pytest.approx((3, 1))
+
+        plan = ReplenishmentService.plan()
+        index = {int(product_id): i for i, product_id in enumerate(plan['product_id'])}
+        s, p = index[steady], index[spiky]
+
+        assert plan['daily_demand'][s] == pytest.approx(5)
+        assert plan['demand_std'][s] == pytest.approx(0)
+        # 20 за один из 10 дней: среднее 2, sd = sqrt(40 - 4) = 6
+        assert plan['daily_demand'][p] == pytest.approx(2)
+        assert plan['demand_std'][p] == pytest.approx(6)
+
+        assert plan['safety_stock'][s] == pytest.approx(Z * 5)
+        assert plan['reorder_point'][s] == pytest.approx(15 + Z * 5)
+        assert plan['safety_stock'][p] == pytest.approx(Z * 112 ** 0.5)
+
+        # Товар 1 ниже точки заказа: до нее плюс 14 дней спроса
+        assert plan['order_quantity'][s] == 74
+        assert plan['order_quantity'][p] == 0
+
+        low_stock = ReplenishmentService.low_stock()
+        assert [item['id'] for item in low_stock] == [steady]
+        assert low_stock[0]['quantity'] == 20
+
+
+def test_low_stock_cached_until_movements_change(app, history, document):
+    """Точки заказа для главной считаются один раз до изменения движений"""
+    from app.instrumentation import capture_queries
+
+    steady, spiky = history
+    with app.app_context():
+        assert [item['id'] for item in ReplenishmentService.low_stock()] == [steady]
+        with capture_queries() as stats:
+            assert [item['id'] for item in ReplenishmentService.low_stock()] == [steady]
+        # Дозагрузка хранилища, остатки товаров со спросом и их названия
+        assert stats.count == 3
+
+        StockBalance.query.filter_by(product_id=steady).update({'quantity': 1000})
+        document('expense', 'RP-15', date.today(), [(spiky, 100)], posted_at=datetime.now())
+        db.session.commit()
+        assert [item['id'] for item in ReplenishmentService.low_stock()] == [spiky]
+
+
+def test_draft_income_counts_as_on_order(app, history, document):
+    """Черновик прихода закрывает потребность"""
+    steady, spiky = history
+    with app.app_context():
+        assert [row['id'] for _, rows in ReplenishmentService.suggestions()
+                for row in rows] == [steady]
+
+        document('income', 'RP-13', date.today(), [(steady, 30)], status='draft')
+        db.session.commit()
+        assert ReplenishmentService.suggestions() == []
+
+
+def test_demand_refreshed_on_posting(app, history, document):
+    """Новый расход учитывается без перезагрузки хранилища"""
+    steady, spiky = history
+    with app.app_context():
+        before = ReplenishmentService.plan()['daily_demand'].copy()
+        document('expense', 'RP-14', date.today(), [(spiky, 30)], posted_at=datetime.now())
+        db.session.commit()
+        after = ReplenishmentService.plan()['daily_demand']
+        assert after.sum() == pytest.approx(before.sum() + 3)
+
+
+def test_create_orders(app, history, test_supplier, admin_user):
+    """Черновики приходов по поставщикам из рекомендаций"""
+    steady, spiky = history
+    with app.app_context():
+        documents = ReplenishmentService.create_orders([test_supplier], author_id=admin_user)
+        assert len(documents) == 1
+        document = documents[0]
+        assert document.status == 'draft'
+        assert document.doc_type == 'income'
+        assert document.supplier_id == test_supplier
+        assert document.doc_number.startswith('ПН-')
+        assert [(item.product_id, float(item.quantity)) for item in document.items] == [(steady, 74)]
+
+        # Повторно заказывать нечего - количество уже в черновике
+        assert ReplenishmentService.create_orders([test_supplier]) == []
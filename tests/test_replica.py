@@ -0,0 +1,167 @@
+import pytest
+from app import create_app, db
+from app.models import User, Product, StockBalance, DailyProductTurnover, TurnoverBucket
+from app.services.bucket_service import BucketService
+from datetime import date, timedelta
+from app.replica import replica_engine, replica_lag, sync_replica, SYNC_STATE_TABLE
+from config import Config
+from sqlalchemy import text
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    """Отдельное приложение с основной БД и репликой в двух файлах SQLite"""
+    class ReplicaConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "primary.db"}'
+        REPLICA_DATABASE_URI = f'sqlite:///{tmp_path / "replica.db"}'
+        REPLICA_MAX_LAG = 300
+
+    app = create_app(ReplicaConfig)
+    with app.app_context():
+        db.create_all()
+        admin = User(username='admin', email='admin@test.com', role='admin')
+        admin.set_password('admin123')
+        db.session.add(admin)
+        db.session.add(Product(article='REP001', name='Товар на реплике', price=10))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        replica_engine().dispose()
+
+
+def login(client):
+    client.post('/auth/login', data={'username': 'admin', 'password': 'admin123'})
+
+
+def test_sync_copies_primary(replica_app):
+    """Синхронизация переносит данные и фиксирует время"""
+    assert replica_lag() is None
+
+    sync_replica()
+
+    with replica_engine().connect() as conn:
+        assert conn.execute(text('SELECT COUNT(*) FROM products')).scalar() == 1
+    assert replica_lag() < 5
+
+
+def test_reports_read_from_replica(replica_app):
+    """Отчёт читает реплику: товар, добавленный после синхронизации, не виден"""
+    db.session.add(StockBalance(product_id=1, cell_id=1, quantity=5))
+    db.session.commit()
+    sync_replica()
+
+    product = Product(article='NEW001', name='Только в основной', price=10)
+    db.session.add(product)
+    db.session.flush()
+    db.session.add(StockBalance(product_id=product.id, cell_id=1, quantity=5))
+    db.session.commit()
+
+    client = replica_app.test_client()
+    login(client)
+    response = client.get('/reports/stock')
+    assert response.status_code == 200
+    assert b'REP001' in response.data
+    assert b'NEW001' not in response.data
+
+
+def test_stale_replica_falls_back_to_primary(replica_app):
+    """Отставшая реплика не используется"""
+    sync_replica()
+    with replica_engine().begin() as conn:
+        conn.execute(text(f"UPDATE {SYNC_STATE_TABLE} SET synced_at = '2000-01-01 00:00:00'"))
+
+    db.session.add(Product(article='NEW002', name='Только в основной', price=10))
+    db.session.commit()
+
+    from app.replica import read_replica
+
+    @read_replica
+    def view():
+        return {p.article for p in Product.query.all()}
+
+    assert view() == {'REP001', 'NEW002'}
+
+
+def test_writes_stay_on_primary(replica_app):
+    """Запись внутри "репличного" запроса попадает в основную БД"""
+    sync_replica()
+
+    from app.replica import read_replica
+
+    @read_replica
+    def view():
+        db.session.add(Product(article='NEW003', name='Запись', price=1))
+        db.session.flush()
+        articles = {p.article for p in Product.query.all()}
+        db.session.commit()
+        return articles
+
+    assert 'NEW003' in view()
+    with db.engines[None].connect() as conn:
+        assert conn.execute(
+            text("SELECT COUNT(*) FROM products WHERE article = 'NEW003'")
+        ).scalar() == 1
+    with replica_engine().connect() as conn:
+        assert conn.execute(
+            text("SELECT COUNT(*) FROM products WHERE article = 'NEW003'")
+        ).scalar() == 0
+
+
+def test_closed_buckets_cached_from_primary(replica_app):
+    """Кэш закрытых интервалов не заполняется устаревшими данными реплики"""
+    last_week = date.today() - timedelta(days=7)
+    sync_replica()
+    db.session.add(DailyProductTurnover(day=last_week, product_id=1, doc_type='income',
+                                        quantity=3, total_sum=30, operations=1))
+    db.session.commit()
+
+    from app.replica import read_replica
+
+    @read_replica
+    def view():
+        return BucketService.turnover_series(last_week, date.today(), 'week')
+
+    assert view()[0]['total_sum'] == 30.0
+    assert float(TurnoverBucket.query.filter_by(granularity='week').one().total_sum) == 30.0
+
+
+def test_replica_sync_command(replica_app):
+    """CLI-команда синхронизации"""
+    result = replica_app.test_cli_runner().invoke(args=['replica', 'sync'])
+    assert 'Реплика синхронизирована' in result.output
+
+
+def test_streamed_export_reads_from_replica(replica_app):
+    """Потоковая выгрузка читает реплику и после выхода из представления"""
+    db.session.add(StockBalance(product_id=1, cell_id=1, quantity=5))
+    db.session.commit()
+    sync_replica()
+
+    product = Product(article='NEW004', name='Только в основной', price=10)
+    db.session.add(product)
+    db.session.flush()
+    db.session.add(StockBalance(product_id=product.id, cell_id=1, quantity=5))
+    db.session.commit()
+
+    client = replica_app.test_client()
+    login(client)
+    response = client.get('/reports/export/valuation?detail=1')
+    assert response.status_code == 200
+    assert b'REP001' in response.data
+    assert b'NEW004' not in response.data
+
+
+def test_lag_check_is_cached(replica_app):
+    """Отставание реплики проверяется не чаще REPLICA_CHECK_INTERVAL"""
+    from app.replica import replica_available
+
+    sync_replica()
+    assert replica_available()
+    with replica_engine().begin() as conn:
+        conn.execute(text(f"UPDATE {SYNC_STATE_TABLE} SET synced_at = '2000-01-01 00:00:00'"))
+    assert replica_available()
+
+    replica_app.config['REPLICA_CHECK_INTERVAL'] = 0
+    assert not replica_available()
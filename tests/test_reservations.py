@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+from app import db
+from app.models import StockBalance, StockReservation
+from app.services.reservation_service import ReservationService, ReservationSweeper
+from app.services.stock_service import DEFAULT_CELL_ID, StockService
+
+
+def balance(product_id):
+    row = StockBalance.query.filter_by(product_id=product_id, cell_id=DEFAULT_CELL_ID).one()
+    db.session.refresh(row)
+    return float(row.quantity), float(row.reserved), float(row.available)
+
+
+def test_drafts_compete_for_stock(app, test_products, test_cells, make_document):
+    """Второй черновик не резервирует занятые единицы и не проводится"""
+    with app.app_context():
+        product = test_products[0]
+        assert StockService.process_income_document(
+            make_document('income', 'ПН-R1', [(product, 10)]))[0]
+
+        first = make_document('expense', 'РН-R1', [(product, 4), (product, 3)])
+        second = make_document('expense', 'РН-R2', [(product, 5)])
+        assert ReservationService.reserve(first)[0]
+        # Повторный резерв заменяет прежний
+        assert ReservationService.reserve(first)[0]
+        assert balance(product) == (10, 7, 3)
+
+        success, message = ReservationService.reserve(second)
+        assert not success and 'свободно: 3' in message
+        assert balance(product) == (10, 7, 3)
+        assert ReservationService.available([product]) == {product: 3}
+
+        success, message = StockService.process_expense_document(second)
+        assert not success and 'доступно: 3' in message
+        # Собственный резерв документа учитывается при проведении и снимается
+        assert StockService.process_expense_document(first)[0]
+        assert balance(product) == (3, 0, 3)
+        assert StockReservation.query.count() == 0
+
+
+def test_expired_reservations_swept(app, test_products, test_cells, make_document):
+    """Просроченные резервы снимаются, остальные остаются"""
+    with app.app_context():
+        product = test_products[0]
+        assert StockService.process_income_document(
+            make_document('income', 'ПН-R2', [(product, 10)]))[0]
+        stale = make_document('expense', 'РН-R3', [(product, 6)])
+        fresh = make_document('expense', 'РН-R4', [(product, 1)])
+        ReservationService.reserve(stale, now=datetime.utcnow() - timedelta(hours=25))
+        ReservationService.reserve(fresh)
+        assert balance(product) == (10, 7, 3)
+        assert ReservationService.reserved_until(stale) < datetime.utcnow()
+
+        assert ReservationService.expire() == 1
+        assert ReservationService.expire() == 0
+        assert balance(product) == (10, 1, 9)
+        assert ReservationService.reserved_until(stale) is None
+        assert ReservationService.document_reserved(fresh) == {product: 1}
+
+
+def test_sweeper_lease_single_holder(app):
+    """Просроченные резервы снимает один процесс; истекшую аренду берет другой"""
+    with app.app_context():
+        now = datetime.utcnow()
+        first, second = ReservationSweeper(), ReservationSweeper()
+        second.holder = 'other-host:1'
+        assert first.acquire(60, now)
+        assert not second.acquire(60, now + timedelta(seconds=60))
+        assert first.acquire(60, now + timedelta(seconds=60))
+        assert not second.acquire(60, now + timedelta(seconds=200))
+        assert second.acquire(60, now + timedelta(seconds=241))
+        assert not first.acquire(60, now + timedelta(seconds=242))
+
+
+def test_reserved_stock_not_taken(app, test_products, test_cells, make_document):
+    """Отмена прихода не списывает зарезервированный черновиками товар"""
+    with app.app_context():
+        product = test_products[0]
+        income = make_document('income', 'ПН-R3', [(product, 5)])
+        assert StockService.process_income_document(income)[0]
+        assert ReservationService.reserve(make_document('expense', 'РН-R5', [(product, 2)]))[0]
+
+        success, message = StockService.cancel_document(income)
+        assert not success and 'недостаточно товара' in message
+        assert balance(product) == (5, 2, 3)
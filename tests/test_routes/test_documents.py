@@ -1,7 +1,7 @@
 import pytest
 from app import db
 from app.models import Document, DocumentItem, Product, Supplier, StockBalance
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 
 def test_document_list_page(client, auth):
     """Тест страницы списка документов"""
@@ -441,4 +441,239 @@ def test_document_create_with_invalid_data(client, auth):
     }, follow_redirects=True)
     
     assert response.status_code == 200
-    # Должна быть ошибка валидации
\ No newline at end of file
+    # Должна быть ошибка валидации
+def test_replenishment_page_and_create(client, auth, app, test_products, test_supplier, test_cells):
+    """Рекомендации поставщикам и создание черновиков приходов"""
+    auth.login()
+    with app.app_context():
+        product_id = test_products[0]
+        for day in range(5):
+            doc = Document(doc_type='expense', doc_number=f'RPL-{day}',
+                           doc_date=date.today() - timedelta(days=day), status='posted',
+                           posted_at=datetime.now())
+            db.session.add(doc)
+            db.session.flush()
+            db.session.add(DocumentItem(document_id=doc.id, product_id=product_id,
+                                        quantity=10, price=100))
+        db.session.commit()
+
+    response = client.get('/documents/replenishment')
+    assert response.status_code == 200
+    assert 'Тестовый поставщик'.encode('utf-8') in response.data
+    assert b'TEST001' in response.data
+
+    response = client.post('/documents/replenishment/create',
+                           data={'supplier_id': str(test_supplier)}, follow_redirects=True)
+    assert response.status_code == 200
+    assert 'Созданы черновики приходов'.encode('utf-8') in response.data
+    with app.app_context():
+        document = Document.query.filter_by(doc_type='income', status='draft').one()
+        assert document.supplier_id == test_supplier
+        assert document.items.first().product_id == product_id
+
+
+def test_document_import_upload(client, auth, app, test_products):
+    """Загрузка накладных через форму"""
+    import io
+    
+    auth.login()
+    response = client.get('/documents/import')
+    assert response.status_code == 200
+    
+    data = {
+        'file': (io.BytesIO('Номер;Дата;Поставщик;Артикул;Количество\n'
+                            'W-1;2024-03-01;Тестовый поставщик;TEST001;4\n'
+                            'W-2;2024-03-01;Тестовый поставщик;NOPE;1\n'
+                            .encode('utf-8')), 'note.csv'),
+        'encoding': 'utf-8-sig'
+    }
+    response = client.post('/documents/import', data=data,
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert 'Документов: 1'.encode('utf-8') in response.data
+    assert 'Товар с артикулом &#34;NOPE&#34; не найден'.encode('utf-8') in response.data
+    with app.app_context():
+        document = Document.query.filter_by(external_number='W-1').one()
+        assert document.status == 'draft'
+
+
+def test_inventory_workflow(client, auth, app, test_products, test_cells):
+    """Создание инвентаризации, загрузка пересчета и проведение через интерфейс"""
+    import io
+    
+    with app.app_context():
+        db.session.add(StockBalance(product_id=test_products[0], cell_id=test_cells[0],
+                                    quantity=10))
+        db.session.commit()
+    
+    auth.login()
+    assert client.get('/documents/inventory/create').status_code == 200
+    response = client.post('/documents/inventory/create', data={
+        'doc_date': date.today().isoformat(), 'cell_from': 'A-01', 'cell_to': 'A-02',
+        'category_id': 0
+    })
+    assert response.status_code == 302
+    with app.app_context():
+        document = Document.query.filter_by(doc_type='inventory').one()
+        document_id = document.id
+    
+    response = client.get(f'/documents/{document_id}')
+    assert response.status_code == 200
+    assert 'Загрузка пересчета'.encode('utf-8') in response.data
+    
+    response = client.post(f'/documents/{document_id}/counts', data={
+        'file': (io.BytesIO(b'cell;article;quantity\nA-01;TEST001;8\n'), 'scan.csv'),
+        'encoding': 'utf-8-sig'
+    }, content_type='multipart/form-data', follow_redirects=True)
+    assert 'обновлено: 1'.encode('utf-8') in response.data
+    
+    response = client.post(f'/documents/{document_id}/post', follow_redirects=True)
+    assert 'Инвентаризация проведена'.encode('utf-8') in response.data
+    with app.app_context():
+        assert float(StockBalance.query.filter_by(product_id=test_products[0]).one().quantity) == 8
+        assert Document.query.filter_by(base_id=document_id, doc_type='expense').count() == 1
+
+
+def test_transfer_create_and_post(client, auth, app, test_products, test_cells):
+    """Перемещение всего содержимого ячейки через форму со сразу проведением"""
+    with app.app_context():
+        db.session.add(StockBalance(product_id=test_products[0], cell_id=test_cells[0],
+                                    quantity=6))
+        db.session.commit()
+    
+    auth.login()
+    assert client.get('/documents/transfer/create').status_code == 200
+    response = client.post('/documents/transfer/create', data={
+        'doc_date': date.today().isoformat(), 'cell_id': test_cells[0],
+        'dest_cell_id': test_cells[2], 'post': 'y'
+    }, follow_redirects=True)
+    assert response.status_code == 200
+    assert 'Документ успешно проведён'.encode('utf-8') in response.data
+    assert 'B-01'.encode('utf-8') in response.data
+    with app.app_context():
+        moved = StockBalance.query.filter_by(product_id=test_products[0],
+                                             cell_id=test_cells[2]).one()
+        assert float(moved.quantity) == 6
+
+
+def test_slotting_page_creates_transfer(client, auth, app, test_products, test_cells):
+    """Рекомендации размещения и черновик перемещения по выбранным товарам"""
+    with app.app_context():
+        db.session.add(StockBalance(product_id=test_products[0], cell_id=test_cells[2],
+                                    quantity=4))
+        db.session.add(StockBalance(product_id=test_products[1], cell_id=test_cells[0],
+                                    quantity=2))
+        document = Document(doc_type='expense', doc_number='РН-SLOT', doc_date=date.today(),
+                            status='posted')
+        db.session.add(document)
+        db.session.flush()
+        db.session.add(DocumentItem(document_id=document.id, product_id=test_products[0],
+                                    quantity=1, price=1))
+        db.session.commit()
+    
+    auth.login()
+    response = client.get('/documents/slotting')
+    assert response.status_code == 200
+    assert 'Экономия'.encode('utf-8') in response.data
+    assert b'TEST001' in response.data
+    
+    response = client.post('/documents/slotting/create',
+                           data={'product_id': [test_products[0]]}, follow_redirects=True)
+    assert 'Создан черновик перемещения'.encode('utf-8') in response.data
+    with app.app_context():
+        transfer = Document.query.filter_by(doc_type='transfer').one()
+        item = transfer.items.one()
+        assert (item.product_id, item.cell_id, item.dest_cell_id) == \
+            (test_products[0], test_cells[2], test_cells[0])
+
+
+def test_income_with_lot_and_fefo_view(client, auth, app, test_products, test_supplier,
+                                       test_cells):
+    """Партия и срок из формы прихода; в проведенном расходе видны списанные партии"""
+    auth.login()
+    client.post('/documents/create', data={
+        'doc_type': 'income', 'doc_date': date.today().isoformat(),
+        'supplier_id': test_supplier,
+        'product_0': test_products[0], 'quantity_0': 4, 'price_0': 10,
+        'lot_0': 'LOT-A', 'expiry_0': '2031-01-31',
+        'product_1': test_products[0], 'quantity_1': 1, 'price_1': 10,
+        'lot_1': 'LOT-B', 'expiry_1': 'неверно'
+    })
+    with app.app_context():
+        income = Document.query.filter_by(doc_type='income').one()
+        assert sorted((item.lot_number, item.expiry_date) for item in income.items) == \
+            [('LOT-A', date(2031, 1, 31)), ('LOT-B', None)]
+        income_id = income.id
+    client.post(f'/documents/{income_id}/post')
+    
+    client.post('/documents/create', data={
+        'doc_type': 'expense', 'doc_date': date.today().isoformat(),
+        'product_0': test_products[0], 'quantity_0': 2, 'price_0': 10, 'lot_0': 'IGNORED'
+    })
+    with app.app_context():
+        expense = Document.query.filter_by(doc_type='expense').one()
+        assert expense.items.one().lot_number is None
+        expense_id = expense.id
+    client.post(f'/documents/{expense_id}/post')
+    
+    response = client.get(f'/documents/{expense_id}')
+    assert 'LOT-A'.encode('utf-8') in response.data
+    assert '31.01.2031'.encode('utf-8') in response.data
+
+
+def test_expense_draft_reserves_stock(client, auth, app, test_products, test_cells):
+    """Черновик расхода резервирует товар; удаление черновика снимает резерв"""
+    auth.login()
+    quantity = 10
+    with app.app_context():
+        db.session.add(StockBalance(product_id=test_products[0], cell_id=1, quantity=quantity))
+        db.session.commit()
+    
+    response = client.post('/documents/create', data={
+        'doc_type': 'expense', 'doc_date': date.today().isoformat(),
+        'product_0': test_products[0], 'quantity_0': 2, 'price_0': 10
+    }, follow_redirects=True)
+    assert 'Товар зарезервирован до'.encode('utf-8') in response.data
+    assert 'Продлить резерв'.encode('utf-8') in response.data
+    assert client.get('/products/scan?code=TEST001').json['available'] == quantity - 2
+    
+    response = client.post('/documents/create', data={
+        'doc_type': 'expense', 'doc_date': date.today().isoformat(),
+        'product_0': test_products[0], 'quantity_0': quantity, 'price_0': 10
+    }, follow_redirects=True)
+    assert 'Товар не зарезервирован: Недостаточно свободного товара'.encode('utf-8') \
+        in response.data
+    
+    with app.app_context():
+        first = Document.query.filter_by(doc_type='expense').order_by(Document.id).first()
+        first_id = first.id
+    client.post(f'/documents/{first_id}/delete')
+    with app.app_context():
+        stock = StockBalance.query.filter_by(product_id=test_products[0], cell_id=1).one()
+        assert (float(stock.reserved), float(stock.available)) == (0, quantity)
+
+
+def test_partial_post_creates_backorder(client, auth, app, test_products, test_cells):
+    """Кнопка «Провести доступное» создает связанный черновик недопоставки"""
+    auth.login()
+    with app.app_context():
+        db.session.add(StockBalance(product_id=test_products[0], cell_id=1, quantity=3))
+        db.session.commit()
+    client.post('/documents/create', data={
+        'doc_type': 'expense', 'doc_date': date.today().isoformat(),
+        'product_0': test_products[0], 'quantity_0': 5, 'price_0': 10
+    })
+    with app.app_context():
+        expense_id = Document.query.filter_by(doc_type='expense').one().id
+    
+    response = client.post(f'/documents/{expense_id}/post', data={'partial': '1'},
+                           follow_redirects=True)
+    assert 'Документ проведён частично'.encode('utf-8') in response.data
+    with app.app_context():
+        backorder = Document.query.filter_by(backorder_for_id=expense_id).one()
+        assert float(backorder.items.one().quantity) == 2
+        backorder_id = backorder.id
+    
+    response = client.get(f'/documents/{backorder_id}')
+    assert 'Недопоставка по документу'.encode('utf-8') in response.data
+    assert 'Провести доступное'.encode('utf-8') in response.data
@@ -0,0 +1,103 @@
+import pytest
+from app import db
+from app.models import Job, Product
+
+
+def test_large_document_posted_in_background(client, auth, test_products, app, make_document):
+    """Документ с большим числом строк проводится фоновой задачей"""
+    app.config['JOBS_EAGER'] = True
+    app.config['JOB_POST_MIN_ITEMS'] = 2
+    auth.login()
+
+    with app.app_context():
+        doc = make_document('income', 'BIG-001',
+                            [(product_id, 1, 1) for product_id in test_products])
+
+        response = client.post(f'/documents/{doc.id}/post', follow_redirects=True)
+        assert 'в очередь на проведение'.encode('utf-8') in response.data
+
+        job = Job.query.filter_by(job_type='post').first()
+        assert job is not None
+        assert job.status == 'done'
+        db.session.refresh(doc)
+        assert doc.status == 'posted'
+
+
+def test_queued_document_not_enqueued_twice(client, auth, test_products, app, make_document):
+    """Повторное проведение документа в очереди не ставит вторую задачу"""
+    app.config['JOB_POST_MIN_ITEMS'] = 1
+    auth.login()
+
+    with app.app_context():
+        doc = make_document('income', 'BIG-002', [(test_products[0], 1, 1)])
+        db.session.add(Job(job_type='post', status='queued', document_id=doc.id,
+                           params=f'{{"document_id": {doc.id}, "partial": false}}'))
+        db.session.commit()
+
+        response = client.post(f'/documents/{doc.id}/post', follow_redirects=True)
+        assert 'уже в очереди на проведение'.encode('utf-8') in response.data
+        assert Job.query.filter_by(job_type='post').count() == 1
+
+
+def test_background_export_and_download(client, auth, test_products, app, tmp_path):
+    """Фоновая выгрузка: 202, статус задачи и скачивание файла"""
+    app.config['JOBS_EAGER'] = True
+    app.config['JOB_RESULTS_DIR'] = str(tmp_path)
+    auth.login()
+
+    response = client.get('/reports/export/turnover?period=month&background=1')
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+
+    status = client.get(f'/jobs/{job_id}').get_json()
+    assert status['status'] == 'done'
+    assert status['progress'] == 100
+    assert status['download_url']
+
+    response = client.get(status['download_url'])
+    assert response.status_code == 200
+    assert 'text/csv' in response.headers['Content-Type']
+
+
+def test_background_report_page(client, auth, test_products, app, tmp_path):
+    """Тяжелый отчет строится задачей, страница показывает ее результат"""
+    app.config['JOBS_EAGER'] = True
+    app.config['JOB_RESULTS_DIR'] = str(tmp_path)
+    auth.login()
+
+    response = client.get('/reports/abc-xyz?period=year&background=1')
+    assert response.status_code == 202
+    data = response.get_json()
+    assert client.get(data['status_url']).get_json()['status'] == 'done'
+
+    response = client.get(data['result_url'])
+    assert response.status_code == 200
+    assert 'TEST001'.encode('utf-8') in response.data
+    assert 'построен заново'.encode('utf-8') not in response.data
+
+    response = client.get(data['result_url'].replace('period=year', 'period=month'))
+    assert 'построен заново'.encode('utf-8') in response.data
+
+
+def test_job_status_forbidden_for_other_user(client, auth, app):
+    """Чужая задача недоступна менеджеру"""
+    with app.app_context():
+        job = Job(job_type='export', params='{}', author_id=None)
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+    auth.login('manager', 'manager123')
+    assert client.get(f'/jobs/{job_id}').status_code == 403
+
+
+def test_download_unfinished_job(client, auth, app):
+    """Результат незавершенной задачи недоступен"""
+    auth.login()
+    with app.app_context():
+        job = Job(job_type='export', params='{}', status='queued')
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+    assert client.get(f'/jobs/{job_id}/download').status_code == 404
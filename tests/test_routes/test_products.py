@@ -1,6 +1,6 @@
 import pytest
 from app import db
-from app.models import Product, Category, Supplier, WarehouseCell, StockBalance
+from app.models import Product, ProductBarcode, Category, Supplier, WarehouseCell, StockBalance
 from datetime import date
 
 def test_product_list_page(client, auth):
@@ -271,4 +271,84 @@ def test_stock_balance_filter(client, auth, test_products, app):
     
     response = client.get(f'/products/stock?product_id={product_id}')
     assert response.status_code == 200
-    assert 'Остатки'.encode('utf-8') in response.data
\ No newline at end of file
+    assert 'Остатки'.encode('utf-8') in response.data
+def test_product_import_upload(client, auth, app):
+    """Загрузка каталога через форму"""
+    import io
+    
+    auth.login()
+    response = client.get('/products/import')
+    assert response.status_code == 200
+    
+    data = {
+        'file': (io.BytesIO('Артикул;Наименование;Цена\nUP-1;Загруженный;10\nUP-2;;5\n'
+                            .encode('utf-8')), 'price.csv'),
+        'encoding': 'utf-8-sig',
+        'create_missing': 'y'
+    }
+    response = client.post('/products/import', data=data,
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert 'добавлено: 1'.encode('utf-8') in response.data
+    assert 'Не указано наименование'.encode('utf-8') in response.data
+    with app.app_context():
+        assert Product.query.filter_by(article='UP-1').count() == 1
+
+def test_cell_capacity_and_search(client, auth, app, test_products):
+    """Ячейка с вместимостью и подбор ячеек под товар"""
+    auth.login()
+    
+    response = client.post('/products/cells/create', data={
+        'name': 'Z-01', 'max_volume': '2', 'max_slots': '3'
+    }, follow_redirects=True)
+    assert 'создана'.encode('utf-8') in response.data
+    
+    with app.app_context():
+        product = db.session.get(Product, test_products[0])
+        product.volume = 0.1
+        db.session.commit()
+    
+    response = client.get('/products/cells?article=TEST001&quantity=20')
+    assert response.status_code == 200
+    assert 'Ячейки для 20.0 шт'.encode('utf-8') in response.data
+    
+    response = client.get('/products/cells?article=TEST001&quantity=21')
+    assert 'Нет ячеек, куда поместится'.encode('utf-8') in response.data
+    
+    response = client.get('/products/cells?article=NOPE&quantity=1')
+    assert 'не найден'.encode('utf-8') in response.data
+
+
+def test_barcode_scan(client, auth, app, test_products):
+    """Штрихкод товара: привязка, сканирование, поиск и сброс кэша при правке товара"""
+    auth.login()
+    
+    response = client.post(f'/products/{test_products[0]}/barcodes', data={
+        'code': '5901234123457', 'multiplier': '12'
+    }, follow_redirects=True)
+    assert 'Штрихкод 5901234123457 добавлен'.encode('utf-8') in response.data
+    
+    response = client.post(f'/products/{test_products[1]}/barcodes', data={
+        'code': '5901234123457', 'multiplier': '1'
+    }, follow_redirects=True)
+    assert 'уже привязан к товару TEST001'.encode('utf-8') in response.data
+    
+    response = client.get('/products/scan?code=5901234123457')
+    assert response.status_code == 200
+    assert (response.json['product_id'], response.json['multiplier']) == (test_products[0], 12.0)
+    assert client.get('/products/scan?code=0000').status_code == 404
+    
+    response = client.get('/products/?search=5901234123457')
+    assert b'TEST001' in response.data and b'TEST002' not in response.data
+    
+    with app.app_context():
+        product = db.session.get(Product, test_products[0])
+        references = {'category_id': product.category_id, 'supplier_id': product.supplier_id}
+    client.post(f'/products/{test_products[0]}/edit', data=dict(
+        article='TEST001', name='Переименован', unit='шт', price='1000', **references))
+    assert client.get('/products/scan?code=5901234123457').json['name'] == 'Переименован'
+    
+    with app.app_context():
+        barcode_id = ProductBarcode.query.one().id
+    client.post(f'/products/barcodes/{barcode_id}/delete')
+    assert client.get('/products/scan?code=5901234123457').status_code == 404
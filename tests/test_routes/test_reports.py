@@ -1,6 +1,7 @@
 import pytest
 from app import db
-from app.models import Product, Category, Supplier, Document, DocumentItem, StockBalance
+from app.models import (Product, Category, Supplier, Document, DocumentItem, StockBalance,
+                        StockLot)
 from datetime import date, timedelta
 
 def test_stock_report_page(client, auth, test_products, app):
@@ -66,6 +67,26 @@ def test_turnover_report_with_category_filter(client, auth, test_categories, app
     response = client.get(f'/reports/turnover?category_id={test_categories[0]}')
     assert response.status_code == 200
 
+def test_turnover_report_date_range(client, auth, app):
+    """Тест отчета по обороту за произвольный диапазон дат"""
+    auth.login()
+    response = client.get('/reports/turnover?date_from=2024-01-01&date_to=2024-01-31')
+    assert response.status_code == 200
+    assert '01.01.2024'.encode('utf-8') in response.data
+    assert '31.01.2024'.encode('utf-8') in response.data
+
+def test_turnover_compare_page(client, auth, app):
+    """Тест страницы сравнения периодов"""
+    auth.login()
+    response = client.get('/reports/turnover/compare?date_from=2024-03-01&date_to=2024-03-10')
+    assert response.status_code == 200
+    assert '20.02.2024'.encode('utf-8') in response.data
+    assert '29.02.2024'.encode('utf-8') in response.data
+
+    response = client.get('/reports/turnover/compare?date_from=bad')
+    assert response.status_code == 200
+    assert 'Неверный формат даты'.encode('utf-8') in response.data
+
 def test_suppliers_report_page(client, auth, test_supplier, app):
     """Тест страницы отчета по поставщикам"""
     auth.login()
@@ -170,10 +191,115 @@ def test_export_turnover_csv(client, auth, test_products, app):
     assert response.status_code == 200
     assert 'text/csv' in response.headers['Content-Type']
 
+def test_export_turnover_csv_uses_date_range(client, auth, test_products, app):
+    """Экспорт оборота берет диапазон дат со страницы отчета"""
+    auth.login()
+    
+    response = client.get('/reports/turnover')
+    assert b'/reports/export/turnover?date_from=' in response.data
+    
+    response = client.get('/reports/export/turnover?date_from=2024-01-01&date_to=2024-01-31')
+    assert response.status_code == 200
+    assert 'oborot_20240101_20240131.csv' in response.headers['Content-Disposition']
+    assert 'TEST001' not in response.data.decode('cp1251')
+
 def test_reports_access_without_login(client):
     """Тест доступа к отчетам без авторизации"""
     response = client.get('/reports/stock')
     assert response.status_code == 302
     
     response = client.get('/reports/turnover')
-    assert response.status_code == 302
\ No newline at end of file
+    assert response.status_code == 302
+def test_abc_xyz_report_and_export(client, auth, test_products, app):
+    """Тест страницы ABC/XYZ и потоковой выгрузки"""
+    auth.login()
+    response = client.get('/reports/abc-xyz?date_from=2024-01-01&date_to=2024-03-31')
+    assert response.status_code == 200
+    assert 'ABC/XYZ'.encode('utf-8') in response.data
+
+    response = client.get('/reports/export/abc-xyz?date_from=2024-01-01&date_to=2024-03-31')
+    assert response.status_code == 200
+    assert response.is_streamed
+    content = response.get_data().decode('cp1251')
+    assert content.startswith('Артикул;')
+    assert 'TEST001' in content
+
+def test_forecast_page_and_api(client, auth, app, test_products):
+    """Страница прогноза и JSON по товару"""
+    from app.models import DemandForecast
+    
+    auth.login()
+    response = client.get('/reports/forecast')
+    assert response.status_code == 200
+    assert 'flask forecast refresh'.encode('utf-8') in response.data
+    
+    week = date.today() - timedelta(days=date.today().weekday())
+    with app.app_context():
+        db.session.add_all([DemandForecast(product_id=test_products[0],
+                                           week_start=week + timedelta(weeks=offset),
+                                           quantity=5 + offset, method='holt', error=1.5)
+                            for offset in range(2)])
+        db.session.commit()
+    
+    response = client.get('/reports/forecast')
+    assert response.status_code == 200
+    assert b'TEST001' in response.data
+    
+    response = client.get(f'/reports/api/forecast/{test_products[0]}')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['forecast']['values'] == [5.0, 6.0]
+    assert data['method'] == 'holt'
+    assert len(data['history']['values']) == app.config['FORECAST_HISTORY_WEEKS']
+    
+    assert client.get('/reports/api/forecast/999999').status_code == 404
+
+def test_valuation_page_and_export(client, auth, app, test_products):
+    """Оценка остатков: итоги по категориям и выгрузка"""
+    auth.login()
+    with app.app_context():
+        db.session.add(StockBalance(product_id=test_products[0], cell_id=1, quantity=3))
+        db.session.commit()
+    
+    response = client.get('/reports/valuation')
+    assert response.status_code == 200
+    assert 'Итого по категории'.encode('utf-8') in response.data
+    assert b'TEST001' not in response.data
+    
+    response = client.get('/reports/valuation?detail=1&as_of=bad')
+    assert response.status_code == 200
+    assert b'TEST001' in response.data
+    
+    response = client.get('/reports/export/valuation?price_basis=purchase')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert 'Итого (1)'.encode('cp1251') in response.data
+
+def test_turnover_ratio_page_and_export(client, auth):
+    """Оборачиваемость запасов: страница и выгрузка"""
+    auth.login()
+    response = client.get('/reports/turnover/ratio?date_from=2024-01-01&date_to=2024-03-31')
+    assert response.status_code == 200
+    assert 'Оборачиваемость запасов'.encode('utf-8') in response.data
+    
+    response = client.get('/reports/export/turnover-ratio?period=month')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+
+
+def test_expiring_report_page(client, auth, test_products, app):
+    """Отчет по истекающим срокам годности"""
+    with app.app_context():
+        db.session.add(StockLot(product_id=test_products[0], lot_number='LOT-1', quantity=3,
+                                expiry_date=date.today() + timedelta(days=5)))
+        db.session.add(StockLot(product_id=test_products[1], lot_number='LOT-2', quantity=3,
+                                expiry_date=date.today() + timedelta(days=50)))
+        db.session.commit()
+    
+    auth.login()
+    response = client.get('/reports/expiring')
+    assert response.status_code == 200
+    assert b'LOT-1' in response.data and b'LOT-2' not in response.data
+    
+    response = client.get('/reports/expiring?days=60')
+    assert b'LOT-2' in response.data
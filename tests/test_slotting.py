@@ -0,0 +1,89 @@
+import pytest
+from app import db
+from app.models import StockBalance
+from app.services.slotting_service import SlottingService
+from app.services.transfer_service import TransferService
+
+
+def put_stock(product_id, cell_id, quantity):
+    db.session.add(StockBalance(product_id=product_id, cell_id=cell_id, quantity=quantity))
+
+
+@pytest.fixture
+def pick(make_document):
+    """Расходы с одной строкой товара"""
+    def make(product_id, times, status='posted'):
+        for number in range(times):
+            make_document('expense', f'РН-S-{product_id}-{number}-{status}',
+                          [(product_id, 1, 1)], status=status)
+    return make
+
+
+def test_cell_distances(app, test_cells):
+    """Расстояние из имени ячейки или из заданных координат"""
+    with app.app_context():
+        assert SlottingService.cell_distances() == {
+            test_cells[0]: ('A-01', 1.0), test_cells[1]: ('A-02', 2.0),
+            test_cells[2]: ('B-01', 4.0)}
+        app.config['SLOTTING_CELL_COORDINATES'] = {'B-01': (0, 0.5)}
+        assert SlottingService.cell_distances()[test_cells[2]] == ('B-01', 0.5)
+
+
+def test_fast_mover_goes_near_dispatch(app, test_products, test_cells, pick):
+    """Частый товар из дальней ячейки меняется местами с редким"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[2], 8)
+        put_stock(test_products[0], test_cells[1], 1)
+        put_stock(test_products[1], test_cells[0], 5)
+        pick(test_products[0], 3)
+        pick(test_products[1], 2, status='cancelled')
+        db.session.commit()
+
+        plan = SlottingService.plan()
+        assert (plan['products'], plan['current'], plan['planned'], plan['savings']) == \
+            (2, 12.0, 3.0, 9.0)
+        moves = {move['article']: move for move in plan['moves']}
+        assert (moves['TEST001']['cell'], moves['TEST001']['dest_cell'],
+                moves['TEST001']['quantity'], moves['TEST001']['savings']) == \
+            ('B-01', 'A-01', 8.0, 9.0)
+        # Редкий товар освобождает ближнюю ячейку
+        assert (moves['TEST002']['cell'], moves['TEST002']['dest_cell'],
+                moves['TEST002']['savings']) == ('A-01', 'A-02', 0.0)
+        assert plan['moves'][0]['article'] == 'TEST001'
+
+        document = SlottingService.create_transfer([test_products[0]])
+        assert document.doc_type == 'transfer' and document.items.count() == 1
+        assert TransferService.process_document(document)[0]
+        assert float(StockBalance.query.filter_by(product_id=test_products[0],
+                                                  cell_id=test_cells[0]).one().quantity) == 8
+
+
+def test_optimal_placement_is_kept(app, test_products, test_cells, pick):
+    """Без выигрыша товары не переставляются, в т.ч. равноценные по частоте и ячейке"""
+    with app.app_context():
+        app.config['SLOTTING_CELL_COORDINATES'] = {'A-02': (0, 1)}
+        put_stock(test_products[0], test_cells[1], 3)
+        put_stock(test_products[1], test_cells[0], 3)
+        pick(test_products[0], 1)
+        pick(test_products[1], 1)
+        db.session.commit()
+
+        plan = SlottingService.plan()
+        assert plan['moves'] == [] and plan['savings'] == 0
+        assert SlottingService.create_transfer() is None
+
+
+def test_slots_per_cell(app, test_products, test_cells, pick):
+    """При нескольких местах в ячейке оба товара помещаются в ближнюю"""
+    with app.app_context():
+        app.config['SLOTTING_CELL_SLOTS'] = 2
+        put_stock(test_products[0], test_cells[2], 1)
+        put_stock(test_products[1], test_cells[1], 1)
+        pick(test_products[0], 2)
+        pick(test_products[1], 1)
+        db.session.commit()
+
+        plan = SlottingService.plan()
+        assert {move['article']: move['dest_cell'] for move in plan['moves']} == \
+            {'TEST001': 'A-01', 'TEST002': 'A-01'}
+        assert plan['savings'] == 2 * 3 + 1 * 1
@@ -0,0 +1,169 @@
+from datetime import date
+from app import db
+from app.instrumentation import capture_queries
+from app.models import Document, StockBalance, DailyProductTurnover
+from app.services.transfer_service import TransferService
+from app.services.stock_service import StockService
+
+
+def put_stock(product_id, cell_id, quantity):
+    db.session.add(StockBalance(product_id=product_id, cell_id=cell_id, quantity=quantity))
+
+
+def balances():
+    return {(balance.product_id, balance.cell_id): float(balance.quantity)
+            for balance in StockBalance.query.all()}
+
+
+def test_transfer_lines(app, test_products, test_cells):
+    """Товар списывается из источника и зачисляется в получатель"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[0], 10)
+        put_stock(test_products[1], test_cells[0], 4)
+        put_stock(test_products[1], test_cells[1], 1)
+        db.session.commit()
+
+        document = TransferService.create([
+            {'product_id': test_products[0], 'cell_id': test_cells[0],
+             'dest_cell_id': test_cells[2], 'quantity': 3},
+            {'product_id': test_products[0], 'cell_id': test_cells[0],
+             'dest_cell_id': test_cells[2], 'quantity': 2},
+            {'product_id': test_products[1], 'cell_id': test_cells[0],
+             'dest_cell_id': test_cells[1], 'quantity': 4}
+        ])
+        assert document.doc_type == 'transfer' and document.doc_number.startswith('ПМ-')
+        assert document.items.count() == 2
+
+        with capture_queries() as stats:
+            success, message = TransferService.process_document(document)
+        assert success, message
+        assert stats.count < 15
+        assert balances() == {(test_products[0], test_cells[0]): 5,
+                              (test_products[0], test_cells[2]): 5,
+                              (test_products[1], test_cells[0]): 0,
+                              (test_products[1], test_cells[1]): 5}
+        # Перемещение не является движением товара
+        assert DailyProductTurnover.query.count() == 0
+
+        success, _ = TransferService.cancel_document(document)
+        assert success
+        assert document.status == 'cancelled'
+        assert balances() == {(test_products[0], test_cells[0]): 10,
+                              (test_products[0], test_cells[2]): 0,
+                              (test_products[1], test_cells[0]): 4,
+                              (test_products[1], test_cells[1]): 1}
+
+
+def test_transfer_shortage(app, test_products, test_cells):
+    """При нехватке в источнике документ не проводится и остатки не меняются"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[0], 2)
+        db.session.commit()
+        document = TransferService.create([
+            {'product_id': test_products[0], 'cell_id': test_cells[0],
+             'dest_cell_id': test_cells[1], 'quantity': 1},
+            {'product_id': test_products[1], 'cell_id': test_cells[0],
+             'dest_cell_id': test_cells[1], 'quantity': 1}
+        ])
+
+        success, message = TransferService.process_document(document)
+        assert not success
+        assert 'Недостаточно товара Тестовый товар 2' in message
+        assert 'в ячейке A-01' in message
+        assert balances() == {(test_products[0], test_cells[0]): 2}
+        assert document.status == 'draft'
+
+
+def test_whole_cell_transfer(app, test_products, test_cells):
+    """Все содержимое ячейки перемещается одной операцией"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[2], 7)
+        put_stock(test_products[1], test_cells[2], 3)
+        put_stock(test_products[1], test_cells[1], 2)
+        db.session.commit()
+
+        document = TransferService.create_cell_transfer(test_cells[2], test_cells[1])
+        assert document.items.count() == 2
+        assert TransferService.process_document(document)[0]
+        assert balances() == {(test_products[0], test_cells[2]): 0,
+                              (test_products[1], test_cells[2]): 0,
+                              (test_products[0], test_cells[1]): 7,
+                              (test_products[1], test_cells[1]): 5}
+
+        try:
+            TransferService.create_cell_transfer(test_cells[2], test_cells[1])
+        except ValueError as e:
+            assert str(e) == 'Ячейка B-01 пуста'
+        else:
+            assert False
+        assert Document.query.count() == 1
+
+
+def test_transfer_not_in_movements(app, test_products, test_cells, test_supplier):
+    """Перемещения не видны в истории движения товара"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[0], 5)
+        db.session.commit()
+        document = TransferService.create([
+            {'product_id': test_products[0], 'cell_id': test_cells[0],
+             'dest_cell_id': test_cells[1], 'quantity': 5}], doc_date=date.today())
+        TransferService.process_document(document)
+        assert StockService.get_product_movement(test_products[0]) == []
+        assert StockService.cancel_document(document)[0] is False
+
+
+def test_moved_stock_is_shipped_and_reserved(app, test_products, test_cells, make_document):
+    """Расход, резерв и недопоставка берут товар из всех ячеек, а не только из приемки"""
+    from app.models import StockReservation
+    from app.services.reservation_service import ReservationService
+
+    def draft(doc_type, number, quantity):
+        return make_document(doc_type, number, [(product, quantity)])
+
+    with app.app_context():
+        product = test_products[0]
+        assert StockService.process_income_document(draft('income', 'ПН-T1', 10))[0]
+        moved = TransferService.create([{'product_id': product, 'cell_id': test_cells[0],
+                                         'dest_cell_id': test_cells[1], 'quantity': 6}])
+        assert TransferService.process_document(moved)[0]
+
+        expense = draft('expense', 'РН-T1', 8)
+        assert ReservationService.reserve(expense)[0]
+        assert ReservationService.available([product]) == {product: 2}
+        assert {(row.cell_id, float(row.quantity)) for row in StockReservation.query} == \
+            {(test_cells[0], 4), (test_cells[1], 4)}
+
+        success, message = StockService.process_expense_document(expense)
+        assert success, message
+        assert balances() == {(product, test_cells[0]): 0, (product, test_cells[1]): 2}
+
+        partial = draft('expense', 'РН-T2', 5)
+        success, message = StockService.process_expense_document(partial, partial=True)
+        assert success, message
+        assert partial.backorders[0].items.one().quantity == 3
+        assert balances() == {(product, test_cells[0]): 0, (product, test_cells[1]): 0}
+
+
+def test_whole_cell_transfer_keeps_reserved(app, test_products, test_cells):
+    """Зарезервированный черновиками товар остается в ячейке"""
+    with app.app_context():
+        put_stock(test_products[0], test_cells[2], 7)
+        put_stock(test_products[1], test_cells[2], 3)
+        db.session.commit()
+        StockBalance.query.filter_by(product_id=test_products[0]).update({'reserved': 2})
+        StockBalance.query.filter_by(product_id=test_products[1]).update({'reserved': 3})
+        db.session.commit()
+
+        document = TransferService.create_cell_transfer(test_cells[2], test_cells[1])
+        assert [float(item.quantity) for item in document.items] == [5]
+        assert TransferService.process_document(document)[0]
+        assert balances() == {(test_products[0], test_cells[2]): 2,
+                              (test_products[1], test_cells[2]): 3,
+                              (test_products[0], test_cells[1]): 5}
+
+        try:
+            TransferService.create_cell_transfer(test_cells[2], test_cells[1])
+        except ValueError as e:
+            assert str(e) == 'Товар ячейки B-01 зарезервирован черновиками'
+        else:
+            assert False
@@ -0,0 +1,126 @@
+from app import db
+from app.instrumentation import capture_queries
+from app.models import DailyProductTurnover
+from app.services.report_service import ReportService
+from app.services.stock_service import StockService
+from app.services.turnover_service import TurnoverService
+from datetime import date, timedelta
+
+
+def facts():
+    return {(f.day, f.product_id, f.doc_type): (float(f.quantity), float(f.total_sum), f.operations)
+            for f in DailyProductTurnover.query.all()}
+
+
+def test_posting_and_cancel_maintain_turnover(app, test_products, admin_user, make_document):
+    """Проведение и отмена документов изменяют дневной оборот"""
+    with app.app_context():
+        first, second = test_products
+        income = make_document('income', 'TO-001',
+                               [(first, 10, 100), (first, 5, 100), (second, 2, 50)],
+                               author_id=admin_user)
+        StockService.process_income_document(income)
+        expense = make_document('expense', 'TO-002', [(first, 3, 100)], author_id=admin_user)
+        StockService.process_expense_document(expense)
+
+        today = date.today()
+        assert facts() == {
+            (today, first, 'income'): (15.0, 1500.0, 2),
+            (today, second, 'income'): (2.0, 100.0, 1),
+            (today, first, 'expense'): (3.0, 300.0, 1)
+        }
+
+        StockService.cancel_document(expense)
+        assert (today, first, 'expense') not in facts()
+        assert len(facts()) == 2
+
+
+def test_cancel_document_missing_from_turnover(app, test_products, admin_user, make_document):
+    """Отмена документа, которого нет в агрегате, не ломается и не создает строк"""
+    with app.app_context():
+        first, _ = test_products
+        income = make_document('income', 'TO-005', [(first, 10, 100)], author_id=admin_user)
+        StockService.process_income_document(income)
+        DailyProductTurnover.query.delete()
+        db.session.commit()
+
+        success, message = StockService.cancel_document(income)
+        assert success, message
+        assert facts() == {}
+
+
+def test_rebuild_matches_incremental(app, test_products, admin_user, make_document):
+    """Пересчет агрегата дает тот же результат, что и ведение при проведении"""
+    with app.app_context():
+        first, second = test_products
+        doc = make_document('income', 'TO-003', [(first, 4, 10), (second, 1, 20)],
+                            author_id=admin_user)
+        StockService.process_income_document(doc)
+        incremental = facts()
+
+        # Документ, записанный в обход StockService, попадает в агрегат только при пересчете
+        make_document('income', 'TO-004', [(first, 1, 10)],
+                      date.today() - timedelta(days=3), status='posted', author_id=admin_user)
+        assert TurnoverService.rebuild() == 3
+
+        rebuilt = facts()
+        assert {key: value for key, value in rebuilt.items() if key in incremental} == incremental
+        assert rebuilt[(date.today() - timedelta(days=3), first, 'income')] == (1.0, 10.0, 1)
+
+
+def test_turnover_report_rolls_up_from_aggregate(app, test_products, admin_user, make_document):
+    """Отчет и график оборота строятся по агрегату"""
+    with app.app_context():
+        first, _ = test_products
+        old = date.today() - timedelta(days=20)
+        make_document('income', 'TO-005', [(first, 2, 100)], doc_date=old, status='posted',
+                      author_id=admin_user)
+        make_document('income', 'TO-006', [(first, 3, 100)], status='posted', author_id=admin_user)
+        TurnoverService.rebuild()
+
+        week = ReportService.turnover_rows(ReportService.period_start('week'))
+        month = ReportService.turnover_rows(ReportService.period_start('month'))
+        assert [(row['total_quantity'], row['operations_count']) for row in week] == [(3.0, 1)]
+        assert [(row['total_quantity'], row['operations_count']) for row in month] == [(5.0, 2)]
+
+        labels, values = ReportService.turnover_chart(ReportService.period_start('week'),
+                                                      date.today(), 'day')
+        assert len(labels) == 8
+        assert labels[-1] == date.today().strftime('%d.%m')
+        assert values[-1] == 300.0 and sum(values) == 300.0
+        assert sum(ReportService.turnover_chart(ReportService.period_start('year'),
+                                                date.today(), 'month')[1]) == 500.0
+
+
+def test_turnover_comparison_with_previous_period(app, test_products, admin_user, make_document):
+    """Сравнение с предыдущим периодом той же длины одним запросом"""
+    with app.app_context():
+        first, second = test_products
+        make_document('income', 'TO-007', [(first, 4, 100)], doc_date=date(2024, 3, 5),
+                      status='posted', author_id=admin_user)
+        make_document('income', 'TO-008', [(first, 1, 100), (second, 2, 50)],
+                      doc_date=date(2024, 2, 25), status='posted', author_id=admin_user)
+        # Вне обоих периодов
+        make_document('income', 'TO-009', [(first, 100, 100)], doc_date=date(2024, 2, 1),
+                      status='posted', author_id=admin_user)
+        TurnoverService.rebuild()
+
+        assert ReportService.previous_range(date(2024, 3, 1), date(2024, 3, 10)) == \
+            (date(2024, 2, 20), date(2024, 2, 29))
+
+        app.config['ANALYTICS_BACKEND'] = 'sql'
+        with capture_queries() as stats:
+            rows = {row['id']: row for row in ReportService.turnover_comparison(
+                date(2024, 3, 1), date(2024, 3, 10))}
+        assert stats.count == 1
+
+        app.config['ANALYTICS_BACKEND'] = 'numpy'
+        assert {row['id']: row for row in ReportService.turnover_comparison(
+            date(2024, 3, 1), date(2024, 3, 10))} == rows
+
+        assert rows[first]['quantity'] == 4.0
+        assert rows[first]['prev_quantity'] == 1.0
+        assert rows[first]['delta_sum'] == 300.0
+        assert rows[first]['delta_sum_percent'] == 300.0
+        assert rows[second]['quantity'] == 0.0
+        assert rows[second]['delta_sum'] == -100.0
@@ -0,0 +1,73 @@
+import pytest
+from app.services.turnover_ratio_service import TurnoverRatioService
+from datetime import date, datetime
+
+DATE_FROM = date(2024, 2, 1)
+DATE_TO = date(2024, 2, 10)
+POSTED = {'status': 'posted', 'posted_at': datetime(2024, 3, 1)}
+
+
+@pytest.fixture
+def movements(app, test_products, make_document):
+    """Товар 1: 100 на начало, расход 50 на 6-й день; товар 2: приход 20 на 9-й день"""
+    first, second = test_products
+    with app.app_context():
+        make_document('income', 'TR-1', [(first, 100)], date(2024, 1, 15), **POSTED)
+        make_document('expense', 'TR-2', [(first, 50)], date(2024, 2, 6), **POSTED)
+        make_document('income', 'TR-3', [(second, 20)], date(2024, 2, 9), **POSTED)
+        make_document('expense', 'TR-4', [(first, 30)], date(2024, 2, 11),
+                      **POSTED)  # после периода
+    return test_products
+
+
+def test_turnover_ratio(app, movements):
+    """Средний остаток по дням, оборачиваемость и запас в днях"""
+    first, second = movements
+    with app.app_context():
+        rows, categories, total = TurnoverRatioService.rows(DATE_FROM, DATE_TO)
+
+        assert [row['id'] for row in rows] == [second, first]
+        row = rows[1]
+        assert (row['opening'], row['closing'], row['outflow']) == (100, 50, 50)
+        assert row['average'] == pytest.approx(75)  # 5 дней по 100 и 5 дней по 50
+        assert row['ratio'] == pytest.approx(50 / 75)
+        assert row['days_of_inventory'] == pytest.approx(15)
+        assert row['days_of_supply'] == pytest.approx(10)
+
+        assert rows[0]['average'] == pytest.approx(4)
+        assert rows[0]['ratio'] == 0
+        assert rows[0]['days_of_inventory'] is None
+        assert rows[0]['days_of_supply'] is None
+
+        assert [row['category'] for row in categories] == ['Ручной инструмент',
+                                                           'Электроинструмент']
+        assert categories[1]['average'] == pytest.approx(75)
+        assert total['products'] == 2
+        assert total['average'] == pytest.approx(79)
+        assert total['ratio'] == pytest.approx(50 / 79)
+
+
+def test_category_filter_and_refresh(app, movements, test_categories, make_document):
+    """Фильтр по категории; новое проведение сбрасывает кэш периода"""
+    first, second = movements
+    with app.app_context():
+        rows, categories, total = TurnoverRatioService.rows(DATE_FROM, DATE_TO,
+                                                            test_categories[0])
+        assert [row['id'] for row in rows] == [first]
+        assert total['outflow'] == 50
+
+        make_document('expense', 'TR-5', [(second, 5)], date(2024, 2, 10), status='posted',
+                      posted_at=datetime.now())
+        rows, categories, total = TurnoverRatioService.rows(DATE_FROM, DATE_TO)
+        assert total['outflow'] == 55
+
+
+def test_turnover_ratio_csv(app, movements):
+    """Выгрузка: товары, итоги категорий, общий итог"""
+    with app.app_context():
+        lines = b''.join(TurnoverRatioService.iter_csv(DATE_FROM, DATE_TO)
+                         ).decode('cp1251').splitlines()
+        assert lines[0].startswith('Артикул;Наименование')
+        assert lines[2].startswith('TEST001;')
+        assert 'Итого по категории (1)' in lines[3]
+        assert lines[-1].startswith(';Итого (2);;;100.0;70.0;79.0;50.0;0.633;15.8;14.0')
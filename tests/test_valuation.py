@@ -0,0 +1,94 @@
+import pytest
+from app import db
+from app.instrumentation import capture_queries
+from app.models import Product, StockBalance
+from app.services.period_service import PeriodService
+from app.services.valuation_service import ValuationService, PRODUCT, CATEGORY, TOTAL
+from datetime import date
+
+
+def add_balance(product_id, cell_id, quantity):
+    db.session.add(StockBalance(product_id=product_id, cell_id=cell_id, quantity=quantity))
+
+
+def test_rollup_rows(app, test_products, test_cells):
+    """Товары, итоги категорий и общий итог одним запросом"""
+    first, second = test_products
+    with app.app_context():
+        add_balance(first, test_cells[0], 3)   # 1000 ₽
+        add_balance(first, test_cells[1], 2)
+        add_balance(second, test_cells[0], 4)  # 500 ₽
+        db.session.commit()
+
+        rows = ValuationService.rows()
+        assert [(row['level'], row['id']) for row in rows] == [
+            (PRODUCT, second), (CATEGORY, None),  # Ручной инструмент
+            (PRODUCT, first), (CATEGORY, None),   # Электроинструмент
+            (TOTAL, None)
+        ]
+        assert rows[2]['quantity'] == 5
+        assert rows[2]['value'] == 5000
+        assert rows[1]['value'] == 2000
+        assert (rows[-1]['quantity'], rows[-1]['value'], rows[-1]['products']) == (9, 7000, 2)
+
+        summary = ValuationService.rows(with_products=False)
+        assert [row['level'] for row in summary] == [CATEGORY, CATEGORY, TOTAL]
+        assert summary[-1]['value'] == 7000
+
+
+def test_as_of_and_purchase_price(app, test_products, make_document):
+    """Остатки на дату по снимку закрытого месяца и цена последнего прихода"""
+    first, second = test_products
+    with app.app_context():
+        make_document('income', 'VAL-1', [(first, 10, 900)], date(2024, 1, 10), status='posted')
+        make_document('expense', 'VAL-2', [(first, 4, 1500)], date(2024, 2, 5), status='posted')
+        make_document('income', 'VAL-3', [(first, 1, 950), (second, 6, 400)], date(2024, 2, 20),
+                      status='posted')
+        PeriodService.close(date(2024, 1, 31), workers=1)
+
+        rows = ValuationService.rows(as_of=date(2024, 2, 10), price_basis='purchase')
+        assert [(row['id'], row['quantity'], row['value']) for row in rows
+                if row['level'] == PRODUCT] == [(first, 6, 6 * 900)]
+
+        rows = ValuationService.rows(as_of=date(2024, 2, 29), price_basis='purchase')
+        by_id = {row['id']: row for row in rows if row['level'] == PRODUCT}
+        assert by_id[first]['price'] == 950
+        assert by_id[second]['value'] == 6 * 400
+
+        # Цена из карточки
+        rows = ValuationService.rows(as_of=date(2024, 2, 29))
+        assert rows[-1]['value'] == 7 * 1000 + 6 * 500
+
+        with pytest.raises(ValueError):
+            ValuationService.rows(price_basis='fifo')
+
+
+def test_query_count_independent_of_catalogue(app, test_cells):
+    """Число запросов не растет с количеством товаров"""
+    with app.app_context():
+        counts = []
+        for size in (2, 40):
+            products = [Product(article=f'VQ-{size}-{number}', name=f'Товар {number}',
+                                unit='шт', price=number + 1) for number in range(size)]
+            db.session.add_all(products)
+            db.session.flush()
+            for product in products:
+                add_balance(product.id, test_cells[0], 1)
+            db.session.commit()
+            with capture_queries() as stats:
+                ValuationService.rows(as_of=date(2024, 1, 1), price_basis='purchase')
+                b''.join(ValuationService.iter_csv())
+            counts.append(stats.count)
+        assert counts[0] == counts[1] <= 3
+
+
+def test_csv_stream(app, test_products, test_cells):
+    """Выгрузка: строки товаров и итогов"""
+    with app.app_context():
+        add_balance(test_products[0], test_cells[0], 2)
+        db.session.commit()
+        lines = b''.join(ValuationService.iter_csv()).decode('cp1251').splitlines()
+        assert lines[0].startswith('Категория;Артикул')
+        assert lines[1].startswith('Электроинструмент;TEST001;')
+        assert 'Итого по категории (1)' in lines[2]
+        assert lines[3] == ';;Итого (1);;2.0;;2000.0'